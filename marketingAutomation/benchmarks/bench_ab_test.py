@@ -0,0 +1,94 @@
+"""
+Streaming A/B evaluation cost as the EmailEvent table grows.
+
+Open events for an A (10% open rate) and a B (12%) variant are staged and
+flushed in batches; every flush re-evaluates the test from the campaign
+counters and reach sketches. The time of one evaluation and the queries it
+issues are reported for a small and a large pre-existing event table, next
+to a full rescan of EmailEvent (what winner selection needed before).
+"""
+import argparse
+import random
+import time
+
+from benchmarks.common import setup, timed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sent', type=int, default=20_000, help='sends per variant')
+    parser.add_argument('--background', type=int, default=1_000_000, help='unrelated events added to EmailEvent')
+    parser.add_argument('--flush-size', type=int, default=500)
+    args = parser.parse_args()
+
+    setup()
+    from django.conf import settings
+    from django.db import connection, transaction
+    from django.db.models import Count
+    from django.test.utils import CaptureQueriesContext
+
+    from campaign.models import Campaign, CustomerSegment
+    from emailMarketing.abtest import evaluate_test
+    from emailMarketing.ingest import flush_staged_events, stage_events
+    from emailMarketing.models import EmailABTest, EmailCampaign, EmailEvent, EmailTemplate
+
+    settings.EMAIL_AB_TEST_MIN_SENT = args.sent
+    segment = CustomerSegment.objects.create(name='bench')
+    template = EmailTemplate.objects.create(name='bench', html_content='x')
+    campaign = Campaign.objects.create(name='ab bench')
+    common = dict(from_email='bench@example.com', email_template=template, customer_segment=segment,
+                  campaign=campaign, ab_test_enabled=True)
+    a = EmailCampaign.objects.create(name='A', subject_line='A', ab_test_variant='A', sent_count=args.sent, **common)
+    b = EmailCampaign.objects.create(name='B', subject_line='B', ab_test_variant='B', sent_count=args.sent, **common)
+    EmailCampaign.objects.create(name='rest', subject_line='?', ab_test_variant='winner', **common)
+    other = EmailCampaign.objects.create(name='other', subject_line='o', from_email='bench@example.com',
+                                         email_template=template, customer_segment=segment)
+
+    rng = random.Random(7)
+    events = []
+    for variant, rate in ((a, 0.10), (b, 0.12)):
+        events += [{'email_campaign_id': variant.pk, 'event_type': 'opened', 'email_address': f'c{i}@example.com'}
+                   for i in range(args.sent) if rng.random() < rate]
+    rng.shuffle(events)
+
+    for label, background in (('small table', 0), ('large table', args.background)):
+        EmailEvent.objects.bulk_insert(
+            {'email_campaign_id': other.pk, 'event_type': 'opened', 'email_address': 'x@example.com'}
+            for _ in range(background)
+        )
+        EmailEvent.objects.filter(email_campaign__in=[a, b]).delete()
+        EmailCampaign.objects.filter(pk__in=[a.pk, b.pk]).update(opened_count=0)
+        EmailABTest.objects.all().delete()
+        EmailCampaign.objects.filter(ab_test_variant='winner').update(status='draft')
+        decided_after = None
+        for start in range(0, len(events), args.flush_size):
+            stage_events(events[start:start + args.flush_size])
+            flush_staged_events(args.flush_size)
+            if EmailABTest.objects.filter(status='running').exists():
+                continue
+            decided_after = min(start + args.flush_size, len(events))
+            break
+        test = EmailABTest.objects.get()
+        # keep the test running while timing the steady-state evaluation
+        EmailABTest.objects.update(status='running')
+        settings.EMAIL_AB_TEST_ALPHA = 0
+        repeats = 200
+        begin = time.perf_counter()
+        with transaction.atomic():  # as inside the ingest flush
+            for _ in range(repeats):
+                evaluate_test(campaign.pk)
+        evaluation = (time.perf_counter() - begin) / repeats
+        with CaptureQueriesContext(connection) as queries:
+            evaluate_test(campaign.pk)
+        del settings.EMAIL_AB_TEST_ALPHA
+        scans = [q['sql'] for q in queries.captured_queries if 'email_event"' in q['sql']]
+        print(f"{label} ({EmailEvent.objects.count():,} events): evaluation {evaluation * 1e6:.0f}us, "
+              f"{len(queries.captured_queries)} queries, event table queries={len(scans)}")
+        print(f"    status={test.status} p={test.p_value:.2g} A={test.rate_a:.3f} B={test.rate_b:.3f} "
+              f"decided after {decided_after} of {len(events)} events")
+        with timed(f'    full EmailEvent rescan ({label})'):
+            list(EmailEvent.objects.filter(event_type='opened').values('email_campaign').annotate(n=Count('id')))
+
+
+if __name__ == '__main__':
+    main()
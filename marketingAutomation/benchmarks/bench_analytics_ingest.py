@@ -0,0 +1,44 @@
+"""Per-row ``CampaignAnalytics.save()`` vs ``CampaignAnalytics.objects.bulk_ingest``."""
+import argparse
+import random
+from decimal import Decimal
+
+from benchmarks.common import setup, timed
+
+
+def rows(campaign_id, n):
+    rnd = random.Random(42)
+    for _ in range(n):
+        yield {
+            'campaign_id': campaign_id,
+            'total_sent': rnd.randint(0, 10_000),
+            'total_opened': rnd.randint(0, 5_000),
+            'revenue_generated': Decimal(rnd.randint(0, 100_000)) / 100,
+            'cost': Decimal(rnd.randint(0, 50_000)) / 100,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=200_000)
+    parser.add_argument('--save-rows', type=int, default=5_000)
+    args = parser.parse_args()
+
+    setup()
+    from campaign.models import Campaign, CampaignAnalytics
+
+    campaign = Campaign.objects.create(name='bench')
+
+    with timed('save() per row', args.save_rows) as per_row:
+        for row in rows(campaign.pk, args.save_rows):
+            CampaignAnalytics(**row).save()
+
+    with timed('bulk_ingest', args.rows) as bulk:
+        CampaignAnalytics.objects.bulk_ingest(rows(campaign.pk, args.rows))
+
+    speedup = (args.rows / bulk['seconds']) / (args.save_rows / per_row['seconds'])
+    print(f"throughput speedup: {speedup:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
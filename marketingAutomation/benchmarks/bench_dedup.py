@@ -0,0 +1,74 @@
+"""
+Webhook dedup: sliding Bloom filter at 10M keys and the claim path end to end.
+
+The filter part adds ``--keys`` distinct keys to a filter sized for them,
+then probes as many never-added keys to measure the false-positive rate.
+The end-to-end part stages webhook batches where a share of events are
+provider retries (spread over later batches) and checks that exactly the
+distinct events are staged, counting the SQL statements per batch.
+"""
+import argparse
+import random
+import time
+
+from benchmarks.common import setup, timed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--keys', type=int, default=10_000_000)
+    parser.add_argument('--error-rate', type=float, default=0.001)
+    parser.add_argument('--events', type=int, default=200_000)
+    parser.add_argument('--retry-share', type=float, default=0.3)
+    parser.add_argument('--batch', type=int, default=500)
+    args = parser.parse_args()
+
+    setup()
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    from campaign.dedup import SlidingBloomFilter, event_key
+    from campaign.models import CustomerSegment
+    from emailMarketing.ingest import parse_event, stage_events
+    from emailMarketing.models import EmailCampaign, EmailEventStaging, EmailTemplate
+
+    bloom = SlidingBloomFilter(args.keys, args.error_rate, window=86400)
+    chunk = 100_000
+    with timed(f'bloom: add {args.keys:,} keys', args.keys):
+        for start in range(0, args.keys, chunk):
+            bloom.check_and_add([event_key('added', i) for i in range(start, min(start + chunk, args.keys))])
+    probes = min(args.keys, 2_000_000)
+    start = time.perf_counter()
+    positives = sum(bloom.check_and_add([event_key('probe', i) for i in range(probes)]))
+    elapsed = time.perf_counter() - start
+    print(f"{'bloom: probe unseen keys':<40} {elapsed:8.3f}s  ({probes / elapsed:,.0f}/s)")
+    print(f"    false positives {positives:,} of {probes:,} = {positives / probes:.5f} "
+          f"(target {args.error_rate}); {bloom.blocks * 64 / args.keys:.1f} bits per key, {bloom.nbytes / 1e6:.1f} MB for two generations")
+
+    segment = CustomerSegment.objects.create(name='bench')
+    template = EmailTemplate.objects.create(name='bench', html_content='x')
+    campaign = EmailCampaign.objects.create(name='bench', subject_line='s', from_email='bench@example.com',
+                                            email_template=template, customer_segment=segment)
+    rng = random.Random(11)
+    distinct = int(args.events * (1 - args.retry_share))
+    originals = [
+        {'email_campaign_id': campaign.pk, 'event_type': 'opened', 'email': f'c{i}@example.com',
+         'timestamp': 1_790_000_000 + i, 'sg_event_id': f'evt-{i}'}
+        for i in range(distinct)
+    ]
+    stream = list(originals)
+    for _ in range(args.events - distinct):
+        # a retry arrives some batches after the original
+        index = rng.randrange(distinct)
+        stream.insert(min(len(stream), index + rng.randrange(args.batch, args.batch * 20)), dict(originals[index]))
+    batches = [stream[i:i + args.batch] for i in range(0, len(stream), args.batch)]
+    with CaptureQueriesContext(connection) as queries:
+        with timed('webhook batches: parse + dedup + stage', len(stream)):
+            staged = sum(stage_events([parse_event(data) for data in batch]) for batch in batches)
+    print(f"    staged {staged:,} of {len(stream):,} events ({distinct:,} distinct), "
+          f"rows={EmailEventStaging.objects.count():,}, {len(queries.captured_queries) / len(batches):.1f} statements/batch")
+    assert staged == distinct
+
+
+if __name__ == '__main__':
+    main()
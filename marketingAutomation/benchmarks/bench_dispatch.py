@@ -0,0 +1,64 @@
+"""Due-queue dispatch throughput for 1..N workers, checking nothing is sent twice."""
+import argparse
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+
+from benchmarks.common import setup, timed
+
+SENT = Counter()
+LOCK = threading.Lock()
+LATENCY = 0.1
+
+
+class StubSender:
+    """Pretends to be a provider API: fixed latency per batch call."""
+
+    def send_batch(self, messages):
+        from campaign.dispatch import SendResult
+
+        time.sleep(LATENCY)
+        with LOCK:
+            SENT.update(m.id for m in messages)
+        return [SendResult(f"stub-{m.id}", None) for m in messages]
+
+
+def main():
+    global LATENCY
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--messages', type=int, default=20_000)
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--latency', type=float, default=LATENCY)
+    args = parser.parse_args()
+    LATENCY = args.latency
+
+    setup()
+    from django.conf import settings
+    from django.utils import timezone
+
+    from campaign.dispatch import run_workers
+    from campaign.models import Campaign, CampaignMessage
+
+    settings.CAMPAIGN_MESSAGE_SENDERS = {'email': '__main__.StubSender'}
+    campaign = Campaign.objects.create(name='bench')
+    due = timezone.now() - timedelta(minutes=1)
+
+    for workers in args.workers:
+        CampaignMessage.objects.all().delete()
+        SENT.clear()
+        CampaignMessage.objects.bulk_create(
+            [CampaignMessage(campaign=campaign, channel='email', status='scheduled', scheduled_time=due)
+             for _ in range(args.messages)],
+            batch_size=2000,
+        )
+        with timed(f'{workers} worker(s)', args.messages):
+            run_workers(workers, batch_size=args.batch_size, once=True)
+        duplicates = sum(1 for n in SENT.values() if n > 1)
+        remaining = CampaignMessage.objects.exclude(status='sent').count()
+        print(f"    sent={len(SENT)} duplicates={duplicates} unsent={remaining}")
+
+
+if __name__ == '__main__':
+    main()
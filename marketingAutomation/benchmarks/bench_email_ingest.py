@@ -0,0 +1,76 @@
+"""
+Webhook event ingestion: per-event INSERT + counter UPDATE vs staging + batched flush.
+
+Both variants end with the same EmailEvent rows and EmailCampaign counters;
+the staged variant is timed for staging (what the webhook request pays) and
+for the flush separately.
+"""
+import argparse
+import random
+from collections import Counter
+
+from benchmarks.common import setup, timed
+
+EVENT_TYPES = ['delivered', 'opened', 'clicked', 'bounced', 'unsubscribed']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--events', type=int, default=50_000)
+    parser.add_argument('--campaigns', type=int, default=20)
+    parser.add_argument('--payload-size', type=int, default=100, help='events per webhook request')
+    args = parser.parse_args()
+
+    setup()
+    from django.db import transaction
+    from django.db.models import F
+
+    from campaign.models import CustomerSegment
+    from emailMarketing.ingest import COUNTER_FIELDS, flush_all, parse_event, stage_events
+    from emailMarketing.models import EmailCampaign, EmailEvent, EmailTemplate
+
+    segment = CustomerSegment.objects.create(name='bench')
+    template = EmailTemplate.objects.create(name='bench', html_content='x')
+    campaigns = [
+        EmailCampaign.objects.create(
+            name=f'c{i}', subject_line='s', from_email='bench@example.com',
+            email_template=template, customer_segment=segment,
+        ).pk
+        for i in range(args.campaigns)
+    ]
+    rng = random.Random(1)
+    payload = [
+        {'email_campaign_id': rng.choice(campaigns), 'event_type': rng.choice(EVENT_TYPES),
+         'email_address': f'c{i}@example.com', 'customer_id': i}
+        for i in range(args.events)
+    ]
+    batches = [payload[i:i + args.payload_size] for i in range(0, len(payload), args.payload_size)]
+
+    with timed('per event INSERT + UPDATE', args.events):
+        for batch in batches:
+            with transaction.atomic():
+                for data in batch:
+                    event = parse_event(data)
+                    event.pop('dedup_key')
+                    EmailEvent.objects.create(**event)
+                    field = COUNTER_FIELDS[event['event_type']]
+                    EmailCampaign.objects.filter(pk=event['email_campaign_id']).update(**{field: F(field) + 1})
+    expected = {pk: Counter() for pk in campaigns}
+    for data in payload:
+        expected[data['email_campaign_id']][data['event_type']] += 1
+    direct = list(EmailCampaign.objects.order_by('pk').values_list(*COUNTER_FIELDS.values()))
+
+    EmailEvent.objects.all().delete()
+    EmailCampaign.objects.update(**{field: 0 for field in COUNTER_FIELDS.values()})
+    with timed('staged (webhook side)', args.events):
+        for batch in batches:
+            stage_events([parse_event(data) for data in batch])
+    with timed('flush to EmailEvent + counters', args.events):
+        moved, dropped = flush_all()
+    staged = list(EmailCampaign.objects.order_by('pk').values_list(*COUNTER_FIELDS.values()))
+    print(f"    moved={moved} dropped={dropped} events={EmailEvent.objects.count()} "
+          f"counters_match={staged == direct}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""
+EmailCampaign send throughput against a local aiosmtpd server.
+
+The server runs in a child process (so it does not compete for the GIL) and
+only counts messages, so the numbers reflect the pipeline (render, MIME
+assembly, SMTP round trips, EmailEvent writes) rather than a real MTA.
+"""
+import argparse
+import multiprocessing
+import time
+
+from benchmarks.common import setup, timed
+
+
+class CountingHandler:
+    def __init__(self, counter):
+        self.counter = counter
+
+    async def handle_DATA(self, server, session, envelope):
+        with self.counter.get_lock():
+            self.counter.value += 1
+        return '250 OK'
+
+
+def serve(port, counter, ready):
+    from aiosmtpd.controller import Controller
+
+    controller = Controller(CountingHandler(counter), hostname='127.0.0.1', port=port)
+    controller.start()
+    ready.set()
+    while True:
+        time.sleep(3600)
+
+
+def resolve(customer_ids, email_campaign):
+    return [
+        {'customer_id': cid, 'email': f'customer{cid}@example.com', 'first_name': f'Name{cid}'}
+        for cid in customer_ids
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--recipients', type=int, default=20_000)
+    parser.add_argument('--pool-sizes', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--port', type=int, default=8025)
+    args = parser.parse_args()
+
+    setup()
+    from django.conf import settings
+
+    from campaign.models import CustomerSegment
+    from emailMarketing.models import EmailCampaign, EmailEvent, EmailTemplate
+    from emailMarketing.sending import SMTPPool, send_email_campaign
+
+    settings.EMAIL_HOST = '127.0.0.1'
+    settings.EMAIL_PORT = args.port
+    settings.EMAIL_RECIPIENT_RESOLVER = '__main__.resolve'
+
+    counter = multiprocessing.Value('q', 0)
+    ready = multiprocessing.Event()
+    server = multiprocessing.Process(target=serve, args=(args.port, counter, ready), daemon=True)
+    server.start()
+    ready.wait(10)
+    try:
+        segment = CustomerSegment.objects.create(name='bench')
+        segment.set_members(range(1, args.recipients + 1))
+        template = EmailTemplate.objects.create(
+            name='bench',
+            html_content='<html><body><h1>Hello {{ first_name }}</h1>'
+                         + '<p>Our offer for you, {{ first_name }}: {{ offer }}.</p>' * 20
+                         + '</body></html>',
+            text_content='Hello {{ first_name }}, {{ offer }}',
+        )
+        for pool_size in args.pool_sizes:
+            email_campaign = EmailCampaign.objects.create(
+                name=f'bench-{pool_size}', subject_line='Hi {{ first_name }}',
+                from_name='Bench', from_email='bench@example.com',
+                email_template=template, customer_segment=segment,
+                personalization_fields={'offer': '20% off'},
+            )
+            counter.value = 0
+            cpu = time.process_time()
+            with timed(f'pool of {pool_size} connection(s)', args.recipients):
+                send_email_campaign(
+                    email_campaign, pool=SMTPPool(pool_size), batch_size=args.batch_size
+                )
+            cpu = time.process_time() - cpu
+            email_campaign.refresh_from_db()
+            events = EmailEvent.objects.filter(email_campaign=email_campaign, event_type='sent').count()
+            print(f"    delivered={counter.value} sent_count={email_campaign.sent_count} "
+                  f"events={events} status={email_campaign.status}")
+            # On a machine with spare cores this, not wall time, bounds throughput.
+            print(f"    pipeline cpu {cpu / args.recipients * 1e6:.0f}us/message "
+                  f"(~{args.recipients / cpu:,.0f}/s per core)")
+    finally:
+        server.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+EmailEvent partitioning and cold archive.
+
+Events spread over a year are inserted into ``email_event``, then moved into
+monthly tables (SQLite's emulated partitions) and finally archived to
+compressed columnar files, except for the most recent months. After each
+step a one-month and a one-campaign range query go through
+``events_in_range`` and must return the same rows; the database and
+archive sizes are reported at the end.
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+from datetime import timedelta
+
+from benchmarks.common import setup, timed
+
+EVENT_TYPES = ['sent', 'delivered', 'opened', 'clicked', 'bounced']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--events', type=int, default=500_000)
+    parser.add_argument('--campaigns', type=int, default=50)
+    parser.add_argument('--keep-days', type=int, default=90)
+    args = parser.parse_args()
+
+    setup()
+    from django.conf import settings
+    from django.db import connection
+    from django.utils import timezone
+
+    from campaign.models import CustomerSegment
+    from emailMarketing.models import EmailCampaign, EmailEvent, EmailTemplate
+    from emailMarketing.partitions import archive_partitions, events_in_range, rotate_partitions
+
+    directory = tempfile.mkdtemp(prefix='bench-archive-')
+    settings.EMAIL_EVENT_ARCHIVE_DIR = directory
+    segment = CustomerSegment.objects.create(name='bench')
+    template = EmailTemplate.objects.create(name='bench', html_content='x')
+    campaigns = [
+        EmailCampaign.objects.create(name=f'c{i}', subject_line='s', from_email='bench@example.com',
+                                     email_template=template, customer_segment=segment).pk
+        for i in range(args.campaigns)
+    ]
+    now = timezone.now()
+    rng = random.Random(5)
+    rows = (
+        {'email_campaign_id': rng.choice(campaigns), 'customer_id': i, 'event_type': rng.choice(EVENT_TYPES),
+         'email_address': f'customer{i % 50_000}@example.com', 'timestamp': now - timedelta(seconds=rng.uniform(0, 365 * 86400)),
+         'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64)', 'ip_address': f'10.0.{i % 256}.{i % 199}'}
+        for i in range(args.events)
+    )
+    with timed('insert', args.events):
+        EmailEvent.objects.bulk_insert(rows)
+    month = (now - timedelta(days=200), now - timedelta(days=170))
+    campaign = campaigns[0]
+
+    def queries(label):
+        with timed(f'{label}: one month'):
+            a = [event['id'] for event in events_in_range(*month)]
+        with timed(f'{label}: one campaign, full year'):
+            b = [event['id'] for event in events_in_range(now - timedelta(days=366), now, email_campaign_id=campaign)]
+        return a, b
+
+    single = queries('single table')
+    with timed('rotate into monthly tables', args.events):
+        rotate_partitions()
+    partitioned = queries('monthly tables')
+    with timed('archive older months'):
+        archived = archive_partitions(args.keep_days)
+    archived_result = queries('archived + live')
+    assert single == partitioned == archived_result, 'range queries differ'
+
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA page_count')
+        pages = cursor.fetchone()[0]
+        cursor.execute('PRAGMA page_size')
+        page_size = cursor.fetchone()[0]
+    archive_bytes = sum(
+        os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(directory) for name in names
+    )
+    print(f"    archived {sum(n for _, n in archived):,} events in {len(archived)} files: {archive_bytes / 1e6:.1f} MB; "
+          f"database file {pages * page_size / 1e6:.1f} MB (not vacuumed); results identical")
+    shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""
+Campaign link registry: message rendering, redirects and event size.
+
+A template with ``--links`` distinct links is prepared for sending with
+click tracking on, which registers the links once. Rendering ``--messages``
+messages (one recipient token each) is compared with signing a click URL
+per link for a tenth of the recipients, the cost of per-link signed
+``t/c/`` URLs. Redirects through the ASGI application are then driven for
+the registered short links (resolved from the in-process cache) and for
+signed click URLs.
+Finally ``--clicks`` clicked events are written to ``email_event`` once
+with the URL and once with the link id, and the table growth is compared.
+"""
+import argparse
+import asyncio
+import random
+
+from benchmarks.bench_tracking import drive
+from benchmarks.common import setup, timed
+
+
+def table_bytes(cursor):
+    cursor.execute('PRAGMA page_count')
+    pages = cursor.fetchone()[0]
+    cursor.execute('PRAGMA page_size')
+    return pages * cursor.fetchone()[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--links', type=int, default=20)
+    parser.add_argument('--messages', type=int, default=20_000)
+    parser.add_argument('--requests', type=int, default=20_000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--clicks', type=int, default=500_000)
+    args = parser.parse_args()
+
+    setup()
+    from django.conf import settings
+    from django.db import connection
+
+    from campaign.models import CustomerSegment
+    from emailMarketing.links import link_cache
+    from emailMarketing.models import EmailCampaign, EmailEvent, EmailLink, EmailTemplate
+    from emailMarketing.sending import EmailSendPipeline, SMTPPool
+    from emailMarketing.tracking import click_url, recipient_token, writer
+    from marketingAutomation.asgi import application
+
+    settings.ALLOWED_HOSTS = ['*']
+    settings.EMAIL_TRACKING_BASE_URL = 'https://track.example.com'
+    urls = [f'https://shop.example.com/collections/spring-sale/item-{i}?utm_source=email&utm_campaign=spring'
+            for i in range(args.links)]
+    html = '<h1>Hello {{ first_name }}</h1>' + ''.join(f'<p><a href="{url}">Item {i}</a></p>' for i, url in enumerate(urls))
+    segment = CustomerSegment.objects.create(name='bench')
+    template = EmailTemplate.objects.create(name='bench', html_content=html)
+    campaign = EmailCampaign.objects.create(name='bench', subject_line='Hi {{ first_name }}', from_email='bench@example.com',
+                                            email_template=template, customer_segment=segment)
+
+    pipeline = EmailSendPipeline(campaign, pool=SMTPPool(1), resolver=lambda ids, campaign: [])
+    with timed(f'prepare ({args.links} links registered)'):
+        pipeline._prepare()
+    assert EmailLink.objects.filter(email_campaign=campaign).count() == args.links
+
+    recipients = [{'email': f'c{i}@example.com', 'customer_id': i, 'first_name': f'Name{i}'} for i in range(args.messages)]
+    with timed(f'render {args.messages:,} tracked messages', args.messages):
+        for recipient in recipients:
+            pipeline.build(recipient, b'Mon, 01 Jan 2024 00:00:00 GMT')
+    sample = recipients[:args.messages // 10]
+    with timed(f'sign {args.links} click URLs per message', len(sample)):
+        for recipient in sample:
+            for url in urls:
+                click_url(campaign.pk, recipient['email'], url, recipient['customer_id'])
+
+    codes = list(EmailLink.objects.filter(email_campaign=campaign).values_list('code', flat=True))
+    rng = random.Random(11)
+    link_paths, click_paths = [], []
+    for i in range(args.requests):
+        token = recipient_token(campaign, f'c{i}@example.com', i)
+        link_paths.append(f'/emailMarketing/t/l/{token}/{rng.choice(codes)}/')
+        click_paths.append(click_url(campaign.pk, f'c{i}@example.com', rng.choice(urls), i))
+    link_cache.clear()
+    for label, paths in (('short link redirects', link_paths), ('signed click redirects', click_paths)):
+        latencies, elapsed, statuses = asyncio.run(drive(application, paths, args.concurrency))
+        print(f'{label:<40} {elapsed:8.3f}s  ({len(paths) / elapsed:,.0f}/s)  statuses={sorted(statuses)}')
+        assert statuses == {302}
+    writer.flush()
+
+    link_ids = dict(EmailLink.objects.filter(email_campaign=campaign).values_list('url', 'pk'))
+    with connection.cursor() as cursor:
+        sizes = {}
+        for label, column in (('url', 'link_clicked'), ('link id', 'link_id')):
+            rows = ({'email_campaign_id': campaign.pk, 'event_type': 'clicked', 'customer_id': i,
+                     'email_address': f'c{i}@example.com', 'ip_address': '203.0.113.7',
+                     column: urls[i % args.links] if column == 'link_clicked' else link_ids[urls[i % args.links]]}
+                    for i in range(args.clicks))
+            before = table_bytes(cursor)
+            with timed(f'insert {args.clicks:,} clicks with {label}', args.clicks):
+                EmailEvent.objects.bulk_insert(rows)
+            sizes[label] = table_bytes(cursor) - before
+            print(f'    database grew {sizes[label] / 1e6:.1f} MB ({sizes[label] / args.clicks:.0f} bytes/event)')
+    print(f'    link ids: {1 - sizes["link id"] / sizes["url"]:.0%} smaller')
+
+
+if __name__ == '__main__':
+    main()
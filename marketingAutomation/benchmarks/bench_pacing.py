@@ -0,0 +1,71 @@
+"""
+Admit-check throughput of BudgetPacer with many campaigns and worker threads.
+
+Threads admit batches against random campaigns while the pacer flushes in
+the background; afterwards the flushed spend is checked against every
+campaign's budget.
+"""
+import argparse
+import random
+import threading
+from decimal import Decimal
+
+from benchmarks.common import setup, timed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--campaigns', type=int, default=5000)
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--checks', type=int, default=200_000, help='admit calls per run')
+    parser.add_argument('--batch', type=int, default=50)
+    parser.add_argument('--flush-interval', type=float, default=0.5)
+    args = parser.parse_args()
+
+    setup()
+    from django.db.models import Sum
+
+    from campaign.models import Campaign, CampaignAnalyticsBucket
+    from campaign.pacing import BudgetPacer, to_micro
+
+    unit_cost = to_micro('0.01')
+    for threads in args.threads:
+        Campaign.objects.all().delete()
+        Campaign.objects.bulk_create(
+            [Campaign(name=f'c{i}', budget=Decimal(random.randint(1, 30))) for i in range(args.campaigns)],
+            batch_size=1000,
+        )
+        ids = list(Campaign.objects.values_list('id', flat=True))
+        pacer = BudgetPacer(args.flush_interval)
+        pacer.preload(ids)
+        pacer.start()
+        per_thread = args.checks // threads
+        admitted = [0] * threads
+
+        def work(index):
+            rng = random.Random(index)
+            total = 0
+            for _ in range(per_thread):
+                total += pacer.admit(rng.choice(ids), args.batch, unit_cost)
+            admitted[index] = total
+
+        pool = [threading.Thread(target=work, args=(i,)) for i in range(threads)]
+        with timed(f'{threads} thread(s) x {per_thread} admits', per_thread * threads):
+            for thread in pool:
+                thread.start()
+            for thread in pool:
+                thread.join()
+        pacer.stop()
+
+        budgets = dict(Campaign.objects.values_list('id', 'budget'))
+        spent = dict(
+            CampaignAnalyticsBucket.objects.filter(granularity='day')
+            .values('campaign_id').annotate(cost=Sum('cost')).values_list('campaign_id', 'cost')
+        )
+        over = sum(1 for cid, cost in spent.items() if cost > budgets[cid])
+        print(f"    admitted={sum(admitted):,} messages  spent={sum(spent.values())}  "
+              f"budget={sum(budgets.values())}  overspent_campaigns={over}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Page latency at increasing depth: OFFSET pagination vs keyset cursors.
+
+Both walk CampaignMessage for one campaign newest first on (created_at, id);
+the keyset variant seeks with the cursor of the previous page's last row.
+"""
+import argparse
+import time
+from datetime import timedelta
+
+from benchmarks.common import setup
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--messages', type=int, default=300_000)
+    parser.add_argument('--limit', type=int, default=50)
+    parser.add_argument('--depths', type=int, nargs='+', default=[1, 100, 1000, 5000])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    setup()
+    from django.db import connection, transaction
+    from django.utils import timezone
+
+    from campaign.models import Campaign, CampaignMessage
+    from campaign.pagination import encode_cursor, keyset_page
+
+    campaign = Campaign.objects.create(name='bench')
+    Campaign.objects.create(name='other')
+    start = timezone.now() - timedelta(days=30)
+    messages = [
+        CampaignMessage(campaign=campaign, channel='email', status='sent')
+        for _ in range(args.messages)
+    ]
+    CampaignMessage.objects.bulk_create(messages, batch_size=5000)
+    # auto_now_add gives every row nearly the same stamp; spread them out
+    # (with deliberate ties) so the ordering matters.
+    ops = connection.ops
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.executemany(
+            'UPDATE campaign_message SET created_at = %s WHERE id = %s',
+            [(ops.adapt_datetimefield_value(start + timedelta(seconds=i // 3)), m.id)
+             for i, m in enumerate(messages)],
+        )
+
+    fields = ['id', 'channel', 'status', 'created_at']
+    queryset = CampaignMessage.objects.filter(campaign=campaign)
+    ordered = queryset.order_by('-created_at', '-id')
+    print(f"{'page':>8} {'offset ms':>12} {'keyset ms':>12}")
+    for depth in args.depths:
+        offset = (depth - 1) * args.limit
+        if offset >= args.messages:
+            continue
+        # cursor = last row of page depth-1
+        cursor = None
+        if depth > 1:
+            previous = ordered.values('id', 'created_at')[offset - 1]
+            cursor = encode_cursor(previous['created_at'], previous['id'])
+
+        t = time.perf_counter()
+        for _ in range(args.repeat):
+            by_offset = list(ordered.values(*fields)[offset:offset + args.limit])
+        offset_ms = (time.perf_counter() - t) / args.repeat * 1000
+
+        t = time.perf_counter()
+        for _ in range(args.repeat):
+            by_cursor, _next = keyset_page(queryset, fields, cursor, args.limit)
+        keyset_ms = (time.perf_counter() - t) / args.repeat * 1000
+
+        assert [r['id'] for r in by_offset] == [r['id'] for r in by_cursor]
+        print(f"{depth:>8} {offset_ms:>12.2f} {keyset_ms:>12.2f}")
+
+
+if __name__ == '__main__':
+    main()
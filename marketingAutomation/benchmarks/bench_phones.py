@@ -0,0 +1,94 @@
+"""
+Normalizing and deduplicating a WhatsApp audience's phone numbers.
+
+``--numbers`` US phone numbers in mixed spellings (``(201) 200-0001``,
+``+1 201 200 0001``, ``1-201-200-0001``, ...) are normalized to E.164 and
+deduplicated through ``Audience.add_numbers`` in batches of ``--batch``.
+``--unique`` of them are distinct people, the rest are the same numbers
+spelled differently, and every ``--invalid-every``-th number is malformed.
+For comparison a sample goes through a per-number normalizer (a regex clean
+and prefix checks per number), extrapolated to the full audience.
+"""
+import argparse
+import re
+
+from benchmarks.common import setup, timed
+
+SPELLINGS = (
+    lambda area, local: f'({area}) {local[:3]}-{local[3:]}',
+    lambda area, local: f'+1 {area} {local[:3]} {local[3:]}',
+    lambda area, local: f'1-{area}-{local[:3]}-{local[3:]}',
+    lambda area, local: f'{area}.{local[:3]}.{local[3:]}',
+    lambda area, local: f'{area}{local}',
+    lambda area, local: f'011 1 {area} {local}',
+)
+INVALID = ('n/a', '555-0100', '+1 (201) 000-0000', '201 200 00 ext. 12')
+
+
+def audience(numbers, unique, invalid_every):
+    people = list(range(unique))
+    people += [(i * 7919) % unique for i in range(numbers - unique)]
+    spelled = []
+    for i, person in enumerate(people):
+        if i % invalid_every == invalid_every - 1:
+            spelled.append(INVALID[i % len(INVALID)])
+        else:
+            spelled.append(SPELLINGS[i % len(SPELLINGS)](201 + person // 8_000_000, str(2_000_000 + person % 8_000_000)))
+    return spelled
+
+
+NON_DIGITS = re.compile(r'[^\d+]')
+NANP = re.compile(r'[2-9]\d{2}[2-9]\d{6}')
+
+
+def normalize_one(number):
+    digits = NON_DIGITS.sub('', number)
+    if digits.startswith('011'):
+        digits = '+' + digits[3:]
+    if digits.startswith('+1'):
+        digits = digits[2:]
+    elif digits.startswith('1') and len(digits) == 11:
+        digits = digits[1:]
+    if NANP.fullmatch(digits):
+        return '+1' + digits
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--numbers', type=int, default=10_000_000)
+    parser.add_argument('--unique', type=int, default=7_000_000)
+    parser.add_argument('--invalid-every', type=int, default=50)
+    parser.add_argument('--batch', type=int, default=100_000)
+    parser.add_argument('--sample', type=int, default=500_000)
+    args = parser.parse_args()
+
+    setup()
+    from whatsappMarketing.phones import Audience
+
+    with timed(f'spell {args.numbers:,} numbers'):
+        numbers = audience(args.numbers, args.unique, args.invalid_every)
+
+    sample = numbers[:args.sample]
+    seen = set()
+    with timed(f'per-number normalize x {len(sample):,}', len(sample)) as result:
+        for number in sample:
+            normalized = normalize_one(number)
+            if normalized is not None:
+                seen.add(normalized)
+    print(f'    {args.numbers:,} numbers would take {result["seconds"] * args.numbers / len(sample):.1f}s')
+
+    recipients = Audience('US')
+    with timed(f'normalize + dedupe {args.numbers:,}', args.numbers):
+        for i in range(0, args.numbers, args.batch):
+            recipients.add_numbers(numbers[i:i + args.batch])
+    print(f'    {len(recipients):,} recipients, {recipients.duplicates:,} duplicates, {recipients.invalid:,} invalid'
+          f' ({args.batch:,} per batch)')
+    invalid = args.numbers // args.invalid_every
+    assert recipients.invalid == invalid, recipients.invalid
+    assert len(recipients) + recipients.duplicates == args.numbers - invalid
+    assert seen <= recipients.seen
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+Unique reach: HyperLogLog sketches against COUNT(DISTINCT) over EmailEvent.
+
+``--events`` opened events over ``--campaigns`` email campaigns and
+``--days`` days, drawn from ``--people`` addresses, are written to
+``email_event`` and, in flush-sized batches, to the reach sketches. Then the
+distinct openers of one campaign and of all campaigns over the whole period
+are counted both ways; the sketch answer has to be within four standard
+errors of the exact one.
+"""
+import argparse
+import random
+from datetime import timedelta
+
+from benchmarks.common import setup, timed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--events', type=int, default=1_000_000)
+    parser.add_argument('--campaigns', type=int, default=10)
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--people', type=int, default=300_000)
+    parser.add_argument('--flush-size', type=int, default=5000)
+    args = parser.parse_args()
+
+    setup()
+    from django.db import transaction
+    from django.utils import timezone
+
+    from campaign.models import CustomerSegment
+    from emailMarketing.models import EmailCampaign, EmailEvent, EmailReachSketch, EmailTemplate
+    from emailMarketing.reach import unique_reach, update_sketches
+
+    segment = CustomerSegment.objects.create(name='bench')
+    template = EmailTemplate.objects.create(name='bench', html_content='x')
+    campaigns = [
+        EmailCampaign.objects.create(name=f'bench {i}', subject_line='s', from_email='bench@example.com',
+                                     email_template=template, customer_segment=segment).pk
+        for i in range(args.campaigns)
+    ]
+    rng = random.Random(3)
+    start = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=args.days)
+    events = [
+        {'email_campaign_id': rng.choice(campaigns), 'event_type': 'opened',
+         'email_address': f'person{rng.randrange(args.people)}@example.com',
+         'timestamp': start + timedelta(seconds=rng.randrange(args.days * 86400))}
+        for _ in range(args.events)
+    ]
+    # webhooks arrive roughly in time order, so a flush touches the sketches of a day or two
+    events.sort(key=lambda event: event['timestamp'])
+    with timed(f'insert {args.events:,} events', args.events):
+        EmailEvent.objects.bulk_insert(events)
+    with timed(f'update sketches ({args.flush_size:,} per flush)', args.events):
+        for i in range(0, len(events), args.flush_size):
+            with transaction.atomic():
+                update_sketches(events[i:i + args.flush_size])
+    print(f'    {EmailReachSketch.objects.count():,} sketches')
+
+    for label, ids in (('one campaign', campaigns[:1]), ('all campaigns', campaigns)):
+        with timed(f'{label}: COUNT(DISTINCT)'):
+            exact = (
+                EmailEvent.objects.filter(email_campaign_id__in=ids, event_type='opened')
+                .values('email_address').distinct().count()
+            )
+        with timed(f'{label}: merge sketches'):
+            sketch = unique_reach(ids, 'opened')
+        estimate = sketch.count()
+        error = (estimate - exact) / exact
+        print(f'    exact {exact:,} estimate {estimate:,} error {error:+.2%} (standard error {sketch.standard_error:.2%})')
+        assert abs(error) <= 4 * sketch.standard_error
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Suppression index: build from EmailEvent, filter a million recipients,
+per-batch lookups of the send pipeline and near real-time updates.
+
+``--suppressed`` bounced/unsubscribed events are inserted and the index is
+built from them. A recipient list of ``--recipients`` addresses, of which
+``--hit-share`` are suppressed, is then filtered in one call (the bulk
+path) and in send-pipeline batches of ``--batch`` (the bisect path); both
+must drop exactly the suppressed addresses. Finally new suppressions are
+recorded the way the ingest flush does and must be visible after one
+``refresh``, and the log is compacted into the index.
+"""
+import argparse
+import random
+import shutil
+import tempfile
+import time
+
+from benchmarks.common import setup, timed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--suppressed', type=int, default=1_000_000)
+    parser.add_argument('--recipients', type=int, default=1_000_000)
+    parser.add_argument('--hit-share', type=float, default=0.05)
+    parser.add_argument('--batch', type=int, default=500)
+    parser.add_argument('--updates', type=int, default=10_000)
+    args = parser.parse_args()
+
+    setup()
+    from django.conf import settings
+    from django.utils import timezone
+
+    from campaign.models import CustomerSegment
+    from emailMarketing.models import EmailCampaign, EmailEvent, EmailTemplate
+    from emailMarketing.suppression import compact_suppression_index, record_suppressions, suppression_index
+
+    directory = tempfile.mkdtemp(prefix='bench-suppression-')
+    settings.EMAIL_SUPPRESSION_DIR = directory
+    segment = CustomerSegment.objects.create(name='bench')
+    template = EmailTemplate.objects.create(name='bench', html_content='x')
+    campaign = EmailCampaign.objects.create(name='bench', subject_line='s', from_email='bench@example.com',
+                                            email_template=template, customer_segment=segment)
+    now = timezone.now()
+    chunk = 50_000
+    with timed(f'insert {args.suppressed:,} suppression events', args.suppressed):
+        for start in range(0, args.suppressed, chunk):
+            EmailEvent.objects.bulk_insert([
+                {'email_campaign_id': campaign.pk, 'event_type': 'bounced' if i % 3 else 'unsubscribed',
+                 'email_address': f'gone{i}@example.com', 'timestamp': now}
+                for i in range(start, min(start + chunk, args.suppressed))
+            ])
+    with timed('build index from EmailEvent', args.suppressed):
+        compact_suppression_index(full=True)
+
+    rng = random.Random(5)
+    hits = int(args.recipients * args.hit_share)
+    recipients = [{'email': f'Gone{rng.randrange(args.suppressed)}@Example.com'} for _ in range(hits)]
+    recipients += [{'email': f'customer{i}@example.com'} for i in range(args.recipients - hits)]
+    rng.shuffle(recipients)
+
+    index = suppression_index()
+    with timed(f'filter {args.recipients:,} recipients at once', args.recipients):
+        allowed = index.exclude(recipients)
+    assert len(allowed) == args.recipients - hits, len(allowed)
+
+    batches = [recipients[i:i + args.batch] for i in range(0, len(recipients), args.batch)]
+    with timed(f'filter in batches of {args.batch}', args.recipients):
+        kept = 0
+        for batch in batches:
+            kept += len(suppression_index().exclude(batch))
+    assert kept == args.recipients - hits, kept
+
+    fresh = [f'customer{i}@example.com' for i in range(args.updates)]
+    start = time.perf_counter()
+    record_suppressions(fresh)
+    index = suppression_index()
+    visible = sum(index.suppressed(fresh))
+    elapsed = time.perf_counter() - start
+    print(f"{'record + refresh + lookup':<40} {elapsed:8.3f}s  ({args.updates / elapsed:,.0f}/s)")
+    assert visible == args.updates, visible
+    with timed('compact log into the index', args.suppressed + args.updates):
+        total = compact_suppression_index()
+    assert all(suppression_index().suppressed(fresh))
+    print(f"    {total:,} addresses in {index.index_path.stat().st_size / 1e6:.1f} MB")
+    shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""Compiled template cache vs naive per-recipient ``Template(...).render()``."""
+import argparse
+
+from benchmarks.common import setup, timed
+
+SOURCE = (
+    "Hi {{ first_name }}, {{ offer.title }} is back at {{ location }}! "
+    "Show code {{ offer.code }} before {{ expires }} to save {{ offer.discount }}%."
+)
+
+
+def contexts(n):
+    for i in range(n):
+        yield {
+            'first_name': f'Customer{i}',
+            'location': 'Dhanmondi',
+            'expires': 'Friday',
+            'offer': {'title': 'Kacchi Night', 'code': f'K{i:07d}', 'discount': 15},
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--recipients', type=int, default=1_000_000)
+    parser.add_argument('--naive-sample', type=int, default=20_000,
+                        help='Naive rendering is timed on a sample and extrapolated.')
+    args = parser.parse_args()
+
+    setup()
+    from django.template import Context, Template
+
+    from campaign.models import Campaign, CampaignMessage
+    from campaign.templating import compiled_template
+
+    campaign = Campaign.objects.create(name='bench')
+    message = CampaignMessage.objects.create(campaign=campaign, channel='sms', message_template=SOURCE)
+
+    with timed(f'naive Template().render() x{args.naive_sample:,}', args.naive_sample) as naive:
+        for context in contexts(args.naive_sample):
+            # message_template is plain text: compiled without autoescaping
+            Template(message.message_template).render(Context(context, autoescape=False))
+    naive_total = naive['seconds'] * args.recipients / args.naive_sample
+    print(f"  extrapolated to {args.recipients:,}: {naive_total:.1f}s")
+
+    with timed(f'compiled stream x{args.recipients:,}', args.recipients) as fast:
+        template = compiled_template(message, 'message_template')
+        for _ in template.stream(contexts(args.recipients)):
+            pass
+    print(f"compiled takes {fast['seconds'] / naive_total:.1%} of naive time")
+
+
+if __name__ == '__main__':
+    main()
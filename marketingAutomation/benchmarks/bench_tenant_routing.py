@@ -0,0 +1,96 @@
+"""
+Request latency through TenantMiddleware/TenantRouter across many tenants.
+
+Every tenant gets its own SQLite file (copied from one migrated template),
+then requests are spread round-robin over the tenants. The run is repeated
+with persistent per-tenant connections and with reconnect-per-request
+(``CONN_MAX_AGE = 0``) to show what connection reuse saves.
+"""
+import argparse
+import shutil
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.common import setup
+
+from django.http import JsonResponse
+from django.urls import path
+
+
+def campaign_count(request):
+    from campaign.models import Campaign
+
+    return JsonResponse({'tenant': request.tenant_schema, 'campaigns': Campaign.objects.count()})
+
+
+urlpatterns = [path('count/', campaign_count)]
+
+
+def run(client, tenants, requests):
+    latencies = []
+    for i in range(requests):
+        schema = tenants[i % len(tenants)]
+        start = time.perf_counter()
+        response = client.get('/count/', headers={'Host': f'{schema}.bench.test'})
+        latencies.append(time.perf_counter() - start)
+        assert response.status_code == 200, response.content
+    latencies.sort()
+    return {
+        'p50': statistics.median(latencies) * 1000,
+        'p99': latencies[int(len(latencies) * 0.99) - 1] * 1000,
+        'rps': len(latencies) / sum(latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--tenants', type=int, default=1000)
+    parser.add_argument('--requests', type=int, default=20_000)
+    args = parser.parse_args()
+
+    setup()
+    from django.conf import settings
+    from django.core.management import call_command
+    from django.db import connections
+    from django.test import Client
+
+    from campaign.models import Campaign
+    from marketingAutomation.tenancy import tenant_alias, tenant_context, tenant_sqlite_path
+
+    tenant_dir = Path(tempfile.mkdtemp(prefix='bench-tenants-'))
+    settings.ROOT_URLCONF = __name__
+    settings.ALLOWED_HOSTS = ['*']
+    tenants = [f't{i:04d}' for i in range(args.tenants)]
+    settings.TENANT_ROUTING = {
+        **settings.TENANT_ROUTING,
+        'SQLITE_DIR': tenant_dir,
+        'HOSTS': {f'{schema}.bench.test': schema for schema in tenants},
+        'MAX_OPEN_PER_THREAD': args.tenants,
+    }
+
+    tenant_sqlite_path(tenants[0]).touch()
+    call_command('migrate', database=tenant_alias(tenants[0]), verbosity=0)
+    with tenant_context(tenants[0]):
+        Campaign.objects.create(name='seed')
+    connections[tenant_alias(tenants[0])].close()
+    for schema in tenants[1:]:
+        shutil.copyfile(tenant_dir / f'{tenants[0]}.sqlite3', tenant_dir / f'{schema}.sqlite3')
+
+    client = Client()
+    for label, max_age in (('persistent per-tenant connections', 600), ('reconnect per request', 0)):
+        for schema in tenants:
+            connections.settings[tenant_alias(schema)]['CONN_MAX_AGE'] = max_age
+            connections[tenant_alias(schema)].close()
+        run(client, tenants, args.tenants)  # warm-up: first touch of every tenant
+        stats = run(client, tenants, args.requests)
+        print(f"{label:<36} p50 {stats['p50']:.3f} ms  p99 {stats['p99']:.3f} ms  {stats['rps']:,.0f} req/s")
+
+    for schema in tenants:
+        connections[tenant_alias(schema)].close()
+    shutil.rmtree(tenant_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+Open-pixel / click-redirect latency through the ASGI application.
+
+Requests are driven in-process against ``marketingAutomation.asgi.application``
+with a fixed number in flight, so the numbers are the application side of a
+single ASGI worker (no HTTP parsing or network). The plain Django ASGI
+handler (the async views behind the full middleware stack) is measured for
+comparison. At the end the background writer is flushed and the staged
+events are counted.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from benchmarks.common import setup
+
+
+async def request(app, path):
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+        'method': 'GET', 'scheme': 'http', 'path': path, 'raw_path': path.encode(),
+        'query_string': b'', 'root_path': '',
+        'headers': [(b'host', b'localhost'), (b'user-agent', b'bench/1.0')],
+        'client': ('203.0.113.7', 50000), 'server': ('localhost', 80),
+    }
+    received = False
+
+    async def receive():
+        nonlocal received
+        if received:
+            await asyncio.sleep(3600)
+        received = True
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    status = None
+
+    async def send(message):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+
+    start = time.perf_counter()
+    await app(scope, receive, send)
+    return time.perf_counter() - start, status
+
+
+async def drive(app, paths, concurrency):
+    latencies = []
+    statuses = set()
+    queue = iter(paths)
+
+    async def worker():
+        for path in queue:
+            latency, status = await request(app, path)
+            latencies.append(latency)
+            statuses.add(status)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, time.perf_counter() - start, statuses
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=20_000)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 16, 64])
+    args = parser.parse_args()
+
+    setup()
+    from django.conf import settings
+
+    from emailMarketing.models import EmailEventStaging
+    from emailMarketing.tracking import click_url, open_pixel_url, writer
+    from marketingAutomation.asgi import application, django_application
+
+    settings.ALLOWED_HOSTS = ['*']
+    paths = []
+    for i in range(args.requests):
+        if i % 4:
+            paths.append(open_pixel_url(1, f'c{i}@example.com', customer_id=i))
+        else:
+            paths.append(click_url(1, f'c{i}@example.com', 'https://example.com/offer', customer_id=i))
+
+    total = 0
+    for label, app, count in [('asgi.application', application, len(paths)),
+                              ('django handler', django_application, len(paths) // 10)]:
+        for concurrency in args.concurrency:
+            latencies, elapsed, statuses = asyncio.run(drive(app, paths[:count], concurrency))
+            total += count
+            latencies.sort()
+            p50 = statistics.median(latencies) * 1000
+            p99 = latencies[int(len(latencies) * 0.99)] * 1000
+            print(f"{label:<17} concurrency {concurrency:>3}: {count / elapsed:8,.0f} req/s  "
+                  f"p50 {p50:.2f}ms  p99 {p99:.2f}ms  statuses={sorted(statuses)}")
+    writer.flush()
+    print(f"    staged events={EmailEventStaging.objects.count()} of {total} requests")
+
+
+if __name__ == '__main__':
+    main()
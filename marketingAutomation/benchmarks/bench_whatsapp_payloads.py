@@ -0,0 +1,106 @@
+"""
+WhatsApp request bodies: built per recipient against the compiled payload.
+
+A template with a text header, ``--body-parameters`` body parameters, a URL
+button, a quick reply and a copy-code button gets ``--recipients`` request
+bodies built the straightforward way (placeholders counted in every
+component, the payload dict assembled and ``json.dumps``-ed per recipient)
+and through ``CompiledPayload.build``. Then ``--send`` messages go through
+the send scheduler against the stub provider (no rate limit, no latency),
+and the compiled build is put in relation to the scheduler's CPU time per
+message.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from benchmarks.common import setup, timed
+
+
+def build_per_recipient(template, recipient):
+    from whatsappMarketing.payloads import parameter_count
+
+    components = []
+    header = recipient.get('header_parameters') or []
+    if template.header_type == 'text' and parameter_count(template.header_content):
+        parameters = [{'type': 'text', 'text': str(value)} for value in header[:parameter_count(template.header_content)]]
+        components.append({'type': 'header', 'parameters': parameters})
+    body = recipient.get('parameters') or []
+    if parameter_count(template.body_content):
+        parameters = [{'type': 'text', 'text': str(value)} for value in body[:parameter_count(template.body_content)]]
+        components.append({'type': 'body', 'parameters': parameters})
+    values = iter(recipient.get('button_parameters') or [])
+    for index, button in enumerate(template.buttons):
+        kind = button['type'].lower()
+        if kind == 'url' and parameter_count(button['url']):
+            components.append({'type': 'button', 'sub_type': kind, 'index': str(index),
+                               'parameters': [{'type': 'text', 'text': str(next(values))}]})
+        elif kind == 'copy_code':
+            components.append({'type': 'button', 'sub_type': kind, 'index': str(index),
+                               'parameters': [{'type': 'coupon_code', 'coupon_code': str(next(values))}]})
+        elif kind == 'quick_reply' and button.get('payload'):
+            components.append({'type': 'button', 'sub_type': kind, 'index': str(index),
+                               'parameters': [{'type': 'payload', 'payload': button['payload']}]})
+    payload = {'messaging_product': 'whatsapp', 'recipient_type': 'individual', 'to': recipient['phone_number'],
+               'type': 'template', 'template': {'name': template.template_id, 'language': {'code': template.language},
+                                                'components': components}}
+    return json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--recipients', type=int, default=200_000)
+    parser.add_argument('--body-parameters', type=int, default=4)
+    parser.add_argument('--send', type=int, default=20_000)
+    args = parser.parse_args()
+
+    setup()
+    from campaign.models import CustomerSegment
+    from whatsappMarketing.models import WhatsAppCampaign, WhatsAppTemplate
+    from whatsappMarketing.payloads import compiled_payload
+    from whatsappMarketing.sending import StubProvider, WhatsAppSendScheduler
+
+    body = 'Hi {{1}}, ' + ', '.join(f'item {{{{{i}}}}}' for i in range(2, args.body_parameters + 1))
+    template = WhatsAppTemplate.objects.create(
+        name='bench', template_id='spring_sale', language='en_US', category='marketing', approval_status='approved',
+        header_type='text', header_content='Spring sale for {{1}}', body_content=body,
+        footer_content='Reply STOP to opt out',
+        buttons=[{'type': 'URL', 'text': 'Shop', 'url': 'https://shop.example.com/r/{{1}}'},
+                 {'type': 'QUICK_REPLY', 'text': 'Stop', 'payload': 'unsubscribe'},
+                 {'type': 'COPY_CODE', 'example': 'SPRING20'}],
+    )
+
+    def recipient(i):
+        return {'customer_id': i, 'phone_number': f'+1555{2_000_000 + i:07d}', 'header_parameters': [f'Customer {i}'],
+                'parameters': [f'Customer {i}'] + [f'Product {i % 97 + p}' for p in range(1, args.body_parameters)],
+                'button_parameters': [f'c{i}', f'SPRING{i % 1000:03d}']}
+
+    recipients = [recipient(i) for i in range(args.recipients)]
+    with timed(f'per-recipient payloads x {args.recipients:,}', args.recipients) as naive:
+        expected = [build_per_recipient(template, r) for r in recipients]
+    build = compiled_payload(template).build
+    with timed(f'compiled payloads x {args.recipients:,}', args.recipients) as compiled:
+        bodies = [build(r) for r in recipients]
+    assert bodies == expected
+    print(f'    {naive["seconds"] / compiled["seconds"]:.1f}x faster')
+
+    segment = CustomerSegment.objects.create(name='bench')
+    segment.set_members(range(args.send))
+    campaign = WhatsAppCampaign.objects.create(name='bench', whatsapp_template=template, customer_segment=segment)
+    scheduler = WhatsAppSendScheduler(provider=StubProvider(rate=1e9, latency=0), concurrency=64,
+                                      resolver=lambda ids, whatsapp_campaign: [recipient(i) for i in ids],
+                                      tenant_rate=1e9, category_rates={})
+    scheduler.add(campaign)
+    start = time.process_time()
+    sent = asyncio.run(scheduler.run())
+    cpu = time.process_time() - start
+    assert sent == args.send
+    per_message = compiled['seconds'] / args.recipients
+    print(f"{'send (CPU)':<40} {cpu:8.3f}s  ({sent / cpu:,.0f}/s)")
+    print(f'    payload build: {per_message * 1e6:.1f}us of {cpu / sent * 1e6:.0f}us CPU per message'
+          f' ({per_message * sent / cpu:.1%}; per-recipient build: {naive["seconds"] / args.recipients * sent / cpu:.1%})')
+
+
+if __name__ == '__main__':
+    main()
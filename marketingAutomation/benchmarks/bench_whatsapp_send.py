@@ -0,0 +1,88 @@
+"""
+WhatsApp sends under per-tenant rate limits, against the local stub provider.
+
+One large tenant starts ``--big-campaigns`` campaigns of ``--big-recipients``
+each next to ``--small-tenants`` tenants with one campaign of
+``--small-recipients``. Every tenant is allowed ``--rate`` messages per
+second by the stub provider, which answers after ``--latency`` seconds.
+The scheduler has to keep every tenant at its limit (aggregate throughput
+close to the sum of the tenant rates) without a single 429, and the small
+tenants have to finish in about their own size / rate, not after the large
+tenant. For contrast the large tenant's campaigns are sent again with
+buckets far above the provider's limit, which is what sending without a
+limiter looks like.
+"""
+import argparse
+import asyncio
+import time
+
+from benchmarks.common import setup
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--big-campaigns', type=int, default=4)
+    parser.add_argument('--big-recipients', type=int, default=5000)
+    parser.add_argument('--small-tenants', type=int, default=3)
+    parser.add_argument('--small-recipients', type=int, default=1000)
+    parser.add_argument('--rate', type=float, default=1000)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--concurrency', type=int, default=256)
+    args = parser.parse_args()
+
+    setup()
+    from campaign.models import CustomerSegment
+    from whatsappMarketing.models import WhatsAppCampaign, WhatsAppTemplate
+    from whatsappMarketing.sending import StubProvider, WhatsAppSendScheduler
+
+    template = WhatsAppTemplate.objects.create(name='bench', template_id='spring_sale', language='en_US',
+                                               category='marketing', body_content='Hi {{1}}')
+
+    def campaign(tenant, recipients, offset):
+        segment = CustomerSegment.objects.create(name=f'bench {tenant}')
+        segment.set_members(range(offset, offset + recipients))
+        return WhatsAppCampaign.objects.create(name=f'bench {tenant}', whatsapp_template=template,
+                                               customer_segment=segment, tenant_schema=tenant)
+
+    def resolver(ids, whatsapp_campaign):
+        return [{'customer_id': i, 'phone_number': f'+1555{2_000_000 + i:07d}', 'parameters': [f'Customer {i}']} for i in ids]
+
+    def run(campaigns, tenant_rate):
+        provider = StubProvider(rate=args.rate, latency=args.latency)
+        scheduler = WhatsAppSendScheduler(provider=provider, concurrency=args.concurrency, resolver=resolver,
+                                          tenant_rate=tenant_rate, category_rates={})
+        finished = {}
+        close = scheduler._close
+
+        async def timed_close(job):
+            finished[job.tenant] = time.perf_counter() - start
+            await close(job)
+
+        scheduler._close = timed_close
+        for whatsapp_campaign in campaigns:
+            scheduler.add(whatsapp_campaign)
+        start = time.perf_counter()
+        sent = asyncio.run(scheduler.run())
+        return sent, time.perf_counter() - start, finished, scheduler
+
+    big = [campaign('big', args.big_recipients, i * args.big_recipients) for i in range(args.big_campaigns)]
+    small = [campaign(f'small{i}', args.small_recipients, 0) for i in range(args.small_tenants)]
+    sent, elapsed, finished, scheduler = run(big + small, args.rate)
+    ideal = max(args.big_campaigns * args.big_recipients, args.small_recipients) / args.rate
+    print(f"{'rate-limited send':<40} {elapsed:8.3f}s  ({sent / elapsed:,.0f}/s, at the limits: {ideal:.2f}s)")
+    for tenant, seconds in sorted(finished.items(), key=lambda item: item[1]):
+        size = args.big_campaigns * args.big_recipients if tenant == 'big' else args.small_recipients
+        print(f'    {tenant:<8} {size:>7,} messages done after {seconds:6.2f}s (alone at its rate: {size / args.rate:.2f}s)')
+    throttled = sum(scheduler.throttled.values())
+    print(f'    429 responses: {throttled}')
+    assert sent == args.big_campaigns * args.big_recipients + args.small_tenants * args.small_recipients
+    assert throttled == 0
+
+    big = [campaign('big', args.big_recipients, i * args.big_recipients) for i in range(args.big_campaigns)]
+    sent, elapsed, finished, scheduler = run(big, args.rate * 100)
+    print(f"{'buckets 100x the provider limit':<40} {elapsed:8.3f}s  ({sent / elapsed:,.0f}/s)")
+    print(f'    429 responses: {sum(scheduler.throttled.values()):,}')
+
+
+if __name__ == '__main__':
+    main()
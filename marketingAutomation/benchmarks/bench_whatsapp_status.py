@@ -0,0 +1,83 @@
+"""
+WhatsApp status callbacks: per-message ``mark_*`` against ``apply_statuses``.
+
+``--messages`` messages over ``--campaigns`` campaigns get a ``delivered``
+callback each and ``--read-share`` of them a ``read`` callback a few minutes
+later. ``--retry-share`` of the callbacks are sent twice, and arrival order
+is jittered by up to ``--disorder`` seconds, so many ``read`` callbacks
+arrive before their ``delivered``. They are applied in batches of
+``--batch`` (one transaction each, like a webhook flush). For comparison a
+sample goes through ``mark_delivered()`` one message at a time. The
+campaign counters have to count every message exactly once.
+"""
+import argparse
+import random
+from datetime import timedelta
+
+from benchmarks.common import setup, timed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--messages', type=int, default=200_000)
+    parser.add_argument('--campaigns', type=int, default=4)
+    parser.add_argument('--read-share', type=float, default=0.6)
+    parser.add_argument('--retry-share', type=float, default=0.1)
+    parser.add_argument('--disorder', type=float, default=900)
+    parser.add_argument('--batch', type=int, default=5000)
+    parser.add_argument('--sample', type=int, default=5000)
+    args = parser.parse_args()
+
+    setup()
+    from django.db import transaction
+    from django.db.models import Sum
+    from django.utils import timezone
+
+    from campaign.models import CustomerSegment
+    from whatsappMarketing.models import WhatsAppCampaign, WhatsAppMessage, WhatsAppTemplate
+    from whatsappMarketing.statuses import apply_statuses
+
+    segment = CustomerSegment.objects.create(name='bench')
+    template = WhatsAppTemplate.objects.create(name='bench', template_id='bench', language='en', body_content='Hi')
+    campaigns = [
+        WhatsAppCampaign.objects.create(name=f'bench {i}', whatsapp_template=template, customer_segment=segment)
+        for i in range(args.campaigns)
+    ]
+    now = timezone.now()
+    with timed(f'create {args.messages:,} messages', args.messages):
+        WhatsAppMessage.objects.bulk_create(
+            (WhatsAppMessage(whatsapp_campaign=campaigns[i % args.campaigns], phone_number=f'+1555{i:07d}',
+                             message_id=f'wamid.{i:012d}', sent_at=now)
+             for i in range(args.messages)),
+            batch_size=5000,
+        )
+
+    with timed(f'mark_delivered() x {args.sample:,}', args.sample):
+        for message in WhatsAppMessage.objects.order_by('pk')[:args.sample]:
+            message.mark_delivered()
+    WhatsAppMessage.objects.update(status='sent', delivered_at=None)
+    WhatsAppCampaign.objects.update(delivered_count=0)
+
+    rng = random.Random(7)
+    reads = int(args.messages * args.read_share)
+    callbacks = []
+    for i in range(args.messages):
+        delivered = now + timedelta(seconds=i // 100)
+        callbacks.append((f'wamid.{i:012d}', 'delivered', delivered))
+        if i < reads:
+            callbacks.append((f'wamid.{i:012d}', 'read', delivered + timedelta(seconds=rng.uniform(1, 600))))
+    callbacks += rng.sample(callbacks, int(len(callbacks) * args.retry_share))
+    callbacks.sort(key=lambda callback: callback[2] + timedelta(seconds=rng.uniform(0, args.disorder)))
+    changed = 0
+    with timed(f'apply {len(callbacks):,} callbacks ({args.batch:,} per batch)', len(callbacks)):
+        for i in range(0, len(callbacks), args.batch):
+            with transaction.atomic():
+                changed += apply_statuses(callbacks[i:i + args.batch])
+    totals = WhatsAppCampaign.objects.aggregate(delivered=Sum('delivered_count'), read=Sum('read_count'))
+    print(f'    {changed:,} transitions, counters {totals}')
+    assert totals == {'delivered': args.messages, 'read': reads}, totals
+    assert not WhatsAppMessage.objects.filter(status='read', delivered_at__isnull=True).exists()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,30 @@
+"""
+Helpers shared by the benchmark scripts.
+
+Run a benchmark from the project directory, e.g.::
+
+    python -m benchmarks.bench_analytics_ingest
+"""
+import os
+import time
+from contextlib import contextmanager
+
+
+def setup():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+    import django
+    from django.core.management import call_command
+
+    django.setup()
+    call_command('migrate', verbosity=0)
+
+
+@contextmanager
+def timed(label, count=None):
+    start = time.perf_counter()
+    result = {}
+    yield result
+    elapsed = time.perf_counter() - start
+    result['seconds'] = elapsed
+    rate = f"  ({count / elapsed:,.0f}/s)" if count else ""
+    print(f"{label:<40} {elapsed:8.3f}s{rate}")
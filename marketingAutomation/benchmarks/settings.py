@@ -0,0 +1,12 @@
+"""Project settings pointed at a throwaway SQLite file for benchmark runs."""
+import os
+import tempfile
+
+from marketingAutomation.settings import *  # noqa: F401,F403
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ.get('BENCH_DB') or os.path.join(tempfile.mkdtemp(prefix='bench-'), 'bench.sqlite3'),
+    }
+}
@@ -0,0 +1,80 @@
+"""
+Per-tenant cache of the ids of campaigns that are active right now.
+
+The cached entry remembers when it stops being valid: the earliest upcoming
+``start_date`` or ``end_date`` among the tenant's active-status campaigns.
+``Campaign.save()``/``delete()`` drop the entry; changes made with
+``QuerySet.update()`` must call ``invalidate_active_campaigns`` themselves.
+
+Entries live in the ``CAMPAIGN_ACTIVE_CACHE`` cache alias. Invalidation only
+reaches the processes sharing that cache, so it has to be a shared backend
+(database, Redis, Memcached); with a per-process ``LocMemCache`` other
+processes keep serving their entry until it expires. The ``DatabaseCache``
+table of the default ``shared`` alias is created by the campaign migrations.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, caches
+from django.db.models import Min, Q
+from django.utils import timezone
+
+from .models import Campaign
+
+logger = logging.getLogger(__name__)
+
+MAX_TTL = getattr(settings, "CAMPAIGN_ACTIVE_CACHE_SECONDS", 300)
+
+
+def _cache():
+    return caches[getattr(settings, "CAMPAIGN_ACTIVE_CACHE", DEFAULT_CACHE_ALIAS)]
+
+
+def _key(tenant_id):
+    return f"campaign:active:{tenant_id}"
+
+
+def _next_boundary(tenant_id, now):
+    # is_active only looks at the dates when both are set.
+    dated = Campaign.objects.for_tenant(tenant_id).filter(
+        status="active", start_date__isnull=False, end_date__isnull=False
+    )
+    bounds = dated.aggregate(
+        next_start=Min("start_date", filter=Q(start_date__gt=now)),
+        next_end=Min("end_date", filter=Q(end_date__gte=now)),
+    )
+    candidates = [now + timedelta(seconds=MAX_TTL)]
+    if bounds["next_start"]:
+        candidates.append(bounds["next_start"])
+    if bounds["next_end"]:
+        # active through end_date inclusive; stale just after it
+        candidates.append(bounds["next_end"] + timedelta(microseconds=1))
+    return min(candidates)
+
+
+def active_campaign_ids(tenant_id, now=None):
+    """Frozenset of active campaign ids for ``tenant_id``, served from cache."""
+    now = now or timezone.now()
+    entry = _cache().get(_key(tenant_id))
+    if entry is not None:
+        ids, valid_until = entry
+        if now < valid_until:
+            return ids
+
+    ids = frozenset(
+        Campaign.objects.for_tenant(tenant_id).active(now).values_list("id", flat=True)
+    )
+    valid_until = _next_boundary(tenant_id, now)
+    timeout = max(1, int((valid_until - now).total_seconds()) + 1)
+    _cache().set(_key(tenant_id), (ids, valid_until), timeout)
+    return ids
+
+
+def invalidate_active_campaigns(*tenant_ids):
+    """Drop the cached entries of ``tenant_ids``. A failing cache is logged,
+    not raised: the entry then lives until it expires (at most ``MAX_TTL``)."""
+    try:
+        _cache().delete_many([_key(tenant_id) for tenant_id in set(tenant_ids)])
+    except Exception:
+        logger.exception("Invalidating the active campaign ids of tenants %s failed", tenant_ids)
@@ -0,0 +1,252 @@
+"""
+Roaring-style compressed bitmap for customer-id sets.
+
+Ids are non-negative integers below ``MAX_ID``, split into a high part
+(``id >> 16``, serialized as 64 bits) selecting a container and a 16-bit
+low part stored in it. A container is either
+
+* an ``array('H')`` of sorted low bits when it holds at most 4096 ids, or
+* a Python ``int`` used as a 65536-bit bitmap when it is denser,
+
+so sparse and dense segments both stay compact, and set operations on
+dense containers run as single big-int ``|``/``&`` operations in C.
+Iteration is always in ascending id order and never builds a list of all ids.
+
+Per-id work is pushed into C where possible (``map``/``compress`` over
+byte flags, ``int(..., 2)``) since pure-Python loops dominate otherwise.
+"""
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from collections import deque
+from itertools import compress, islice, repeat
+from operator import not_
+
+ARRAY_MAX = 4096
+BITMAP_BYTES = 8192
+MAGIC = b"RBM1"
+UPDATE_CHUNK = 1_000_000
+MAX_ID = (1 << 80) - 1
+
+_HEADER = struct.Struct("<4sI")
+_CONTAINER = struct.Struct("<QBI")
+_ARRAY, _BITMAP = 0, 1
+
+CONTAINER_BITS = 65536
+_FLAG_TO_DIGIT = bytes.maketrans(b"\x00\x01", b"01")
+_DIGIT_TO_FLAG = bytes.maketrans(b"01", b"\x00\x01")
+
+
+def _array_to_bits(values):
+    flags = bytearray(CONTAINER_BITS)
+    deque(map(flags.__setitem__, values, repeat(1)), maxlen=0)
+    return int(flags[::-1].translate(_FLAG_TO_DIGIT), 2)
+
+
+def _flags(bits):
+    """One 0/1 byte per low value, indexable by the low value."""
+    return format(bits, "065536b")[::-1].encode().translate(_DIGIT_TO_FLAG)
+
+
+def _bits_to_array(bits):
+    return array("H", compress(range(CONTAINER_BITS), _flags(bits)))
+
+
+def _lows(container, base=0):
+    """Ascending ``base + low`` for every id in the container."""
+    if isinstance(container, int):
+        return compress(range(base, base + CONTAINER_BITS), _flags(container))
+    return map(base.__add__, container) if base else iter(container)
+
+
+def _pack(values):
+    """Container for a sorted iterable of low bits (picks array or bitmap)."""
+    values = values if isinstance(values, array) else array("H", values)
+    if len(values) > ARRAY_MAX:
+        return _array_to_bits(values)
+    return values
+
+
+def _pack_bits(bits):
+    if bits.bit_count() <= ARRAY_MAX:
+        return _bits_to_array(bits)
+    return bits
+
+
+def _cardinality(container):
+    return container.bit_count() if isinstance(container, int) else len(container)
+
+
+def _union(a, b):
+    if isinstance(a, int) or isinstance(b, int):
+        a = a if isinstance(a, int) else _array_to_bits(a)
+        b = b if isinstance(b, int) else _array_to_bits(b)
+        return a | b
+    return _pack(sorted(set(a).union(b)))
+
+
+def _intersection(a, b):
+    if isinstance(a, int) and isinstance(b, int):
+        return _pack_bits(a & b)
+    if isinstance(a, int):
+        a, b = b, a
+    if isinstance(b, int):
+        return array("H", compress(a, map(_flags(b).__getitem__, a)))
+    return array("H", sorted(set(a).intersection(b)))
+
+
+def _difference(a, b):
+    if isinstance(a, int):
+        b = b if isinstance(b, int) else _array_to_bits(b)
+        return _pack_bits(a & ~b)
+    if isinstance(b, int):
+        return array("H", compress(a, map(not_, map(_flags(b).__getitem__, a))))
+    return array("H", sorted(set(a).difference(b)))
+
+
+class RoaringBitmap:
+    __slots__ = ("_containers",)
+
+    def __init__(self, ids=()):
+        self._containers = {}
+        self.update(ids)
+
+    @classmethod
+    def _from_containers(cls, containers):
+        bitmap = cls()
+        bitmap._containers = {key: c for key, c in containers.items() if _cardinality(c)}
+        return bitmap
+
+    def update(self, ids):
+        """Add many ids, consuming ``ids`` in chunks."""
+        ids = iter(ids)
+        while True:
+            chunk = sorted(set(islice(ids, UPDATE_CHUNK)))
+            if not chunk:
+                return
+            if chunk[0] < 0 or chunk[-1] > MAX_ID:
+                bad = chunk[0] if chunk[0] < 0 else chunk[-1]
+                raise ValueError(f"RoaringBitmap ids must be between 0 and {MAX_ID}, got {bad}")
+            start = 0
+            while start < len(chunk):
+                key = chunk[start] >> 16
+                base = key << 16
+                end = bisect_left(chunk, base + CONTAINER_BITS, start)
+                container = _pack(array("H", map((-base).__add__, chunk[start:end])))
+                existing = self._containers.get(key)
+                self._containers[key] = container if existing is None else _union(existing, container)
+                start = end
+
+    def add(self, value):
+        self.update((value,))
+
+    def __contains__(self, value):
+        container = self._containers.get(value >> 16)
+        if container is None:
+            return False
+        low = value & 0xFFFF
+        if isinstance(container, int):
+            return bool(container >> low & 1)
+        index = bisect_left(container, low)
+        return index < len(container) and container[index] == low
+
+    def __len__(self):
+        return sum(_cardinality(c) for c in self._containers.values())
+
+    def __bool__(self):
+        return bool(self._containers)
+
+    def __eq__(self, other):
+        # Containers are canonical (bitmap iff more than ARRAY_MAX ids).
+        if not isinstance(other, RoaringBitmap):
+            return NotImplemented
+        return self._containers == other._containers
+
+    def __repr__(self):
+        return f"<RoaringBitmap {len(self)} ids in {len(self._containers)} containers>"
+
+    def union(self, other):
+        containers = dict(self._containers)
+        for key, container in other._containers.items():
+            mine = containers.get(key)
+            containers[key] = container if mine is None else _union(mine, container)
+        return self._from_containers(containers)
+
+    def intersection(self, other):
+        return self._from_containers({
+            key: _intersection(container, other._containers[key])
+            for key, container in self._containers.items()
+            if key in other._containers
+        })
+
+    def difference(self, other):
+        return self._from_containers({
+            key: container if key not in other._containers else _difference(container, other._containers[key])
+            for key, container in self._containers.items()
+        })
+
+    __or__ = union
+    __and__ = intersection
+    __sub__ = difference
+
+    def __iter__(self):
+        for key in sorted(self._containers):
+            yield from _lows(self._containers[key], key << 16)
+
+    def iter_chunks(self, size=10000):
+        """Yield ascending ids as ``array('q')`` chunks of at most ``size``."""
+        chunk = array("q")
+        for key in sorted(self._containers):
+            ids = _lows(self._containers[key], key << 16)
+            while True:
+                before = len(chunk)
+                chunk.extend(islice(ids, size - before))
+                if len(chunk) < size:
+                    break
+                yield chunk
+                chunk = array("q")
+        if chunk:
+            yield chunk
+
+    def to_bytes(self):
+        parts = [_HEADER.pack(MAGIC, len(self._containers))]
+        for key in sorted(self._containers):
+            container = self._containers[key]
+            if isinstance(container, int):
+                payload = container.to_bytes(BITMAP_BYTES, "little")
+                kind = _BITMAP
+            else:
+                if sys.byteorder == "big":
+                    container = array("H", container)
+                    container.byteswap()
+                payload = container.tobytes()
+                kind = _ARRAY
+            parts.append(_CONTAINER.pack(key, kind, len(payload)))
+            parts.append(payload)
+        return b"".join(parts)
+
+    @classmethod
+    def from_bytes(cls, data):
+        data = memoryview(data)
+        magic, count = _HEADER.unpack_from(data, 0)
+        if magic != MAGIC:
+            raise ValueError("not a serialized RoaringBitmap")
+        offset = _HEADER.size
+        containers = {}
+        for _ in range(count):
+            key, kind, length = _CONTAINER.unpack_from(data, offset)
+            offset += _CONTAINER.size
+            payload = data[offset:offset + length]
+            offset += length
+            if kind == _BITMAP:
+                containers[key] = int.from_bytes(payload, "little")
+            else:
+                container = array("H")
+                container.frombytes(payload)
+                if sys.byteorder == "big":
+                    container.byteswap()
+                containers[key] = container
+        bitmap = cls()
+        bitmap._containers = containers
+        return bitmap
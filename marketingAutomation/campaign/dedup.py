@@ -0,0 +1,256 @@
+"""
+Idempotent ingestion of provider callbacks.
+
+Providers retry webhooks, so one event can arrive several times. Every
+callback gets a 64-bit key (``event_key``) from the provider's event id or,
+lacking one, from the fields that identify it, and ``Deduplicator.claim``
+filters a batch of keys in three steps:
+
+* repeats inside the batch are dropped;
+* keys the in-memory ``SlidingBloomFilter`` has definitely not seen go
+  straight to the claim, while the ones it may have seen are looked up with
+  a single ``SELECT ... IN`` for the whole batch and dropped if confirmed;
+* the rest are inserted into ``IdempotencyKey`` with ``ON CONFLICT DO
+  NOTHING RETURNING``, and only the keys the insert returns are new. The
+  unique constraint settles races between processes.
+
+Claims have to be made in the transaction of the write they guard: if that
+write rolls back, so do the keys, and the provider's retry is accepted (the
+filter bit stays set, but the confirming lookup comes back empty). Keys older
+than ``INGEST_DEDUP_RETENTION_HOURS`` are removed by ``prune_keys``.
+"""
+import hashlib
+import math
+import threading
+import time
+from array import array
+from datetime import timedelta
+from itertools import islice
+
+from django.conf import settings
+from django.db import connections, router
+from django.utils import timezone
+
+from .models import IdempotencyKey
+
+MASK64 = (1 << 64) - 1
+CHUNK_SIZE = 500
+
+
+def event_key(*parts):
+    """Signed 64-bit key of ``parts`` (fits a ``BigIntegerField``)."""
+    text = "\x1f".join("" if part is None else str(part) for part in parts)
+    return int.from_bytes(hashlib.blake2b(text.encode(), digest_size=8).digest(), "big", signed=True)
+
+
+def _chunks(items, size=CHUNK_SIZE):
+    items = iter(items)
+    while chunk := list(islice(items, size)):
+        yield chunk
+
+
+# bit pairs for a 12-bit chunk of a key: 8 bits per key from four chunks
+_BIT_PAIRS = [(1 << (chunk & 63)) | (1 << (chunk >> 6)) for chunk in range(4096)]
+_MIX = 0x9E3779B97F4A7C15
+
+
+def _block_bits_per_key(error_rate, hashes=8, width=64):
+    """Bits per key a filter of ``width``-bit blocks needs for ``error_rate``.
+
+    The number of keys in a block is Poisson distributed, so the rate is
+    averaged over the block loads rather than taken from the textbook formula.
+    """
+    bits_per_key = 4.0
+    while bits_per_key < 64:
+        load = width / bits_per_key
+        rate, probability, keys = 0.0, math.exp(-load), 0
+        while keys < load * 6 + 30:
+            rate += probability * (1 - (1 - 1 / width) ** (hashes * keys)) ** hashes
+            keys += 1
+            probability *= load / keys
+        if rate <= error_rate:
+            break
+        bits_per_key += 0.5
+    return bits_per_key
+
+
+class SlidingBloomFilter:
+    """Blocked Bloom filter over the keys of roughly the last ``window`` seconds.
+
+    Every key sets 8 bits in a single 64-bit word, so a lookup is one array
+    read and a mask compare instead of 8 scattered bit probes. That needs
+    more bits per key than a plain Bloom filter for the same ``error_rate``
+    (about 24 instead of 14.4 at 0.1%), which is sized for here.
+
+    Two generations of ``capacity`` keys each: new keys go into the current
+    one, lookups check both, and the current generation becomes the
+    previous one (dropping the older) when it is full or ``window`` seconds
+    old. The false-positive rate stays below about twice ``error_rate``.
+    Keys are expected to be hashes already (see ``event_key``).
+    """
+
+    def __init__(self, capacity=1_000_000, error_rate=0.001, window=86400.0):
+        self.capacity = capacity
+        self.window = window
+        self.blocks = max(1, math.ceil(capacity * _block_bits_per_key(error_rate) / 64))
+        self._lock = threading.Lock()
+        self._current = array("Q", bytes(8 * self.blocks))
+        self._previous = array("Q", bytes(8 * self.blocks))
+        self._count = 0
+        self._rotated_at = time.monotonic()
+
+    @property
+    def nbytes(self):
+        return (len(self._current) + len(self._previous)) * 8
+
+    def _rotate(self):
+        self._previous = self._current
+        self._current = array("Q", bytes(8 * self.blocks))
+        self._count = 0
+        self._rotated_at = time.monotonic()
+
+    def _locate(self, key):
+        # the low half picks the word, the mixed high half the bits in it
+        mixed = ((key >> 32) & 0xFFFFFFFF) * _MIX & MASK64
+        return (key & 0xFFFFFFFF) % self.blocks, (
+            _BIT_PAIRS[mixed & 4095]
+            | _BIT_PAIRS[(mixed >> 12) & 4095]
+            | _BIT_PAIRS[(mixed >> 24) & 4095]
+            | _BIT_PAIRS[(mixed >> 36) & 4095]
+        )
+
+    def check_and_add(self, keys):
+        """Add ``keys``; returns for each whether it may have been seen before."""
+        seen = []
+        append = seen.append
+        blocks, pairs = self.blocks, _BIT_PAIRS
+        with self._lock:
+            if time.monotonic() - self._rotated_at >= self.window:
+                self._rotate()
+            current, previous = self._current, self._previous
+            for key in keys:
+                mixed = ((key >> 32) & 0xFFFFFFFF) * _MIX & MASK64
+                block = (key & 0xFFFFFFFF) % blocks
+                mask = (
+                    pairs[mixed & 4095]
+                    | pairs[(mixed >> 12) & 4095]
+                    | pairs[(mixed >> 24) & 4095]
+                    | pairs[(mixed >> 36) & 4095]
+                )
+                word = current[block]
+                if word & mask == mask:
+                    append(True)
+                    continue
+                current[block] = word | mask
+                append(previous[block] & mask == mask)
+                self._count += 1
+                if self._count >= self.capacity:
+                    self._rotate()
+                    current, previous = self._current, self._previous
+        return seen
+
+    def __contains__(self, key):
+        block, mask = self._locate(key)
+        return self._current[block] & mask == mask or self._previous[block] & mask == mask
+
+
+class Deduplicator:
+    """Claims callback keys of one ``scope`` (e.g. ``"email"``, ``"whatsapp"``)."""
+
+    def __init__(self, scope, capacity=None, error_rate=None, window=None):
+        self.scope = scope
+        self.capacity = capacity or getattr(settings, "INGEST_DEDUP_CAPACITY", 1_000_000)
+        self.error_rate = error_rate or getattr(settings, "INGEST_DEDUP_ERROR_RATE", 0.001)
+        self.window = window or getattr(settings, "INGEST_DEDUP_WINDOW_SECONDS", 86400)
+        self._filters = {}
+        self._lock = threading.Lock()
+
+    def _filter(self, using):
+        bloom = self._filters.get(using)
+        if bloom is None:
+            with self._lock:
+                bloom = self._filters.setdefault(
+                    using, SlidingBloomFilter(self.capacity, self.error_rate, self.window)
+                )
+        return bloom
+
+    def _confirmed(self, keys, using):
+        found = set()
+        for chunk in _chunks(keys, 5000):
+            found.update(
+                IdempotencyKey.objects.using(using)
+                .filter(scope=self.scope, key__in=chunk)
+                .values_list("key", flat=True)
+            )
+        return found
+
+    def _insert(self, keys, using):
+        connection = connections[using]
+        if connection.vendor not in ("postgresql", "sqlite"):
+            existing = self._confirmed(keys, using)
+            fresh = [key for key in keys if key not in existing]
+            IdempotencyKey.objects.using(using).bulk_create(
+                [IdempotencyKey(scope=self.scope, key=key) for key in fresh], ignore_conflicts=True
+            )
+            return set(fresh)
+        ops = connection.ops
+        table, column = ops.quote_name(IdempotencyKey._meta.db_table), ops.quote_name("key")
+        now = ops.adapt_datetimefield_value(timezone.now())
+        claimed = set()
+        with connection.cursor() as cursor:
+            for chunk in _chunks(keys):
+                cursor.execute(
+                    f"INSERT INTO {table} (scope, {column}, created_at) VALUES "
+                    + ", ".join(["(%s, %s, %s)"] * len(chunk))
+                    + f" ON CONFLICT (scope, {column}) DO NOTHING RETURNING {column}",
+                    [value for key in chunk for value in (self.scope, key, now)],
+                )
+                claimed.update(row[0] for row in cursor.fetchall())
+        return claimed
+
+    def claim(self, keys, using=None):
+        """The subset of ``keys`` not claimed before; claims them."""
+        using = using or router.db_for_write(IdempotencyKey)
+        unique = list(dict.fromkeys(keys))
+        if not unique:
+            return set()
+        maybe = self._filter(using).check_and_add(unique)
+        candidates = [key for key, seen in zip(unique, maybe) if not seen]
+        suspects = [key for key, seen in zip(unique, maybe) if seen]
+        if suspects:
+            confirmed = self._confirmed(suspects, using)
+            candidates.extend(key for key in suspects if key not in confirmed)
+        return self._insert(candidates, using) if candidates else set()
+
+    def filter(self, items, key, using=None):
+        """Items whose ``key(item)`` is new, first occurrence only; items
+        with a ``None`` key are always kept."""
+        keys = [key(item) for item in items]
+        fresh = self.claim([k for k in keys if k is not None], using)
+        kept = []
+        for item, k in zip(items, keys):
+            if k is None:
+                kept.append(item)
+            elif k in fresh:
+                kept.append(item)
+                fresh.discard(k)
+        return kept
+
+
+_deduplicators = {}
+
+
+def deduplicator(scope):
+    """Process-wide ``Deduplicator`` for ``scope``."""
+    if scope not in _deduplicators:
+        _deduplicators.setdefault(scope, Deduplicator(scope))
+    return _deduplicators[scope]
+
+
+def prune_keys(older_than=None, using=None):
+    """Delete claimed keys older than ``older_than`` (default
+    ``INGEST_DEDUP_RETENTION_HOURS``); returns the number deleted."""
+    if older_than is None:
+        older_than = timedelta(hours=getattr(settings, "INGEST_DEDUP_RETENTION_HOURS", 72))
+    using = using or router.db_for_write(IdempotencyKey)
+    return IdempotencyKey.objects.using(using).filter(created_at__lt=timezone.now() - older_than).delete()[0]
@@ -0,0 +1,293 @@
+"""
+Database-backed dispatcher for due ``CampaignMessage`` rows.
+
+Workers claim batches from the due queue (``status='scheduled'`` and
+``scheduled_time <= now``) by flipping them to ``sending`` in a single
+statement, so two workers can never claim the same row:
+
+* PostgreSQL: ``UPDATE ... WHERE id IN (SELECT ... FOR UPDATE SKIP LOCKED)
+  RETURNING id`` - concurrent workers skip each other's rows instead of
+  blocking.
+* SQLite: the same ``UPDATE ... RETURNING`` without row locks; SQLite
+  serialises writers, so the statement is atomic.
+* Other backends: ``select_for_update(skip_locked=True)`` inside a
+  transaction.
+
+Claimed batches are handed to the channel sender configured in
+``CAMPAIGN_MESSAGE_SENDERS``; attempts, provider ids and errors are recorded
+in ``CampaignMessage.metadata``. With a ``BudgetPacer``, messages that no
+longer fit their campaign's budget are deferred instead of sent.
+"""
+import logging
+import threading
+import time
+from collections import defaultdict, namedtuple
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, connections, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import CampaignMessage
+from .pacing import message_cost
+
+logger = logging.getLogger(__name__)
+
+SendResult = namedtuple("SendResult", ["provider_id", "error"])
+
+MAX_ATTEMPTS = getattr(settings, "CAMPAIGN_DISPATCH_MAX_ATTEMPTS", 3)
+RETRY_DELAY = timedelta(seconds=getattr(settings, "CAMPAIGN_DISPATCH_RETRY_SECONDS", 60))
+PACING_DELAY = timedelta(seconds=getattr(settings, "CAMPAIGN_PACING_DEFER_SECONDS", 300))
+
+
+class ChannelSender:
+    """Delivers a batch of messages for one channel.
+
+    ``send_batch`` returns one ``SendResult`` per message, in order. Raising
+    fails the whole batch (it is retried like a per-message error), and so
+    does a missing result for the messages at the end of the batch.
+    """
+
+    def send_batch(self, messages):
+        raise NotImplementedError
+
+
+_senders = {}
+
+
+def get_sender(channel):
+    if channel not in _senders:
+        path = getattr(settings, "CAMPAIGN_MESSAGE_SENDERS", {}).get(channel)
+        _senders[channel] = import_string(path)() if path else None
+    return _senders[channel]
+
+
+def due_messages(now=None):
+    return CampaignMessage.objects.filter(
+        status="scheduled", scheduled_time__lte=now or timezone.now()
+    ).order_by("scheduled_time", "id")
+
+
+def claim_batch(batch_size, now=None, using="default"):
+    """Atomically move up to ``batch_size`` due messages to ``sending``."""
+    now = now or timezone.now()
+    connection = connections[using]
+    if connection.vendor in ("postgresql", "sqlite"):
+        ops = connection.ops
+        table = ops.quote_name(CampaignMessage._meta.db_table)
+        lock = " FOR UPDATE SKIP LOCKED" if connection.vendor == "postgresql" else ""
+        sql = (
+            f"UPDATE {table} SET status = 'sending', updated_at = %s "
+            f"WHERE id IN (SELECT id FROM {table} WHERE status = 'scheduled' "
+            f"AND scheduled_time <= %s ORDER BY scheduled_time, id LIMIT %s{lock}) "
+            f"RETURNING id"
+        )
+        stamp = ops.adapt_datetimefield_value(now)
+        with transaction.atomic(using=using), connection.cursor() as cursor:
+            cursor.execute(sql, [stamp, stamp, batch_size])
+            ids = [row[0] for row in cursor.fetchall()]
+    else:
+        with transaction.atomic(using=using):
+            ids = list(
+                due_messages(now)
+                .using(using)
+                .select_for_update(skip_locked=True)
+                .values_list("id", flat=True)[:batch_size]
+            )
+            CampaignMessage.objects.using(using).filter(id__in=ids).update(
+                status="sending", updated_at=now
+            )
+    if not ids:
+        return []
+    return list(CampaignMessage.objects.using(using).filter(id__in=ids).order_by("scheduled_time", "id"))
+
+
+def requeue_stale(older_than, using="default"):
+    """Return ``sending`` rows abandoned by a crashed worker to the queue."""
+    cutoff = timezone.now() - older_than
+    return CampaignMessage.objects.using(using).filter(
+        status="sending", updated_at__lt=cutoff
+    ).update(status="scheduled", updated_at=timezone.now())
+
+
+def _record(message, result, now):
+    meta = dict(message.metadata or {})
+    meta["attempts"] = meta.get("attempts", 0) + 1
+    meta["last_attempt_at"] = now.isoformat()
+    if result.error is None:
+        message.status = "sent"
+        meta["provider_id"] = result.provider_id
+        meta.pop("last_error", None)
+    else:
+        meta["last_error"] = str(result.error)
+        if meta["attempts"] >= MAX_ATTEMPTS:
+            message.status = "failed"
+        else:
+            message.status = "scheduled"
+            message.scheduled_time = now + RETRY_DELAY * meta["attempts"]
+    message.metadata = meta
+    message.updated_at = now
+
+
+def _defer(message, now):
+    """Put a message back in the queue without counting an attempt."""
+    meta = dict(message.metadata or {})
+    meta["deferred"] = meta.get("deferred", 0) + 1
+    message.status = "scheduled"
+    message.scheduled_time = now + PACING_DELAY
+    message.metadata = meta
+    message.updated_at = now
+
+
+def _pace(group, pacer, unit_cost, reserved):
+    """Split ``group`` into messages admitted by the pacer and deferred ones.
+
+    Admitted messages are added to ``reserved`` as ``(message, unit cost)``
+    as soon as the pacer holds budget for them.
+    """
+    by_campaign = defaultdict(list)
+    for message in group:
+        by_campaign[message.campaign_id].append(message)
+    admitted, deferred = [], []
+    for campaign_id, messages in by_campaign.items():
+        count = pacer.admit(campaign_id, len(messages), unit_cost)
+        admitted.extend(messages[:count])
+        deferred.extend(messages[count:])
+        reserved.extend((message, unit_cost) for message in messages[:count])
+    return admitted, deferred
+
+
+def _store(messages, using):
+    # One executemany instead of bulk_update's per-field CASE expressions,
+    # which keeps the write lock short when many workers share a database.
+    connection = connections[using]
+    ops = connection.ops
+    opts = CampaignMessage._meta
+    metadata = opts.get_field("metadata")
+    sql = "UPDATE %s SET status = %%s, scheduled_time = %%s, metadata = %%s, updated_at = %%s WHERE id = %%s" % (
+        ops.quote_name(opts.db_table)
+    )
+    params = [
+        (
+            m.status,
+            ops.adapt_datetimefield_value(m.scheduled_time),
+            metadata.get_db_prep_save(m.metadata, connection),
+            ops.adapt_datetimefield_value(m.updated_at),
+            m.id,
+        )
+        for m in messages
+    ]
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        cursor.executemany(sql, params)
+
+
+def process_batch(messages, using="default", pacer=None):
+    """Send a claimed batch through the channel senders and store the outcome.
+
+    The pacer keeps the budget of sent messages only: the reservations of
+    failed messages are refunded once the batch is stored, and all of them
+    when it cannot be stored (its rows are then requeued as stale).
+    """
+    by_channel = defaultdict(list)
+    for message in messages:
+        by_channel[message.channel].append(message)
+
+    reserved = []
+    try:
+        for channel, group in by_channel.items():
+            if pacer is not None:
+                group, deferred = _pace(group, pacer, message_cost(channel), reserved)
+                now = timezone.now()
+                for message in deferred:
+                    _defer(message, now)
+                if not group:
+                    continue
+            try:
+                sender = get_sender(channel)
+                if sender is None:
+                    raise LookupError(f"no sender configured for channel {channel!r}")
+                results = list(sender.send_batch(group))
+            except Exception as exc:
+                logger.exception("sending %d %s messages failed", len(group), channel)
+                results = [SendResult(None, exc)] * len(group)
+            if len(results) < len(group):
+                logger.error("%s sender returned %d results for %d messages", channel, len(results), len(group))
+                missing = SendResult(None, LookupError("sender returned no result"))
+                results += [missing] * (len(group) - len(results))
+            now = timezone.now()
+            for message, result in zip(group, results):
+                _record(message, result, now)
+
+        _store(messages, using)
+    except BaseException:
+        for message, unit_cost in reserved:
+            pacer.refund(message.campaign_id, unit_cost)
+        raise
+    for message, unit_cost in reserved:
+        if message.status != "sent":
+            pacer.refund(message.campaign_id, unit_cost)
+    return len(messages)
+
+
+class Worker(threading.Thread):
+    """Claims and sends batches until ``stop`` is set (or the queue drains, with ``once``)."""
+
+    def __init__(self, stop, batch_size=500, poll_interval=1.0, once=False, using="default", pacer=None):
+        super().__init__(daemon=True)
+        self.stop = stop
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.once = once
+        self.using = using
+        self.pacer = pacer
+        self.sent = 0
+
+    def run(self):
+        try:
+            while not self.stop.is_set():
+                close_old_connections()
+                try:
+                    batch = claim_batch(self.batch_size, using=self.using)
+                    if batch:
+                        self.sent += process_batch(batch, using=self.using, pacer=self.pacer)
+                        continue
+                except Exception:
+                    # Claimed rows stay in 'sending' until requeue_stale() (run
+                    # periodically by run_workers) returns them; keep the worker alive.
+                    logger.exception("dispatch worker failed, backing off")
+                else:
+                    if self.once:
+                        return
+                self.stop.wait(self.poll_interval)
+        finally:
+            connections.close_all()
+
+
+def run_workers(workers, batch_size=500, poll_interval=1.0, once=False, stop=None, using="default", pacer=None,
+                requeue_after=None):
+    """Run ``workers`` threads until they finish; with ``requeue_after`` (a
+    ``timedelta``), rows left in ``sending`` longer than that are returned to
+    the queue at that interval while they run."""
+    stop = stop or threading.Event()
+    pool = [Worker(stop, batch_size, poll_interval, once, using, pacer) for _ in range(workers)]
+    for worker in pool:
+        worker.start()
+    next_requeue = time.monotonic() + requeue_after.total_seconds() if requeue_after else None
+    try:
+        while any(worker.is_alive() for worker in pool):
+            if next_requeue is not None and time.monotonic() >= next_requeue:
+                next_requeue = time.monotonic() + requeue_after.total_seconds()
+                try:
+                    requeued = requeue_stale(requeue_after, using=using)
+                except DatabaseError:
+                    logger.exception("requeueing stale messages failed")
+                else:
+                    if requeued:
+                        logger.warning("requeued %d messages stuck in 'sending'", requeued)
+            time.sleep(0.2)
+    except KeyboardInterrupt:
+        stop.set()
+    for worker in pool:
+        worker.join()
+    return sum(worker.sent for worker in pool)
@@ -0,0 +1,184 @@
+"""
+HyperLogLog sketches for counting distinct recipients.
+
+A sketch keeps ``2 ** p`` one-byte registers (16 KiB at the default
+``p = 14``). Every value is hashed to 64 bits; the top ``p`` bits pick a
+register, which keeps the maximum position of the first set bit in the rest.
+Two sketches of the same ``p`` merge by taking the register-wise maximum,
+and the merge of per-day or per-variant sketches is exactly the sketch of
+the combined stream, so unique counts over any range of days or set of
+campaigns come from merging stored sketches instead of rescanning events.
+
+Counts use Ertl's improved estimator ("New cardinality estimation
+algorithms for HyperLogLog sketches", 2017), which is unbiased from empty
+sketches up to billions of values without empirical correction tables. The
+relative standard error is ``1.04 / sqrt(2 ** p)``, about 0.8% at ``p = 14``.
+
+Serialized sketches are zlib compressed; the registers of small sketches
+are mostly zero and shrink to a few hundred bytes.
+"""
+import hashlib
+import math
+import struct
+import zlib
+from array import array
+from functools import lru_cache, partial
+from operator import methodcaller
+
+DEFAULT_PRECISION = 14
+MAGIC = b"HLL1"
+_HEADER = struct.Struct("<4sB")
+_ALPHA_INF = 1 / (2 * math.log(2))
+
+_blake2b = partial(hashlib.blake2b, digest_size=8)
+_digest = methodcaller("digest")
+
+
+def value_hashes(values):
+    """``array("Q")`` of the 64-bit hashes of ``values`` (``str()`` of each)."""
+    hashes = array("Q")
+    hashes.frombytes(b"".join(map(_digest, map(_blake2b, map(str.encode, map(str, values))))))
+    return hashes
+
+
+@lru_cache(maxsize=None)
+def _high_bits(size):
+    return int.from_bytes(b"\x80" * size, "little")
+
+
+def _register_max(a, b):
+    """Register-wise maximum of two register strings in a few big-int
+    operations: registers stay below 0x80, so ``(a | 0x80) - b`` never
+    borrows across bytes and its high bit tells whether ``a >= b``."""
+    size = len(a)
+    high = _high_bits(size)
+    x, y = int.from_bytes(a, "little"), int.from_bytes(b, "little")
+    keep = ((((x | high) - y) & high) >> 7) * 0xFF
+    return bytearray(((x & keep) | (y & ~keep)).to_bytes(size, "little"))
+
+
+def _sigma(x):
+    if x == 1:
+        return math.inf
+    y, z = 1.0, x
+    while True:
+        x *= x
+        previous = z
+        z += x * y
+        y += y
+        if z == previous:
+            return z
+
+
+def _tau(x):
+    if x == 0 or x == 1:
+        return 0.0
+    y, z = 1.0, 1 - x
+    while True:
+        x = math.sqrt(x)
+        previous = z
+        y *= 0.5
+        z -= (1 - x) ** 2 * y
+        if z == previous:
+            return z / 3
+
+
+class HyperLogLog:
+    """Mergeable distinct-count sketch."""
+
+    __slots__ = ("p", "registers")
+
+    def __init__(self, values=(), p=DEFAULT_PRECISION):
+        if not 4 <= p <= 18:
+            raise ValueError("precision must be between 4 and 18")
+        self.p = p
+        self.registers = bytearray(1 << p)
+        if values:
+            self.update(values)
+
+    def update_hashes(self, hashes):
+        """Add values by their 64-bit hashes."""
+        registers = self.registers
+        shift = 64 - self.p
+        mask = (1 << shift) - 1
+        width = shift + 1
+        for value in hashes:
+            index = value >> shift
+            rank = width - (value & mask).bit_length()
+            if rank > registers[index]:
+                registers[index] = rank
+
+    def update(self, values):
+        self.update_hashes(value_hashes(values))
+
+    def add(self, value):
+        self.update((value,))
+
+    def _check(self, other):
+        if other.p != self.p:
+            raise ValueError("cannot merge sketches of different precision")
+
+    def merge(self, other):
+        """Fold ``other`` into this sketch (in place)."""
+        self._check(other)
+        self.registers = _register_max(self.registers, other.registers)
+        return self
+
+    def __or__(self, other):
+        self._check(other)
+        merged = HyperLogLog(p=self.p)
+        merged.registers = _register_max(self.registers, other.registers)
+        return merged
+
+    @classmethod
+    def union(cls, sketches, p=DEFAULT_PRECISION):
+        merged = cls(p=p)
+        for sketch in sketches:
+            merged.merge(sketch)
+        return merged
+
+    def __eq__(self, other):
+        return isinstance(other, HyperLogLog) and self.p == other.p and self.registers == other.registers
+
+    def __bool__(self):
+        return any(self.registers)
+
+    def count(self):
+        """Estimated number of distinct values."""
+        m = len(self.registers)
+        q = 64 - self.p
+        histogram = [self.registers.count(k) for k in range(q + 2)]
+        z = m * _tau(1 - histogram[q + 1] / m)
+        for k in range(q, 0, -1):
+            z = 0.5 * (z + histogram[k])
+        z += m * _sigma(histogram[0] / m)
+        if z == math.inf:
+            return 0
+        return round(_ALPHA_INF * m * m / z)
+
+    def __len__(self):
+        return self.count()
+
+    @property
+    def standard_error(self):
+        """Relative standard error of ``count()``."""
+        return 1.04 / math.sqrt(1 << self.p)
+
+    def __repr__(self):
+        return f"<HyperLogLog p={self.p} ~{self.count()}>"
+
+    def to_bytes(self):
+        return _HEADER.pack(MAGIC, self.p) + zlib.compress(bytes(self.registers), 1)
+
+    @classmethod
+    def from_bytes(cls, data):
+        data = bytes(data)
+        magic, p = _HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError("not a serialized HyperLogLog")
+        sketch = cls(p=p)
+        registers = zlib.decompress(data[_HEADER.size:])
+        if len(registers) != 1 << p:
+            raise ValueError("corrupt HyperLogLog registers")
+        sketch.registers = bytearray(registers)
+        return sketch
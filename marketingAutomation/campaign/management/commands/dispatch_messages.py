@@ -0,0 +1,54 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from campaign.dispatch import requeue_stale, run_workers
+from campaign.pacing import BudgetPacer
+from marketingAutomation.tenancy import tenant_alias
+
+
+class Command(BaseCommand):
+    help = "Run worker threads that claim and send due CampaignMessage rows."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=4)
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--poll-interval", type=float, default=1.0)
+        parser.add_argument("--tenant", help="Dispatch from this tenant schema's database.")
+        parser.add_argument("--once", action="store_true", help="Exit when the due queue is empty.")
+        parser.add_argument(
+            "--requeue-after",
+            type=int,
+            default=600,
+            help="Requeue messages stuck in 'sending' for this many seconds, at start and then at this interval; "
+            "keep it above the time a batch takes to send.",
+        )
+        parser.add_argument(
+            "--no-pacing", action="store_true", help="Send without checking campaign budgets."
+        )
+
+    def handle(self, *args, **options):
+        using = tenant_alias(options["tenant"]) if options["tenant"] else "default"
+        requeue_after = timedelta(seconds=options["requeue_after"])
+        requeued = requeue_stale(requeue_after, using=using)
+        if requeued:
+            self.stdout.write(f"Requeued {requeued} stale messages")
+        pacer = None
+        if not options["no_pacing"]:
+            flush_interval = getattr(settings, "CAMPAIGN_PACING_FLUSH_SECONDS", 5.0)
+            pacer = BudgetPacer(flush_interval, using=using).start()
+        try:
+            sent = run_workers(
+                options["workers"],
+                batch_size=options["batch_size"],
+                poll_interval=options["poll_interval"],
+                once=options["once"],
+                using=using,
+                pacer=pacer,
+                requeue_after=requeue_after,
+            )
+        finally:
+            if pacer is not None:
+                pacer.stop()
+        self.stdout.write(self.style.SUCCESS(f"Processed {sent} messages"))
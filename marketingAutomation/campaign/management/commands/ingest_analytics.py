@@ -0,0 +1,59 @@
+import csv
+import json
+import sys
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+
+from campaign.models import CampaignAnalytics
+
+INT_FIELDS = ("total_sent", "total_delivered", "total_opened", "total_clicked", "total_conversions")
+DECIMAL_FIELDS = ("revenue_generated", "cost")
+
+
+def parse_row(raw):
+    row = {"campaign_id": int(raw["campaign_id"])}
+    if raw.get("recorded_at"):
+        row["recorded_at"] = parse_datetime(raw["recorded_at"])
+    for field in INT_FIELDS:
+        if raw.get(field) not in (None, ""):
+            row[field] = int(raw[field])
+    for field in DECIMAL_FIELDS:
+        if raw.get(field) not in (None, ""):
+            row[field] = Decimal(str(raw[field]))
+    return row
+
+
+def read_rows(stream, fmt):
+    if fmt == "csv":
+        records = csv.DictReader(stream)
+    else:
+        records = (json.loads(line) for line in stream if line.strip())
+    for lineno, raw in enumerate(records, start=1):
+        try:
+            yield parse_row(raw)
+        except (KeyError, ValueError, ArithmeticError) as exc:
+            raise CommandError(f"record {lineno}: {exc!r}") from exc
+
+
+class Command(BaseCommand):
+    help = "Bulk-load CampaignAnalytics snapshots (with ROI) from a CSV or NDJSON file."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Input file, or '-' for stdin.")
+        parser.add_argument("--format", choices=["csv", "ndjson"])
+        parser.add_argument("--batch-size", type=int, default=5000)
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        fmt = options["format"] or ("csv" if path.endswith(".csv") else "ndjson")
+        stream = sys.stdin if path == "-" else open(path, newline="", encoding="utf-8")
+        try:
+            written = CampaignAnalytics.objects.bulk_ingest(
+                read_rows(stream, fmt), batch_size=options["batch_size"]
+            )
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+        self.stdout.write(self.style.SUCCESS(f"Ingested {written} analytics rows"))
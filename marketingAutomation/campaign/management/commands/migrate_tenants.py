@@ -0,0 +1,25 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from marketingAutomation.tenancy import tenant_alias, tenant_settings, tenant_sqlite_path
+
+
+class Command(BaseCommand):
+    help = "Create (if needed) and migrate the databases/schemas of the given tenants."
+
+    def add_arguments(self, parser):
+        parser.add_argument("schemas", nargs="+")
+
+    def handle(self, *args, **options):
+        for schema in options["schemas"]:
+            alias = tenant_alias(schema)
+            if tenant_settings()["MODE"] == "sqlite":
+                path = tenant_sqlite_path(schema)
+                path.parent.mkdir(parents=True, exist_ok=True)
+                path.touch()
+            else:
+                with connections["default"].cursor() as cursor:
+                    cursor.execute(f'CREATE SCHEMA IF NOT EXISTS "{schema}"')
+            call_command("migrate", database=alias, verbosity=options["verbosity"] - 1)
+            self.stdout.write(self.style.SUCCESS(f"Migrated {schema} ({alias})"))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from campaign.models import Campaign
+from campaign.rollups import DEFAULT_BATCH_SIZE, SOURCES, run_rollups, snapshot_campaign
+
+
+class Command(BaseCommand):
+    help = "Roll up new channel events into hourly/daily campaign analytics buckets."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--source", action="append", choices=sorted(SOURCES), dest="sources")
+        parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+        parser.add_argument(
+            "--snapshot",
+            action="store_true",
+            help="Also write a CampaignAnalytics snapshot for every campaign with buckets.",
+        )
+
+    def handle(self, *args, **options):
+        processed = run_rollups(options["sources"], batch_size=options["batch_size"])
+        for name, count in processed.items():
+            self.stdout.write(f"{name}: {count}")
+
+        if options["snapshot"]:
+            campaigns = Campaign.objects.filter(analytics_buckets__isnull=False).distinct()
+            for campaign in campaigns.iterator():
+                snapshot_campaign(campaign)
+            self.stdout.write(self.style.SUCCESS(f"Snapshotted {campaigns.count()} campaigns"))
@@ -0,0 +1,67 @@
+# Generated by Django 5.2.8 on 2026-10-18 03:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('campaign', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupWatermark',
+            fields=[
+                ('source', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('last_id', models.BigIntegerField(default=0)),
+                ('last_timestamp', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Rollup Watermark',
+                'verbose_name_plural': 'Rollup Watermarks',
+                'db_table': 'rollup_watermark',
+            },
+        ),
+        migrations.CreateModel(
+            name='RollupBaseline',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('source', models.CharField(max_length=100)),
+                ('object_id', models.BigIntegerField()),
+                ('values', models.JSONField(blank=True, default=dict)),
+            ],
+            options={
+                'verbose_name': 'Rollup Baseline',
+                'verbose_name_plural': 'Rollup Baselines',
+                'db_table': 'rollup_baseline',
+                'constraints': [models.UniqueConstraint(fields=('source', 'object_id'), name='uniq_rollup_baseline')],
+            },
+        ),
+        migrations.CreateModel(
+            name='CampaignAnalyticsBucket',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('granularity', models.CharField(choices=[('hour', 'hour'), ('day', 'day')], max_length=10)),
+                ('bucket_start', models.DateTimeField()),
+                ('sent', models.BigIntegerField(default=0)),
+                ('delivered', models.BigIntegerField(default=0)),
+                ('opened', models.BigIntegerField(default=0)),
+                ('clicked', models.BigIntegerField(default=0)),
+                ('conversions', models.BigIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('cost', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('campaign', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='analytics_buckets', to='campaign.campaign')),
+            ],
+            options={
+                'verbose_name': 'Campaign Analytics Bucket',
+                'verbose_name_plural': 'Campaign Analytics Buckets',
+                'db_table': 'campaign_analytics_bucket',
+                'ordering': ['-bucket_start'],
+                'constraints': [models.UniqueConstraint(fields=('campaign', 'granularity', 'bucket_start'), name='uniq_campaign_bucket')],
+            },
+        ),
+    ]
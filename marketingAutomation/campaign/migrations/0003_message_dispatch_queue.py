@@ -0,0 +1,22 @@
+# Generated by Django 5.2.8 on 2026-10-18 03:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('campaign', '0002_analytics_rollups'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='campaignmessage',
+            name='status',
+            field=models.CharField(choices=[('draft', 'draft'), ('scheduled', 'scheduled'), ('sending', 'sending'), ('sent', 'sent'), ('failed', 'failed'), ('cancelled', 'cancelled')], default='draft', max_length=30),
+        ),
+        migrations.AddIndex(
+            model_name='campaignmessage',
+            index=models.Index(fields=['status', 'scheduled_time', 'id'], name='campaign_message_due_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.8 on 2026-10-18 03:10
+
+import django.core.validators
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('campaign', '0003_message_dispatch_queue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerSegmentMembership',
+            fields=[
+                ('segment', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='membership', serialize=False, to='campaign.customersegment')),
+                ('data', models.BinaryField()),
+                ('member_count', models.BigIntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)])),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Customer Segment Membership',
+                'verbose_name_plural': 'Customer Segment Memberships',
+                'db_table': 'customer_segment_membership',
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.8 on 2026-10-18 03:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('campaign', '0004_segment_membership'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='campaign',
+            index=models.Index(fields=['tenant_id', 'status', 'start_date', 'end_date'], name='campaign_tenant_active_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.8 on 2026-10-18 03:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('campaign', '0005_campaign_active_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='campaign',
+            index=models.Index(fields=['created_at', 'id'], name='campaign_page_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='campaign',
+            index=models.Index(fields=['tenant_id', 'created_at', 'id'], name='campaign_tenant_page_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='campaignmessage',
+            index=models.Index(fields=['created_at', 'id'], name='campaign_msg_page_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='campaignmessage',
+            index=models.Index(fields=['campaign', 'created_at', 'id'], name='campaign_msg_campaign_page_idx'),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.8 on 2026-10-18 03:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_channels(apps, schema_editor):
+    Campaign = apps.get_model('campaign', 'Campaign')
+    CampaignChannel = apps.get_model('campaign', 'CampaignChannel')
+    db = schema_editor.connection.alias
+    links = []
+    for campaign_id, channels in Campaign.objects.using(db).values_list('id', 'channels').iterator(chunk_size=2000):
+        if not isinstance(channels, list):
+            continue
+        names = {c.strip().lower() for c in channels if isinstance(c, str) and c.strip()}
+        links.extend(CampaignChannel(campaign_id=campaign_id, channel=name) for name in sorted(names))
+        if len(links) >= 5000:
+            CampaignChannel.objects.using(db).bulk_create(links)
+            links = []
+    CampaignChannel.objects.using(db).bulk_create(links)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('campaign', '0006_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CampaignChannel',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('channel', models.CharField(max_length=30)),
+                ('campaign', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='channel_links', to='campaign.campaign')),
+            ],
+            options={
+                'verbose_name': 'Campaign Channel',
+                'verbose_name_plural': 'Campaign Channels',
+                'db_table': 'campaign_channel',
+                'indexes': [models.Index(fields=['channel', 'campaign'], name='campaign_channel_lookup_idx')],
+                'constraints': [models.UniqueConstraint(fields=('campaign', 'channel'), name='campaign_channel_unique')],
+            },
+        ),
+        migrations.RunPython(backfill_channels, migrations.RunPython.noop),
+    ]
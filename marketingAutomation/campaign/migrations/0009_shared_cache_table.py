@@ -0,0 +1,21 @@
+# Generated by Django 5.2.8 on 2026-10-18 18:40
+
+from django.core.management import call_command
+from django.db import migrations
+
+
+def create_cache_tables(apps, schema_editor):
+    # the tables of the DatabaseCache aliases in CACHES (the "shared" one holds
+    # the active campaign ids, campaign.active); existing tables are kept
+    call_command("createcachetable", database=schema_editor.connection.alias, verbosity=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('campaign', '0008_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_cache_tables, migrations.RunPython.noop),
+    ]
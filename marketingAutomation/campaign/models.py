@@ -1,4 +1,7 @@
-from django.db import models
+from decimal import Decimal
+from itertools import islice
+
+from django.db import connections, models, transaction
 from django.utils import timezone
 from django.core.validators import MinValueValidator
 
@@ -19,6 +22,89 @@ class CustomerSegment(models.Model):
     def __str__(self):
         return self.name
 
+    def get_members(self):
+        """Customer ids in this segment as a ``RoaringBitmap`` (empty if never set)."""
+        from .bitmaps import RoaringBitmap
+
+        try:
+            return self.membership.bitmap()
+        except CustomerSegmentMembership.DoesNotExist:
+            return RoaringBitmap()
+
+    def set_members(self, ids):
+        """Replace the membership with ``ids`` (a ``RoaringBitmap`` or iterable of ints)."""
+        from .bitmaps import RoaringBitmap
+
+        bitmap = ids if isinstance(ids, RoaringBitmap) else RoaringBitmap(ids)
+        membership, _ = CustomerSegmentMembership.objects.update_or_create(
+            segment=self,
+            defaults={"data": bitmap.to_bytes(), "member_count": len(bitmap)},
+        )
+        return membership
+
+
+class CustomerSegmentMembership(models.Model):
+    """Compressed customer-id bitmap of a segment, kept out of the segment row
+    so listing segments never loads the (possibly multi-MB) membership blob."""
+    segment = models.OneToOneField(
+        CustomerSegment,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="membership",
+    )
+    data = models.BinaryField()
+    member_count = models.BigIntegerField(default=0, validators=[MinValueValidator(0)])
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = "customer_segment_membership"
+        verbose_name = "Customer Segment Membership"
+        verbose_name_plural = "Customer Segment Memberships"
+
+    def __str__(self):
+        return f"{self.segment_id}: {self.member_count} members"
+
+    def bitmap(self):
+        from .bitmaps import RoaringBitmap
+
+        return RoaringBitmap.from_bytes(self.data)
+
+
+def normalize_channels(channels):
+    """Distinct lower-cased channel names from a ``Campaign.channels`` value."""
+    if not isinstance(channels, (list, tuple, set)):
+        return []
+    return sorted({c.strip().lower() for c in channels if isinstance(c, str) and c.strip()})
+
+
+class CampaignQuerySet(models.QuerySet):
+    def active(self, now=None):
+        """SQL equivalent of ``Campaign.is_active`` (dates only apply when both are set)."""
+        now = now or timezone.now()
+        return self.filter(status="active").filter(
+            models.Q(start_date__isnull=True)
+            | models.Q(end_date__isnull=True)
+            | models.Q(start_date__lte=now, end_date__gte=now)
+        )
+
+    def for_tenant(self, tenant_id):
+        return self.filter(tenant_id=tenant_id)
+
+    def with_channel(self, channel):
+        """Campaigns whose ``channels`` include ``channel`` (via the indexed ``CampaignChannel``)."""
+        return self.with_any_channel([channel])
+
+    def with_any_channel(self, channels):
+        channels = normalize_channels(channels)
+        return self.filter(
+            id__in=CampaignChannel.objects.filter(channel__in=channels).values("campaign_id")
+        )
+
+    def sync_channels(self):
+        """Rebuild ``CampaignChannel`` rows for campaigns written with ``update()``/``bulk_create()``."""
+        for campaign in self.only("id", "channels").iterator(chunk_size=2000):
+            campaign.sync_channels()
+
 
 class Campaign(models.Model):
     id = models.BigAutoField(primary_key=True)
@@ -74,9 +160,20 @@ class Campaign(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = CampaignQuerySet.as_manager()
+
     class Meta:
         db_table = "campaign"
         ordering = ["-created_at"]
+        indexes = [
+            models.Index(
+                fields=["tenant_id", "status", "start_date", "end_date"],
+                name="campaign_tenant_active_idx",
+            ),
+            # keyset pagination (campaign.pagination)
+            models.Index(fields=["created_at", "id"], name="campaign_page_idx"),
+            models.Index(fields=["tenant_id", "created_at", "id"], name="campaign_tenant_page_idx"),
+        ]
         verbose_name = "Campaign"
         verbose_name_plural = "Campaigns"
 
@@ -90,6 +187,151 @@ class Campaign(models.Model):
             return self.start_date <= now <= self.end_date and self.status == "active"
         return self.status == "active"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if "tenant_id" in field_names:
+            # the tenant whose cached active ids hold this row (see save())
+            instance._stored_tenant_id = instance.tenant_id
+        return instance
+
+    def _invalidate_active(self):
+        from .active import invalidate_active_campaigns
+
+        # moving a campaign to another tenant changes both tenants' active ids
+        invalidate_active_campaigns(self.tenant_id, getattr(self, "_stored_tenant_id", self.tenant_id))
+        self._stored_tenant_id = self.tenant_id
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is None or "channels" in update_fields:
+            self.sync_channels()
+        self._invalidate_active()
+
+    def sync_channels(self):
+        """Make this campaign's ``CampaignChannel`` rows match ``channels``."""
+        wanted = set(normalize_channels(self.channels))
+        links = CampaignChannel.objects.db_manager(self._state.db)
+        existing = set(links.filter(campaign_id=self.pk).values_list("channel", flat=True))
+        if existing - wanted:
+            links.filter(campaign_id=self.pk, channel__in=existing - wanted).delete()
+        if wanted - existing:
+            links.bulk_create(
+                [CampaignChannel(campaign_id=self.pk, channel=c) for c in sorted(wanted - existing)],
+                ignore_conflicts=True,
+            )
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        self._invalidate_active()
+        return result
+
+
+class CampaignChannel(models.Model):
+    """One row per entry of ``Campaign.channels``, so channel filters can use a B-tree index."""
+
+    id = models.BigAutoField(primary_key=True)
+    campaign = models.ForeignKey(
+        Campaign,
+        on_delete=models.CASCADE,
+        related_name="channel_links",
+    )
+    channel = models.CharField(max_length=30)
+
+    class Meta:
+        db_table = "campaign_channel"
+        constraints = [
+            models.UniqueConstraint(fields=["campaign", "channel"], name="campaign_channel_unique"),
+        ]
+        indexes = [
+            models.Index(fields=["channel", "campaign"], name="campaign_channel_lookup_idx"),
+        ]
+        verbose_name = "Campaign Channel"
+        verbose_name_plural = "Campaign Channels"
+
+    def __str__(self):
+        return f"{self.campaign_id}: {self.channel}"
+
+
+def compute_roi(revenue, cost):
+    """ROI = (revenue - cost) / cost, or None when cost is zero/unknown."""
+    try:
+        if cost and cost > 0:
+            return (revenue - cost) / cost
+    except Exception:
+        pass
+    return None
+
+
+ROI_QUANTUM = Decimal("0.0001")
+
+
+class CampaignAnalyticsQuerySet(models.QuerySet):
+    INGEST_FIELDS = (
+        "campaign_id",
+        "recorded_at",
+        "total_sent",
+        "total_delivered",
+        "total_opened",
+        "total_clicked",
+        "total_conversions",
+        "revenue_generated",
+        "cost",
+    )
+
+    def bulk_ingest(self, rows, batch_size=10000):
+        """Insert many snapshots with ROI filled in, one executemany per batch.
+
+        ``rows`` may be ``CampaignAnalytics`` instances or dicts of field values
+        and is consumed lazily, so it can be a generator over a large file.
+        This skips model instantiation and per-field ORM preparation, which is
+        what makes ``save()``/``bulk_create`` slow for millions of rows.
+        Returns the number of rows written.
+        """
+        connection = connections[self.db]
+        ops = connection.ops
+        opts = self.model._meta
+        columns = [opts.get_field(name).column for name in self.INGEST_FIELDS]
+        columns += ["roi", "created_at"]
+        sql = "INSERT INTO %s (%s) VALUES (%s)" % (
+            ops.quote_name(opts.db_table),
+            ", ".join(ops.quote_name(column) for column in columns),
+            ", ".join(["%s"] * len(columns)),
+        )
+
+        rows = iter(rows)
+        written = 0
+        while True:
+            chunk = list(islice(rows, batch_size))
+            if not chunk:
+                return written
+            created_at = ops.adapt_datetimefield_value(timezone.now())
+            params = []
+            for row in chunk:
+                if isinstance(row, CampaignAnalytics):
+                    row = {name: getattr(row, name) for name in self.INGEST_FIELDS}
+                revenue = Decimal(row.get("revenue_generated") or 0)
+                cost = Decimal(row.get("cost") or 0)
+                recorded_at = row.get("recorded_at")
+                roi = compute_roi(revenue, cost)
+                params.append((
+                    row["campaign_id"],
+                    ops.adapt_datetimefield_value(recorded_at) if recorded_at else created_at,
+                    row.get("total_sent") or 0,
+                    row.get("total_delivered") or 0,
+                    row.get("total_opened") or 0,
+                    row.get("total_clicked") or 0,
+                    row.get("total_conversions") or 0,
+                    ops.adapt_decimalfield_value(revenue),
+                    ops.adapt_decimalfield_value(cost),
+                    None if roi is None else ops.adapt_decimalfield_value(roi.quantize(ROI_QUANTUM)),
+                    created_at,
+                ))
+            with transaction.atomic(using=self.db), connection.cursor() as cursor:
+                cursor.executemany(sql, params)
+            written += len(params)
+
 
 class CampaignAnalytics(models.Model):
     id = models.BigAutoField(primary_key=True)
@@ -119,6 +361,8 @@ class CampaignAnalytics(models.Model):
 
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = CampaignAnalyticsQuerySet.as_manager()
+
     class Meta:
         db_table = "campaign_analytics"
         ordering = ["-recorded_at"]
@@ -134,16 +378,92 @@ class CampaignAnalytics(models.Model):
 
     def save(self, *args, **kwargs):
         # compute ROI if possible: ROI = (revenue - cost) / cost
-        try:
-            if self.cost and self.cost > 0:
-                self.roi = (self.revenue_generated - self.cost) / self.cost
-            else:
-                self.roi = None
-        except Exception:
-            self.roi = None
+        self.roi = compute_roi(self.revenue_generated, self.cost)
         super().save(*args, **kwargs)
 
 
+class CampaignAnalyticsBucket(models.Model):
+    """Hourly / daily rollup of the channel event tables for one campaign.
+
+    Filled incrementally by ``campaign.rollups``; dashboards sum buckets
+    instead of scanning the event tables.
+    """
+    id = models.BigAutoField(primary_key=True)
+    campaign = models.ForeignKey(
+        Campaign,
+        on_delete=models.CASCADE,
+        related_name="analytics_buckets",
+    )
+
+    GRANULARITY_CHOICES = [
+        ("hour", "hour"),
+        ("day", "day"),
+    ]
+    granularity = models.CharField(max_length=10, choices=GRANULARITY_CHOICES)
+    bucket_start = models.DateTimeField()
+
+    sent = models.BigIntegerField(default=0)
+    delivered = models.BigIntegerField(default=0)
+    opened = models.BigIntegerField(default=0)
+    clicked = models.BigIntegerField(default=0)
+    conversions = models.BigIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    cost = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = "campaign_analytics_bucket"
+        ordering = ["-bucket_start"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["campaign", "granularity", "bucket_start"],
+                name="uniq_campaign_bucket",
+            ),
+        ]
+        verbose_name = "Campaign Analytics Bucket"
+        verbose_name_plural = "Campaign Analytics Buckets"
+
+    def __str__(self):
+        return f"{self.granularity} bucket {self.campaign_id} @ {self.bucket_start.isoformat()}"
+
+
+class RollupWatermark(models.Model):
+    """High-water mark of a rollup source (last processed id or timestamp)."""
+    source = models.CharField(max_length=100, primary_key=True)
+    last_id = models.BigIntegerField(default=0)
+    last_timestamp = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = "rollup_watermark"
+        verbose_name = "Rollup Watermark"
+        verbose_name_plural = "Rollup Watermarks"
+
+    def __str__(self):
+        return f"{self.source} @ {self.last_timestamp or self.last_id}"
+
+
+class RollupBaseline(models.Model):
+    """Last rolled-up values of a cumulative source row (e.g. social metrics),
+    so that only the delta since the previous sync is added to the buckets."""
+    id = models.BigAutoField(primary_key=True)
+    source = models.CharField(max_length=100)
+    object_id = models.BigIntegerField()
+    values = models.JSONField(default=dict, blank=True)
+
+    class Meta:
+        db_table = "rollup_baseline"
+        constraints = [
+            models.UniqueConstraint(fields=["source", "object_id"], name="uniq_rollup_baseline"),
+        ]
+        verbose_name = "Rollup Baseline"
+        verbose_name_plural = "Rollup Baselines"
+
+    def __str__(self):
+        return f"{self.source}:{self.object_id}"
+
+
 class CampaignMessage(models.Model):
     id = models.BigAutoField(primary_key=True)
     campaign = models.ForeignKey(
@@ -172,6 +492,7 @@ class CampaignMessage(models.Model):
     STATUS_CHOICES = [
         ("draft", "draft"),
         ("scheduled", "scheduled"),
+        ("sending", "sending"),
         ("sent", "sent"),
         ("failed", "failed"),
         ("cancelled", "cancelled"),
@@ -189,9 +510,34 @@ class CampaignMessage(models.Model):
         ordering = ["-scheduled_time", "-created_at"]
         indexes = [
             models.Index(fields=["campaign", "status"]),
+            # due queue: status = 'scheduled' AND scheduled_time <= now
+            models.Index(fields=["status", "scheduled_time", "id"], name="campaign_message_due_idx"),
+            # keyset pagination (campaign.pagination)
+            models.Index(fields=["created_at", "id"], name="campaign_msg_page_idx"),
+            models.Index(fields=["campaign", "created_at", "id"], name="campaign_msg_campaign_page_idx"),
         ]
         verbose_name = "Campaign Message"
         verbose_name_plural = "Campaign Messages"
 
     def __str__(self):
         return f"{self.channel} message for {self.campaign.name} ({self.status})"
+
+
+class IdempotencyKey(models.Model):
+    """Claimed 64-bit key of an ingested provider callback (``campaign.dedup``);
+    the unique constraint is what confirms a duplicate."""
+    id = models.BigAutoField(primary_key=True)
+    scope = models.CharField(max_length=30)
+    key = models.BigIntegerField()
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        db_table = "idempotency_key"
+        constraints = [
+            models.UniqueConstraint(fields=["scope", "key"], name="uniq_idempotency_key"),
+        ]
+        verbose_name = "Idempotency Key"
+        verbose_name_plural = "Idempotency Keys"
+
+    def __str__(self):
+        return f"{self.scope}:{self.key}"
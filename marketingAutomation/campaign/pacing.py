@@ -0,0 +1,206 @@
+"""
+In-memory budget pacing against ``Campaign.budget``.
+
+Each campaign gets an account holding its budget, the spend already
+committed to the database (the ``cost`` of its daily analytics buckets) and
+the spend reserved in this process but not yet flushed. ``admit()`` decides
+per batch how many messages still fit the budget without touching the
+database; ``flush()`` periodically writes the reserved spend into the hourly
+and daily ``CampaignAnalyticsBucket.cost`` and reloads budgets and committed
+spend, which also picks up spend flushed by other processes. Overspend across
+processes is therefore bounded by what they reserve within one flush interval.
+
+Amounts are kept as integer micro-units so the hot path never does Decimal
+arithmetic.
+"""
+import logging
+import threading
+from collections import Counter
+from decimal import ROUND_DOWN, Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from .models import Campaign, CampaignAnalyticsBucket
+
+logger = logging.getLogger(__name__)
+
+MICRO = 1_000_000
+CENT = MICRO // 100
+LOAD_CHUNK = 500
+
+
+def to_micro(amount):
+    return int((Decimal(amount) * MICRO).to_integral_value(ROUND_DOWN))
+
+
+def from_micro(micro):
+    return Decimal(micro) / MICRO
+
+
+def message_cost(channel):
+    """Unit cost of one message on ``channel`` from ``CAMPAIGN_MESSAGE_COSTS``, in micro-units."""
+    return to_micro(getattr(settings, "CAMPAIGN_MESSAGE_COSTS", {}).get(channel, 0))
+
+
+class _Account:
+    __slots__ = ("lock", "budget", "committed", "pending")
+
+    def __init__(self, budget, committed):
+        self.lock = threading.Lock()
+        self.budget = budget  # None = unlimited
+        self.committed = committed
+        self.pending = 0
+
+
+class BudgetPacer:
+    def __init__(self, flush_interval=5.0, using="default"):
+        self.flush_interval = flush_interval
+        self.using = using
+        self._accounts = {}
+        self._accounts_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _load(self, campaign_ids):
+        """``{campaign_id: (budget, committed)}`` in micro-units."""
+        campaign_ids = list(campaign_ids)
+        loaded = {}
+        for start in range(0, len(campaign_ids), LOAD_CHUNK):
+            chunk = campaign_ids[start:start + LOAD_CHUNK]
+            budgets = dict(
+                Campaign.objects.using(self.using).filter(id__in=chunk).values_list("id", "budget")
+            )
+            spent = dict(
+                CampaignAnalyticsBucket.objects.using(self.using)
+                .filter(campaign_id__in=chunk, granularity="day")
+                .values("campaign_id")
+                .annotate(cost=Sum("cost"))
+                .values_list("campaign_id", "cost")
+            )
+            for campaign_id in chunk:
+                budget = budgets.get(campaign_id)
+                loaded[campaign_id] = (
+                    None if budget is None else to_micro(budget),
+                    to_micro(spent.get(campaign_id) or 0),
+                )
+        return loaded
+
+    def preload(self, campaign_ids):
+        """Load accounts for many campaigns up front (two queries per chunk)."""
+        missing = [cid for cid in set(campaign_ids) if cid not in self._accounts]
+        if not missing:
+            return
+        loaded = self._load(missing)
+        with self._accounts_lock:
+            for campaign_id, (budget, committed) in loaded.items():
+                self._accounts.setdefault(campaign_id, _Account(budget, committed))
+
+    def _account(self, campaign_id):
+        account = self._accounts.get(campaign_id)
+        if account is None:
+            self.preload([campaign_id])
+            account = self._accounts[campaign_id]
+        return account
+
+    def admit(self, campaign_id, count, unit_cost):
+        """Reserve budget for up to ``count`` messages; returns how many fit.
+
+        ``unit_cost`` is in micro-units (see ``message_cost``).
+        """
+        account = self._account(campaign_id)
+        if account.budget is None or unit_cost <= 0:
+            with account.lock:
+                account.pending += unit_cost * count
+            return count
+        with account.lock:
+            remaining = account.budget - account.committed - account.pending
+            admitted = max(0, min(count, remaining // unit_cost))
+            account.pending += admitted * unit_cost
+        return admitted
+
+    def refund(self, campaign_id, amount):
+        """Give back reserved spend (micro-units) for messages that were not sent."""
+        account = self._account(campaign_id)
+        with account.lock:
+            account.pending -= amount
+
+    def remaining(self, campaign_id):
+        account = self._account(campaign_id)
+        if account.budget is None:
+            return None
+        return from_micro(account.budget - account.committed - account.pending)
+
+    def flush(self):
+        """Write whole cents of reserved spend to the buckets and reload accounts.
+
+        Refunds of spend flushed already leave ``pending`` negative; those
+        whole cents are written as negative cost, so the buckets (and the
+        ``committed`` reloaded from them) are not left overstated.
+        """
+        from .rollups import apply_deltas
+
+        with self._flush_lock:
+            hour = timezone.now().replace(minute=0, second=0, microsecond=0)
+            taken = {}
+            for campaign_id, account in list(self._accounts.items()):
+                with account.lock:
+                    pending = account.pending
+                    # whole cents, rounded towards zero
+                    cents = pending // CENT if pending >= 0 else -(-pending // CENT)
+                    if cents:
+                        account.pending -= cents * CENT
+                        account.committed += cents * CENT
+                        taken[campaign_id] = cents
+            if taken:
+                try:
+                    with transaction.atomic(using=self.using):
+                        apply_deltas({
+                            (campaign_id, hour): Counter(cost=Decimal(cents) / 100)
+                            for campaign_id, cents in taken.items()
+                        }, using=self.using)
+                except Exception:
+                    for campaign_id, cents in taken.items():
+                        account = self._accounts[campaign_id]
+                        with account.lock:
+                            account.pending += cents * CENT
+                            account.committed -= cents * CENT
+                    raise
+
+            loaded = self._load(self._accounts)
+            for campaign_id, (budget, committed) in loaded.items():
+                account = self._accounts[campaign_id]
+                with account.lock:
+                    account.budget = budget
+                    account.committed = committed
+            return sum(taken.values())
+
+    def _run(self):
+        from django.db import connections
+
+        try:
+            while not self._stop.wait(self.flush_interval):
+                try:
+                    self.flush()
+                except Exception:
+                    # the spend stays reserved and goes out with the next flush
+                    logger.exception("Budget pacing flush failed")
+                    connections[self.using].close_if_unusable_or_obsolete()
+        finally:
+            connections.close_all()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
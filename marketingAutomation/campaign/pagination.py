@@ -0,0 +1,102 @@
+"""
+Keyset (cursor) pagination for the JSON list endpoints.
+
+Pages are ordered newest first on ``(created_at, id)`` and the cursor encodes
+the last row of the previous page, so fetching page N is one index range scan
+of ``limit + 1`` rows no matter how deep N is (an ``OFFSET`` has to walk and
+discard every earlier row). Each listing needs an index on ``(created_at,
+id)``, prefixed by the column it filters on.
+
+First pages - the ones dashboards poll - are cached for
+``CAMPAIGN_PAGE_CACHE_SECONDS``; deeper pages are not worth the cache space.
+"""
+import base64
+import hashlib
+from datetime import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+from django.http import JsonResponse
+
+from marketingAutomation.tenancy import current_tenant_alias
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(created_at, pk):
+    raw = f"{created_at.isoformat()}|{pk}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        stamp, pk = raw.rsplit("|", 1)
+        return datetime.fromisoformat(stamp), int(pk)
+    except (ValueError, UnicodeDecodeError) as exc:
+        raise InvalidCursor(f"Invalid cursor {cursor!r}") from exc
+
+
+def keyset_page(queryset, fields, cursor=None, limit=DEFAULT_LIMIT):
+    """One page of ``queryset.values(*fields)`` newest first, and the next cursor."""
+    queryset = queryset.order_by("-created_at", "-id")
+    if cursor:
+        created_at, pk = decode_cursor(cursor)
+        # The created_at bound lets the planner range-scan the index; the OR
+        # only breaks ties within the boundary timestamp.
+        queryset = queryset.filter(Q(created_at__lt=created_at) | Q(id__lt=pk), created_at__lte=created_at)
+    fields = list(dict.fromkeys([*fields, "id", "created_at"]))
+    rows = list(queryset.values(*fields)[:limit + 1])
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]["created_at"], rows[-1]["id"])
+    return rows, next_cursor
+
+
+def _limit(request):
+    try:
+        limit = int(request.GET.get("limit", DEFAULT_LIMIT))
+    except ValueError:
+        raise InvalidCursor("limit must be an integer")
+    return max(1, min(limit, MAX_LIMIT))
+
+
+def _cache_key(request, limit):
+    params = sorted((k, v) for k, v in request.GET.items() if k not in ("cursor", "limit"))
+    raw = repr((current_tenant_alias(), request.path, params, limit))
+    return "keyset-page:" + hashlib.blake2b(raw.encode(), digest_size=16).hexdigest()
+
+
+def paginated_response(request, queryset, fields):
+    """``JsonResponse`` with ``results`` and ``next`` for the request's cursor/limit."""
+    return page_response(request, lambda cursor, limit: keyset_page(queryset, fields, cursor, limit))
+
+
+def page_response(request, page):
+    """``JsonResponse`` of ``page(cursor, limit)`` -> ``(rows, next_cursor)`` for
+    the request's cursor/limit, for listings that are not a single queryset."""
+    try:
+        limit = _limit(request)
+        cursor = request.GET.get("cursor")
+        if cursor:
+            rows, next_cursor = page(cursor, limit)
+            return JsonResponse({"results": rows, "next": next_cursor})
+    except InvalidCursor as exc:
+        return JsonResponse({"error": str(exc)}, status=400)
+
+    timeout = getattr(settings, "CAMPAIGN_PAGE_CACHE_SECONDS", 5)
+    key = _cache_key(request, limit)
+    payload = cache.get(key) if timeout else None
+    if payload is None:
+        rows, next_cursor = page(None, limit)
+        payload = {"results": rows, "next": next_cursor}
+        if timeout:
+            cache.set(key, payload, timeout)
+    return JsonResponse(payload)
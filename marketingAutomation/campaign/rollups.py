@@ -0,0 +1,355 @@
+"""
+Incremental hourly / daily rollups of the channel event tables.
+
+Every source keeps a high-water mark in ``RollupWatermark`` (the last
+processed primary key, or the last processed timestamp for columns that are
+filled in after the row is created). A run only aggregates rows past that
+mark and adds the result to ``CampaignAnalyticsBucket``, so dashboards read
+O(buckets) instead of O(events).
+
+Both kinds of marks stay ``SETTLE_SECONDS`` behind the present: ids are
+assigned at insert but rows only become visible at commit, so a row with a
+lower id can appear after a higher one. Id sources therefore only advance
+to the newest row inserted (``created_field``) before the settle window.
+
+WhatsApp deliveries and reads have no source here: callbacks arrive late
+and carry the provider's timestamp, so ``whatsappMarketing.statuses``
+adds each transition to the buckets as it applies it.
+"""
+from collections import Counter, defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import Coalesce, TruncHour
+from django.utils import timezone
+
+from emailMarketing.models import EmailCampaign, EmailEvent
+from emailMarketing.partitions import events_in_range, settled_partition_id
+from qrCodeMarketing.models import QRCodeScan
+from socialMedia.models import SocialMediaPostMetrics
+from whatsappMarketing.models import WhatsAppMessage
+
+from .models import (
+    CampaignAnalytics,
+    CampaignAnalyticsBucket,
+    RollupBaseline,
+    RollupWatermark,
+)
+
+METRICS = ("sent", "delivered", "opened", "clicked", "conversions", "revenue", "cost")
+DECIMAL_METRICS = ("revenue", "cost")
+
+DEFAULT_BATCH_SIZE = 50_000
+# Rows are only rolled up once they were inserted (id sources) or synced
+# (last_synced_at) longer ago than this, so rows of transactions still open
+# at the time of a run are not skipped.
+SETTLE_SECONDS = getattr(settings, "ROLLUP_SETTLE_SECONDS", 60)
+
+EMAIL_EVENT_METRICS = {
+    "sent": "sent",
+    "delivered": "delivered",
+    "opened": "opened",
+    "clicked": "clicked",
+}
+SOCIAL_METRICS = {"reach": "delivered", "clicks": "clicked"}
+CONVERTED_ACTIONS = ("signed_up", "downloaded", "ordered")
+
+
+def _day(hour):
+    return hour.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def apply_deltas(deltas, using=None):
+    """Add ``{(campaign_id, hour_start): Counter}`` to the hourly and daily buckets.
+
+    Must run inside a transaction.
+    """
+    buckets = CampaignAnalyticsBucket.objects.db_manager(using)
+    keyed = defaultdict(Counter)
+    for (campaign_id, hour), values in deltas.items():
+        keyed[(campaign_id, "hour", hour)].update(values)
+        keyed[(campaign_id, "day", _day(hour))].update(values)
+    if not keyed:
+        return 0
+
+    existing = buckets.select_for_update().filter(
+        campaign_id__in={key[0] for key in keyed},
+        bucket_start__in={key[2] for key in keyed},
+    )
+    existing = {(b.campaign_id, b.granularity, b.bucket_start): b for b in existing}
+
+    to_update, to_create = [], []
+    for key, values in keyed.items():
+        bucket = existing.get(key)
+        if bucket is None:
+            campaign_id, granularity, start = key
+            bucket = CampaignAnalyticsBucket(
+                campaign_id=campaign_id, granularity=granularity, bucket_start=start
+            )
+            to_create.append(bucket)
+        else:
+            to_update.append(bucket)
+        for metric, value in values.items():
+            setattr(bucket, metric, getattr(bucket, metric) + value)
+
+    now = timezone.now()
+    for bucket in to_update:
+        bucket.updated_at = now
+    if to_update:
+        buckets.bulk_update(to_update, [*METRICS, "updated_at"], batch_size=1000)
+    if to_create:
+        buckets.bulk_create(to_create, batch_size=1000)
+    return len(keyed)
+
+
+class RollupSource:
+    """One event table feeding the buckets. Subclasses implement ``collect``."""
+    name = None
+
+    def watermark(self):
+        mark, _ = RollupWatermark.objects.get_or_create(source=self.name)
+        return RollupWatermark.objects.select_for_update().get(pk=mark.pk)
+
+    def run(self, batch_size=DEFAULT_BATCH_SIZE):
+        raise NotImplementedError
+
+
+class IdRollupSource(RollupSource):
+    """Source whose rows are immutable once inserted: walk the primary key."""
+    model = None
+    # insert time of a row, set by the application before the commit
+    created_field = "created_at"
+
+    def collect(self, low, high):
+        raise NotImplementedError
+
+    def settled_id(self):
+        """Highest id inserted before the settle window; ids above it may
+        still have lower-id neighbours in open transactions."""
+        upto = timezone.now() - timedelta(seconds=SETTLE_SECONDS)
+        # walks the primary key index back from the newest row
+        return (
+            self.model.objects.filter(**{f"{self.created_field}__lte": upto})
+            .order_by("-id")
+            .values_list("id", flat=True)
+            .first()
+        ) or 0
+
+    def run(self, batch_size=DEFAULT_BATCH_SIZE):
+        processed = 0
+        max_id = self.settled_id()
+        while True:
+            with transaction.atomic():
+                mark = self.watermark()
+                low = mark.last_id
+                if low >= max_id:
+                    return processed
+                high = min(low + batch_size, max_id)
+                apply_deltas(self.collect(low, high))
+                mark.last_id = high
+                mark.save(update_fields=["last_id", "updated_at"])
+            processed += high - low
+
+
+class TimestampRollupSource(RollupSource):
+    """Source whose rollup column is set after insert: walk that timestamp."""
+
+    def collect(self, after, upto):
+        raise NotImplementedError
+
+    def run(self, batch_size=DEFAULT_BATCH_SIZE):
+        upto = timezone.now() - timedelta(seconds=SETTLE_SECONDS)
+        with transaction.atomic():
+            mark = self.watermark()
+            after = mark.last_timestamp
+            if after is not None and after >= upto:
+                return 0
+            deltas = self.collect(after, upto)
+            apply_deltas(deltas)
+            mark.last_timestamp = upto
+            mark.save(update_fields=["last_timestamp", "updated_at"])
+        return len(deltas)
+
+
+def _range(field, after, upto):
+    q = Q(**{f"{field}__lte": upto})
+    if after is not None:
+        q &= Q(**{f"{field}__gt": after})
+    return q
+
+
+class EmailEventSource(IdRollupSource):
+    name = "email_event"
+    model = EmailEvent
+
+    def settled_id(self):
+        upto = timezone.now() - timedelta(seconds=SETTLE_SECONDS)
+        return max(super().settled_id(), settled_partition_id(upto))
+
+    def collect(self, low, high):
+        # events of older months may already sit in partitions or the archive
+        counts = Counter()
+        for event in events_in_range(ids=(low, high)):
+            if event["event_type"] in EMAIL_EVENT_METRICS:
+                hour = timezone.localtime(event["timestamp"]).replace(minute=0, second=0, microsecond=0)
+                counts[(event["email_campaign_id"], hour, event["event_type"])] += 1
+        campaigns = dict(
+            EmailCampaign.objects.filter(pk__in={key[0] for key in counts}, campaign__isnull=False)
+            .values_list("pk", "campaign_id")
+        )
+        deltas = defaultdict(Counter)
+        for (email_campaign_id, hour, event_type), n in counts.items():
+            if email_campaign_id in campaigns:
+                deltas[(campaigns[email_campaign_id], hour)][EMAIL_EVENT_METRICS[event_type]] += n
+        return deltas
+
+
+class WhatsAppSentSource(IdRollupSource):
+    name = "whatsapp_sent"
+    model = WhatsAppMessage
+
+    def collect(self, low, high):
+        rows = (
+            WhatsAppMessage.objects.filter(
+                id__gt=low, id__lte=high, whatsapp_campaign__campaign__isnull=False
+            )
+            .annotate(hour=TruncHour(Coalesce("sent_at", "created_at")))
+            .values("whatsapp_campaign__campaign_id", "hour")
+            .annotate(n=Count("id"))
+            .order_by()
+        )
+        deltas = defaultdict(Counter)
+        for row in rows:
+            deltas[(row["whatsapp_campaign__campaign_id"], row["hour"])]["sent"] += row["n"]
+        return deltas
+
+
+class QRCodeScanSource(IdRollupSource):
+    name = "qr_code_scan"
+    model = QRCodeScan
+    created_field = "scanned_at"
+
+    def collect(self, low, high):
+        rows = (
+            QRCodeScan.objects.filter(id__gt=low, id__lte=high, qr_code__campaign__isnull=False)
+            .annotate(hour=TruncHour("scanned_at"))
+            .values("qr_code__campaign_id", "hour")
+            .annotate(
+                scans=Count("id"),
+                conversions=Count("id", filter=Q(action_taken__in=CONVERTED_ACTIONS)),
+                revenue=Sum("conversion_value"),
+            )
+            .order_by()
+        )
+        deltas = defaultdict(Counter)
+        for row in rows:
+            bucket = deltas[(row["qr_code__campaign_id"], row["hour"])]
+            bucket["clicked"] += row["scans"]
+            bucket["conversions"] += row["conversions"]
+            if row["revenue"]:
+                bucket["revenue"] += row["revenue"]
+        return deltas
+
+
+class SocialMetricsSource(TimestampRollupSource):
+    """Social metrics are cumulative per post/platform; roll up the delta since
+    the previous sync, remembered in ``RollupBaseline``."""
+    name = "social_metrics"
+
+    def collect(self, after, upto):
+        rows = list(
+            SocialMediaPostMetrics.objects.filter(
+                _range("last_synced_at", after, upto),
+                social_media_post__campaign__isnull=False,
+            )
+            .values("id", "social_media_post__campaign_id", "last_synced_at", *SOCIAL_METRICS)
+            .order_by()
+        )
+        baselines = {
+            b.object_id: b
+            for b in RollupBaseline.objects.filter(
+                source=self.name, object_id__in=[row["id"] for row in rows]
+            )
+        }
+        deltas = defaultdict(Counter)
+        to_update, to_create = [], []
+        for row in rows:
+            baseline = baselines.get(row["id"])
+            if baseline is None:
+                baseline = RollupBaseline(source=self.name, object_id=row["id"])
+                to_create.append(baseline)
+            else:
+                to_update.append(baseline)
+            hour = row["last_synced_at"].replace(minute=0, second=0, microsecond=0)
+            bucket = deltas[(row["social_media_post__campaign_id"], hour)]
+            for field, metric in SOCIAL_METRICS.items():
+                bucket[metric] += row[field] - baseline.values.get(field, 0)
+            baseline.values = {field: row[field] for field in SOCIAL_METRICS}
+        RollupBaseline.objects.bulk_update(to_update, ["values"], batch_size=1000)
+        RollupBaseline.objects.bulk_create(to_create, batch_size=1000)
+        return deltas
+
+
+SOURCES = {
+    source.name: source
+    for source in (
+        EmailEventSource(),
+        WhatsAppSentSource(),
+        QRCodeScanSource(),
+        SocialMetricsSource(),
+    )
+}
+
+
+def run_rollups(sources=None, batch_size=DEFAULT_BATCH_SIZE):
+    """Roll up everything past each source's high-water mark."""
+    return {
+        name: SOURCES[name].run(batch_size=batch_size)
+        for name in (sources or SOURCES)
+    }
+
+
+def _buckets(campaign_id, granularity, start, end):
+    qs = CampaignAnalyticsBucket.objects.filter(campaign_id=campaign_id, granularity=granularity)
+    if start is not None:
+        qs = qs.filter(bucket_start__gte=start)
+    if end is not None:
+        qs = qs.filter(bucket_start__lt=end)
+    return qs
+
+
+def campaign_totals(campaign_id, start=None, end=None, granularity="day"):
+    totals = _buckets(campaign_id, granularity, start, end).aggregate(
+        **{metric: Sum(metric) for metric in METRICS}
+    )
+    return {
+        metric: totals[metric] or (Decimal("0") if metric in DECIMAL_METRICS else 0)
+        for metric in METRICS
+    }
+
+
+def campaign_series(campaign_id, start=None, end=None, granularity="hour"):
+    return list(
+        _buckets(campaign_id, granularity, start, end)
+        .order_by("bucket_start")
+        .values("bucket_start", *METRICS)
+    )
+
+
+def snapshot_campaign(campaign, recorded_at=None):
+    """Write a ``CampaignAnalytics`` snapshot from the daily buckets."""
+    totals = campaign_totals(campaign.pk)
+    return CampaignAnalytics.objects.create(
+        campaign=campaign,
+        recorded_at=recorded_at or timezone.now(),
+        total_sent=totals["sent"],
+        total_delivered=totals["delivered"],
+        total_opened=totals["opened"],
+        total_clicked=totals["clicked"],
+        total_conversions=totals["conversions"],
+        revenue_generated=totals["revenue"],
+        cost=totals["cost"],
+    )
@@ -0,0 +1,209 @@
+"""
+Compile-once personalisation for message templates.
+
+``CampaignMessage.message_template`` and ``EmailTemplate.html_content`` use
+Django-style ``{{ placeholder }}`` / ``{{ customer.first_name }}`` markup.
+Templates that only use plain placeholders are compiled into a
+``str.format`` pattern, so rendering one recipient is a handful of lookups
+plus one C-level format call. Anything richer (tags, filters, comments)
+falls back to a Django ``Template`` that is still parsed only once.
+
+Output matches ``Template(source).render(Context(context,
+autoescape=...))`` with the same autoescape setting. Unlike a bare
+``Context``, autoescaping is only on by default for HTML fields (field names
+containing ``html``); plain-text fields such as
+``CampaignMessage.message_template`` (SMS, WhatsApp) render unescaped, since
+``&amp;`` in a text message is a bug, not a safeguard. Pass ``autoescape``
+to ``compiled_template`` to choose explicitly.
+
+Compiled templates are cached per ``(model, pk, field, updated_at)``, so an
+edit to the row naturally produces a new cache entry.
+"""
+import html
+import inspect
+import re
+import threading
+from collections import OrderedDict
+from itertools import islice
+
+from django.conf import settings
+from django.template import Context, Template
+from django.utils.formats import localize
+from django.utils.html import conditional_escape
+from django.utils.timezone import template_localtime
+
+PLACEHOLDER_RE = re.compile(r"{{\s*([A-Za-z_]\w*(?:\.\w+)*)\s*}}")
+DJANGO_SYNTAX = ("{{", "{%", "{#")
+
+
+def split_placeholders(source):
+    """Split ``source`` into static chunks and placeholder names.
+
+    Returns ``(chunks, names)`` with ``len(chunks) == len(names) + 1``, or
+    ``None`` when the template uses syntax beyond plain placeholders.
+    """
+    chunks, names = [], []
+    position = 0
+    for match in PLACEHOLDER_RE.finditer(source):
+        chunks.append(source[position:match.start()])
+        names.append(match.group(1))
+        position = match.end()
+    chunks.append(source[position:])
+    if any(marker in chunk for chunk in chunks for marker in DJANGO_SYNTAX):
+        return None
+    return chunks, names
+
+
+def _call(value):
+    # Same rules as django.template.base.Variable._resolve_lookup: methods
+    # that alter data (Model.save/delete, ...) render as invalid, and
+    # callables asking not to be called are returned as they are.
+    if getattr(value, "do_not_call_in_templates", False):
+        return value
+    if getattr(value, "alters_data", False):
+        return ""
+    try:
+        return value()
+    except TypeError:
+        try:
+            inspect.signature(value).bind()
+        except (TypeError, ValueError):
+            # needs arguments: invalid, as in Django
+            return ""
+        raise
+
+
+def _lookup(path):
+    """Resolve a dotted placeholder the way Django's variable lookup does."""
+    head, *rest = path.split(".")
+    if not rest:
+        def resolve(context):
+            value = context.get(head, "")
+            return _call(value) if callable(value) else value
+        return resolve
+
+    def resolve(context):
+        value = context.get(head, "")
+        if callable(value):
+            value = _call(value)
+        for bit in rest:
+            try:
+                value = value[bit]
+            except (TypeError, KeyError, IndexError, AttributeError):
+                try:
+                    value = getattr(value, bit)
+                except AttributeError:
+                    try:
+                        value = value[int(bit)]
+                    except (TypeError, ValueError, KeyError, IndexError):
+                        return ""
+            if callable(value):
+                value = _call(value)
+        return value
+    return resolve
+
+
+def _display(value):
+    # Same conversion as django.template.base.render_value_in_context.
+    if isinstance(value, str):
+        return value
+    return str(localize(template_localtime(value)))
+
+
+def _escape(value):
+    # conditional_escape() without the lazy-string wrapper on the common path.
+    if type(value) is str:
+        return html.escape(value)
+    return conditional_escape(value)
+
+
+def placeholder_resolver(path, autoescape=False):
+    """Callable giving the rendered (optionally escaped) text of ``path`` for a context."""
+    lookup = _lookup(path)
+    if autoescape:
+        return lambda context: _escape(_display(lookup(context)))
+    return lambda context: _display(lookup(context))
+
+
+class CompiledTemplate:
+    def __init__(self, source, autoescape=False):
+        self.source = source or ""
+        self.autoescape = autoescape
+        parts = split_placeholders(self.source)
+        if parts is None:
+            self.placeholders = ()
+            self._template = Template(self.source)
+            self._format = None
+        else:
+            chunks, names = parts
+            self.placeholders = tuple(names)
+            self._template = None
+            # Each distinct placeholder is resolved (and escaped) once per
+            # render, however often it appears in the template.
+            distinct = list(dict.fromkeys(names))
+            self._resolvers = [_lookup(name) for name in distinct]
+            pattern = [chunks[0].replace("{", "{{").replace("}", "}}")]
+            for name, chunk in zip(names, chunks[1:]):
+                pattern.append("{%d}" % distinct.index(name))
+                pattern.append(chunk.replace("{", "{{").replace("}", "}}"))
+            self._format = "".join(pattern).format
+
+    def render(self, context):
+        if self._format is None:
+            return self._template.render(Context(context, autoescape=self.autoescape))
+        values = [resolve(context) for resolve in self._resolvers]
+        if self.autoescape:
+            return self._format(*[_escape(_display(value)) for value in values])
+        return self._format(*[_display(value) for value in values])
+
+    def render_batches(self, contexts, batch_size=1000):
+        """Yield lists of rendered strings, ``batch_size`` recipients at a time."""
+        contexts = iter(contexts)
+        render = self.render
+        while True:
+            batch = [render(context) for context in islice(contexts, batch_size)]
+            if not batch:
+                return
+            yield batch
+
+    def stream(self, contexts, batch_size=1000):
+        for batch in self.render_batches(contexts, batch_size):
+            yield from batch
+
+
+class TemplateCache:
+    """Thread-safe LRU of ``CompiledTemplate`` keyed by row version."""
+
+    def __init__(self, maxsize=512):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, instance, field, autoescape=None):
+        if autoescape is None:
+            autoescape = "html" in field
+        key = (instance._meta.label_lower, instance.pk, field, instance.updated_at, autoescape)
+        with self._lock:
+            compiled = self._entries.get(key)
+            if compiled is not None:
+                self._entries.move_to_end(key)
+                return compiled
+        compiled = CompiledTemplate(getattr(instance, field), autoescape=autoescape)
+        with self._lock:
+            self._entries[key] = compiled
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return compiled
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+template_cache = TemplateCache(getattr(settings, "CAMPAIGN_TEMPLATE_CACHE_SIZE", 512))
+
+
+def compiled_template(instance, field, autoescape=None):
+    """Compiled ``instance.<field>``; HTML fields are autoescaped by default."""
+    return template_cache.get(instance, field, autoescape)
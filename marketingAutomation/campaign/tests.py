@@ -1,3 +1,577 @@
-from django.test import TestCase
+import random
+import shutil
+import sqlite3
+import tempfile
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core import signals
+from django.core.cache import cache
+from django.core.cache.backends.db import DatabaseCache
+from django.core.exceptions import SuspiciousOperation
+from django.db import OperationalError, close_old_connections, connections, transaction
+from django.db.models import Sum
+from django.http import HttpResponse
+from django.template import Context, Template
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from marketingAutomation import tenancy
+from whatsappMarketing.models import WhatsAppCampaign, WhatsAppMessage, WhatsAppTemplate
+
+from . import dispatch
+from .active import active_campaign_ids
+from .bitmaps import ARRAY_MAX, MAX_ID, RoaringBitmap
+from .dedup import Deduplicator, SlidingBloomFilter, event_key, prune_keys
+from .hll import HyperLogLog
+from .models import (
+    Campaign,
+    CampaignAnalytics,
+    CampaignAnalyticsBucket,
+    CampaignChannel,
+    CampaignMessage,
+    CustomerSegment,
+    IdempotencyKey,
+    RollupWatermark,
+)
+from .pacing import BudgetPacer, to_micro
+from .rollups import SETTLE_SECONDS, campaign_totals, run_rollups
+from .templating import CompiledTemplate, compiled_template
+
+
+class IdRollupSourceTests(TestCase):
+    def setUp(self):
+        self.campaign = Campaign.objects.create(name="spring")
+        template = WhatsAppTemplate.objects.create(name="t", template_id="t", language="en", body_content="Hi")
+        self.whatsapp_campaign = WhatsAppCampaign.objects.create(
+            name="spring", whatsapp_template=template, customer_segment=CustomerSegment.objects.create(name="s"),
+            campaign=self.campaign,
+        )
+
+    def send(self, count, age=timedelta(minutes=10)):
+        ids = []
+        for i in range(count):
+            message = WhatsAppMessage.objects.create(
+                whatsapp_campaign=self.whatsapp_campaign, phone_number=f"+1212555{i:04d}", sent_at=timezone.now()
+            )
+            ids.append(message.pk)
+        WhatsAppMessage.objects.filter(pk__in=ids).update(created_at=timezone.now() - age)
+        return ids
+
+    def test_resumes_from_watermark(self):
+        self.send(3)
+        run_rollups(["whatsapp_sent"])
+        self.send(2)
+        run_rollups(["whatsapp_sent"])
+        run_rollups(["whatsapp_sent"])
+        self.assertEqual(campaign_totals(self.campaign.pk)["sent"], 5)
+        self.assertEqual(
+            RollupWatermark.objects.get(source="whatsapp_sent").last_id, WhatsAppMessage.objects.latest("id").pk
+        )
+
+    def test_rows_inside_settle_window_wait(self):
+        settled = self.send(2)
+        recent = self.send(1, age=timedelta(seconds=0))
+        run_rollups(["whatsapp_sent"])
+        self.assertEqual(campaign_totals(self.campaign.pk)["sent"], 2)
+        self.assertEqual(RollupWatermark.objects.get(source="whatsapp_sent").last_id, settled[-1])
+
+        WhatsAppMessage.objects.filter(pk__in=recent).update(
+            created_at=timezone.now() - timedelta(seconds=SETTLE_SECONDS + 1)
+        )
+        run_rollups(["whatsapp_sent"])
+        self.assertEqual(campaign_totals(self.campaign.pk)["sent"], 3)
+
+
+class BulkIngestTests(TestCase):
+    def test_roi_and_missing_values(self):
+        campaign = Campaign.objects.create(name="spring")
+        written = CampaignAnalytics.objects.bulk_ingest([
+            {"campaign_id": campaign.pk, "total_sent": 10, "revenue_generated": "150", "cost": "100"},
+            {"campaign_id": campaign.pk, "total_sent": None, "revenue_generated": None, "cost": None},
+            CampaignAnalytics(campaign=campaign, total_sent=3, revenue_generated=Decimal("5"), cost=Decimal("0")),
+        ])
+        self.assertEqual(written, 3)
+        rows = list(CampaignAnalytics.objects.order_by("id").values_list("total_sent", "cost", "roi"))
+        self.assertEqual(rows, [(10, Decimal("100"), Decimal("0.5")), (0, Decimal("0"), None), (3, Decimal("0"), None)])
+
+
+class ShortSender(dispatch.ChannelSender):
+    """Sends all but the last message of a batch."""
+
+    def send_batch(self, messages):
+        return [dispatch.SendResult(f"id-{m.pk}", None) for m in messages[:-1]]
+
+
+class AcceptingSender(dispatch.ChannelSender):
+    def send_batch(self, messages):
+        return [dispatch.SendResult(f"id-{m.pk}", None) for m in messages]
+
+
+class DispatchTests(TestCase):
+    def setUp(self):
+        dispatch._senders.clear()
+        self.addCleanup(dispatch._senders.clear)
+        campaign = Campaign.objects.create(name="spring")
+        due = timezone.now() - timedelta(minutes=1)
+        self.messages = [
+            CampaignMessage.objects.create(campaign=campaign, channel="sms", status="scheduled", scheduled_time=due)
+            for _ in range(3)
+        ]
+        CampaignMessage.objects.create(
+            campaign=campaign, channel="sms", status="scheduled", scheduled_time=timezone.now() + timedelta(hours=1)
+        )
+
+    def test_claims_only_due_messages_once(self):
+        self.assertEqual(len(dispatch.claim_batch(10)), 3)
+        self.assertEqual(dispatch.claim_batch(10), [])
+
+    @override_settings(CAMPAIGN_MESSAGE_SENDERS={"sms": "campaign.tests.ShortSender"})
+    def test_missing_results_are_retried(self):
+        with self.assertLogs("campaign.dispatch", "ERROR"):
+            dispatch.process_batch(dispatch.claim_batch(10))
+        statuses = list(CampaignMessage.objects.filter(pk__in=[m.pk for m in self.messages]).order_by("id")
+                        .values_list("status", flat=True))
+        self.assertEqual(statuses, ["sent", "sent", "scheduled"])
+        self.assertEqual(CampaignMessage.objects.get(pk=self.messages[-1].pk).metadata["attempts"], 1)
+
+    @override_settings(CAMPAIGN_MESSAGE_SENDERS={"sms": "campaign.tests.NoSuchSender"})
+    def test_unimportable_sender_fails_the_batch_not_the_worker(self):
+        with self.assertLogs("campaign.dispatch", "ERROR"):
+            dispatch.process_batch(dispatch.claim_batch(10))
+        self.assertFalse(CampaignMessage.objects.filter(status="sending").exists())
+        self.assertEqual(CampaignMessage.objects.filter(status="scheduled").count(), 4)
+
+
+    @override_settings(CAMPAIGN_MESSAGE_SENDERS={"sms": "campaign.tests.ShortSender"},
+                       CAMPAIGN_MESSAGE_COSTS={"sms": "0.10"})
+    def test_pacer_keeps_only_the_budget_of_stored_sends(self):
+        campaign_id = self.messages[0].campaign_id
+        Campaign.objects.filter(pk=campaign_id).update(budget=Decimal("1.00"))
+        pacer = BudgetPacer()
+        with mock.patch.object(dispatch, "_store", side_effect=OperationalError("database is locked")), \
+                self.assertLogs("campaign.dispatch", "ERROR"), self.assertRaises(OperationalError):
+            dispatch.process_batch(dispatch.claim_batch(10), pacer=pacer)
+        self.assertEqual(pacer.remaining(campaign_id), Decimal("1.00"))
+        self.assertEqual(CampaignMessage.objects.filter(status="sending").count(), 3)
+
+        CampaignMessage.objects.filter(status="sending").update(status="scheduled")
+        with self.assertLogs("campaign.dispatch", "ERROR"):
+            dispatch.process_batch(dispatch.claim_batch(10), pacer=pacer)
+        # the message without a result is refunded
+        self.assertEqual(pacer.remaining(campaign_id), Decimal("0.80"))
+
+
+class DispatchWorkerTests(TransactionTestCase):
+    def setUp(self):
+        dispatch._senders.clear()
+        self.addCleanup(dispatch._senders.clear)
+
+    @override_settings(CAMPAIGN_MESSAGE_SENDERS={"sms": "campaign.tests.AcceptingSender"})
+    def test_rows_of_a_crashed_batch_are_requeued_while_running(self):
+        campaign = Campaign.objects.create(name="spring")
+        due = timezone.now() - timedelta(minutes=1)
+        CampaignMessage.objects.bulk_create([
+            CampaignMessage(campaign=campaign, channel="sms", status="scheduled", scheduled_time=due)
+            for _ in range(3)
+        ])
+        stop = threading.Event()
+        process_batch = dispatch.process_batch
+        calls = []
+
+        def crashes_once(batch, **kwargs):
+            calls.append(len(batch))
+            if len(calls) == 1:
+                raise ValueError("bad metadata")
+            sent = process_batch(batch, **kwargs)
+            stop.set()
+            return sent
+
+        timer = threading.Timer(20, stop.set)
+        timer.start()
+        self.addCleanup(timer.cancel)
+        with mock.patch.object(dispatch, "process_batch", crashes_once), \
+                self.assertLogs("campaign.dispatch", "WARNING") as logs:
+            sent = dispatch.run_workers(1, poll_interval=0.05, stop=stop, requeue_after=timedelta(seconds=0.3))
+        self.assertEqual((sent, calls), (3, [3, 3]))
+        self.assertEqual(CampaignMessage.objects.filter(status="sent").count(), 3)
+        self.assertTrue(any("requeued 3 messages" in line for line in logs.output))
+
+
+class CompiledTemplateTests(TestCase):
+    context = {"first_name": "Ann & <Bob>", "offer": {"code": "K1", "discount": 15}, "items": ["a", "b"]}
+
+    def assertMatchesDjango(self, source, autoescape):
+        expected = Template(source).render(Context(self.context, autoescape=autoescape))
+        self.assertEqual(CompiledTemplate(source, autoescape=autoescape).render(self.context), expected)
+
+    def test_plain_placeholders_match_template_render(self):
+        source = "Hi {{ first_name }}, {{ offer.code }} saves {{ offer.discount }}% {{ items.1 }} {{ missing }} {x}"
+        for autoescape in (True, False):
+            self.assertMatchesDjango(source, autoescape)
+
+    def test_tags_and_filters_fall_back_to_django(self):
+        source = "{% if offer %}{{ first_name|upper }}{% endif %}"
+        for autoescape in (True, False):
+            self.assertMatchesDjango(source, autoescape)
+
+    def test_methods_altering_data_are_not_called(self):
+        campaign = Campaign.objects.create(name="spring")
+
+        class Greeting:
+            do_not_call_in_templates = True
+            label = "hello"
+
+            def __call__(self):
+                raise AssertionError("called")
+
+        context = {"campaign": campaign, "greeting": Greeting(), "upper": "ann".upper, "split": "a b".split}
+        source = "{{ campaign.delete }}|{{ campaign.save }}|{{ greeting.label }}|{{ upper }}|{{ split.0 }}"
+        # neither Campaign.delete nor Campaign.save runs a query
+        with self.assertNumQueries(0):
+            self.assertEqual(CompiledTemplate(source).render(context), "||hello|ANN|a")
+        self.assertEqual(CompiledTemplate(source).render(context), Template(source).render(Context(context)))
+        self.assertTrue(Campaign.objects.filter(pk=campaign.pk).exists())
+
+    def test_text_fields_are_not_escaped_by_default(self):
+        campaign = Campaign.objects.create(name="spring")
+        message = CampaignMessage.objects.create(campaign=campaign, channel="sms", message_template="Hi {{ first_name }}")
+        self.assertEqual(compiled_template(message, "message_template").render(self.context), "Hi Ann & <Bob>")
+
+    def test_cache_follows_row_version(self):
+        campaign = Campaign.objects.create(name="spring")
+        message = CampaignMessage.objects.create(campaign=campaign, channel="sms", message_template="A {{ first_name }}")
+        first = compiled_template(message, "message_template")
+        self.assertIs(compiled_template(message, "message_template"), first)
+        message.message_template = "B {{ first_name }}"
+        message.save()
+        self.assertEqual(compiled_template(message, "message_template").render(self.context), "B Ann & <Bob>")
+
+
+class ActiveCampaignCacheTests(TestCase):
+    def other_process(self):
+        # a cache handle that shares nothing with this process but the table
+        return DatabaseCache("shared_cache", {})
+
+    def test_save_invalidates_for_every_process(self):
+        now = timezone.now()
+        campaign = Campaign.objects.create(name="spring", status="active")
+        self.assertEqual(active_campaign_ids(campaign.tenant_id, now), {campaign.pk})
+        self.assertIsNotNone(self.other_process().get(f"campaign:active:{campaign.tenant_id}"))
+
+        campaign.status = "paused"
+        campaign.save()
+        self.assertIsNone(self.other_process().get(f"campaign:active:{campaign.tenant_id}"))
+        self.assertEqual(active_campaign_ids(campaign.tenant_id, now), frozenset())
+
+    def test_moving_a_campaign_invalidates_both_tenants(self):
+        now = timezone.now()
+        Campaign.objects.create(name="spring", status="active", tenant_id=1)
+        campaign = Campaign.objects.get()
+        self.assertEqual(active_campaign_ids(1, now), {campaign.pk})
+        self.assertEqual(active_campaign_ids(2, now), frozenset())
+
+        campaign.tenant_id = 2
+        campaign.save()
+        self.assertEqual(active_campaign_ids(1, now), frozenset())
+        self.assertEqual(active_campaign_ids(2, now), {campaign.pk})
+
+    def test_cache_failures_do_not_break_saves(self):
+        campaign = Campaign.objects.create(name="spring", status="active")
+        with mock.patch.object(DatabaseCache, "delete_many", side_effect=OperationalError("no such table")), \
+                self.assertLogs("campaign.active", "ERROR"):
+            campaign.save()
+            campaign.delete()
+
+    def test_entry_expires_at_next_boundary(self):
+        now = timezone.now()
+        campaign = Campaign.objects.create(
+            name="spring", status="active", start_date=now + timedelta(minutes=1), end_date=now + timedelta(days=1)
+        )
+        self.assertEqual(active_campaign_ids(campaign.tenant_id, now), frozenset())
+        self.assertEqual(active_campaign_ids(campaign.tenant_id, now + timedelta(minutes=2)), {campaign.pk})
+        self.assertEqual(active_campaign_ids(campaign.tenant_id, now + timedelta(days=2)), frozenset())
+
+
+@override_settings(ALLOWED_HOSTS=["acme.example.com", "other.example.com"])
+class TenantRoutingTests(TestCase):
+    def setUp(self):
+        self.directory = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        routing = {"SQLITE_DIR": self.directory, "HOSTS": {"acme.example.com": "acme"}, "SCHEMAS": ["worker"]}
+        override = override_settings(TENANT_ROUTING=routing)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.addCleanup(self.forget_aliases)
+        self.middleware = tenancy.TenantMiddleware(lambda request: HttpResponse(tenancy.current_tenant_alias() or ""))
+
+    def forget_aliases(self):
+        for alias in [alias for alias in connections.settings if alias.startswith("tenant_")]:
+            connections[alias].close()
+            del connections.settings[alias]
+            settings.DATABASES.pop(alias, None)
+
+    def test_tenant_comes_from_the_host(self):
+        factory = RequestFactory()
+        response = self.middleware(factory.get("/", HTTP_HOST="acme.example.com:8000"))
+        self.assertEqual(response.content, b"tenant_acme")
+        response = self.middleware(factory.get("/", HTTP_HOST="other.example.com", HTTP_X_TENANT_SCHEMA="acme"))
+        self.assertEqual(response.content, b"")
+
+    def test_only_configured_schemas_are_routed(self):
+        self.assertEqual(tenancy.tenant_alias("worker"), "tenant_worker")
+        for schema in ("evil", "../evil", ""):
+            with self.assertRaises(SuspiciousOperation):
+                tenancy.tenant_alias(schema)
+
+    def test_unprovisioned_tenant_creates_no_files(self):
+        name = connections.settings[tenancy.tenant_alias("acme")]["NAME"]
+        with self.assertRaises(sqlite3.OperationalError):
+            sqlite3.connect(name, uri=True)
+        self.assertEqual(list(self.directory.iterdir()), [])
+
+    def test_django_request_handlers_stay_connected(self):
+        self.assertTrue(signals.request_finished.disconnect(close_old_connections))
+        signals.request_finished.connect(close_old_connections)
+
+
+class BudgetPacerTests(TestCase):
+    def test_flush_thread_survives_failures(self):
+        pacer = BudgetPacer(flush_interval=0.001)
+        calls = []
+        flushed = threading.Event()
+
+        def flush():
+            calls.append(None)
+            if len(calls) == 1:
+                raise OperationalError("database is locked")
+            flushed.set()
+            return 0
+
+        with mock.patch.object(pacer, "flush", flush), self.assertLogs("campaign.pacing", "ERROR"):
+            pacer.start()
+            self.assertTrue(flushed.wait(5))
+            pacer._stop.set()
+            pacer._thread.join()
+
+    def test_admits_within_budget_and_flushes_spend(self):
+        campaign = Campaign.objects.create(name="spring", budget=Decimal("1.00"))
+        pacer = BudgetPacer()
+        self.assertEqual(pacer.admit(campaign.pk, 30, to_micro("0.05")), 20)
+        self.assertEqual(pacer.remaining(campaign.pk), Decimal("0"))
+        self.assertEqual(pacer.flush(), 100)
+        self.assertEqual(BudgetPacer().admit(campaign.pk, 1, to_micro("0.05")), 0)
+
+
+    def test_refund_after_flush_lowers_the_flushed_spend(self):
+        campaign = Campaign.objects.create(name="spring", budget=Decimal("1.00"))
+        pacer = BudgetPacer()
+        self.assertEqual(pacer.admit(campaign.pk, 5, to_micro("0.05")), 5)
+        self.assertEqual(pacer.flush(), 25)
+        pacer.refund(campaign.pk, 2 * to_micro("0.05") + to_micro("0.005"))
+        self.assertEqual(pacer.flush(), -10)
+        self.assertEqual(pacer.remaining(campaign.pk), Decimal("0.855"))
+        days = CampaignAnalyticsBucket.objects.filter(campaign=campaign, granularity="day")
+        self.assertEqual(days.aggregate(cost=Sum("cost"))["cost"], Decimal("0.15"))
+        self.assertEqual(BudgetPacer().remaining(campaign.pk), Decimal("0.85"))
+
+
+class RoaringBitmapTests(TestCase):
+    def sets(self):
+        rng = random.Random(5)
+        # a sparse container, a dense one and ids past 32 bits
+        a = set(rng.sample(range(0, 70_000), 3000)) | set(range(200_000, 200_000 + 2 * ARRAY_MAX)) | {2 ** 40}
+        b = set(rng.sample(range(0, 70_000), 5000)) | set(range(201_000, 230_000, 3))
+        return a, b
+
+    def test_set_operations_match_python_sets(self):
+        a, b = self.sets()
+        x, y = RoaringBitmap(a), RoaringBitmap(b)
+        self.assertEqual(list(x), sorted(a))
+        self.assertEqual(len(x), len(a))
+        self.assertEqual(list(x | y), sorted(a | b))
+        self.assertEqual(list(x & y), sorted(a & b))
+        self.assertEqual(list(x - y), sorted(a - b))
+        self.assertTrue(200_000 in x and 2 ** 40 in x and 199_999 not in x)
+        # canonical containers: built in another order, still equal
+        self.assertEqual(RoaringBitmap(sorted(a, reverse=True)), x)
+
+    def test_serialization_and_chunks(self):
+        a, _ = self.sets()
+        bitmap = RoaringBitmap(a)
+        self.assertEqual(RoaringBitmap.from_bytes(bitmap.to_bytes()), bitmap)
+        chunks = list(bitmap.iter_chunks(1000))
+        self.assertTrue(all(len(chunk) == 1000 for chunk in chunks[:-1]))
+        self.assertEqual([i for chunk in chunks for i in chunk], sorted(a))
+        with self.assertRaises(ValueError):
+            RoaringBitmap.from_bytes(b"nope" + bytes(4))
+
+    def test_segment_membership(self):
+        segment = CustomerSegment.objects.create(name="spring")
+        self.assertEqual(len(segment.get_members()), 0)
+        segment.set_members(range(10, 20))
+        segment.set_members([1, 2, 3])
+        segment = CustomerSegment.objects.get(pk=segment.pk)
+        self.assertEqual(list(segment.get_members()), [1, 2, 3])
+        self.assertEqual(segment.membership.member_count, 3)
+
+    def test_ids_out_of_range_are_refused(self):
+        bitmap = RoaringBitmap([5])
+        for ids in ([-1], [3, -70_000], [MAX_ID + 1]):
+            with self.assertRaisesMessage(ValueError, "ids must be between 0"):
+                bitmap.update(ids)
+        with self.assertRaises(ValueError):
+            bitmap.add(-5)
+        bitmap.add(MAX_ID)
+        self.assertEqual(RoaringBitmap.from_bytes(bitmap.to_bytes()), RoaringBitmap([5, MAX_ID]))
+        segment = CustomerSegment.objects.create(name="spring")
+        with self.assertRaises(ValueError):
+            segment.set_members([1, -2])
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        now = timezone.now()
+        self.campaigns = [Campaign.objects.create(name=f"c{i}", status="active" if i % 2 else "draft")
+                          for i in range(7)]
+        # ties on created_at are broken by id
+        for i, campaign in enumerate(self.campaigns):
+            Campaign.objects.filter(pk=campaign.pk).update(created_at=now - timedelta(minutes=i // 3))
+
+    def walk(self, **params):
+        ids, cursor = [], None
+        while True:
+            query = {**params, "limit": 2, **({"cursor": cursor} if cursor else {})}
+            payload = self.client.get(reverse("campaign_list"), query).json()
+            ids += [row["id"] for row in payload["results"]]
+            cursor = payload["next"]
+            if cursor is None:
+                return ids
+
+    @override_settings(CAMPAIGN_PAGE_CACHE_SECONDS=0)
+    def test_pages_cover_every_row_once_newest_first(self):
+        expected = list(Campaign.objects.order_by("-created_at", "-id").values_list("id", flat=True))
+        self.assertEqual(self.walk(), expected)
+        active = [pk for pk in expected if pk in {c.pk for c in self.campaigns if c.status == "active"}]
+        self.assertEqual(self.walk(status="active"), active)
+
+    def test_bad_cursor_and_filters_are_rejected(self):
+        url = reverse("campaign_list")
+        self.assertEqual(self.client.get(url, {"cursor": "not-a-cursor"}).status_code, 400)
+        self.assertEqual(self.client.get(url, {"tenant_id": "x"}).status_code, 400)
+        self.assertEqual(self.client.get(url, {"limit": "many"}).status_code, 400)
+
+    def test_first_page_is_cached(self):
+        url = reverse("campaign_list")
+        first = self.client.get(url, {"limit": 2}).json()
+        Campaign.objects.create(name="newer")
+        self.assertEqual(self.client.get(url, {"limit": 2}).json(), first)
+        with override_settings(CAMPAIGN_PAGE_CACHE_SECONDS=0):
+            self.assertNotEqual(self.client.get(url, {"limit": 2}).json(), first)
+
+
+class CampaignChannelTests(TestCase):
+    def names(self, queryset):
+        return sorted(queryset.values_list("name", flat=True))
+
+    def test_filters_follow_saved_channels(self):
+        email = Campaign.objects.create(name="email", channels=[" Email ", "sms", "email"])
+        Campaign.objects.create(name="whatsapp", channels=["whatsapp"])
+        Campaign.objects.create(name="none", channels="email")
+        self.assertEqual(self.names(Campaign.objects.with_channel("EMAIL")), ["email"])
+        self.assertEqual(self.names(Campaign.objects.with_any_channel(["sms", "whatsapp"])), ["email", "whatsapp"])
+
+        email.channels = ["whatsapp"]
+        email.save(update_fields=["channels"])
+        self.assertEqual(self.names(Campaign.objects.with_channel("whatsapp")), ["email", "whatsapp"])
+        self.assertFalse(Campaign.objects.with_channel("sms").exists())
+
+    def test_sync_repairs_rows_written_around_save(self):
+        campaign = Campaign.objects.create(name="spring", channels=["email"])
+        Campaign.objects.filter(pk=campaign.pk).update(channels=["sms", "push"])
+        self.assertFalse(Campaign.objects.with_channel("sms").exists())
+        Campaign.objects.sync_channels()
+        self.assertEqual(sorted(CampaignChannel.objects.values_list("channel", flat=True)), ["push", "sms"])
+        self.assertEqual(self.names(Campaign.objects.with_channel("sms")), ["spring"])
+
+
+class DeduplicatorTests(TestCase):
+    def test_bloom_filter_has_no_false_negatives(self):
+        bloom = SlidingBloomFilter(capacity=10_000, error_rate=0.001)
+        keys = [event_key("id", i) for i in range(10_000)]
+        self.assertFalse(any(bloom.check_and_add(keys[:5000])))
+        self.assertTrue(all(bloom.check_and_add(keys[:5000])))
+        fresh = bloom.check_and_add(keys[5000:])
+        self.assertLess(sum(fresh), 50)
+        self.assertTrue(all(key in bloom for key in keys))
+
+    def test_full_generation_rotates_but_is_still_checked(self):
+        bloom = SlidingBloomFilter(capacity=100)
+        first = [event_key("a", i) for i in range(100)]
+        bloom.check_and_add(first)
+        bloom.check_and_add([event_key("b", i) for i in range(50)])
+        self.assertTrue(all(key in bloom for key in first))
+        bloom.check_and_add([event_key("c", i) for i in range(100)])
+        self.assertLess(sum(key in bloom for key in first), 10)
+
+    def test_claims_drop_repeats_and_roll_back_with_the_write(self):
+        dedup = Deduplicator("test")
+        self.assertEqual(dedup.claim([1, 2, 2, 3]), {1, 2, 3})
+        self.assertEqual(dedup.claim([3, 4]), {4})
+        # another process: its own filter, the same table
+        self.assertEqual(Deduplicator("test").claim([4, 5]), {5})
+        self.assertEqual(Deduplicator("other").claim([4]), {4})
+        try:
+            with transaction.atomic():
+                self.assertEqual(dedup.claim([6]), {6})
+                raise OperationalError("staging failed")
+        except OperationalError:
+            pass
+        self.assertEqual(dedup.claim([6]), {6})
+
+    def test_filter_keeps_first_occurrences_and_keyless_items(self):
+        items = [{"key": 1}, {"key": None}, {"key": 1}, {"key": 2}, {"key": None}]
+        kept = Deduplicator("test").filter(items, key=lambda item: item["key"])
+        self.assertEqual(kept, [items[0], items[1], items[3], items[4]])
+
+    def test_prune_removes_old_keys(self):
+        Deduplicator("test").claim([1, 2])
+        IdempotencyKey.objects.filter(key=1).update(created_at=timezone.now() - timedelta(days=10))
+        self.assertEqual(prune_keys(timedelta(days=1)), 1)
+        self.assertEqual(list(IdempotencyKey.objects.values_list("key", flat=True)), [2])
+
+
+class HyperLogLogTests(TestCase):
+    def assertClose(self, sketch, expected):
+        self.assertAlmostEqual(sketch.count(), expected, delta=max(1, 3 * sketch.standard_error * expected))
+
+    def test_counts_distinct_values(self):
+        self.assertEqual(HyperLogLog().count(), 0)
+        for n in (10, 1000, 100_000):
+            sketch = HyperLogLog(f"user{i}@example.com" for i in range(n))
+            sketch.update(f"user{i}@example.com" for i in range(n // 2))
+            self.assertClose(sketch, n)
+
+    def test_merge_is_the_sketch_of_the_union(self):
+        a = HyperLogLog(range(0, 30_000))
+        b = HyperLogLog(range(20_000, 50_000))
+        self.assertEqual(a | b, HyperLogLog(range(50_000)))
+        self.assertEqual(HyperLogLog.union([a, b]), a | b)
+        self.assertClose(a.merge(b), 50_000)
+        with self.assertRaises(ValueError):
+            a.merge(HyperLogLog(p=10))
+
+    def test_serialization(self):
+        sketch = HyperLogLog(range(5000), p=12)
+        self.assertEqual(HyperLogLog.from_bytes(sketch.to_bytes()), sketch)
+        with self.assertRaises(ValueError):
+            HyperLogLog.from_bytes(b"nope" + bytes(8))
+        with self.assertRaises(ValueError):
+            HyperLogLog(p=3)
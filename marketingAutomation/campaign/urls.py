@@ -3,4 +3,7 @@ from . import views
 
 urlpatterns = [
     path('', views.campaign, name='campaign'),
+    path('api/campaigns/', views.campaign_list, name='campaign_list'),
+    path('api/campaigns/<int:campaign_id>/messages/', views.message_list, name='campaign_message_list'),
+    path('api/messages/', views.message_list, name='message_list'),
 ]
@@ -1,4 +1,54 @@
-from django.http import HttpResponse
+from django.http import HttpResponse, JsonResponse
+from django.views.decorators.http import require_GET
+
+from .models import Campaign, CampaignMessage
+from .pagination import paginated_response
+
+CAMPAIGN_FIELDS = [
+    "id", "tenant_id", "name", "campaign_type", "status", "start_date", "end_date",
+    "budget", "created_at", "updated_at",
+]
+MESSAGE_FIELDS = [
+    "id", "campaign_id", "channel", "subject_line", "scheduled_time", "status",
+    "created_at", "updated_at",
+]
+
 
 def campaign(request):
-    return HttpResponse("Welcome to the Marketing Automation campaign Page")
\ No newline at end of file
+    return HttpResponse("Welcome to the Marketing Automation campaign Page")
+
+
+def _filters(request, allowed):
+    """Equality filters from the query string; ``*_id`` values must be integers."""
+    filters = {}
+    for name in allowed:
+        value = request.GET.get(name)
+        if value is None:
+            continue
+        if name.endswith("_id"):
+            try:
+                value = int(value)
+            except ValueError:
+                raise ValueError(f"{name} must be an integer")
+        filters[name] = value
+    return filters
+
+
+@require_GET
+def campaign_list(request):
+    try:
+        filters = _filters(request, ["tenant_id", "status", "campaign_type"])
+    except ValueError as exc:
+        return JsonResponse({"error": str(exc)}, status=400)
+    return paginated_response(request, Campaign.objects.filter(**filters), CAMPAIGN_FIELDS)
+
+
+@require_GET
+def message_list(request, campaign_id=None):
+    try:
+        filters = _filters(request, ["campaign_id", "status", "channel"])
+    except ValueError as exc:
+        return JsonResponse({"error": str(exc)}, status=400)
+    if campaign_id is not None:
+        filters["campaign_id"] = campaign_id
+    return paginated_response(request, CampaignMessage.objects.filter(**filters), MESSAGE_FIELDS)
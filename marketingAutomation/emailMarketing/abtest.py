@@ -0,0 +1,152 @@
+"""
+Streaming A/B test evaluation for email campaign variants.
+
+The variants of a test are the ``EmailCampaign`` rows of one
+``campaign.Campaign`` with ``ab_test_enabled`` and ``ab_test_variant`` ``A``
+and ``B``; an optional ``winner`` row holds the remaining audience. A
+variant's rate is its unique responders over ``sent_count``: the opened and
+clicked counters count repeat events, so the responders come from the
+unique-reach sketches (``emailMarketing.reach``) that the ingest flush
+updates just before it evaluates the tests. Evaluating a test reads the
+two campaign rows and their sketches and never touches ``EmailEvent``.
+
+The test is a mixture sequential probability ratio test (mSPRT) on the
+difference of the two rates, using the normal approximation: after every
+flush the always-valid p-value ``min(p, 1 / Lambda)`` is updated, and it is
+safe to stop as soon as it drops below ``EMAIL_AB_TEST_ALPHA``, however
+often the test is looked at. The better variant is then copied into the
+``winner`` campaign, which is scheduled for immediate sending; the
+``send_email_campaign --due`` worker picks it up.
+"""
+import logging
+import math
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import EmailABTest, EmailCampaign
+from .reach import unique_reach
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ALPHA = 0.05
+DEFAULT_TAU = 0.05
+DEFAULT_MIN_SENT = 1000
+VARIANTS = ("A", "B")
+# copied from the winning variant into the "winner" campaign
+PROMOTED_FIELDS = (
+    "subject_line",
+    "preview_text",
+    "from_name",
+    "from_email",
+    "reply_to_email",
+    "email_template_id",
+    "personalization_fields",
+)
+
+
+def msprt_lambda(successes_a, n_a, successes_b, n_b, tau=DEFAULT_TAU):
+    """Mixture likelihood ratio for ``rate_b - rate_a != 0`` with a normal
+    mixing distribution of standard deviation ``tau`` over the difference."""
+    if not n_a or not n_b:
+        return 1.0
+    rate_a, rate_b = successes_a / n_a, successes_b / n_b
+    variance = rate_a * (1 - rate_a) / n_a + rate_b * (1 - rate_b) / n_b
+    if variance <= 0:
+        return 1.0
+    tau2 = tau * tau
+    diff = rate_b - rate_a
+    return math.sqrt(variance / (variance + tau2)) * math.exp(
+        min(tau2 * diff * diff / (2 * variance * (variance + tau2)), 700.0)
+    )
+
+
+def _settings():
+    return (
+        getattr(settings, "EMAIL_AB_TEST_ALPHA", DEFAULT_ALPHA),
+        getattr(settings, "EMAIL_AB_TEST_TAU", DEFAULT_TAU),
+        getattr(settings, "EMAIL_AB_TEST_MIN_SENT", DEFAULT_MIN_SENT),
+    )
+
+
+def responders(variant, metric, using=None):
+    """Distinct addresses with a ``metric`` event in ``variant``: the reach
+    sketch estimate, capped by the event counter and the messages sent."""
+    events = getattr(variant, f"{metric}_count")
+    if not events:
+        return 0
+    estimate = round(unique_reach([variant.pk], metric, using=using).count())
+    return min(estimate, events, variant.sent_count)
+
+
+def promote_winner(test, winner, using=None):
+    """Copy ``winner`` into the campaign's ``winner`` variant and schedule it."""
+    now = timezone.now()
+    remaining = (
+        EmailCampaign.objects.using(using)
+        .filter(campaign_id=test.campaign_id, ab_test_variant="winner", status="draft")
+        .first()
+    )
+    if remaining is None:
+        logger.info("A/B test %s decided; no draft winner campaign to promote", test.pk)
+        return None
+    winner = EmailCampaign.objects.using(using).only(*PROMOTED_FIELDS).get(pk=winner.pk)
+    for field in PROMOTED_FIELDS:
+        setattr(remaining, field, getattr(winner, field))
+    remaining.status = "scheduled"
+    remaining.scheduled_time = remaining.scheduled_time or now
+    remaining.save(using=using, update_fields=[*PROMOTED_FIELDS, "status", "scheduled_time", "updated_at"])
+    return remaining
+
+
+def evaluate_test(campaign_id, using=None):
+    """Update the test of ``campaign_id`` from the variant counters; returns the
+    ``EmailABTest`` (``None`` when the campaign has no A and B variants)."""
+    alpha, tau, min_sent = _settings()
+    with transaction.atomic(using=using):
+        variants = {
+            variant.ab_test_variant: variant
+            for variant in EmailCampaign.objects.using(using)
+            .filter(campaign_id=campaign_id, ab_test_enabled=True, ab_test_variant__in=VARIANTS)
+            .only("ab_test_variant", "sent_count", "opened_count", "clicked_count")
+        }
+        if len(variants) != 2:
+            return None
+        test, _ = EmailABTest.objects.using(using).select_for_update().get_or_create(
+            campaign_id=campaign_id,
+            defaults={"metric": getattr(settings, "EMAIL_AB_TEST_METRIC", "opened")},
+        )
+        if test.status != "running":
+            return test
+        a, b = variants["A"], variants["B"]
+        hits_a, hits_b = responders(a, test.metric, using), responders(b, test.metric, using)
+        test.rate_a = hits_a / a.sent_count if a.sent_count else 0.0
+        test.rate_b = hits_b / b.sent_count if b.sent_count else 0.0
+        test.p_value = min(test.p_value, 1.0 / msprt_lambda(hits_a, a.sent_count, hits_b, b.sent_count, tau))
+        if test.p_value <= alpha and min(a.sent_count, b.sent_count) >= min_sent:
+            test.winner = b if test.rate_b > test.rate_a else a
+            test.decided_at = timezone.now()
+            test.status = "promoted" if promote_winner(test, test.winner, using) else "decided"
+        test.save(
+            using=using,
+            update_fields=["p_value", "rate_a", "rate_b", "winner", "decided_at", "status", "updated_at"],
+        )
+    return test
+
+
+def evaluate_campaigns(email_campaign_ids, using=None):
+    """Re-evaluate the running tests the given email campaigns take part in;
+    called by the ingest flush with the campaigns whose counters changed."""
+    campaign_ids = set(
+        EmailCampaign.objects.using(using)
+        .filter(
+            pk__in=email_campaign_ids,
+            ab_test_enabled=True,
+            ab_test_variant__in=VARIANTS,
+            campaign_id__isnull=False,
+        )
+        .exclude(campaign__email_ab_test__status__in=["decided", "promoted"])
+        .values_list("campaign_id", flat=True)
+    )
+    return [test for test in (evaluate_test(pk, using) for pk in sorted(campaign_ids)) if test is not None]
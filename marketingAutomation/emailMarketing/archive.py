@@ -0,0 +1,205 @@
+"""
+Compressed columnar files for archived ``EmailEvent`` rows.
+
+One file holds one month of events sorted by ``timestamp``. Each column is
+stored separately and zlib compressed: integer and datetime columns as
+packed 64-bit arrays (datetimes as UTC microseconds, ``NULL`` as a
+sentinel), text columns dictionary encoded as a JSON list of distinct
+values plus an array of codes, which is what makes repetitive columns such
+as ``event_type`` or ``email_address`` nearly free. Readers only decompress
+the columns they need, and a range query bisects the sorted timestamp
+column instead of looking at every row.
+
+Layout: ``MAGIC``, a 4-byte big-endian header length, the JSON header
+(row count, time and id range, and per column its kind, offset and length
+in the data section), then the column blobs.
+"""
+import bisect
+import json
+import os
+import struct
+import tempfile
+import zlib
+from array import array
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+MAGIC = b"EVZ1"
+NULL = -(2 ** 63)
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+COLUMNS = (
+    ("id", "int"),
+    ("email_campaign_id", "int"),
+    ("customer_id", "int"),
+    ("event_type", "text"),
+    ("email_address", "text"),
+    ("timestamp", "datetime"),
+    ("user_agent", "text"),
+    ("ip_address", "text"),
+    ("link_clicked", "text"),
+    ("link_id", "int"),
+    ("bounce_reason", "text"),
+    ("created_at", "datetime"),
+)
+COLUMN_NAMES = tuple(name for name, _ in COLUMNS)
+
+
+def to_micros(value):
+    if value is None:
+        return NULL
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=dt_timezone.utc)
+    delta = value - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds
+
+
+def from_micros(value):
+    return None if value == NULL else EPOCH + timedelta(microseconds=value)
+
+
+def _encode(kind, values):
+    if kind == "int":
+        raw = array("q", [NULL if v is None else v for v in values]).tobytes()
+    elif kind == "datetime":
+        raw = array("q", [to_micros(v) for v in values]).tobytes()
+    else:
+        codes = {}
+        indexes = array("i", [codes.setdefault(v, len(codes)) for v in values])
+        dictionary = json.dumps(list(codes), separators=(",", ":")).encode()
+        raw = struct.pack(">I", len(dictionary)) + dictionary + indexes.tobytes()
+    return zlib.compress(raw, 6)
+
+
+def _decode(kind, blob):
+    raw = zlib.decompress(blob)
+    if kind in ("int", "datetime"):
+        values = array("q")
+        values.frombytes(raw)
+        return values
+    size = struct.unpack(">I", raw[:4])[0]
+    dictionary = json.loads(raw[4:4 + size])
+    codes = array("i")
+    codes.frombytes(raw[4 + size:])
+    return dictionary, codes
+
+
+def write_archive(path, rows):
+    """Write event dicts (``COLUMN_NAMES`` keys) to ``path``; returns the row count.
+
+    The file is written to a temporary name and renamed into place, so a
+    reader never sees a partial archive.
+    """
+    rows = sorted(rows, key=lambda row: (row["timestamp"], row["id"]))
+    blobs, columns, offset = [], {}, 0
+    for name, kind in COLUMNS:
+        blob = _encode(kind, [row.get(name) for row in rows])
+        columns[name] = {"kind": kind, "offset": offset, "length": len(blob)}
+        blobs.append(blob)
+        offset += len(blob)
+    header = json.dumps({
+        "rows": len(rows),
+        "min_timestamp": to_micros(rows[0]["timestamp"]) if rows else None,
+        "max_timestamp": to_micros(rows[-1]["timestamp"]) if rows else None,
+        "min_id": min(row["id"] for row in rows) if rows else None,
+        "max_id": max(row["id"] for row in rows) if rows else None,
+        "columns": columns,
+    }).encode()
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, "wb") as handle:
+        handle.write(MAGIC + struct.pack(">I", len(header)) + header)
+        for blob in blobs:
+            handle.write(blob)
+    os.replace(tmp, path)
+    return len(rows)
+
+
+class ArchiveFile:
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as handle:
+            if handle.read(4) != MAGIC:
+                raise ValueError(f"{path} is not an event archive")
+            size = struct.unpack(">I", handle.read(4))[0]
+            self.header = json.loads(handle.read(size))
+        self._data_start = 8 + size
+        self.rows = self.header["rows"]
+
+    def overlaps(self, start=None, end=None, ids=None):
+        """Whether any event falls in ``[start, end)`` (either open when
+        ``None``) and, given ``ids=(low, high)``, has ``low < id <= high``."""
+        if not self.rows:
+            return False
+        if end is not None and self.header["min_timestamp"] >= to_micros(end):
+            return False
+        if start is not None and self.header["max_timestamp"] < to_micros(start):
+            return False
+        if ids is not None and self.header.get("min_id") is not None:
+            low, high = ids
+            return self.header["min_id"] <= high and self.header["max_id"] > low
+        return True
+
+    def _raw(self, name):
+        meta = self.header["columns"][name]
+        with open(self.path, "rb") as handle:
+            handle.seek(self._data_start + meta["offset"])
+            return meta["kind"], _decode(meta["kind"], handle.read(meta["length"]))
+
+    def column(self, name, rows=None):
+        """Decoded values of column ``name`` (optionally only positions ``rows``);
+        all ``None`` for a column added after the archive was written."""
+        if name not in self.header["columns"]:
+            return [None] * (self.rows if rows is None else len(rows))
+        kind, values = self._raw(name)
+        if kind == "text":
+            dictionary, values = values
+            if rows is not None:
+                values = [values[i] for i in rows]
+            return [dictionary[code] for code in values]
+        if rows is not None:
+            values = [values[i] for i in rows]
+        if kind == "datetime":
+            return [from_micros(v) for v in values]
+        return [None if v == NULL else v for v in values]
+
+    def read(self, start=None, end=None, email_campaign_id=None, event_type=None, fields=COLUMN_NAMES,
+             customer_id=None, ids=None, reverse=False, before=None):
+        """Yield event dicts with ``start <= timestamp < end`` (either open when
+        ``None``), in timestamp order (newest first with ``reverse``);
+        ``ids=(low, high)`` keeps ``low < id <= high`` and ``before=(timestamp,
+        id)`` the events sorting before that one."""
+        if not self.overlaps(start, end, ids):
+            return
+        stamps = self._raw("timestamp")[1]
+        low = 0 if start is None else bisect.bisect_left(stamps, to_micros(start))
+        high = len(stamps) if end is None else bisect.bisect_left(stamps, to_micros(end))
+        if before is not None:
+            # ids ascend within a timestamp, so the bound is two bisections
+            stamp = to_micros(before[0])
+            first = bisect.bisect_left(stamps, stamp, low, max(low, high))
+            last = bisect.bisect_right(stamps, stamp, first, max(first, high))
+            high = min(high, bisect.bisect_left(self._raw("id")[1], before[1], first, last))
+        rows = range(low, high)
+        if email_campaign_id is not None:
+            campaigns = self._raw("email_campaign_id")[1]
+            rows = [i for i in rows if campaigns[i] == email_campaign_id]
+        if customer_id is not None:
+            customers = self._raw("customer_id")[1]
+            rows = [i for i in rows if customers[i] == customer_id]
+        if event_type is not None:
+            dictionary, codes = self._raw("event_type")[1]
+            code = dictionary.index(event_type) if event_type in dictionary else -1
+            rows = [i for i in rows if codes[i] == code]
+        if ids is not None:
+            id_low, id_high = ids
+            event_ids = self._raw("id")[1]
+            rows = [i for i in rows if id_low < event_ids[i] <= id_high]
+        rows = list(rows)
+        if not rows:
+            return
+        if reverse:
+            # rows are sorted by (timestamp, id)
+            rows.reverse()
+        columns = [self.column(name, rows) for name in fields]
+        for values in zip(*columns):
+            yield dict(zip(fields, values))
@@ -0,0 +1,266 @@
+"""
+Precompiled ``EmailTemplate`` artifacts.
+
+An artifact is built once per template version (``updated_at``): CSS is
+inlined, the HTML and text bodies are split at their placeholders, and the
+static chunks are stored already quoted-printable encoded, each ending on a
+line boundary (a soft ``=\\r\\n`` break when the chunk does not end in a
+newline). Quoted-printable lines are independent, so a recipient's MIME
+part is just the encoded chunks interleaved with the encoded placeholder
+values - no re-inlining, re-parsing or re-encoding of the static text.
+
+Templates using tags or filters keep a compiled Django template of the
+inlined source and encode its output per recipient.
+
+With click tracking, the HTML hrefs are rewritten to tracked links
+(``emailMarketing.links``) before compiling; such artifacts are keyed by the
+template version and a hash of the rewrites, so campaigns sharing a template
+each get their own.
+
+Artifacts live in an in-memory LRU and, when ``EMAIL_ARTIFACT_DIR`` is set,
+as JSON files there, so restarted send workers skip the compile step. Storing
+a template version removes the files of its older versions.
+"""
+import binascii
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from django.conf import settings
+
+from campaign.templating import CompiledTemplate, placeholder_resolver, split_placeholders
+
+from .css import inline_css
+from .links import rewrite_links
+
+logger = logging.getLogger(__name__)
+
+ARTIFACT_VERSION = 1
+
+
+def encode_segment(text):
+    """Quoted-printable bytes of ``text`` that end on a line boundary."""
+    if not text:
+        return b""
+    if len(text) < 76 and text.isascii() and text.isprintable() and "=" not in text and text[-1] != " ":
+        # the common short placeholder value is its own encoding
+        return text.encode("ascii") + b"=\r\n"
+    # b2a_qp picks its line ending from the input; encode with LF and convert once.
+    text = text.replace("\r\n", "\n")
+    encoded = binascii.b2a_qp(text.encode("utf-8"), istext=True).replace(b"\n", b"\r\n")
+    if not encoded.endswith(b"\r\n"):
+        encoded += b"=\r\n"
+    return encoded
+
+
+class _Body:
+    """One body (HTML or text) of an artifact."""
+
+    def __init__(self, source, segments=None, names=None, autoescape=False):
+        self.source = source
+        self.segments = segments
+        self.names = names
+        self.autoescape = autoescape
+        if segments is None:
+            self._template = CompiledTemplate(source, autoescape=autoescape)
+            return
+        # Like CompiledTemplate: each distinct placeholder is resolved and
+        # encoded once, then everything is joined by one bytes % mapping.
+        distinct = list(dict.fromkeys(names))
+        self._resolvers = [(b"%d" % i, placeholder_resolver(name, autoescape)) for i, name in enumerate(distinct)]
+        pattern = [segments[0].replace(b"%", b"%%")]
+        for name, segment in zip(names, segments[1:]):
+            pattern.append(b"%%(%d)s" % distinct.index(name))
+            pattern.append(segment.replace(b"%", b"%%"))
+        self._pattern = b"".join(pattern)
+
+    @classmethod
+    def compile(cls, source, autoescape):
+        parts = split_placeholders(source)
+        if parts is None:
+            return cls(source, autoescape=autoescape)
+        chunks, names = parts
+        return cls(source, [encode_segment(chunk) for chunk in chunks], names, autoescape)
+
+    def render(self, context):
+        if self.segments is None:
+            return encode_segment(self._template.render(context))
+        return self._pattern % {key: encode_segment(resolve(context)) for key, resolve in self._resolvers}
+
+    def to_dict(self):
+        return {
+            "source": self.source,
+            "segments": None if self.segments is None else [s.decode("ascii") for s in self.segments],
+            "names": self.names,
+            "autoescape": self.autoescape,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        segments = data["segments"]
+        return cls(
+            data["source"],
+            None if segments is None else [s.encode("ascii") for s in segments],
+            data["names"],
+            data["autoescape"],
+        )
+
+
+class TemplateArtifact:
+    def __init__(self, template_id, version, html, text=None):
+        self.template_id = template_id
+        self.version = version
+        self.html = html
+        self.text = text
+
+    @classmethod
+    def compile(cls, template, links=None):
+        """``links`` maps hrefs to their replacements (``links.rewrite_links``)."""
+        source = inline_css(template.html_content or "")
+        if links:
+            source = rewrite_links(source, links)
+        html = _Body.compile(source, autoescape=True)
+        text = _Body.compile(template.text_content, autoescape=False) if template.text_content else None
+        return cls(template.pk, template.updated_at.isoformat(), html, text)
+
+    def html_part(self, context):
+        """Quoted-printable HTML body for one recipient."""
+        return self.html.render(context)
+
+    def text_part(self, context):
+        return None if self.text is None else self.text.render(context)
+
+    def to_json(self):
+        return json.dumps({
+            "format": ARTIFACT_VERSION,
+            "template_id": self.template_id,
+            "version": self.version,
+            "html": self.html.to_dict(),
+            "text": None if self.text is None else self.text.to_dict(),
+        })
+
+    @classmethod
+    def from_json(cls, raw):
+        data = json.loads(raw)
+        if data.get("format") != ARTIFACT_VERSION:
+            raise ValueError("artifact format changed")
+        text = data["text"]
+        return cls(
+            data["template_id"],
+            data["version"],
+            _Body.from_dict(data["html"]),
+            None if text is None else _Body.from_dict(text),
+        )
+
+
+FROM_SETTINGS = "EMAIL_ARTIFACT_DIR"
+
+
+class ArtifactCache:
+    """Thread-safe LRU of artifacts, backed by a directory of JSON files.
+
+    ``directory`` defaults to the ``EMAIL_ARTIFACT_DIR`` setting, read on
+    every use, so ``override_settings`` applies to the shared cache too."""
+
+    def __init__(self, maxsize=256, directory=FROM_SETTINGS):
+        self.maxsize = maxsize
+        self._directory = directory
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def directory(self):
+        directory = self._directory
+        if directory == FROM_SETTINGS:
+            directory = getattr(settings, "EMAIL_ARTIFACT_DIR", None)
+        return Path(directory) if directory else None
+
+    def _path(self, directory, key):
+        db, pk, updated_at, links_key = key
+        suffix = f"-{links_key}" if links_key else ""
+        return directory / f"{db}-{pk}-{updated_at.timestamp():.6f}{suffix}-v{ARTIFACT_VERSION}.json"
+
+    def _load(self, key):
+        directory = self.directory
+        if directory is None:
+            return None
+        path = self._path(directory, key)
+        try:
+            return TemplateArtifact.from_json(path.read_text())
+        except FileNotFoundError:
+            return None
+        except (ValueError, KeyError, TypeError):
+            logger.warning("ignoring unreadable artifact %s", path)
+            return None
+
+    def _store(self, key, artifact):
+        directory = self.directory
+        if directory is None:
+            return
+        directory.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as handle:
+            handle.write(artifact.to_json())
+        os.replace(tmp, self._path(directory, key))
+        self._prune(directory, key)
+
+    def _prune(self, directory, key):
+        """Remove the files of the template's versions older than ``key``'s, and
+        of this version written by other artifact formats."""
+        db, pk, updated_at, _ = key
+        prefix = f"{db}-{pk}-"
+        version = float(f"{updated_at.timestamp():.6f}")  # as rounded in the file name
+        suffix = f"-v{ARTIFACT_VERSION}.json"
+        for path in directory.glob(f"{prefix}*.json"):
+            stamp = path.name[len(prefix):].split("-", 1)[0]
+            try:
+                stamp = float(stamp)
+            except ValueError:
+                continue
+            if stamp < version or (stamp == version and not path.name.endswith(suffix)):
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+
+    def get(self, template, links=None):
+        links_key = links_digest(links) if links else ""
+        key = (template._state.db or "default", template.pk, template.updated_at, links_key)
+        with self._lock:
+            artifact = self._entries.get(key)
+            if artifact is not None:
+                self._entries.move_to_end(key)
+                return artifact
+        artifact = self._load(key)
+        if artifact is None:
+            artifact = TemplateArtifact.compile(template, links)
+            self._store(key, artifact)
+        with self._lock:
+            self._entries[key] = artifact
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return artifact
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+artifact_cache = ArtifactCache(getattr(settings, "EMAIL_ARTIFACT_CACHE_SIZE", 256))
+
+
+def links_digest(links):
+    raw = json.dumps(sorted(links.items()), separators=(",", ":")).encode()
+    return hashlib.blake2b(raw, digest_size=8).hexdigest()
+
+
+def template_artifact(template, links=None):
+    """Artifact for the current version of ``template``, with the hrefs in
+    ``links`` (``{url: replacement}``) rewritten."""
+    return artifact_cache.get(template, links)
@@ -0,0 +1,144 @@
+"""
+Minimal CSS inliner for email HTML.
+
+Rules from ``<style>`` blocks whose selectors are simple (``*``, ``tag``,
+``.class``, ``#id`` and compounds such as ``td.cell#total``) are copied into
+the ``style`` attribute of every matching element, ordered by
+``!important``, specificity and source order, with existing inline styles
+winning over non-important rules. Everything that cannot be inlined
+(``@media``, pseudo-classes, combinators, ...) is kept in a single
+``<style>`` block so clients that support it still apply it.
+"""
+import re
+
+COMMENT_RE = re.compile(r"/\*.*?\*/", re.S)
+STYLE_BLOCK_RE = re.compile(r"<style\b[^>]*>(.*?)</style\s*>", re.S | re.I)
+TAG_RE = re.compile(r"<([a-zA-Z][a-zA-Z0-9]*)((?:\s+[^\s<>=/]+(?:\s*=\s*(?:\"[^\"]*\"|'[^']*'|[^\s>\"']+))?)*)\s*(/?)>")
+ATTR_RE = re.compile(r"([^\s<>=/]+)(?:\s*=\s*(\"[^\"]*\"|'[^']*'|[^\s>\"']+))?")
+SIMPLE_SELECTOR_RE = re.compile(r"^(\*|[a-zA-Z][a-zA-Z0-9]*)?((?:[.#][-\w]+)*)$")
+PART_RE = re.compile(r"([.#])([-\w]+)")
+HEAD_TAGS = {"html", "head", "title", "meta", "link", "style", "script", "base"}
+
+
+def _split_rules(css):
+    """Yield ``(prelude, body)`` for top-level rules, keeping nested at-rules whole."""
+    position, length = 0, len(css)
+    while position < length:
+        brace = css.find("{", position)
+        if brace == -1:
+            return
+        prelude = css[position:brace].strip()
+        depth, end = 1, brace + 1
+        while end < length and depth:
+            if css[end] == "{":
+                depth += 1
+            elif css[end] == "}":
+                depth -= 1
+            end += 1
+        yield prelude, css[brace + 1:end - 1]
+        position = end
+
+
+def _declarations(body):
+    result = []
+    for declaration in body.split(";"):
+        prop, sep, value = declaration.partition(":")
+        prop, value = prop.strip().lower(), value.strip()
+        if not sep or not prop or not value:
+            continue
+        important = value.lower().endswith("!important")
+        if important:
+            value = value[: -len("!important")].rstrip()
+        result.append((prop, value, important))
+    return result
+
+
+def _parse_selector(selector):
+    match = SIMPLE_SELECTOR_RE.match(selector)
+    if not match or not selector:
+        return None
+    tag = match.group(1)
+    ids, classes = set(), set()
+    for kind, name in PART_RE.findall(match.group(2)):
+        (ids if kind == "#" else classes).add(name)
+    specificity = (len(ids), len(classes), 0 if tag in (None, "*") else 1)
+    return (None if tag in (None, "*") else tag.lower(), frozenset(ids), frozenset(classes), specificity)
+
+
+def parse_stylesheet(css):
+    """Split ``css`` into inlinable rules and the CSS text that has to stay in a <style>."""
+    rules, leftover = [], []
+    for prelude, body in _split_rules(COMMENT_RE.sub("", css)):
+        if prelude.startswith("@"):
+            leftover.append(f"{prelude} {{{body}}}")
+            continue
+        declarations = _declarations(body)
+        kept = []
+        for selector in prelude.split(","):
+            selector = selector.strip()
+            parsed = _parse_selector(selector)
+            if parsed is None:
+                kept.append(selector)
+            else:
+                rules.append((parsed, declarations))
+        if kept:
+            leftover.append(f"{', '.join(kept)} {{{body.strip()}}}")
+    return rules, "\n".join(leftover)
+
+
+def _matches(parsed, tag, ids, classes):
+    rule_tag, rule_ids, rule_classes, _ = parsed
+    return (rule_tag is None or rule_tag == tag) and rule_ids <= ids and rule_classes <= classes
+
+
+def inline_css(html):
+    """Return ``html`` with simple ``<style>`` rules moved into ``style`` attributes."""
+    sheets = STYLE_BLOCK_RE.findall(html)
+    if not sheets:
+        return html
+    rules, leftover = parse_stylesheet("\n".join(sheets))
+    first = [True]
+
+    def replace_style(match):
+        if first[0] and leftover:
+            first[0] = False
+            return f"<style>{leftover}</style>"
+        return ""
+
+    html = STYLE_BLOCK_RE.sub(replace_style, html)
+    if not rules:
+        return html
+    indexed = [(order, parsed, declarations) for order, (parsed, declarations) in enumerate(rules)]
+
+    def rewrite(match):
+        tag, attrs, closing = match.group(1), match.group(2) or "", match.group(3)
+        if tag.lower() in HEAD_TAGS:
+            return match.group(0)
+        pairs = ATTR_RE.findall(attrs)
+        values = {name.lower(): value.strip("\"'") for name, value in pairs}
+        ids = frozenset(values.get("id", "").split())
+        classes = frozenset(values.get("class", "").split())
+        matched = []
+        for order, parsed, declarations in indexed:
+            if _matches(parsed, tag.lower(), ids, classes):
+                for prop, value, important in declarations:
+                    matched.append(((important, parsed[3], order), prop, value))
+        if not matched:
+            return match.group(0)
+        for prop, value, important in _declarations(values.get("style", "")):
+            # inline styles beat every non-important rule
+            matched.append(((important, (1 << 30, 0, 0), 0), prop, value))
+        matched.sort(key=lambda item: item[0])
+        merged = {}
+        for _, prop, value in matched:
+            merged.pop(prop, None)
+            merged[prop] = value
+        style = "; ".join(f"{prop}: {value}" for prop, value in merged.items()).replace('"', "'")
+        kept = "".join(
+            f" {name}" + (f"={value}" if value else "")
+            for name, value in pairs
+            if name.lower() != "style"
+        )
+        return f'<{tag}{kept} style="{style}"{" /" if closing else ""}>'
+
+    return TAG_RE.sub(rewrite, html)
@@ -0,0 +1,240 @@
+"""
+Buffered ingestion of provider webhook events.
+
+The webhook view validates a batch of events and writes it to
+``EmailEventStaging`` with one insert, so an accepted event is durable
+before the provider gets its 2xx and survives a process restart.
+``flush_staged_events`` later moves staged rows into ``EmailEvent`` and
+applies the counters with one ``F()`` update per campaign per flush, instead
+of one INSERT plus one contended UPDATE per event. Staged rows are deleted in
+the same transaction, so each event is applied exactly once. Provider retries
+are dropped before staging by ``campaign.dedup``. A/B tests of the
+touched campaigns are re-evaluated from the new counters (``emailMarketing.abtest``),
+opens and clicks are added to the unique-reach sketches (``emailMarketing.reach``),
+clicks on registered campaign links store the link id instead of the URL
+(``emailMarketing.links``),
+and bounced or unsubscribed addresses go to the suppression index once the
+flush commits (``emailMarketing.suppression``).
+"""
+import logging
+from collections import Counter, defaultdict
+from datetime import datetime, timezone as dt_timezone
+
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_ipv46_address
+from django.db import connections, router, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from campaign.dedup import deduplicator, event_key
+
+from .abtest import evaluate_campaigns
+from .links import link_cache
+from .models import EmailCampaign, EmailEvent, EmailEventQuerySet, EmailEventStaging
+from .reach import update_sketches
+from .suppression import SUPPRESSION_EVENTS, record_suppressions
+
+logger = logging.getLogger(__name__)
+
+COUNTER_FIELDS = {
+    "sent": "sent_count",
+    "delivered": "delivered_count",
+    "opened": "opened_count",
+    "clicked": "clicked_count",
+    "bounced": "bounced_count",
+    "unsubscribed": "unsubscribed_count",
+}
+EVENT_FIELDS = EmailEventQuerySet.INSERT_FIELDS
+PROVIDER_ID_FIELDS = ("event_id", "sg_event_id")
+DEFAULT_FLUSH_SIZE = 5000
+BIGINT_RANGE = range(-2**63, 2**63)
+
+
+class InvalidEvent(ValueError):
+    pass
+
+
+def _timestamp(value):
+    if value in (None, ""):
+        return timezone.now()
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        try:
+            return datetime.fromtimestamp(value, tz=dt_timezone.utc)
+        except (OverflowError, OSError, ValueError):
+            raise InvalidEvent(f"timestamp {value!r} is out of range")
+    if not isinstance(value, str):
+        raise InvalidEvent(f"invalid timestamp {value!r}")
+    try:
+        parsed = parse_datetime(value)
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise InvalidEvent(f"invalid timestamp {value!r}")
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, dt_timezone.utc)
+    return parsed
+
+
+def _optional_int(data, name):
+    value = data.get(name)
+    if value in (None, ""):
+        return None
+    try:
+        value = int(value)
+    except (TypeError, ValueError, OverflowError):
+        raise InvalidEvent(f"{name} must be an integer")
+    if value not in BIGINT_RANGE:
+        raise InvalidEvent(f"{name} is out of range")
+    return value
+
+
+def _optional_str(data, *names):
+    """The first of ``names`` that is set, which has to be a string."""
+    for name in names:
+        value = data.get(name)
+        if value in (None, ""):
+            continue
+        if not isinstance(value, str):
+            raise InvalidEvent(f"{name} must be a string")
+        return value
+    return None
+
+
+def parse_event(data):
+    """Validate one webhook event dict into ``EmailEventStaging`` field values.
+    Anything that could not be stored raises ``InvalidEvent``, which rejects
+    this event only."""
+    if not isinstance(data, dict):
+        raise InvalidEvent("event must be an object")
+    event_type = data.get("event_type") or data.get("event")
+    if not isinstance(event_type, str) or event_type not in COUNTER_FIELDS:
+        raise InvalidEvent(f"unknown event_type {event_type!r}")
+    email_campaign_id = _optional_int(data, "email_campaign_id")
+    if email_campaign_id is None:
+        raise InvalidEvent("email_campaign_id is required")
+    email_address = _optional_str(data, "email_address", "email")
+    if not email_address:
+        raise InvalidEvent("email_address is required")
+    ip_address = _optional_str(data, "ip_address")
+    if ip_address is not None:
+        try:
+            validate_ipv46_address(ip_address)
+        except ValidationError:
+            raise InvalidEvent(f"invalid ip_address {ip_address!r}")
+    event = {
+        "email_campaign_id": email_campaign_id,
+        "customer_id": _optional_int(data, "customer_id"),
+        "event_type": event_type,
+        "email_address": email_address[:254],
+        "timestamp": _timestamp(data.get("timestamp")),
+        "user_agent": _optional_str(data, "user_agent"),
+        "ip_address": ip_address,
+        "link_clicked": _optional_str(data, "link_clicked", "url"),
+        "bounce_reason": _optional_str(data, "bounce_reason", "reason"),
+    }
+    event["dedup_key"] = _dedup_key(data, event)
+    return event
+
+
+def _dedup_key(data, event):
+    """Key identifying a provider event across retries, or ``None`` when the
+    event carries neither a provider id nor its own timestamp."""
+    for field in PROVIDER_ID_FIELDS:
+        if data.get(field):
+            return event_key(field, data[field])
+    if data.get("timestamp") in (None, ""):
+        return None
+    return event_key(
+        event["email_campaign_id"],
+        event["event_type"],
+        event["email_address"],
+        event["timestamp"].isoformat(),
+        event["customer_id"],
+        event["link_clicked"],
+    )
+
+
+def stage_events(events, using=None):
+    """Durably buffer already-parsed events, dropping ones whose ``dedup_key``
+    was seen before; returns how many were staged."""
+    using = using or router.db_for_write(EmailEventStaging)
+    with transaction.atomic(using=using):
+        events = deduplicator("email").filter(events, key=lambda event: event.get("dedup_key"), using=using)
+        return EmailEventStaging.objects.db_manager(using).bulk_insert(events)
+
+
+def apply_counters(counts, using=None):
+    """Add ``{email_campaign_id: Counter(event_type=n)}`` to the campaign counters,
+    one UPDATE per campaign (in id order, so concurrent flushers cannot deadlock)."""
+    now = timezone.now()
+    campaigns = EmailCampaign.objects.db_manager(using)
+    for campaign_id in sorted(counts):
+        increments = {
+            COUNTER_FIELDS[event_type]: F(COUNTER_FIELDS[event_type]) + n
+            for event_type, n in counts[campaign_id].items()
+            if n
+        }
+        if increments:
+            campaigns.filter(pk=campaign_id).update(updated_at=now, **increments)
+
+
+def resolve_link_clicks(events, using=None):
+    """Replace the URL of clicks on registered links of their campaign with the link id."""
+    for event in events:
+        url = event["link_clicked"]
+        if url and event["link_id"] is None and event["event_type"] == "clicked":
+            link_id = link_cache.link_id(using, event["email_campaign_id"], url)
+            if link_id is not None:
+                event["link_id"] = link_id
+                event["link_clicked"] = None
+
+
+def flush_staged_events(batch_size=DEFAULT_FLUSH_SIZE, using=None):
+    """Move up to ``batch_size`` staged events into ``EmailEvent``.
+
+    Returns ``(moved, dropped)``; events for unknown campaigns are dropped.
+    """
+    using = using or router.db_for_write(EmailEventStaging)
+    staged = EmailEventStaging.objects.using(using).order_by("id")
+    if connections[using].features.has_select_for_update_skip_locked:
+        # lets several flushers work through the staging table side by side
+        staged = staged.select_for_update(skip_locked=True)
+    with transaction.atomic(using=using):
+        rows = list(staged.values("id", *EVENT_FIELDS)[:batch_size])
+        if not rows:
+            return 0, 0
+        known = set(
+            EmailCampaign.objects.using(using)
+            .filter(pk__in={row["email_campaign_id"] for row in rows})
+            .values_list("pk", flat=True)
+        )
+        events = [row for row in rows if row["email_campaign_id"] in known]
+        dropped = len(rows) - len(events)
+        if dropped:
+            logger.warning("dropping %d staged events for unknown email campaigns", dropped)
+
+        resolve_link_clicks(events, using)
+        EmailEvent.objects.using(using).bulk_insert(events)
+        counts = defaultdict(Counter)
+        for event in events:
+            counts[event["email_campaign_id"]][event["event_type"]] += 1
+        apply_counters(counts, using=using)
+        update_sketches(events, using=using)
+        evaluate_campaigns(list(counts), using=using)
+        suppressed = [event["email_address"] for event in events if event["event_type"] in SUPPRESSION_EVENTS]
+        if suppressed:
+            transaction.on_commit(lambda: record_suppressions(suppressed, using), using=using)
+        EmailEventStaging.objects.using(using).filter(id__in=[row["id"] for row in rows]).delete()
+    return len(events), dropped
+
+
+def flush_all(batch_size=DEFAULT_FLUSH_SIZE, using=None):
+    """Flush until the staging table is empty; returns ``(moved, dropped)``."""
+    moved = dropped = 0
+    while True:
+        batch_moved, batch_dropped = flush_staged_events(batch_size, using)
+        if not batch_moved and not batch_dropped:
+            return moved, dropped
+        moved += batch_moved
+        dropped += batch_dropped
@@ -0,0 +1,158 @@
+"""
+Per-campaign registry of tracked links.
+
+When click tracking is on (``EMAIL_TRACKING_BASE_URL``), the send pipeline
+extracts the static ``http(s)`` links of the template's ``<a href>``
+attributes once, registers them as ``EmailLink`` rows of the email campaign
+with short base62 codes (``0``, ``1``, ... ``z``, ``10``, ...; a code never
+changes once assigned), and compiles a campaign-specific artifact whose
+hrefs point at ``t/l/<recipient token>/<code>/``. Per recipient only the
+token differs, and it is the same for every link of the message.
+
+The redirect view and the ingest flush resolve codes and URLs through
+``link_cache``, an in-process LRU of each campaign's links, so clicks do not
+query the database once a campaign's links are loaded. Click events store
+the ``EmailLink`` id instead of repeating the URL on every row.
+"""
+import html
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import EmailCampaign, EmailLink
+
+BASE62 = "0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
+HREF_RE = re.compile(r"""(<a\b[^>]*?\bhref\s*=\s*)(["'])(.*?)\2""", re.IGNORECASE | re.DOTALL)
+TRACKED_SCHEMES = ("http://", "https://")
+# a miss reloads a campaign's links at most this often
+RELOAD_SECONDS = 5.0
+
+
+def base62(number):
+    if number == 0:
+        return BASE62[0]
+    digits = []
+    while number:
+        number, digit = divmod(number, 62)
+        digits.append(BASE62[digit])
+    return "".join(reversed(digits))
+
+
+def _trackable(value):
+    return value.startswith(TRACKED_SCHEMES) and "{{" not in value and "{%" not in value
+
+
+def extract_links(source):
+    """Distinct static http(s) URLs of the ``<a href>`` attributes in ``source``,
+    in order of appearance; links built from placeholders are left alone."""
+    urls = {}
+    for match in HREF_RE.finditer(source or ""):
+        url = html.unescape(match.group(3).strip())
+        if _trackable(url):
+            urls.setdefault(url, None)
+    return list(urls)
+
+
+def rewrite_links(source, replacements):
+    """``source`` with each href in ``replacements`` (``{url: new href}``) replaced."""
+    def replace(match):
+        new = replacements.get(html.unescape(match.group(3).strip()))
+        if new is None:
+            return match.group(0)
+        return f"{match.group(1)}{match.group(2)}{new}{match.group(2)}"
+
+    return HREF_RE.sub(replace, source)
+
+
+def register_links(email_campaign, urls, using=None):
+    """``{url: code}`` for ``urls``, registering the ones ``email_campaign`` does
+    not have yet; existing links keep their codes."""
+    using = using or email_campaign._state.db
+    with transaction.atomic(using=using):
+        # serializes registrations of one campaign, so codes are not handed out twice
+        EmailCampaign.objects.using(using).select_for_update().filter(pk=email_campaign.pk).exists()
+        links = EmailLink.objects.using(using).filter(email_campaign_id=email_campaign.pk)
+        codes = dict(links.values_list("url", "code"))
+        missing = [url for url in dict.fromkeys(urls) if url not in codes]
+        if missing:
+            first = links.count()
+            created = [
+                EmailLink(email_campaign_id=email_campaign.pk, code=base62(first + i), url=url)
+                for i, url in enumerate(missing)
+            ]
+            EmailLink.objects.using(using).bulk_create(created)
+            codes.update((link.url, link.code) for link in created)
+    link_cache.invalidate(using, email_campaign.pk)
+    return {url: codes[url] for url in urls}
+
+
+class _CampaignLinks:
+    __slots__ = ("by_code", "by_url", "loaded_at")
+
+    def __init__(self, rows):
+        self.by_code = {code: (pk, url) for pk, code, url in rows}
+        self.by_url = {url: pk for pk, code, url in rows}
+        self.loaded_at = time.monotonic()
+
+
+class LinkCache:
+    """Thread-safe LRU of the links of recently clicked campaigns."""
+
+    def __init__(self, maxsize=1000):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _load(self, using, email_campaign_id):
+        rows = EmailLink.objects.using(using).filter(email_campaign_id=email_campaign_id)
+        links = _CampaignLinks(rows.values_list("pk", "code", "url"))
+        with self._lock:
+            self._entries[(using, email_campaign_id)] = links
+            self._entries.move_to_end((using, email_campaign_id))
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return links
+
+    def _get(self, using, email_campaign_id):
+        key = (using or "default", email_campaign_id)
+        with self._lock:
+            links = self._entries.get(key)
+            if links is not None:
+                self._entries.move_to_end(key)
+        return key[0], links
+
+    def _lookup(self, using, email_campaign_id, table, value):
+        using, links = self._get(using, email_campaign_id)
+        if links is None or (
+            value not in getattr(links, table) and time.monotonic() - links.loaded_at >= RELOAD_SECONDS
+        ):
+            links = self._load(using, email_campaign_id)
+        return getattr(links, table).get(value)
+
+    def cached(self, using, email_campaign_id, code):
+        """``(link id, url)`` of ``code`` if it is in memory; never queries."""
+        links = self._get(using, email_campaign_id)[1]
+        return None if links is None else links.by_code.get(code)
+
+    def resolve(self, using, email_campaign_id, code):
+        """``(link id, url)`` of ``code``, or ``None`` for an unknown code."""
+        return self._lookup(using, email_campaign_id, "by_code", code)
+
+    def link_id(self, using, email_campaign_id, url):
+        """Id of the campaign's link to ``url``, or ``None``."""
+        return self._lookup(using, email_campaign_id, "by_url", url)
+
+    def invalidate(self, using, email_campaign_id):
+        with self._lock:
+            self._entries.pop((using or "default", email_campaign_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+link_cache = LinkCache(getattr(settings, "EMAIL_LINK_CACHE_SIZE", 1000))
@@ -0,0 +1,49 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from emailMarketing.partitions import archive_partitions, ensure_partitions, rotate_partitions
+from marketingAutomation.tenancy import tenant_context
+
+# ``--days`` given without a value
+FROM_SETTINGS = "EMAIL_EVENT_ARCHIVE_DAYS"
+
+
+class Command(BaseCommand):
+    help = "Maintain EmailEvent's monthly partitions and archive old months to compressed files."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            nargs="?",
+            const=FROM_SETTINGS,
+            help=(
+                "Move events into their monthly tables and archive months that ended more than this many days "
+                "ago (EMAIL_EVENT_ARCHIVE_DAYS without a value). Without it only partitions are created."
+            ),
+        )
+        parser.add_argument("--months-ahead", type=int, default=2, help="PostgreSQL partitions to create ahead.")
+        parser.add_argument("--tenant", help="Work on this tenant schema's database.")
+
+    def handle(self, *args, **options):
+        days = options["days"]
+        if days == FROM_SETTINGS:
+            days = getattr(settings, "EMAIL_EVENT_ARCHIVE_DAYS", None)
+            if days is None:
+                raise CommandError("--days needs a value when EMAIL_EVENT_ARCHIVE_DAYS is not set")
+        archived = []
+        with tenant_context(options["tenant"]):
+            created = ensure_partitions(options["months_ahead"])
+            if created:
+                self.stdout.write(f"Created partitions {', '.join(created)}")
+            if days is None:
+                return
+            moved = rotate_partitions()
+            if moved:
+                self.stdout.write(f"Moved {moved} events into monthly tables")
+            try:
+                archived = archive_partitions(days)
+            except ValueError as exc:
+                raise CommandError(str(exc))
+        for month, rows in archived:
+            self.stdout.write(self.style.SUCCESS(f"Archived {rows} events of {month:%Y-%m}"))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from emailMarketing.suppression import compact_suppression_index
+from marketingAutomation.tenancy import tenant_context
+
+
+class Command(BaseCommand):
+    help = "Build or update the suppression index of bounced and unsubscribed addresses."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--full", action="store_true", help="Rebuild from every EmailEvent, archives included.")
+        parser.add_argument("--tenant", help="Work on this tenant schema's database.")
+
+    def handle(self, *args, **options):
+        with tenant_context(options["tenant"]):
+            count = compact_suppression_index(full=options["full"])
+        self.stdout.write(self.style.SUCCESS(f"Suppression index holds {count} addresses"))
@@ -0,0 +1,40 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from campaign.dedup import prune_keys
+from emailMarketing.ingest import DEFAULT_FLUSH_SIZE, flush_all
+from emailMarketing.suppression import DEFAULT_COMPACT_AFTER, compact_suppression_index
+from marketingAutomation.tenancy import tenant_context
+
+PRUNE_INTERVAL = 60.0
+
+
+class Command(BaseCommand):
+    help = "Move staged webhook events into EmailEvent and apply the campaign counters."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=DEFAULT_FLUSH_SIZE)
+        parser.add_argument("--tenant", help="Flush this tenant schema's database.")
+        parser.add_argument("--loop", action="store_true", help="Keep flushing until interrupted.")
+        parser.add_argument("--interval", type=float, default=1.0, help="Seconds between flushes with --loop.")
+
+    def handle(self, *args, **options):
+        with tenant_context(options["tenant"]):
+            pruned_at = None
+            while True:
+                if pruned_at is None or time.monotonic() - pruned_at >= PRUNE_INTERVAL:
+                    # expired idempotency keys of the webhook dedup (campaign.dedup)
+                    prune_keys()
+                    # builds the suppression index the first time, then folds in its log
+                    compact_suppression_index(
+                        min_log=getattr(settings, "EMAIL_SUPPRESSION_COMPACT_AFTER", DEFAULT_COMPACT_AFTER)
+                    )
+                    pruned_at = time.monotonic()
+                moved, dropped = flush_all(options["batch_size"])
+                if moved or dropped or not options["loop"]:
+                    self.stdout.write(f"Moved {moved} events, dropped {dropped}")
+                if not options["loop"]:
+                    return
+                time.sleep(options["interval"])
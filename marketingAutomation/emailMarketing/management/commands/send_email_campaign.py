@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from emailMarketing.models import EmailCampaign
+from emailMarketing.sending import SMTPPool, send_due_campaigns, send_email_campaign
+from marketingAutomation.tenancy import tenant_context
+
+
+class Command(BaseCommand):
+    help = (
+        "Send an EmailCampaign to its customer segment over pooled SMTP connections, or with --due "
+        "every scheduled one whose time has come (e.g. promoted A/B test winners)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("email_campaign_id", type=int, nargs="?")
+        parser.add_argument("--due", action="store_true", help="Send the due scheduled campaigns.")
+        parser.add_argument("--pool-size", type=int, help="Concurrent SMTP connections (EMAIL_SEND_POOL_SIZE).")
+        parser.add_argument("--batch-size", type=int, help="Recipients per batch (EMAIL_SEND_BATCH_SIZE).")
+        parser.add_argument("--tenant", help="Read and record in this tenant schema's database.")
+
+    def handle(self, *args, **options):
+        if (options["email_campaign_id"] is None) == (not options["due"]):
+            raise CommandError("Give either an email campaign id or --due")
+        with tenant_context(options["tenant"]):
+            if options["due"]:
+                sent = send_due_campaigns(pool_size=options["pool_size"], batch_size=options["batch_size"])
+            else:
+                try:
+                    email_campaign = EmailCampaign.objects.select_related(
+                        "email_template", "customer_segment"
+                    ).get(pk=options["email_campaign_id"])
+                except EmailCampaign.DoesNotExist:
+                    raise CommandError(f"EmailCampaign {options['email_campaign_id']} does not exist")
+                pool = SMTPPool(options["pool_size"]) if options["pool_size"] else None
+                sent = send_email_campaign(email_campaign, pool=pool, batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Sent {sent} messages"))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from emailMarketing.suppression import remove_suppressions
+from marketingAutomation.tenancy import tenant_context
+
+
+class Command(BaseCommand):
+    help = "Lift the suppression of addresses, e.g. customers who subscribed again."
+
+    def add_arguments(self, parser):
+        parser.add_argument("addresses", nargs="+")
+        parser.add_argument("--tenant", help="Work on this tenant schema's database.")
+
+    def handle(self, *args, **options):
+        with tenant_context(options["tenant"]):
+            count = remove_suppressions(options["addresses"])
+        self.stdout.write(self.style.SUCCESS(f"Lifted the suppression of {count} addresses"))
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.8 on 2026-10-18 03:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emailMarketing', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='emailevent',
+            index=models.Index(fields=['created_at', 'id'], name='email_event_page_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='emailevent',
+            index=models.Index(fields=['email_campaign', 'created_at', 'id'], name='email_event_campaign_page_idx'),
+        ),
+    ]
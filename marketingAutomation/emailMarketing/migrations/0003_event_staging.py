@@ -0,0 +1,36 @@
+# Generated by Django 5.2.8 on 2026-10-18 03:35
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emailMarketing', '0002_event_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmailEventStaging',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('email_campaign_id', models.BigIntegerField()),
+                ('customer_id', models.BigIntegerField(blank=True, null=True)),
+                ('event_type', models.CharField(choices=[('sent', 'sent'), ('delivered', 'delivered'), ('opened', 'opened'), ('clicked', 'clicked'), ('bounced', 'bounced'), ('unsubscribed', 'unsubscribed')], max_length=30)),
+                ('email_address', models.CharField(max_length=254)),
+                ('timestamp', models.DateTimeField(default=django.utils.timezone.now)),
+                ('user_agent', models.TextField(blank=True, null=True)),
+                ('ip_address', models.GenericIPAddressField(blank=True, null=True)),
+                ('link_clicked', models.TextField(blank=True, null=True)),
+                ('bounce_reason', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Email Event (staged)',
+                'verbose_name_plural': 'Email Events (staged)',
+                'db_table': 'email_event_staging',
+                'ordering': ['id'],
+            },
+        ),
+    ]
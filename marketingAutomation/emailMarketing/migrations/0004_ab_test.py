@@ -0,0 +1,36 @@
+# Generated by Django 5.2.8 on 2026-10-18 03:49
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('campaign', '0007_campaign_channel'),
+        ('emailMarketing', '0003_event_staging'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmailABTest',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('metric', models.CharField(choices=[('opened', 'opened'), ('clicked', 'clicked')], default='opened', max_length=20)),
+                ('status', models.CharField(choices=[('running', 'running'), ('decided', 'decided'), ('promoted', 'promoted')], default='running', max_length=20)),
+                ('p_value', models.FloatField(default=1.0)),
+                ('rate_a', models.FloatField(default=0.0)),
+                ('rate_b', models.FloatField(default=0.0)),
+                ('decided_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('campaign', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='email_ab_test', to='campaign.campaign')),
+                ('winner', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='won_ab_tests', to='emailMarketing.emailcampaign')),
+            ],
+            options={
+                'verbose_name': 'Email A/B Test',
+                'verbose_name_plural': 'Email A/B Tests',
+                'db_table': 'email_ab_test',
+            },
+        ),
+    ]
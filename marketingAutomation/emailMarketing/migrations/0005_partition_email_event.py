@@ -0,0 +1,78 @@
+# Generated by Django 5.2.8 on 2026-10-18 03:55
+
+from datetime import datetime, timezone
+
+from django.db import migrations
+
+MONTHS_AHEAD = 2
+
+
+def _next_month(month):
+    return datetime(month.year + month.month // 12, month.month % 12 + 1, 1, tzinfo=timezone.utc)
+
+
+def partition_email_event(apps, schema_editor):
+    """PostgreSQL: rebuild email_event as a table range-partitioned by month on
+    "timestamp" (emailMarketing.partitions). Other databases are left alone;
+    SQLite emulates partitions at run time."""
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('email_event')")
+        if cursor.fetchone()[0] == 'p':
+            return
+        cursor.execute(
+            "SELECT indexdef FROM pg_indexes WHERE schemaname = current_schema() "
+            "AND tablename = 'email_event' AND indexname <> 'email_event_pkey'"
+        )
+        indexes = [row[0] for row in cursor.fetchall()]
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = 'email_event'::regclass AND contype = 'f'"
+        )
+        foreign_keys = cursor.fetchall()
+        cursor.execute('SELECT MIN("timestamp"), COALESCE(MAX(id), 0) FROM email_event')
+        oldest, max_id = cursor.fetchone()
+
+        cursor.execute('ALTER TABLE email_event RENAME TO email_event_unpartitioned')
+        cursor.execute(
+            'CREATE TABLE email_event (LIKE email_event_unpartitioned INCLUDING DEFAULTS) '
+            'PARTITION BY RANGE ("timestamp")'
+        )
+        cursor.execute('CREATE TABLE email_event_default PARTITION OF email_event DEFAULT')
+        now = datetime.now(timezone.utc)
+        month = (oldest or now).astimezone(timezone.utc).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        last = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        for _ in range(MONTHS_AHEAD):
+            last = _next_month(last)
+        while month <= last:
+            cursor.execute(
+                f"CREATE TABLE email_event_p{month:%Y%m} PARTITION OF email_event "
+                f"FOR VALUES FROM ('{month.isoformat()}') TO ('{_next_month(month).isoformat()}')"
+            )
+            month = _next_month(month)
+        cursor.execute('INSERT INTO email_event SELECT * FROM email_event_unpartitioned')
+        cursor.execute('DROP TABLE email_event_unpartitioned')
+
+        # The primary key of a partitioned table has to include the partition key.
+        cursor.execute('CREATE SEQUENCE email_event_id_seq AS bigint OWNED BY email_event.id')
+        cursor.execute("SELECT setval('email_event_id_seq', %s, %s)", [max(max_id, 1), max_id > 0])
+        cursor.execute("ALTER TABLE email_event ALTER COLUMN id SET DEFAULT nextval('email_event_id_seq')")
+        cursor.execute('ALTER TABLE email_event ADD PRIMARY KEY (id, "timestamp")')
+        for definition in indexes:
+            cursor.execute(definition)
+        for name, definition in foreign_keys:
+            cursor.execute(f'ALTER TABLE email_event ADD CONSTRAINT "{name}" {definition}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emailMarketing', '0004_ab_test'),
+    ]
+
+    operations = [
+        # The partitioned table serves the same model, so there is nothing to undo.
+        migrations.RunPython(partition_email_event, migrations.RunPython.noop),
+    ]
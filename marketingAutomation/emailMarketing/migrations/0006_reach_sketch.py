@@ -0,0 +1,33 @@
+# Generated by Django 5.2.8 on 2026-10-18 04:22
+
+import django.core.validators
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emailMarketing', '0005_partition_email_event'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmailReachSketch',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('day', models.DateField()),
+                ('event_type', models.CharField(choices=[('opened', 'opened'), ('clicked', 'clicked')], max_length=20)),
+                ('sketch', models.BinaryField()),
+                ('unique_count', models.BigIntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)])),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('email_campaign', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reach_sketches', to='emailMarketing.emailcampaign')),
+            ],
+            options={
+                'verbose_name': 'Email Reach Sketch',
+                'verbose_name_plural': 'Email Reach Sketches',
+                'db_table': 'email_reach_sketch',
+                'constraints': [models.UniqueConstraint(fields=('email_campaign', 'day', 'event_type'), name='uniq_email_reach_sketch')],
+            },
+        ),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 5.2.8 on 2026-10-18 04:32
+
+import re
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+PARTITION_RE = re.compile(r'^email_event_p\d{6}$')
+
+
+def add_link_to_partitions(apps, schema_editor):
+    """SQLite: monthly email_event_pYYYYMM tables are plain copies made by
+    emailMarketing.partitions, so give the existing ones the new column too.
+    PostgreSQL partitions inherit it from email_event."""
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for table in connection.introspection.table_names(cursor):
+            if not PARTITION_RE.match(table):
+                continue
+            cursor.execute(f'PRAGMA table_info("{table}")')
+            if 'link_id' not in {row[1] for row in cursor.fetchall()}:
+                cursor.execute(f'ALTER TABLE "{table}" ADD COLUMN "link_id" bigint NULL')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emailMarketing', '0006_reach_sketch'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emaileventstaging',
+            name='link_id',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='EmailLink',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('code', models.CharField(max_length=16)),
+                ('url', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('email_campaign', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='links', to='emailMarketing.emailcampaign')),
+            ],
+            options={
+                'verbose_name': 'Email Link',
+                'verbose_name_plural': 'Email Links',
+                'db_table': 'email_link',
+                'ordering': ['email_campaign', 'id'],
+            },
+        ),
+        migrations.AddField(
+            model_name='emailevent',
+            name='link',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='events', to='emailMarketing.emaillink'),
+        ),
+        migrations.AddConstraint(
+            model_name='emaillink',
+            constraint=models.UniqueConstraint(fields=('email_campaign', 'code'), name='uniq_email_link_code'),
+        ),
+        migrations.RunPython(add_link_to_partitions, migrations.RunPython.noop),
+    ]
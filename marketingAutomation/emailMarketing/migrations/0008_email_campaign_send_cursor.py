@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 05:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emailMarketing', '0007_email_link'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emailcampaign',
+            name='send_cursor',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 05:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emailMarketing', '0008_email_campaign_send_cursor'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='emailevent',
+            name='link_clicked',
+            field=models.TextField(blank=True, null=True),
+        ),
+    ]
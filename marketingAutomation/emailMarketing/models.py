@@ -1,4 +1,6 @@
-from django.db import models
+from itertools import islice
+
+from django.db import connections, models, transaction
 from django.utils import timezone
 from django.core.validators import MinValueValidator
 
@@ -96,6 +98,9 @@ class EmailCampaign(models.Model):
 	clicked_count = models.BigIntegerField(default=0, validators=[MinValueValidator(0)])
 	bounced_count = models.BigIntegerField(default=0, validators=[MinValueValidator(0)])
 	unsubscribed_count = models.BigIntegerField(default=0, validators=[MinValueValidator(0)])
+	# highest customer id of the segment whose batch has been sent and recorded;
+	# a rerun of the send pipeline resumes after it
+	send_cursor = models.BigIntegerField(blank=True, null=True)
 
 	created_at = models.DateTimeField(auto_now_add=True)
 	updated_at = models.DateTimeField(auto_now=True)
@@ -114,6 +119,102 @@ class EmailCampaign(models.Model):
 	def __str__(self):
 		return f"{self.name} [{self.status}]"
 
+	def delete(self, *args, **kwargs):
+		from .partitions import delete_campaign_events
+
+		pk, using = self.pk, kwargs.get("using") or self._state.db
+		result = super().delete(*args, **kwargs)
+		# the cascade only reaches email_event; QuerySet.delete() skips this
+		delete_campaign_events(pk, using=using)
+		return result
+
+
+class EmailLink(models.Model):
+	"""A tracked link of an email campaign, addressed by a short per-campaign
+	code in redirect URLs (``emailMarketing.links``)."""
+	id = models.BigAutoField(primary_key=True)
+	email_campaign = models.ForeignKey(
+		EmailCampaign,
+		on_delete=models.CASCADE,
+		related_name='links',
+	)
+	code = models.CharField(max_length=16)
+	url = models.TextField()
+
+	created_at = models.DateTimeField(auto_now_add=True)
+
+	class Meta:
+		db_table = "email_link"
+		ordering = ["email_campaign", "id"]
+		constraints = [
+			models.UniqueConstraint(fields=["email_campaign", "code"], name="uniq_email_link_code"),
+		]
+		verbose_name = "Email Link"
+		verbose_name_plural = "Email Links"
+
+	def __str__(self):
+		return f"{self.code} -> {self.url}"
+
+
+class EmailEventQuerySet(models.QuerySet):
+	INSERT_FIELDS = (
+		"email_campaign_id",
+		"customer_id",
+		"event_type",
+		"email_address",
+		"timestamp",
+		"user_agent",
+		"ip_address",
+		"link_clicked",
+		"link_id",
+		"bounce_reason",
+	)
+
+	def bulk_insert(self, rows, batch_size=10000):
+		"""Insert many events from dicts of field values, one executemany per batch.
+
+		Same idea as ``CampaignAnalytics.objects.bulk_ingest``: no model
+		instances, no per-field ORM preparation. Missing fields default to
+		``None`` (``timestamp`` to now). Returns the number of rows written.
+		"""
+		connection = connections[self.db]
+		ops = connection.ops
+		opts = self.model._meta
+		columns = [opts.get_field(name).column for name in self.INSERT_FIELDS] + ["created_at"]
+		sql = "INSERT INTO %s (%s) VALUES (%s)" % (
+			ops.quote_name(opts.db_table),
+			", ".join(ops.quote_name(column) for column in columns),
+			", ".join(["%s"] * len(columns)),
+		)
+
+		rows = iter(rows)
+		written = 0
+		while True:
+			chunk = list(islice(rows, batch_size))
+			if not chunk:
+				return written
+			now = timezone.now()
+			created_at = ops.adapt_datetimefield_value(now)
+			params = [
+				(
+					row["email_campaign_id"],
+					row.get("customer_id"),
+					row["event_type"],
+					row["email_address"],
+					ops.adapt_datetimefield_value(row.get("timestamp") or now),
+					row.get("user_agent"),
+					ops.adapt_ipaddressfield_value(row.get("ip_address")),
+					row.get("link_clicked"),
+					row.get("link_id"),
+					row.get("bounce_reason"),
+					created_at,
+				)
+				for row in chunk
+			]
+			with transaction.atomic(using=self.db), connection.cursor() as cursor:
+				cursor.executemany(sql, params)
+			written += len(params)
+
 
 class EmailEvent(models.Model):
 	id = models.BigAutoField(primary_key=True)
@@ -139,17 +240,34 @@ class EmailEvent(models.Model):
 	timestamp = models.DateTimeField(default=timezone.now)
 	user_agent = models.TextField(blank=True, null=True)
 	ip_address = models.GenericIPAddressField(blank=True, null=True)
-	link_clicked = models.URLField(blank=True, null=True)
+	# as the provider reported it; tracked URLs easily exceed a URLField's 200 characters
+	link_clicked = models.TextField(blank=True, null=True)
+	# tracked clicks reference the campaign's link instead of repeating its URL.
+	# Not indexed: per-link reports go through the (campaign, type, timestamp)
+	# index, and links are only deleted along with their campaign and its events.
+	link = models.ForeignKey(
+		EmailLink,
+		on_delete=models.DO_NOTHING,
+		related_name='events',
+		null=True,
+		blank=True,
+		db_index=False,
+	)
 	bounce_reason = models.TextField(blank=True, null=True)
 
 	created_at = models.DateTimeField(auto_now_add=True)
 
+	objects = EmailEventQuerySet.as_manager()
+
 	class Meta:
 		db_table = "email_event"
 		ordering = ["-timestamp"]
 		indexes = [
 			models.Index(fields=["email_campaign", "event_type", "timestamp"]),
 			models.Index(fields=["customer_id"]),
+			# keyset pagination (campaign.pagination)
+			models.Index(fields=["created_at", "id"], name="email_event_page_idx"),
+			models.Index(fields=["email_campaign", "created_at", "id"], name="email_event_campaign_page_idx"),
 		]
 		verbose_name = "Email Event"
 		verbose_name_plural = "Email Events"
@@ -157,3 +275,119 @@ class EmailEvent(models.Model):
 	def __str__(self):
 		return f"Event {self.event_type} for campaign {self.email_campaign_id} @ {self.timestamp.isoformat()}"
 
+
+
+class EmailEventStaging(models.Model):
+	"""Durable buffer for webhook events until ``emailMarketing.ingest`` moves
+	them into ``EmailEvent`` and the campaign counters in batches."""
+	id = models.BigAutoField(primary_key=True)
+	# plain column: validated against EmailCampaign when flushed, not per insert
+	email_campaign_id = models.BigIntegerField()
+	customer_id = models.BigIntegerField(null=True, blank=True)
+	event_type = models.CharField(max_length=30, choices=EmailEvent.EVENT_TYPE_CHOICES)
+	email_address = models.CharField(max_length=254)
+	timestamp = models.DateTimeField(default=timezone.now)
+	user_agent = models.TextField(blank=True, null=True)
+	ip_address = models.GenericIPAddressField(blank=True, null=True)
+	link_clicked = models.TextField(blank=True, null=True)
+	link_id = models.BigIntegerField(null=True, blank=True)
+	bounce_reason = models.TextField(blank=True, null=True)
+
+	created_at = models.DateTimeField(auto_now_add=True)
+
+	objects = EmailEventQuerySet.as_manager()
+
+	class Meta:
+		db_table = "email_event_staging"
+		ordering = ["id"]
+		verbose_name = "Email Event (staged)"
+		verbose_name_plural = "Email Events (staged)"
+
+	def __str__(self):
+		return f"Staged {self.event_type} for campaign {self.email_campaign_id}"
+
+
+class EmailABTest(models.Model):
+	"""Running state of the A/B test between the ``A`` and ``B`` email
+	campaigns of one ``campaign.Campaign``; maintained by ``emailMarketing.abtest``."""
+	id = models.BigAutoField(primary_key=True)
+	campaign = models.OneToOneField(
+		'campaign.Campaign',
+		on_delete=models.CASCADE,
+		related_name='email_ab_test',
+	)
+
+	METRIC_CHOICES = [("opened", "opened"), ("clicked", "clicked")]
+	metric = models.CharField(max_length=20, choices=METRIC_CHOICES, default="opened")
+
+	STATUS_CHOICES = [
+		("running", "running"),
+		("decided", "decided"),
+		("promoted", "promoted"),
+	]
+	status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="running")
+
+	# always-valid p-value of the mixture SPRT; only ever decreases
+	p_value = models.FloatField(default=1.0)
+	rate_a = models.FloatField(default=0.0)
+	rate_b = models.FloatField(default=0.0)
+	winner = models.ForeignKey(
+		EmailCampaign,
+		on_delete=models.SET_NULL,
+		related_name='won_ab_tests',
+		null=True,
+		blank=True,
+	)
+	decided_at = models.DateTimeField(blank=True, null=True)
+
+	created_at = models.DateTimeField(auto_now_add=True)
+	updated_at = models.DateTimeField(auto_now=True)
+
+	class Meta:
+		db_table = "email_ab_test"
+		verbose_name = "Email A/B Test"
+		verbose_name_plural = "Email A/B Tests"
+
+	def __str__(self):
+		return f"A/B test for campaign {self.campaign_id} [{self.status}]"
+
+
+class EmailReachSketch(models.Model):
+	"""HyperLogLog sketch of the distinct addresses that opened or clicked one
+	email campaign (i.e. one variant) on one day; maintained by ``emailMarketing.reach``."""
+	id = models.BigAutoField(primary_key=True)
+	email_campaign = models.ForeignKey(
+		EmailCampaign,
+		on_delete=models.CASCADE,
+		related_name='reach_sketches',
+	)
+	day = models.DateField()
+
+	EVENT_TYPE_CHOICES = [("opened", "opened"), ("clicked", "clicked")]
+	event_type = models.CharField(max_length=20, choices=EVENT_TYPE_CHOICES)
+
+	# campaign.hll.HyperLogLog.to_bytes()
+	sketch = models.BinaryField()
+	# estimate of this sketch alone, so listing days needs no decoding
+	unique_count = models.BigIntegerField(default=0, validators=[MinValueValidator(0)])
+
+	updated_at = models.DateTimeField(auto_now=True)
+
+	class Meta:
+		db_table = "email_reach_sketch"
+		constraints = [
+			models.UniqueConstraint(
+				fields=["email_campaign", "day", "event_type"],
+				name="uniq_email_reach_sketch",
+			),
+		]
+		verbose_name = "Email Reach Sketch"
+		verbose_name_plural = "Email Reach Sketches"
+
+	def __str__(self):
+		return f"Unique {self.event_type} of campaign {self.email_campaign_id} on {self.day}: ~{self.unique_count}"
+
+	def hll(self):
+		from campaign.hll import HyperLogLog
+
+		return HyperLogLog.from_bytes(self.sketch)
@@ -0,0 +1,496 @@
+"""
+Monthly partitions of ``EmailEvent`` and archiving of old months.
+
+On PostgreSQL ``email_event`` is a native range-partitioned table (see
+migration ``0005_partition_email_event``) with one partition per month,
+``email_event_pYYYYMM``, plus ``email_event_default`` for anything outside
+the created months; the ORM keeps working against the parent table and the
+planner prunes partitions for time-bounded queries.
+
+SQLite has no partitioning, so it is emulated: ``email_event`` holds the
+current month and ``rotate_partitions`` (run when archiving) moves older
+rows into tables of the same name pattern. ORM queries only see
+``email_event`` there; reads that must see every month (the event list
+API, the email event rollup, the suppression index build) go through
+``events_in_range``. Deleting an ``EmailCampaign`` removes its events from
+those tables and from the archive (``delete_campaign_events``).
+
+``archive_partitions`` turns months older than the retention into
+compressed columnar files (``emailMarketing.archive``) under
+``EMAIL_EVENT_ARCHIVE_DIR/<db alias>/`` and drops their partitions; on
+PostgreSQL old rows that fell into ``email_event_default`` get their
+monthly partition first, so they are archived too. ``events_in_range``
+merges archived files, partitions and live rows into one timestamp-ordered
+stream, so callers do not need to know where a month currently lives.
+"""
+import heapq
+import logging
+import re
+from datetime import datetime, timedelta, timezone as dt_timezone
+from itertools import chain
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import Max, Min, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .archive import COLUMN_NAMES, ArchiveFile, from_micros, write_archive
+from .models import EmailEvent
+
+logger = logging.getLogger(__name__)
+
+PARENT = EmailEvent._meta.db_table
+PARTITION_RE = re.compile(rf"^{PARENT}_p(\d{{4}})(\d{{2}})$")
+DEFAULT_PARTITION = f"{PARENT}_default"
+REFERENCES_RE = re.compile(r'\s+REFERENCES\s+"\w+"\s*\("\w+"\)(\s+DEFERRABLE INITIALLY DEFERRED)?')
+TIMESTAMP = '"timestamp"'
+FETCH_SIZE = 2000
+
+
+def month_start(value):
+    value = value.astimezone(dt_timezone.utc)
+    return datetime(value.year, value.month, 1, tzinfo=dt_timezone.utc)
+
+
+def next_month(month):
+    return datetime(month.year + month.month // 12, month.month % 12 + 1, 1, tzinfo=dt_timezone.utc)
+
+
+def partition_name(month):
+    return f"{PARENT}_p{month:%Y%m}"
+
+
+def _using(using):
+    return using or router.db_for_write(EmailEvent)
+
+
+def _datetime(value):
+    if isinstance(value, str):
+        value = parse_datetime(value)
+    if value is not None and timezone.is_naive(value):
+        value = timezone.make_aware(value, dt_timezone.utc)
+    return value
+
+
+def is_partitioned(using=None):
+    """Whether ``email_event`` is partitioned (natively or emulated) on ``using``."""
+    connection = connections[_using(using)]
+    if connection.vendor == "sqlite":
+        return True
+    if connection.vendor != "postgresql":
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", [PARENT])
+        row = cursor.fetchone()
+    return bool(row) and row[0] == "p"
+
+
+def partitions(using=None):
+    """``[(month, table)]`` of the existing monthly partitions, oldest first."""
+    connection = connections[_using(using)]
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            cursor.execute(
+                "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                "WHERE i.inhparent = to_regclass(%s)",
+                [PARENT],
+            )
+        elif connection.vendor == "sqlite":
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE %s", [f"{PARENT}_p%"])
+        else:
+            return []
+        names = [row[0] for row in cursor.fetchall()]
+    found = []
+    for name in names:
+        match = PARTITION_RE.match(name)
+        if match:
+            found.append((datetime(int(match[1]), int(match[2]), 1, tzinfo=dt_timezone.utc), name))
+    return sorted(found)
+
+
+def _create_sqlite_partition(cursor, connection, month):
+    quote = connection.ops.quote_name
+    name = partition_name(month)
+    cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = %s", [PARENT])
+    create = re.sub(r'^CREATE TABLE "?%s"?' % PARENT, f"CREATE TABLE IF NOT EXISTS {quote(name)}", cursor.fetchone()[0])
+    # no foreign keys: campaign deletes cascade through the ORM on email_event only
+    cursor.execute(REFERENCES_RE.sub("", create))
+    cursor.execute(
+        f"CREATE INDEX IF NOT EXISTS {quote(name + '_campaign_idx')} "
+        f"ON {quote(name)} (email_campaign_id, event_type, {TIMESTAMP})"
+    )
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS {quote(name + '_timestamp_idx')} ON {quote(name)} ({TIMESTAMP})")
+
+
+def _create_postgres_partition(cursor, connection, month):
+    quote = connection.ops.quote_name
+    name = partition_name(month)
+    low, high = month.isoformat(), next_month(month).isoformat()
+    # Rows of this month that landed in the default partition move along;
+    # ATTACH would fail otherwise.
+    cursor.execute(f"CREATE TABLE {quote(name)} (LIKE {quote(PARENT)} INCLUDING DEFAULTS)")
+    cursor.execute(
+        f"WITH moved AS (DELETE FROM {quote(DEFAULT_PARTITION)} "
+        f"WHERE {TIMESTAMP} >= %s AND {TIMESTAMP} < %s RETURNING *) "
+        f"INSERT INTO {quote(name)} SELECT * FROM moved",
+        [low, high],
+    )
+    cursor.execute(
+        f"ALTER TABLE {quote(PARENT)} ATTACH PARTITION {quote(name)} FOR VALUES FROM ('{low}') TO ('{high}')"
+    )
+
+
+def ensure_partitions(months_ahead=2, since=None, using=None):
+    """PostgreSQL: create the monthly partitions from ``since`` (default: this
+    month) up to ``months_ahead`` months ahead; returns the names created.
+    SQLite tables are created on demand by ``rotate_partitions``."""
+    using = _using(using)
+    connection = connections[using]
+    if connection.vendor != "postgresql" or not is_partitioned(using):
+        return []
+    existing = {name for _, name in partitions(using)}
+    month = month_start(since or timezone.now())
+    last = month_start(timezone.now())
+    for _ in range(months_ahead):
+        last = next_month(last)
+    created = []
+    while month <= last:
+        name = partition_name(month)
+        if name not in existing:
+            with transaction.atomic(using=using), connection.cursor() as cursor:
+                _create_postgres_partition(cursor, connection, month)
+            created.append(name)
+        month = next_month(month)
+    return created
+
+
+def _table_columns(cursor, table):
+    cursor.execute(f"PRAGMA table_info({table})")
+    return {row[1]: row[2] for row in cursor.fetchall()}
+
+
+def rotate_partitions(using=None, before=None):
+    """SQLite: move ``email_event`` rows older than the current month into
+    their monthly tables; returns the number of rows moved."""
+    using = _using(using)
+    connection = connections[using]
+    if connection.vendor != "sqlite":
+        return 0
+    quote = connection.ops.quote_name
+    cutoff = connection.ops.adapt_datetimefield_value(month_start(before or timezone.now()))
+    where = f"{TIMESTAMP} >= %s AND {TIMESTAMP} < %s"
+    moved = 0
+    while True:
+        with transaction.atomic(using=using), connection.cursor() as cursor:
+            cursor.execute(f"SELECT MIN({TIMESTAMP}) FROM {quote(PARENT)} WHERE {TIMESTAMP} < %s", [cutoff])
+            oldest = _datetime(cursor.fetchone()[0])
+            if oldest is None:
+                return moved
+            month = month_start(oldest)
+            name = partition_name(month)
+            bounds = [connection.ops.adapt_datetimefield_value(value) for value in (month, next_month(month))]
+            _create_sqlite_partition(cursor, connection, month)
+            parent_columns = _table_columns(cursor, quote(PARENT))
+            partition_columns = _table_columns(cursor, quote(name))
+            for column, kind in parent_columns.items():
+                # migrations rebuild email_event, not the partitions
+                if column not in partition_columns:
+                    cursor.execute(f"ALTER TABLE {quote(name)} ADD COLUMN {quote(column)} {kind}")
+            columns = ", ".join(quote(column) for column in parent_columns)
+            cursor.execute(
+                f"INSERT INTO {quote(name)} ({columns}) SELECT {columns} FROM {quote(PARENT)} WHERE {where}",
+                bounds,
+            )
+            moved += cursor.rowcount
+            cursor.execute(f"DELETE FROM {quote(PARENT)} WHERE {where}", bounds)
+
+
+def archive_directory(using=None, directory=None):
+    directory = directory or getattr(settings, "EMAIL_EVENT_ARCHIVE_DIR", None)
+    if not directory:
+        return None
+    return Path(directory) / _using(using)
+
+
+def archive_path(month, using=None, directory=None):
+    return archive_directory(using, directory) / f"{PARENT}_{month:%Y%m}.evz"
+
+
+def _select(connection, table, start=None, end=None, filters=None, ids=None, reverse=False, before=None):
+    """Yield rows of ``table`` as dicts in timestamp order (newest first with
+    ``reverse``), ``FETCH_SIZE`` at a time."""
+    quote = connection.ops.quote_name
+    where, params = [], []
+    if start is not None:
+        where.append(f"{TIMESTAMP} >= %s")
+        params.append(connection.ops.adapt_datetimefield_value(start))
+    if end is not None:
+        where.append(f"{TIMESTAMP} < %s")
+        params.append(connection.ops.adapt_datetimefield_value(end))
+    if before is not None:
+        stamp = connection.ops.adapt_datetimefield_value(before[0])
+        # the plain bound lets the timestamp index range-scan; the OR breaks ties
+        where.append(f"{TIMESTAMP} <= %s AND ({TIMESTAMP} < %s OR id < %s)")
+        params.extend([stamp, stamp, before[1]])
+    if ids is not None:
+        where.append("id > %s AND id <= %s")
+        params.extend(ids)
+    for column, value in (filters or {}).items():
+        where.append(f"{quote(column)} = %s")
+        params.append(value)
+    direction = " DESC" if reverse else ""
+    sql = "SELECT %s FROM %s%s ORDER BY %s%s, id%s" % (
+        ", ".join(quote(column) for column in COLUMN_NAMES),
+        quote(table),
+        " WHERE " + " AND ".join(where) if where else "",
+        TIMESTAMP,
+        direction,
+        direction,
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(FETCH_SIZE)
+            if not rows:
+                return
+            for row in rows:
+                event = dict(zip(COLUMN_NAMES, row))
+                event["timestamp"] = _datetime(event["timestamp"])
+                event["created_at"] = _datetime(event["created_at"])
+                if event["ip_address"] is not None:
+                    event["ip_address"] = str(event["ip_address"])
+                yield event
+
+
+def _default_partition_months(connection, before):
+    """Months of the rows in ``email_event_default`` older than ``before``."""
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT DISTINCT date_trunc('month', {TIMESTAMP} AT TIME ZONE 'UTC') "
+            f"FROM {quote(DEFAULT_PARTITION)} WHERE {TIMESTAMP} < %s",
+            [before],
+        )
+        return sorted(row[0].replace(tzinfo=dt_timezone.utc) for row in cursor.fetchall())
+
+
+def archive_partitions(older_than_days, using=None, directory=None):
+    """Archive every monthly partition that ends more than ``older_than_days``
+    ago and drop it; returns ``[(month, rows)]``.
+
+    The file is written (merged with an existing archive of the same month,
+    e.g. late events) before the partition is dropped, so an interrupted run
+    leaves the rows in at least one place and the next run picks them up.
+    """
+    using = _using(using)
+    connection = connections[using]
+    if archive_directory(using, directory) is None:
+        raise ValueError("EMAIL_EVENT_ARCHIVE_DIR is not configured")
+    rotate_partitions(using)
+    cutoff = month_start(timezone.now() - timedelta(days=older_than_days))
+    if connection.vendor == "postgresql" and is_partitioned(using):
+        # rows outside the created months sit in the default partition;
+        # creating their month's partition moves them there
+        existing = {name for _, name in partitions(using)}
+        for month in _default_partition_months(connection, cutoff):
+            if partition_name(month) not in existing:
+                with transaction.atomic(using=using), connection.cursor() as cursor:
+                    _create_postgres_partition(cursor, connection, month)
+    quote = connection.ops.quote_name
+    archived = []
+    for month, table in partitions(using):
+        if month >= cutoff:
+            continue
+        path = archive_path(month, using, directory)
+        rows = {row["id"]: row for row in _select(connection, table)}
+        if rows and path.exists():
+            for row in ArchiveFile(path).read(month, next_month(month)):
+                rows.setdefault(row["id"], row)
+        if rows:
+            write_archive(path, rows.values())
+        with transaction.atomic(using=using), connection.cursor() as cursor:
+            if connection.vendor == "postgresql":
+                cursor.execute(f"ALTER TABLE {quote(PARENT)} DETACH PARTITION {quote(table)}")
+            cursor.execute(f"DROP TABLE {quote(table)}")
+        logger.info("archived %d events of %s to %s", len(rows), f"{month:%Y-%m}", path)
+        archived.append((month, len(rows)))
+    return archived
+
+
+def _archives(using, directory, start=None, end=None, ids=None):
+    base = archive_directory(using, directory)
+    if base is None or not base.is_dir():
+        return []
+    files = []
+    for path in sorted(base.glob(f"{PARENT}_*.evz")):
+        archive = ArchiveFile(path)
+        if archive.overlaps(start, end, ids):
+            files.append(archive)
+    return files
+
+
+def _sources(using, directory, start, end, filters, ids, reverse, before=None):
+    """Timestamp-ordered event streams of the archive, the SQLite monthly
+    tables and ``email_event`` for ``[start, end)`` (either open when ``None``)."""
+    connection = connections[using]
+    sources = [
+        archive.read(start, end, ids=ids, reverse=reverse, before=before, **filters)
+        for archive in _archives(using, directory, start, end, ids)
+    ]
+    if connection.vendor == "sqlite":
+        for month, table in partitions(using):
+            if (end is None or month < end) and (start is None or next_month(month) > start):
+                sources.append(_select(connection, table, start, end, filters, ids, reverse, before))
+    live = EmailEvent.objects.using(using).filter(**filters)
+    if start is not None:
+        live = live.filter(timestamp__gte=start)
+    if end is not None:
+        live = live.filter(timestamp__lt=end)
+    if ids is not None:
+        live = live.filter(id__gt=ids[0], id__lte=ids[1])
+    if before is not None:
+        live = live.filter(Q(timestamp__lt=before[0]) | Q(id__lt=before[1]), timestamp__lte=before[0])
+    order = ("-timestamp", "-id") if reverse else ("timestamp", "id")
+    sources.append(live.order_by(*order).values(*COLUMN_NAMES).iterator(chunk_size=FETCH_SIZE))
+    return sources
+
+
+def _merge(sources, reverse):
+    return heapq.merge(*sources, key=lambda event: (event["timestamp"], event["id"]), reverse=reverse)
+
+
+def _time_range(using, directory):
+    """``(oldest, newest)`` event timestamp across all stores, or ``(None, None)``."""
+    stamps = []
+    for archive in _archives(using, directory):
+        stamps += [from_micros(archive.header["min_timestamp"]), from_micros(archive.header["max_timestamp"])]
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    tables = [table for _, table in partitions(using)] if connection.vendor == "sqlite" else []
+    with connection.cursor() as cursor:
+        for table in tables:
+            cursor.execute(f"SELECT MIN({TIMESTAMP}), MAX({TIMESTAMP}) FROM {quote(table)}")
+            stamps += [_datetime(value) for value in cursor.fetchone()]
+    live = EmailEvent.objects.using(using).aggregate(oldest=Min("timestamp"), newest=Max("timestamp"))
+    stamps += [live["oldest"], live["newest"]]
+    stamps = [stamp for stamp in stamps if stamp is not None]
+    return (min(stamps), max(stamps)) if stamps else (None, None)
+
+
+def settled_partition_id(upto, using=None):
+    """SQLite: highest id in the monthly tables created no later than
+    ``upto`` (0 if none); rotated rows are out of the ORM's sight."""
+    using = _using(using)
+    connection = connections[using]
+    if connection.vendor != "sqlite":
+        return 0
+    quote = connection.ops.quote_name
+    highest = 0
+    with connection.cursor() as cursor:
+        for _, table in partitions(using):
+            cursor.execute(
+                f"SELECT MAX(id) FROM {quote(table)} WHERE created_at <= %s",
+                [connection.ops.adapt_datetimefield_value(upto)],
+            )
+            highest = max(highest, cursor.fetchone()[0] or 0)
+    return highest
+
+
+def latest_event_id(using=None, directory=None):
+    """Highest ``EmailEvent`` id in any store, archive included (0 if none)."""
+    using = _using(using)
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    highest = max((archive.header.get("max_id") or 0 for archive in _archives(using, directory)), default=0)
+    if connection.vendor == "sqlite":
+        with connection.cursor() as cursor:
+            for _, table in partitions(using):
+                cursor.execute(f"SELECT MAX(id) FROM {quote(table)}")
+                highest = max(highest, cursor.fetchone()[0] or 0)
+    live = EmailEvent.objects.using(using).aggregate(highest=Max("id"))["highest"]
+    return max(highest, live or 0)
+
+
+def events_in_range(start=None, end=None, email_campaign_id=None, event_type=None, using=None, directory=None,
+                    customer_id=None, ids=None, reverse=False, before=None):
+    """Yield events with ``start <= timestamp < end`` as dicts (``archive.COLUMN_NAMES``),
+    in timestamp order (newest first with ``reverse``), from archived files,
+    partitions and live rows alike. ``start``/``end`` may be left open;
+    ``ids=(low, high)`` keeps the events with ``low < id <= high``, and
+    ``before=(timestamp, id)`` the ones sorting before that event (a keyset
+    cursor, applied in every store's query).
+
+    Time ranges are read a month at a time, so a consumer that stops early
+    never touches the months it did not reach."""
+    using = _using(using)
+    filters = {
+        name: value
+        for name, value in (("email_campaign_id", email_campaign_id), ("customer_id", customer_id),
+                            ("event_type", event_type))
+        if value is not None
+    }
+    if ids is not None:
+        # an id window is a few recent rows, not a time range worth splitting
+        return _merge(_sources(using, directory, start, end, filters, ids, reverse, before), reverse)
+    if before is not None:
+        bound = before[0] + timedelta(microseconds=1)
+        end = min(end, bound) if end else bound
+    if reverse and end is not None:
+        return _read_back(using, directory, start, end, filters, before)
+    # windows only cover months that hold events
+    oldest, newest = _time_range(using, directory)
+    if oldest is None:
+        return iter(())
+    start = max(start, oldest) if start else oldest
+    end = min(end, newest + timedelta(microseconds=1)) if end else newest + timedelta(microseconds=1)
+    windows = []
+    month = month_start(start)
+    while month < end:
+        windows.append((max(start, month), min(end, next_month(month))))
+        month = next_month(month)
+    if reverse:
+        windows.reverse()
+    return chain.from_iterable(
+        _merge(_sources(using, directory, low, high, filters, None, reverse, before), reverse)
+        for low, high in windows
+    )
+
+
+def _read_back(using, directory, start, end, filters, before):
+    """Newest first from ``end`` back, a month at a time. The stored time
+    range is only looked up (once) when a month turns out empty, so pages
+    that fill from the months they start in never scan it."""
+    oldest = None
+    high = end
+    while start is None or high > start:
+        month = month_start(high - timedelta(microseconds=1))
+        low = max(start, month) if start else month
+        empty = True
+        for event in _merge(_sources(using, directory, low, high, filters, None, True, before), True):
+            empty = False
+            yield event
+        if empty:
+            if oldest is None:
+                oldest = _time_range(using, directory)[0]
+            if oldest is None or low <= oldest:
+                return
+        high = low
+
+
+def delete_campaign_events(email_campaign_id, using=None, directory=None):
+    """Remove the events of ``email_campaign_id`` that the ORM cascade does
+    not reach: SQLite monthly tables and archived files."""
+    using = _using(using)
+    connection = connections[using]
+    if connection.vendor == "sqlite":
+        quote = connection.ops.quote_name
+        with transaction.atomic(using=using), connection.cursor() as cursor:
+            for _, table in partitions(using):
+                cursor.execute(f"DELETE FROM {quote(table)} WHERE email_campaign_id = %s", [email_campaign_id])
+    for archive in _archives(using, directory):
+        ids = archive._raw("email_campaign_id")[1]
+        if email_campaign_id in ids:
+            rows = [row for row in archive.read() if row["email_campaign_id"] != email_campaign_id]
+            write_archive(archive.path, rows)
@@ -0,0 +1,104 @@
+"""
+Unique reach (distinct opening / clicking addresses) of email campaigns.
+
+``EmailCampaign.opened_count``/``clicked_count`` count events, so someone
+opening a message five times counts five times, and ``COUNT(DISTINCT ...)``
+over ``EmailEvent`` gets slower with every event. Instead every ingest flush
+adds the addresses of its opened and clicked events to one
+``EmailReachSketch`` (a HyperLogLog, ``campaign.hll``) per email campaign,
+day and event type, in the transaction that applies the counters.
+
+Sketches merge losslessly, so ``unique_reach`` answers for any range of
+days and any set of email campaigns (A/B variants, or all the email
+campaigns of a ``campaign.Campaign``) by merging a few 16 KiB sketches,
+whatever the number of events, with a relative standard error of about
+0.8%.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.utils import timezone
+
+from campaign.hll import HyperLogLog
+
+from .models import EmailCampaign, EmailReachSketch
+
+REACH_EVENTS = ("opened", "clicked")
+
+
+def update_sketches(events, using=None):
+    """Add the addresses of the opened and clicked ``events`` (dicts, as
+    flushed by ``emailMarketing.ingest``) to their sketches; returns the
+    number of sketches written."""
+    grouped = defaultdict(list)
+    for event in events:
+        if event["event_type"] in REACH_EVENTS:
+            day = timezone.localtime(event["timestamp"]).date()
+            grouped[(event["email_campaign_id"], day, event["event_type"])].append(
+                event["email_address"].strip().lower()
+            )
+    if not grouped:
+        return 0
+    sketches = EmailReachSketch.objects.using(using)
+    empty = HyperLogLog().to_bytes()
+    with transaction.atomic(using=using):
+        # create missing rows first so that concurrent flushers lock the same rows below
+        sketches.bulk_create(
+            [
+                EmailReachSketch(email_campaign_id=campaign_id, day=day, event_type=event_type, sketch=empty)
+                for campaign_id, day, event_type in grouped
+            ],
+            ignore_conflicts=True,
+        )
+        rows = (
+            sketches.select_for_update()
+            .filter(
+                email_campaign_id__in={key[0] for key in grouped},
+                day__in={key[1] for key in grouped},
+                event_type__in={key[2] for key in grouped},
+            )
+            .order_by("pk")
+        )
+        now = timezone.now()
+        changed = []
+        for row in rows:
+            addresses = grouped.get((row.email_campaign_id, row.day, row.event_type))
+            if addresses is None:
+                continue
+            sketch = row.hll()
+            sketch.update(addresses)
+            row.sketch = sketch.to_bytes()
+            row.unique_count = sketch.count()
+            row.updated_at = now
+            changed.append(row)
+        sketches.bulk_update(changed, ["sketch", "unique_count", "updated_at"])
+    return len(changed)
+
+
+def unique_reach(email_campaign_ids, event_type="opened", start=None, end=None, using=None):
+    """Merged ``HyperLogLog`` of the addresses with an ``event_type`` event in
+    any of ``email_campaign_ids`` on days ``start`` to ``end`` (inclusive,
+    either optional); ``count()`` is the estimate, ``standard_error`` its
+    relative error."""
+    rows = EmailReachSketch.objects.using(using).filter(
+        email_campaign_id__in=list(email_campaign_ids), event_type=event_type
+    )
+    if start is not None:
+        rows = rows.filter(day__gte=start)
+    if end is not None:
+        rows = rows.filter(day__lte=end)
+    return HyperLogLog.union(HyperLogLog.from_bytes(data) for data in rows.values_list("sketch", flat=True))
+
+
+def campaign_reach(campaign_id, event_type="opened", start=None, end=None, using=None):
+    """Unique reach of a ``campaign.Campaign``: ``(per_variant, total)`` where
+    ``per_variant`` maps each email campaign's ``ab_test_variant`` (or its id
+    when it has none) to a ``HyperLogLog`` and ``total`` is their merge, i.e.
+    people reached by any variant, counted once."""
+    variants = dict(
+        EmailCampaign.objects.using(using).filter(campaign_id=campaign_id).values_list("pk", "ab_test_variant")
+    )
+    per_variant = {
+        variant or pk: unique_reach([pk], event_type, start, end, using) for pk, variant in variants.items()
+    }
+    return per_variant, HyperLogLog.union(per_variant.values())
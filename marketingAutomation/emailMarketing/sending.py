@@ -0,0 +1,336 @@
+"""
+Asyncio send pipeline for an ``EmailCampaign``.
+
+Recipients are streamed from the campaign's ``customer_segment`` bitmap in
+batches of customer ids, turned into addresses by the configured
+``EMAIL_RECIPIENT_RESOLVER``, rendered from the precompiled artifact of the
+``email_template`` (see ``emailMarketing.artifacts``) and sent over a bounded pool of persistent SMTP connections (``EMAIL_HOST``
+and friends). Each batch is recorded with one insert of ``sent``
+(or ``bounced``) ``EmailEvent`` rows via ``bulk_insert`` and one ``F()``
+update of the counters. Addresses in the suppression index (bounced or
+unsubscribed before, see ``emailMarketing.suppression``) are skipped, and
+new hard (5xx) bounces are added to it; temporary (4xx) refusals count as
+failed sends. With ``EMAIL_TRACKING_BASE_URL`` set, the
+template's links are registered for the campaign and the artifact points
+them at the click tracker, so each message only adds its recipient token.
+
+Segment members are sent in ascending customer id order, and each batch's
+record also moves the campaign's ``send_cursor`` past the batch. A run that
+dies part way leaves the campaign ``failed`` with the cursor at the last
+recorded batch; running it again resumes after the cursor, so at most the
+batch that was on the wire is sent twice. Failed sends are counted, not
+retried.
+
+Messages are assembled directly as bytes: the headers shared by the whole
+campaign and the MIME skeleton are built once, and the quoted-printable
+parts are the artifact's pre-encoded static chunks joined with the encoded
+placeholder values, which keeps per-message overhead small enough for
+thousands of messages per second.
+"""
+import asyncio
+import logging
+import uuid
+from email.header import Header
+from email.utils import formataddr, formatdate
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from campaign.templating import compiled_template
+
+from .artifacts import template_artifact
+from .models import EmailCampaign, EmailEvent
+from .suppression import record_suppressions, suppression_index
+from .tracking import recipient_token, tracked_links
+
+try:
+    import aiosmtplib
+except ImportError:  # pragma: no cover
+    aiosmtplib = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POOL_SIZE = 8
+DEFAULT_BATCH_SIZE = 500
+
+
+def _refusal(replies):
+    """``(outcome, reason)`` for refused recipients' ``(code, text)`` replies:
+    a permanent (5xx) refusal is a hard bounce, which suppresses the address;
+    a temporary (4xx) one, e.g. a full mailbox or greylisting, is only a
+    failed send."""
+    outcome = "bounced" if any(code >= 500 for code, _ in replies) else "failed"
+    return outcome, "; ".join(text for _, text in replies)
+
+
+def _header(value):
+    if value.isascii():
+        return value
+    return Header(value, "utf-8").encode()
+
+
+def get_recipient_resolver():
+    """``EMAIL_RECIPIENT_RESOLVER``: ``resolver(customer_ids, email_campaign)``
+    returning an iterable of dicts with at least ``email`` (and usually
+    ``customer_id`` plus any fields the template uses)."""
+    path = getattr(settings, "EMAIL_RECIPIENT_RESOLVER", None)
+    if not path:
+        raise ImproperlyConfigured("EMAIL_RECIPIENT_RESOLVER is not configured")
+    return import_string(path)
+
+
+class SMTPPool:
+    """Bounded pool of persistent ``aiosmtplib.SMTP`` connections."""
+
+    def __init__(self, size=DEFAULT_POOL_SIZE, **options):
+        if aiosmtplib is None:
+            raise ImproperlyConfigured("aiosmtplib is required to send email campaigns")
+        self.size = size
+        self.options = {
+            "hostname": settings.EMAIL_HOST,
+            "port": settings.EMAIL_PORT,
+            "username": settings.EMAIL_HOST_USER or None,
+            "password": settings.EMAIL_HOST_PASSWORD or None,
+            "use_tls": settings.EMAIL_USE_SSL,
+            "start_tls": settings.EMAIL_USE_TLS or None,
+            "timeout": settings.EMAIL_TIMEOUT or 60,
+            **options,
+        }
+        self._idle = asyncio.Queue()
+        self._slots = asyncio.Semaphore(size)
+        self._all = []
+
+    async def acquire(self):
+        await self._slots.acquire()
+        try:
+            client = self._idle.get_nowait()
+        except asyncio.QueueEmpty:
+            client = aiosmtplib.SMTP(**self.options)
+            self._all.append(client)
+        try:
+            if not client.is_connected:
+                await client.connect()
+        except Exception:
+            self._slots.release()
+            self._idle.put_nowait(client)
+            raise
+        return client
+
+    def release(self, client, broken=False):
+        if broken:
+            client.close()
+        self._idle.put_nowait(client)
+        self._slots.release()
+
+    async def close(self):
+        for client in self._all:
+            if client.is_connected:
+                try:
+                    await client.quit()
+                except aiosmtplib.SMTPException:
+                    client.close()
+        self._all.clear()
+
+
+class EmailSendPipeline:
+    def __init__(self, email_campaign, pool=None, batch_size=None, resolver=None):
+        self.email_campaign = email_campaign
+        self.pool = pool or SMTPPool(getattr(settings, "EMAIL_SEND_POOL_SIZE", DEFAULT_POOL_SIZE))
+        self.batch_size = batch_size or getattr(settings, "EMAIL_SEND_BATCH_SIZE", DEFAULT_BATCH_SIZE)
+        self.resolver = resolver or get_recipient_resolver()
+        self.sent = 0
+        self.bounced = 0
+        self.failed = 0
+        self.suppressed = 0
+
+    def _prepare(self):
+        campaign = self.email_campaign
+        links = tracked_links(campaign)
+        self.tracking = bool(links)
+        self.artifact = template_artifact(campaign.email_template, links)
+        self.subject = compiled_template(campaign, "subject_line", autoescape=False)
+        self.sender = campaign.from_email
+        self.domain = campaign.from_email.rpartition("@")[2] or "localhost"
+        self.base_context = dict(campaign.personalization_fields or {})
+
+        common = [
+            b"From: " + _header(formataddr((campaign.from_name or "", campaign.from_email))).encode(),
+            b"MIME-Version: 1.0",
+        ]
+        if campaign.reply_to_email:
+            common.append(b"Reply-To: " + campaign.reply_to_email.encode())
+        self.common_headers = b"\r\n".join(common) + b"\r\n"
+        self.boundary = f"=_{uuid.uuid4().hex}".encode()
+        self.part_headers = b'Content-Type: text/%s; charset="utf-8"\r\nContent-Transfer-Encoding: quoted-printable\r\n\r\n'
+
+    def build(self, recipient, date):
+        """Raw RFC 5322 bytes for one recipient dict."""
+        context = {**self.base_context, **recipient, "customer": recipient}
+        if self.tracking:
+            context["tracking_token"] = recipient_token(
+                self.email_campaign, recipient["email"], recipient.get("customer_id")
+            )
+        boundary = self.boundary
+        head = [
+            self.common_headers,
+            b"To: ", recipient["email"].encode(), b"\r\n",
+            b"Subject: ", _header(self.subject.render(context)).encode(), b"\r\n",
+            b"Date: ", date, b"\r\n",
+            b"Message-ID: <", uuid.uuid4().hex.encode(), b"@", self.domain.encode(), b">\r\n",
+            b'Content-Type: multipart/alternative; boundary="', boundary, b'"\r\n\r\n',
+        ]
+        text = self.artifact.text_part(context)
+        if text is not None:
+            head += [b"--", boundary, b"\r\n", self.part_headers % b"plain", text]
+        head += [
+            b"--", boundary, b"\r\n", self.part_headers % b"html", self.artifact.html_part(context),
+            b"--", boundary, b"--\r\n",
+        ]
+        return b"".join(head)
+
+    async def _send(self, recipient, message):
+        """Send one message, retrying once on a fresh connection; returns ``(outcome, reason)``."""
+        error = None
+        for _ in range(2):
+            try:
+                client = await self.pool.acquire()
+            except (aiosmtplib.SMTPException, OSError) as exc:
+                error = exc
+                continue
+            try:
+                errors, _ = await client.sendmail(self.sender, [recipient["email"]], message)
+            except aiosmtplib.SMTPRecipientsRefused as exc:
+                self.pool.release(client)
+                return _refusal([(r.code, str(r)) for r in exc.recipients])
+            except (aiosmtplib.SMTPServerDisconnected, aiosmtplib.SMTPConnectError, OSError) as exc:
+                self.pool.release(client, broken=True)
+                error = exc
+                continue
+            except aiosmtplib.SMTPException as exc:
+                self.pool.release(client)
+                return "failed", str(exc)
+            self.pool.release(client)
+            if errors:
+                return _refusal([(reply.code, f"{addr}: {reply}") for addr, reply in errors.items()])
+            return "sent", None
+        logger.warning("sending to %s failed: %s", recipient["email"], error)
+        return "failed", str(error)
+
+    def _record(self, recipients, outcomes, cursor):
+        now = timezone.now()
+        events = []
+        bounced_addresses = []
+        sent = bounced = 0
+        for recipient, (outcome, reason) in zip(recipients, outcomes):
+            if outcome == "failed":
+                continue
+            if outcome == "sent":
+                sent += 1
+            else:
+                bounced += 1
+                bounced_addresses.append(recipient["email"])
+            events.append({
+                "email_campaign_id": self.email_campaign.pk,
+                "customer_id": recipient.get("customer_id"),
+                "event_type": outcome,
+                "email_address": recipient["email"],
+                "timestamp": now,
+                "bounce_reason": reason,
+            })
+        with transaction.atomic():
+            EmailEvent.objects.bulk_insert(events)
+            EmailCampaign.objects.filter(pk=self.email_campaign.pk).update(
+                sent_count=F("sent_count") + sent,
+                bounced_count=F("bounced_count") + bounced,
+                send_cursor=cursor,
+                updated_at=now,
+            )
+            if bounced_addresses:
+                transaction.on_commit(lambda: record_suppressions(bounced_addresses))
+        return sent, bounced
+
+    def _batches(self):
+        """``(recipients, cursor)`` per batch of segment members after the
+        campaign's ``send_cursor``; ``cursor`` is the batch's last customer id."""
+        members = self.email_campaign.customer_segment.get_members()
+        cursor = self.email_campaign.send_cursor
+        for ids in members.iter_chunks(self.batch_size):
+            if cursor is not None:
+                if ids[-1] <= cursor:
+                    continue
+                ids = [i for i in ids if i > cursor]
+            recipients = [r for r in self.resolver(ids, self.email_campaign) if r.get("email")]
+            # refreshed per batch, so suppressions arriving mid-send apply
+            allowed = suppression_index().exclude(recipients)
+            self.suppressed += len(recipients) - len(allowed)
+            yield allowed, ids[-1]
+
+    def _set_status(self, status):
+        EmailCampaign.objects.filter(pk=self.email_campaign.pk).update(status=status, updated_at=timezone.now())
+        self.email_campaign.status = status
+
+    async def run(self):
+        """Send to the segment members after ``send_cursor``; the campaign ends
+        up ``sent``, or ``failed`` when nothing went out or the run raised."""
+        await sync_to_async(self._prepare)()
+        status = "failed"
+        upcoming = None
+        try:
+            await sync_to_async(self._set_status)("sending")
+            batches = await sync_to_async(self._batches)()
+            next_batch = sync_to_async(lambda: next(batches, None))
+            batch = await next_batch()
+            while batch is not None:
+                recipients, cursor = batch
+                date = formatdate(usegmt=True).encode()
+                messages = [self.build(r, date) for r in recipients]
+                # Resolve the next batch while this one is on the wire.
+                upcoming = asyncio.ensure_future(next_batch())
+                outcomes = await asyncio.gather(*map(self._send, recipients, messages))
+                self.failed += sum(1 for outcome, _ in outcomes if outcome == "failed")
+                sent, bounced = await sync_to_async(self._record)(recipients, outcomes, cursor)
+                self.sent += sent
+                self.bounced += bounced
+                batch = await upcoming
+            status = "sent" if self.sent or not self.failed else "failed"
+        finally:
+            if upcoming is not None:
+                upcoming.cancel()
+            await self.pool.close()
+            await sync_to_async(self._set_status)(status)
+        return self.sent
+
+
+def send_email_campaign(email_campaign, **kwargs):
+    """Run the send pipeline for ``email_campaign`` to completion; returns messages sent."""
+    return asyncio.run(EmailSendPipeline(email_campaign, **kwargs).run())
+
+
+def send_due_campaigns(now=None, pool_size=None, **kwargs):
+    """Send the ``scheduled`` email campaigns whose ``scheduled_time`` has come
+    (promoted A/B test winners among them), one after the other; returns the
+    messages sent. Each campaign is claimed first, so concurrent workers send
+    it once; one that fails is logged and left ``failed``."""
+    now = now or timezone.now()
+    due = (
+        EmailCampaign.objects.select_related("email_template", "customer_segment")
+        .filter(status="scheduled", scheduled_time__lte=now)
+        .order_by("scheduled_time", "pk")
+    )
+    sent = 0
+    for email_campaign in due:
+        if not EmailCampaign.objects.filter(pk=email_campaign.pk, status="scheduled").update(
+            status="sending", updated_at=timezone.now()
+        ):
+            continue
+        pool = SMTPPool(pool_size) if pool_size else None
+        try:
+            sent += send_email_campaign(email_campaign, pool=pool, **kwargs)
+        except Exception:
+            logger.exception("sending email campaign %s failed", email_campaign.pk)
+    return sent
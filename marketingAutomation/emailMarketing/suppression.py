@@ -0,0 +1,431 @@
+"""
+Suppression index of bounced and unsubscribed addresses.
+
+Sends must skip every address that bounced or unsubscribed, and looking
+each recipient up in ``EmailEvent`` is far too slow, so every database alias
+(i.e. every tenant) gets an index under ``EMAIL_SUPPRESSION_DIR`` holding
+the 64-bit hashes of the normalized addresses (``address_hashes``):
+
+* ``<alias>.idx``: a header, a directory of offsets by the top bits of the
+  hash and the sorted hashes. Readers memory-map it, so a process only pages
+  in what its lookups touch and all processes share the same pages.
+* ``<alias>.log``: hashes appended since the ``.idx`` was written, held in
+  memory by readers as a small overlay set.
+* ``<alias>.tomb``: the addresses whose suppression was lifted, each with
+  the highest ``EmailEvent`` id at that time.
+
+``record_suppressions`` appends to the log as events are stored (by the
+ingest flush and by the send pipeline for its own bounces), and a reader
+picks them up on its next ``refresh``, which costs two ``stat`` calls when
+nothing changed. ``compact_suppression_index`` folds the log, plus any
+suppression events past the index's ``EmailEvent`` id watermark, into a new
+``.idx``; the first build reads every event, archived months included
+(``partitions.events_in_range``).
+
+``remove_suppressions`` lifts a suppression (say a customer subscribes
+again) by appending a tombstone to the log. Readers and compaction replay
+the log in order, so a later suppression of the same address wins again.
+Compaction drops tombstoned hashes from the index and keeps the tombstones
+in ``.tomb``: suppression events up to a tombstone's id no longer count for
+its address, not even in a full rebuild.
+
+A batch is checked either by intersecting the set of its hashes with the
+whole index (large batches) or by bisecting one directory block per
+recipient (small ones), whichever touches fewer entries.
+"""
+import bisect
+import hashlib
+import heapq
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+from array import array
+from functools import partial
+from itertools import compress, filterfalse
+from operator import methodcaller, not_
+from pathlib import Path
+
+from django.conf import settings
+from django.db import router
+
+from .models import EmailEvent
+from .partitions import FETCH_SIZE, events_in_range, latest_event_id
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+SUPPRESSION_EVENTS = ("bounced", "unsubscribed")
+MAGIC = b"SUP1"
+# log marker of a tombstone: followed by the hash and an EmailEvent id (a
+# 64-bit hash of 0 is not expected to occur)
+TOMBSTONE = 0
+# magic, directory bits, hash count, EmailEvent id watermark
+HEADER = struct.Struct("<4sIQq8x")
+MAX_DIRECTORY_BITS = 16
+DEFAULT_COMPACT_AFTER = 50_000
+# a scan reads every index entry, a bisect about a dozen; scan when cheaper
+SCAN_RATIO = 12
+
+_blake2b = partial(hashlib.blake2b, digest_size=8)
+_digest = methodcaller("digest")
+
+
+def address_hashes(addresses):
+    """``array("Q")`` of the 64-bit hashes of ``addresses``, stripped and
+    lowercased; one pass of C-level maps, as this dominates a lookup."""
+    normalized = map(str.encode, map(str.lower, map(str.strip, addresses)))
+    hashes = array("Q")
+    hashes.frombytes(b"".join(map(_digest, map(_blake2b, normalized))))
+    return hashes
+
+
+def _directory_bits(count):
+    return max(0, min(MAX_DIRECTORY_BITS, count.bit_length() - 3))
+
+
+def write_index(path, hashes, watermark=0):
+    """Write sorted, distinct ``hashes`` as an index file, atomically."""
+    hashes = hashes if isinstance(hashes, array) else array("Q", hashes)
+    bits = _directory_bits(len(hashes))
+    shift = 64 - bits
+    directory = array("Q", (bisect.bisect_left(hashes, block << shift) for block in range(1 << bits)))
+    directory.append(len(hashes))
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    with os.fdopen(fd, "wb") as handle:
+        handle.write(HEADER.pack(MAGIC, bits, len(hashes), watermark))
+        directory.tofile(handle)
+        hashes.tofile(handle)
+    os.replace(tmp, path)
+
+
+def _read_index(path):
+    """``(hashes, directory, bits, watermark)`` of an index file, memory-mapped."""
+    with open(path, "rb") as handle:
+        header = handle.read(HEADER.size)
+        if len(header) < HEADER.size or header[:4] != MAGIC:
+            raise ValueError(f"{path} is not a suppression index")
+        _, bits, count, watermark = HEADER.unpack(header)
+        if not count:
+            return array("Q"), array("Q", [0] * ((1 << bits) + 1)), bits, watermark
+        mapped = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapped)
+    start = HEADER.size + ((1 << bits) + 1) * 8
+    return view[start:start + count * 8].cast("Q"), view[HEADER.size:start].cast("Q"), bits, watermark
+
+
+def _read_log(path, start=0):
+    """Records in the log from byte ``start``; returns ``(records, end)``. A
+    suppression is its hash, a tombstone ``TOMBSTONE, hash, event id``."""
+    records = array("Q")
+    try:
+        with open(path, "rb") as handle:
+            handle.seek(start)
+            data = handle.read()
+    except FileNotFoundError:
+        return records, 0
+    usable = len(data) - len(data) % 8  # a record being appended right now
+    records.frombytes(data[:usable])
+    if TOMBSTONE in records:
+        position = 0
+        while position < len(records):
+            if records[position] != TOMBSTONE:
+                position += 1
+            elif position + 3 <= len(records):
+                position += 3
+            else:
+                del records[position:]  # a tombstone being appended
+    return records, start + len(records) * 8
+
+
+def _replay_log(records, added, removed, tombstones=None):
+    """Apply log ``records`` in order to the ``added`` and ``removed`` hash
+    sets, so the last record of a hash wins; tombstone ids go to ``tombstones``."""
+    if TOMBSTONE not in records:
+        added.update(records)
+        if removed:
+            removed.difference_update(records)
+        return
+    position = 0
+    while position < len(records):
+        value = records[position]
+        if value != TOMBSTONE:
+            added.add(value)
+            removed.discard(value)
+            position += 1
+            continue
+        value, event_id = records[position + 1], records[position + 2]
+        added.discard(value)
+        removed.add(value)
+        if tombstones is not None:
+            tombstones[value] = max(tombstones.get(value, 0), event_id)
+        position += 3
+
+
+def _read_tombstones(path):
+    """``{hash: EmailEvent id}`` of a ``.tomb`` file."""
+    records = array("Q")
+    try:
+        with open(path, "rb") as handle:
+            records.frombytes(handle.read())
+    except FileNotFoundError:
+        pass
+    return dict(zip(records[::2], records[1::2]))
+
+
+def _write_tombstones(path, tombstones):
+    records = array("Q")
+    for value in sorted(tombstones):
+        records.extend((value, tombstones[value]))
+    fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    with os.fdopen(fd, "wb") as handle:
+        records.tofile(handle)
+    os.replace(tmp, path)
+
+
+def _lock(handle, exclusive=False):
+    """Writers share the log; compaction has it to itself. Released on close."""
+    if fcntl is not None:
+        fcntl.flock(handle.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+
+
+def suppression_paths(using):
+    directory = getattr(settings, "EMAIL_SUPPRESSION_DIR", None) or Path(settings.BASE_DIR) / "suppression"
+    return Path(directory) / f"{using}.idx", Path(directory) / f"{using}.log"
+
+
+def tombstone_path(using):
+    return suppression_paths(using)[0].with_suffix(".tomb")
+
+
+class SuppressionIndex:
+    """Read side of one alias's suppression index; safe to share between threads."""
+
+    def __init__(self, index_path, log_path):
+        self.index_path = Path(index_path)
+        self.log_path = Path(log_path)
+        self._lock = threading.Lock()
+        self._signature = None
+        self._log_end = 0
+        self._hashes = array("Q")
+        self._directory = array("Q", [0, 0])
+        self._shift = 64
+        self._overlay = set()
+        self._removed = set()
+        self.watermark = 0
+
+    def _load(self):
+        try:
+            stat = os.stat(self.index_path)
+        except FileNotFoundError:
+            signature = None
+        else:
+            signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if signature == self._signature:
+            return False
+        if signature is None:
+            self._hashes, self._directory, self._shift, self.watermark = array("Q"), array("Q", [0, 0]), 64, 0
+        else:
+            self._hashes, self._directory, bits, self.watermark = _read_index(self.index_path)
+            self._shift = 64 - bits
+        self._signature = signature
+        self._overlay = set()
+        self._removed = set()
+        self._log_end = 0
+        return True
+
+    def refresh(self):
+        """Pick up a new ``.idx`` and hashes appended to the log since the last call."""
+        with self._lock:
+            self._load()
+            try:
+                size = os.stat(self.log_path).st_size
+            except FileNotFoundError:
+                size = 0
+            if size < self._log_end:
+                # compacted between the two stats: the new index has the entries
+                self._signature = None
+                self._load()
+            if size > self._log_end:
+                records, self._log_end = _read_log(self.log_path, self._log_end)
+                _replay_log(records, self._overlay, self._removed)
+
+    def contains_hashes(self, hashes):
+        """For each hash, whether it is suppressed."""
+        with self._lock:
+            base, overlay, removed = self._hashes, self._overlay, self._removed
+            if len(hashes) * SCAN_RATIO >= len(base):
+                wanted = set(hashes)
+                found = wanted.intersection(base)
+                if removed:
+                    found.difference_update(removed)
+                if overlay:
+                    found.update(wanted.intersection(overlay))
+                return list(map(found.__contains__, hashes))
+            directory, shift, bisect_left = self._directory, self._shift, bisect.bisect_left
+            result = []
+            append = result.append
+            for value in hashes:
+                block = value >> shift
+                low, high = directory[block], directory[block + 1]
+                position = bisect_left(base, value, low, high)
+                append((position < high and base[position] == value and value not in removed) or value in overlay)
+            return result
+
+    def suppressed(self, addresses):
+        """For each address, whether it is suppressed."""
+        return self.contains_hashes(address_hashes(addresses))
+
+    def __contains__(self, address):
+        return self.suppressed([address])[0]
+
+    def exclude(self, items, key=lambda item: item["email"]):
+        """``items`` whose address (``key(item)``) is not suppressed."""
+        flags = self.suppressed(list(map(key, items)))
+        return list(compress(items, map(not_, flags)))
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def _alias(using):
+    return using or router.db_for_write(EmailEvent) or "default"
+
+
+def suppression_index(using=None):
+    """Process-wide ``SuppressionIndex`` of ``using``, refreshed."""
+    using = _alias(using)
+    index = _indexes.get(using)
+    if index is None:
+        with _indexes_lock:
+            index = _indexes.setdefault(using, SuppressionIndex(*suppression_paths(using)))
+    index.refresh()
+    return index
+
+
+def record_suppressions(addresses, using=None):
+    """Append ``addresses`` to the log of ``using``'s index; visible to readers
+    on their next ``refresh``. Call it once the events are committed."""
+    hashes = address_hashes(addresses)
+    if not hashes:
+        return 0
+    log_path = suppression_paths(_alias(using))[1]
+    log_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(log_path, "ab") as handle:
+        _lock(handle)
+        handle.write(hashes.tobytes())
+    return len(hashes)
+
+
+def remove_suppressions(addresses, using=None):
+    """Lift the suppression of ``addresses`` by appending tombstones to the
+    log of ``using``'s index; the suppression events stored so far stop
+    counting for them, a later bounce or unsubscribe suppresses them again."""
+    hashes = address_hashes(addresses)
+    if not hashes:
+        return 0
+    using = _alias(using)
+    event_id = latest_event_id(using)
+    records = array("Q")
+    for value in hashes:
+        records.extend((TOMBSTONE, value, event_id))
+    log_path = suppression_paths(using)[1]
+    log_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(log_path, "ab") as handle:
+        _lock(handle)
+        handle.write(records.tobytes())
+    return len(hashes)
+
+
+def _events_since(watermark, using):
+    """``(addresses, ids, highest id)`` of suppression events past
+    ``watermark``; ``None`` reads them all, archived and partitioned months
+    included."""
+    highest = watermark or 0
+    if watermark is None:
+        rows = (
+            (event["id"], event["email_address"])
+            for event_type in SUPPRESSION_EVENTS
+            for event in events_in_range(event_type=event_type, using=using)
+        )
+    else:
+        rows = (
+            EmailEvent.objects.using(using)
+            .filter(pk__gt=watermark, event_type__in=SUPPRESSION_EVENTS)
+            .values_list("pk", "email_address")
+            .iterator(chunk_size=FETCH_SIZE)
+        )
+    addresses, ids = [], array("Q")
+    for pk, address in rows:
+        addresses.append(address)
+        ids.append(pk)
+    return addresses, ids, max(ids, default=highest)
+
+
+def _distinct(values):
+    previous = None
+    for value in values:
+        if value != previous:
+            yield value
+            previous = value
+
+
+def compact_suppression_index(using=None, full=False, min_log=0):
+    """Rebuild ``using``'s index from the current one, its log and the
+    suppression events past its watermark (all events with ``full`` or when
+    there is no index yet). Skipped, returning ``None``, while the log holds
+    fewer than ``min_log`` hashes; otherwise returns the number of hashes.
+    """
+    using = _alias(using)
+    index_path, log_path = suppression_paths(using)
+    if not full and index_path.exists():
+        try:
+            if os.stat(log_path).st_size < min_log * 8:
+                return None
+        except FileNotFoundError:
+            if min_log:
+                return None
+        watermark = _read_index(index_path)[3]
+    else:
+        watermark = None
+    # outside the lock: a full scan can take a while and writers must not wait
+    addresses, ids, highest = _events_since(watermark, using)
+    fresh_hashes = address_hashes(addresses)
+    log_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(log_path, "ab") as log:
+        _lock(log, exclusive=True)
+        hashes = array("Q")
+        if watermark is not None and index_path.exists():
+            hashes, _, _, current = _read_index(index_path)
+            highest = max(highest, current)
+        tomb_path = tombstone_path(using)
+        tombstones = _read_tombstones(tomb_path)
+        known = len(tombstones)
+        added, removed = set(), set()
+        _replay_log(_read_log(log_path)[0], added, removed, tombstones)
+        if tombstones:
+            # events up to an address's tombstone were lifted
+            fresh = {value for value, pk in zip(fresh_hashes, ids) if pk > tombstones.get(value, -1)}
+        else:
+            fresh = set(fresh_hashes)
+        fresh.update(added)
+        if removed:
+            hashes = filterfalse(removed.__contains__, hashes)
+        merged = array("Q", _distinct(heapq.merge(hashes, sorted(fresh))))
+        if removed or len(tombstones) != known:
+            # before the log that holds them is truncated
+            _write_tombstones(tomb_path, tombstones)
+        write_index(index_path, merged, highest)
+        # readers see the new index before the log shrinks (see refresh)
+        log.truncate(0)
+    logger.info("suppression index of %s: %d addresses", using, len(merged))
+    return len(merged)
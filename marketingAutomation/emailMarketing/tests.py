@@ -1,3 +1,543 @@
-from django.test import TestCase
+import hashlib
+import hmac
+import json
+import os
+import shutil
+import socket
+import tempfile
+from array import array
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from aiosmtpd.controller import Controller
+from django.conf import settings
+from django.core.management import call_command
+from django.db import OperationalError
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from campaign.models import Campaign, CustomerSegment
+from campaign.rollups import campaign_totals, run_rollups
+
+from . import partitions, suppression, tracking
+from .abtest import evaluate_test
+from .artifacts import ArtifactCache
+from .ingest import InvalidEvent, flush_staged_events, parse_event, stage_events
+from .links import extract_links, link_cache, register_links
+from .models import EmailCampaign, EmailEvent, EmailEventStaging, EmailLink, EmailTemplate
+from .partitions import archive_partitions, events_in_range, rotate_partitions
+from .reach import campaign_reach, unique_reach, update_sketches
+from .sending import SMTPPool, send_due_campaigns, send_email_campaign
+
+
+class RecordingHandler:
+    def __init__(self):
+        self.recipients = []
+
+    async def handle_DATA(self, server, session, envelope):
+        self.recipients.extend(envelope.rcpt_tos)
+        return "250 OK"
+
+
+class RefusingHandler(RecordingHandler):
+    """Refuses c1@ for good and c2@ for now."""
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.startswith("c1@"):
+            return "550 5.1.1 No such user"
+        if address.startswith("c2@"):
+            return "452 4.2.2 Mailbox full"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+
+class EmailCampaignTestMixin:
+    def email_campaign(self, members=()):
+        segment = CustomerSegment.objects.create(name="spring")
+        segment.set_members(members)
+        template = EmailTemplate.objects.create(name="t", html_content="<p>Hi {{ first_name }}</p>")
+        return EmailCampaign.objects.create(
+            name="spring", subject_line="Hi {{ first_name }}", from_email="shop@example.com",
+            email_template=template, customer_segment=segment,
+        )
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class SMTPTestMixin(EmailCampaignTestMixin):
+    handler_class = RecordingHandler
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.artifact_dir = Path(directory) / "artifacts"
+        override = override_settings(EMAIL_ARTIFACT_DIR=self.artifact_dir, EMAIL_SUPPRESSION_DIR=directory)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.addCleanup(suppression._indexes.clear)
+        self.handler = self.handler_class()
+        self.port = free_port()
+        controller = Controller(self.handler, hostname="127.0.0.1", port=self.port)
+        controller.start()
+        self.addCleanup(controller.stop)
+
+    def pool(self):
+        return SMTPPool(2, hostname="127.0.0.1", port=self.port, username=None, password=None,
+                        use_tls=False, start_tls=False)
+
+
+def resolve(customer_ids, email_campaign):
+    return [{"customer_id": i, "email": f"c{i}@example.com", "first_name": f"N{i}"} for i in customer_ids]
+
+
+class EmailSendPipelineTests(SMTPTestMixin, TransactionTestCase):
+    def test_rerun_resumes_after_the_last_recorded_batch(self):
+        email_campaign = self.email_campaign(range(1, 7))
+        project_artifacts = Path(settings.BASE_DIR) / "artifacts"
+        before = set(project_artifacts.glob("*")) if project_artifacts.exists() else set()
+
+        def dies_at_five(customer_ids, email_campaign):
+            if 5 in customer_ids:
+                raise RuntimeError("resolver went away")
+            return resolve(customer_ids, email_campaign)
+
+        with self.assertRaises(RuntimeError):
+            send_email_campaign(email_campaign, pool=self.pool(), batch_size=2, resolver=dies_at_five)
+        email_campaign.refresh_from_db()
+        self.assertEqual((email_campaign.status, email_campaign.send_cursor, email_campaign.sent_count),
+                         ("failed", 4, 4))
+
+        self.assertEqual(send_email_campaign(email_campaign, pool=self.pool(), batch_size=2, resolver=resolve), 2)
+        email_campaign.refresh_from_db()
+        self.assertEqual((email_campaign.status, email_campaign.sent_count), ("sent", 6))
+        self.assertEqual(sorted(self.handler.recipients), sorted(f"c{i}@example.com" for i in range(1, 7)))
+        self.assertEqual(EmailEvent.objects.filter(event_type="sent").count(), 6)
+        # artifacts go to the directory configured now, nowhere else
+        self.assertEqual(len(list(self.artifact_dir.glob(f"default-{email_campaign.email_template_id}-*.json"))), 1)
+        self.assertEqual(set(project_artifacts.glob("*")) if project_artifacts.exists() else set(), before)
+
+    def test_due_scheduled_campaigns_are_sent_once(self):
+        due = self.email_campaign(range(1, 4))
+        later = self.email_campaign(range(1, 4))
+        EmailCampaign.objects.filter(pk=due.pk).update(status="scheduled", scheduled_time=timezone.now())
+        EmailCampaign.objects.filter(pk=later.pk).update(
+            status="scheduled", scheduled_time=timezone.now() + timedelta(hours=1)
+        )
+        with override_settings(EMAIL_HOST="127.0.0.1", EMAIL_PORT=self.port):
+            self.assertEqual(send_due_campaigns(resolver=resolve), 3)
+            self.assertEqual(send_due_campaigns(resolver=resolve), 0)
+        self.assertEqual(EmailCampaign.objects.get(pk=due.pk).status, "sent")
+        self.assertEqual(EmailCampaign.objects.get(pk=later.pk).status, "scheduled")
+        self.assertEqual(len(self.handler.recipients), 3)
+
+    def test_status_is_set_when_the_server_is_unreachable(self):
+        email_campaign = self.email_campaign(range(1, 3))
+        pool = SMTPPool(1, hostname="127.0.0.1", port=free_port(), timeout=1)
+        with self.assertLogs("emailMarketing.sending", "WARNING"):
+            self.assertEqual(send_email_campaign(email_campaign, pool=pool, resolver=resolve), 0)
+        email_campaign.refresh_from_db()
+        self.assertEqual(email_campaign.status, "failed")
+
+
+class SMTPRefusalTests(SMTPTestMixin, TransactionTestCase):
+    handler_class = RefusingHandler
+
+    def test_only_permanent_refusals_suppress(self):
+        email_campaign = self.email_campaign(range(1, 4))
+        self.assertEqual(send_email_campaign(email_campaign, pool=self.pool(), resolver=resolve), 1)
+        email_campaign.refresh_from_db()
+        self.assertEqual((email_campaign.sent_count, email_campaign.bounced_count), (1, 1))
+        self.assertEqual(list(EmailEvent.objects.filter(event_type="bounced").values_list("email_address", flat=True)),
+                         ["c1@example.com"])
+        self.assertEqual(suppression.suppression_index().suppressed(["c1@example.com", "c2@example.com"]),
+                         [True, False])
+
+
+@override_settings(EMAIL_WEBHOOK_SECRET="s3cret")
+class EventWebhookTests(EmailCampaignTestMixin, TestCase):
+    def post(self, payload, secret="s3cret"):
+        body = json.dumps(payload).encode()
+        headers = {}
+        if secret:
+            headers["X-Webhook-Signature"] = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+        return self.client.post(reverse("email_event_webhook"), body, content_type="application/json",
+                                headers=headers)
+
+    def event(self, **fields):
+        return {"event": "opened", "email_campaign_id": self.campaign_id, "email": "a@example.com", **fields}
+
+    def setUp(self):
+        self.campaign_id = self.email_campaign().pk
+
+    def test_unsigned_and_badly_signed_requests_are_rejected(self):
+        self.assertEqual(self.post([self.event()], secret=None).status_code, 403)
+        self.assertEqual(self.post([self.event()], secret="guess").status_code, 403)
+        with override_settings(EMAIL_WEBHOOK_SECRET=None):
+            self.assertEqual(self.post([self.event()], secret=None).status_code, 403)
+            with override_settings(DEBUG=True):
+                self.assertEqual(self.post([self.event()], secret=None).status_code, 202)
+
+    def test_malformed_events_are_rejected_one_by_one(self):
+        bad = [
+            self.event(event=["opened"]),
+            self.event(timestamp=1e20),
+            self.event(timestamp="2024-02-30T10:00:00"),
+            self.event(ip_address="999.1.1.1"),
+            self.event(user_agent={"name": "x"}),
+            self.event(customer_id=2**70),
+            self.event(email=["a@example.com"]),
+            "opened",
+        ]
+        response = self.post(bad + [self.event(timestamp=1700000000)])
+        self.assertEqual(response.status_code, 202)
+        result = response.json()
+        self.assertEqual(result["accepted"], 1)
+        self.assertEqual([r["index"] for r in result["rejected"]], list(range(len(bad))))
+        self.assertEqual(EmailEventStaging.objects.count(), 1)
+
+    def test_retried_events_are_staged_once(self):
+        events = [self.event(event_id="evt-1"), self.event(timestamp=1700000000), self.event()]
+        self.assertEqual(self.post(events).json()["accepted"], 3)
+        self.post(events)
+        # the event without an id or a timestamp cannot be told apart from a new one
+        self.assertEqual(EmailEventStaging.objects.count(), 4)
+
+    def test_long_click_urls_are_kept(self):
+        url = "https://shop.example.com/?" + "utm=x&" * 100
+        self.assertEqual(parse_event(self.event(event="clicked", url=url))["link_clicked"], url)
+        self.post([self.event(event="clicked", url=url, timestamp=1700000000)])
+        self.assertEqual(flush_staged_events(), (1, 0))
+        self.assertEqual(EmailEvent.objects.get().link_clicked, url)
+
+    def test_parse_event_checks_types(self):
+        with self.assertRaises(InvalidEvent):
+            parse_event(self.event(bounce_reason=550))
+        event = parse_event(self.event(ip_address="2001:db8::1", customer_id="7"))
+        self.assertEqual((event["ip_address"], event["customer_id"]), ("2001:db8::1", 7))
+
+
+class TrackingWriterTests(EmailCampaignTestMixin, TestCase):
+    def event(self):
+        return {"email_campaign_id": self.campaign_id, "event_type": "opened", "email_address": "a@example.com"}
+
+    def setUp(self):
+        self.campaign_id = self.email_campaign().pk
+        # a flush interval the test never reaches; flushes are explicit
+        self.writer = tracking.TrackingWriter(interval=3600, batch_size=100, max_buffer=3)
+        # nothing left for the writer's atexit flush
+        self.addCleanup(self.writer._buffer.clear)
+
+    def test_buffer_is_bounded_while_staging_fails(self):
+        for _ in range(5):
+            self.writer.add(None, self.event())
+        self.assertEqual((len(self.writer._buffer), self.writer.dropped), (3, 2))
+
+        with mock.patch.object(tracking, "stage_events", side_effect=OperationalError("locked")), \
+                self.assertLogs("emailMarketing.tracking", "ERROR"), self.assertRaises(OperationalError):
+            self.writer.flush()
+        self.assertEqual(len(self.writer._buffer), 3)
+
+        self.assertEqual(self.writer.flush(), 3)
+        self.assertEqual(EmailEventStaging.objects.count(), 3)
+        self.writer.add(None, self.event())
+        self.assertEqual(self.writer.dropped, 2)
+
+
+class LinkTrackingTests(EmailCampaignTestMixin, TestCase):
+    def setUp(self):
+        self.campaign = self.email_campaign()
+        self.campaign.email_template.html_content = (
+            '<a href="https://shop.example.com/a?x=1&amp;y=2">A</a> <a href="mailto:shop@example.com">M</a>'
+            '<a href="https://shop.example.com/{{ slug }}">P</a> <a class="b" href=\'https://shop.example.com/b\'>B</a>'
+            '<a href="https://shop.example.com/a?x=1&amp;y=2">A again</a>'
+        )
+        self.campaign.email_template.save()
+        self.addCleanup(link_cache.clear)
+        # clicks stay in this writer's buffer; nothing is staged behind the test's back
+        self.writer = tracking.TrackingWriter(interval=3600)
+        self.addCleanup(self.writer._buffer.clear)
+        patcher = mock.patch.object(tracking, "writer", self.writer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_links_keep_their_codes(self):
+        urls = extract_links(self.campaign.email_template.html_content)
+        self.assertEqual(urls, ["https://shop.example.com/a?x=1&y=2", "https://shop.example.com/b"])
+        self.assertEqual(register_links(self.campaign, urls), dict(zip(urls, "01")))
+        codes = register_links(self.campaign, ["https://shop.example.com/c", urls[1]])
+        self.assertEqual(codes, {"https://shop.example.com/c": "2", urls[1]: "1"})
+        self.assertEqual(EmailLink.objects.count(), 3)
+
+        with override_settings(EMAIL_TRACKING_BASE_URL="https://t.example.com/"):
+            links = tracking.tracked_links(self.campaign)
+        self.assertEqual(
+            links[urls[1]],
+            "https://t.example.com" + reverse("email_link_redirect", args=["TOKEN", "1"]).replace(
+                "TOKEN", "{{ tracking_token }}"),
+        )
+        self.assertEqual(tracking.tracked_links(self.campaign), {})
+
+    def test_redirect_records_the_click(self):
+        url = "https://shop.example.com/b"
+        code = register_links(self.campaign, [url])[url]
+        token = tracking.recipient_token(self.campaign, "a@example.com", customer_id=7)
+
+        response = self.client.get(reverse("email_link_redirect", args=[token, code]))
+        self.assertEqual((response.status_code, response["Location"]), (302, url))
+        self.assertEqual(self.client.get(reverse("email_link_redirect", args=[token, "zz"])).status_code, 404)
+        self.assertEqual(self.client.get(reverse("email_link_redirect", args=[token + "x", code])).status_code, 404)
+
+        [click] = self.writer._buffer
+        self.assertEqual(
+            (click[1]["event_type"], click[1]["customer_id"], click[1]["link_id"], click[1]["link_clicked"]),
+            ("clicked", 7, EmailLink.objects.get(code=code).pk, None),
+        )
+
+    def test_clicks_reported_by_url_store_the_link(self):
+        url = "https://shop.example.com/b"
+        register_links(self.campaign, [url])
+        stage_events([
+            parse_event({"event": "clicked", "email_campaign_id": self.campaign.pk, "email": "a@example.com",
+                         "url": link})
+            for link in (url, "https://elsewhere.example.com/")
+        ])
+        self.assertEqual(flush_staged_events(), (2, 0))
+        self.assertEqual(
+            set(EmailEvent.objects.values_list("link_id", "link_clicked")),
+            {(EmailLink.objects.get().pk, None), (None, "https://elsewhere.example.com/")},
+        )
+
+
+class ArtifactCacheTests(EmailCampaignTestMixin, TestCase):
+    def setUp(self):
+        self.directory = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def test_storing_a_version_removes_older_ones(self):
+        cache = ArtifactCache(directory=self.directory)
+        template = EmailTemplate.objects.create(name="t", html_content='<a href="https://a.example">{{ x }}</a>')
+        other = EmailTemplate.objects.create(name="o", html_content="<p>{{ x }}</p>")
+        cache.get(other)
+        cache.get(template)
+        template.html_content = '<a href="https://b.example">{{ x }}</a>'
+        template.save()
+        cache.get(template)
+        cache.get(template, {"https://b.example": "https://t.example/1"})
+
+        names = sorted(path.name for path in self.directory.iterdir())
+        self.assertEqual(len(names), 3)
+        self.assertEqual(sum(name.startswith(f"default-{template.pk}-") for name in names), 2)
+        self.assertTrue(all(f"{template.updated_at.timestamp():.6f}" in name
+                            for name in names if name.startswith(f"default-{template.pk}-")))
+        self.assertEqual(ArtifactCache(directory=self.directory).get(template).to_json(), cache.get(template).to_json())
+
+
+@override_settings(EMAIL_AB_TEST_MIN_SENT=100, EMAIL_AB_TEST_METRIC="opened")
+class ABTestTests(EmailCampaignTestMixin, TestCase):
+    def variant(self, campaign, name, opens, openers):
+        variant = self.email_campaign()
+        EmailCampaign.objects.filter(pk=variant.pk).update(
+            campaign=campaign, ab_test_enabled=True, ab_test_variant=name, sent_count=1000, opened_count=opens,
+        )
+        now = timezone.now()
+        update_sketches([
+            {"email_campaign_id": variant.pk, "event_type": "opened", "timestamp": now,
+             "email_address": f"{name}{i % openers}@example.com"}
+            for i in range(opens)
+        ])
+        return variant
+
+    def test_repeat_opens_do_not_count(self):
+        campaign = Campaign.objects.create(name="spring")
+        # A: 10 people opening 100 times each; B: 300 people opening once
+        self.variant(campaign, "A", 1000, 10)
+        b = self.variant(campaign, "B", 300, 300)
+        winner = self.email_campaign()
+        EmailCampaign.objects.filter(pk=winner.pk).update(campaign=campaign, ab_test_variant="winner")
+
+        test = evaluate_test(campaign.pk)
+        self.assertEqual(test.rate_a, 0.01)
+        self.assertAlmostEqual(test.rate_b, 0.3, delta=0.01)
+        self.assertEqual((test.status, test.winner_id), ("promoted", b.pk))
+        self.assertEqual(EmailCampaign.objects.get(pk=winner.pk).status, "scheduled")
+
+
+@override_settings(CAMPAIGN_PAGE_CACHE_SECONDS=0)
+class EventPartitionTests(EmailCampaignTestMixin, TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        override = override_settings(EMAIL_EVENT_ARCHIVE_DIR=self.directory)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.campaign = self.email_campaign()
+        self.now = timezone.now()
+
+    def events(self, days_ago, count=1, campaign=None, **fields):
+        created = [
+            EmailEvent.objects.create(
+                email_campaign=campaign or self.campaign, event_type="opened", email_address="a@example.com",
+                timestamp=self.now - timedelta(days=days_ago), **fields,
+            )
+            for _ in range(count)
+        ]
+        EmailEvent.objects.filter(pk__in=[e.pk for e in created]).update(created_at=self.now - timedelta(hours=1))
+        return [e.pk for e in created]
+
+    def list_ids(self, **params):
+        ids, cursor = [], None
+        while True:
+            query = {**params, "limit": 2, **({"cursor": cursor} if cursor else {})}
+            payload = self.client.get(reverse("email_event_list"), query).json()
+            ids += [row["id"] for row in payload["results"]]
+            cursor = payload["next"]
+            if cursor is None:
+                return ids
+
+    def test_event_list_reads_rotated_and_archived_months(self):
+        archived = self.events(400, 2)
+        rotated = self.events(60, 3, customer_id=7)
+        live = self.events(0, 2)
+        archive_partitions(300)
+        self.assertEqual(EmailEvent.objects.count(), 2)
+        self.assertEqual(self.list_ids(), live[::-1] + rotated[::-1] + archived[::-1])
+        self.assertEqual(self.list_ids(customer_id=7), rotated[::-1])
+        start = (self.now - timedelta(days=61)).isoformat()
+        self.assertEqual(self.list_ids(start=start), live[::-1] + rotated[::-1])
+
+    def test_cursor_bounds_every_store(self):
+        batches = [self.events(400, 3), self.events(60, 3), self.events(0, 3)]
+        archive_partitions(300)
+        everything = list(events_in_range(reverse=True))
+        self.assertEqual([event["id"] for event in everything], [pk for batch in batches[::-1] for pk in batch[::-1]])
+        for batch in batches:
+            # ties on the timestamp are broken by id in the archive, partition and live queries
+            cursor = next(event for event in everything if event["id"] == batch[1])
+            expected = [event["id"] for event in everything[everything.index(cursor) + 1:]]
+            before = (cursor["timestamp"], cursor["id"])
+            self.assertEqual([event["id"] for event in events_in_range(reverse=True, before=before)], expected)
+
+        # a page filling up from its cursor's month never looks up the stored time range
+        first = self.client.get(reverse("email_event_list"), {"limit": 1}).json()
+        with mock.patch.object(partitions, "_time_range", side_effect=AssertionError("scanned")):
+            page = self.client.get(reverse("email_event_list"), {"limit": 1, "cursor": first["next"]}).json()
+        self.assertEqual([row["id"] for row in page["results"]], [batches[2][1]])
+
+    def test_rollup_counts_rotated_events(self):
+        campaign = Campaign.objects.create(name="spring")
+        EmailCampaign.objects.filter(pk=self.campaign.pk).update(campaign=campaign)
+        self.events(60, 3)
+        rotate_partitions()
+        self.assertFalse(EmailEvent.objects.exists())
+        run_rollups(["email_event"])
+        self.assertEqual(campaign_totals(campaign.pk)["opened"], 3)
+
+    def test_deleting_a_campaign_purges_partitions_and_archive(self):
+        other = self.email_campaign()
+        self.events(400, 2)
+        self.events(60, 2)
+        kept = self.events(400, 1, campaign=other) + self.events(60, 1, campaign=other)
+        archive_partitions(300)
+        self.campaign.delete()
+        self.assertEqual(sorted(event["id"] for event in events_in_range()), kept)
+
+    def test_command_rotates_only_when_asked(self):
+        self.events(60, 2)
+        call_command("archive_email_events", stdout=StringIO())
+        self.assertEqual(EmailEvent.objects.count(), 2)
+        call_command("archive_email_events", "--days", "300", stdout=StringIO())
+        self.assertEqual(EmailEvent.objects.count(), 0)
+        self.assertEqual(len(list(events_in_range())), 2)
+
+
+class SuppressionIndexTests(EmailCampaignTestMixin, TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        override = override_settings(EMAIL_SUPPRESSION_DIR=directory)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.addCleanup(suppression._indexes.clear)
+        self.campaign = self.email_campaign()
+
+    def bounce(self, address):
+        EmailEvent.objects.create(email_campaign=self.campaign, event_type="bounced", email_address=address)
+
+    def suppressed(self, *addresses):
+        return suppression.suppression_index().suppressed(addresses)
+
+    def test_log_is_visible_before_and_after_compaction(self):
+        self.bounce("a@example.com")
+        self.assertEqual(suppression.compact_suppression_index(), 1)
+        suppression.record_suppressions([" B@Example.com"])
+        self.assertEqual(self.suppressed("a@example.com", "b@example.com", "c@example.com"), [True, True, False])
+        self.assertEqual(suppression.compact_suppression_index(), 2)
+        self.assertEqual(os.path.getsize(suppression.suppression_paths("default")[1]), 0)
+        self.assertEqual(self.suppressed("a@example.com", "b@example.com", "c@example.com"), [True, True, False])
+
+    def test_removed_addresses_survive_compaction_until_suppressed_again(self):
+        self.bounce("a@example.com")
+        self.bounce("b@example.com")
+        suppression.compact_suppression_index(full=True)
+        suppression.remove_suppressions(["A@example.com"])
+        self.assertEqual(self.suppressed("a@example.com", "b@example.com"), [False, True])
+        suppression.compact_suppression_index()
+        self.assertEqual(self.suppressed("a@example.com", "b@example.com"), [False, True])
+        suppression.compact_suppression_index(full=True)
+        self.assertEqual(self.suppressed("a@example.com", "b@example.com"), [False, True])
+
+        self.bounce("a@example.com")
+        suppression.record_suppressions(["a@example.com"])
+        self.assertEqual(self.suppressed("a@example.com"), [True])
+        suppression.compact_suppression_index(full=True)
+        self.assertEqual(self.suppressed("a@example.com"), [True])
+
+    def test_tombstone_being_appended_is_read_later(self):
+        log_path = suppression.suppression_paths("default")[1]
+        log_path.parent.mkdir(parents=True, exist_ok=True)
+        value = suppression.address_hashes(["a@example.com"])[0]
+        log_path.write_bytes(array("Q", [value, suppression.TOMBSTONE, value]).tobytes())
+        records, end = suppression._read_log(log_path)
+        self.assertEqual((list(records), end), ([value], 8))
+
+
+class ReachTests(EmailCampaignTestMixin, TestCase):
+    def opens(self, email_campaign, addresses, day):
+        timestamp = timezone.make_aware(timezone.datetime.combine(day, timezone.datetime.min.time()))
+        update_sketches([
+            {"email_campaign_id": email_campaign.pk, "event_type": "opened", "timestamp": timestamp,
+             "email_address": address}
+            for address in addresses
+        ])
+
+    def test_reach_merges_days_and_variants(self):
+        campaign = Campaign.objects.create(name="spring")
+        a, b = self.email_campaign(), self.email_campaign()
+        EmailCampaign.objects.filter(pk=a.pk).update(campaign=campaign, ab_test_variant="A")
+        EmailCampaign.objects.filter(pk=b.pk).update(campaign=campaign, ab_test_variant="B")
+        today = timezone.localdate()
+        yesterday = today - timedelta(days=1)
+        self.opens(a, [f"u{i}@example.com" for i in range(100)], yesterday)
+        self.opens(a, [f"U{i}@Example.com " for i in range(50, 150)], today)
+        self.opens(b, [f"u{i}@example.com" for i in range(100, 200)], today)
+
+        # estimates: about 0.8% standard error
+        self.assertAlmostEqual(unique_reach([a.pk], start=today).count(), 100, delta=3)
+        self.assertAlmostEqual(unique_reach([a.pk]).count(), 150, delta=4)
+        per_variant, total = campaign_reach(campaign.pk)
+        self.assertEqual(set(per_variant), {"A", "B"})
+        self.assertAlmostEqual(per_variant["B"].count(), 100, delta=3)
+        self.assertAlmostEqual(total.count(), 200, delta=5)
+
+        response = self.client.get(reverse("email_campaign_reach", args=[a.pk]), {"start": today.isoformat()})
+        self.assertEqual(response.json()["opened"]["unique"], unique_reach([a.pk], start=today).count())
+        self.assertEqual(self.client.get(reverse("email_campaign_reach", args=[a.pk]), {"end": "soon"}).status_code,
+                         400)
@@ -0,0 +1,289 @@
+"""
+Open-pixel and click-redirect tracking.
+
+Tracking links carry a signed token (``django.core.signing``) with the
+email campaign, customer, address, tenant schema and - for clicks - the
+target URL, so the views answer without touching the database. Links of
+templates sent with ``EMAIL_TRACKING_BASE_URL`` set point at
+``t/l/<token>/<code>/`` instead: one token per recipient and the
+campaign's short link code (``emailMarketing.links``), resolved from an
+in-process cache; their clicks store the link id rather than the URL. Events are
+appended to an in-process buffer and a background thread writes them to
+``EmailEventStaging`` in batches every ``EMAIL_TRACKING_FLUSH_SECONDS``;
+from there ``emailMarketing.ingest`` applies them like webhook events.
+Events still in the buffer when the process dies are lost, which bounds the
+loss to one flush interval of opens and clicks. While staging keeps failing
+the buffer is capped at ``MAX_BUFFER`` events; further events are dropped
+and counted (``TrackingWriter.dropped``) rather than growing memory.
+
+Under ASGI, ``TrackingASGIMiddleware`` (installed in ``asgi.py``) serves
+these paths before the Django handler; see its docstring.
+"""
+import atexit
+import logging
+import threading
+from collections import defaultdict, deque
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core import signing
+from django.db import connections
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.encoding import iri_to_uri
+
+from marketingAutomation.tenancy import tenant_alias
+
+from .ingest import stage_events
+from .links import extract_links, link_cache, register_links
+
+logger = logging.getLogger(__name__)
+
+SALT = "emailMarketing.tracking"
+MAX_BUFFER = 1_000_000
+
+PIXEL = (
+    b"GIF89a\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\xff\xff\xff!\xf9\x04\x01\x00\x00\x00\x00"
+    b",\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02D\x01\x00;"
+)
+NO_CACHE = "no-store, no-cache, must-revalidate, max-age=0"
+PIXEL_HEADERS = [
+    (b"content-type", b"image/gif"),
+    (b"content-length", str(len(PIXEL)).encode()),
+    (b"cache-control", NO_CACHE.encode()),
+]
+REDIRECT_SCHEMES = ("http://", "https://")
+
+
+def make_token(email_campaign_id, email_address, customer_id=None, url=None, tenant_schema=None):
+    payload = [email_campaign_id, customer_id, email_address, tenant_schema]
+    if url:
+        if not url.startswith(REDIRECT_SCHEMES):
+            raise ValueError(f"Refusing to track non-HTTP URL {url!r}")
+        payload.append(url)
+    return signing.dumps(payload, salt=SALT, compress=True)
+
+
+def read_token(token):
+    """Decoded token as a dict, or ``None`` if it was tampered with or malformed."""
+    try:
+        payload = signing.loads(token, salt=SALT)
+        email_campaign_id, customer_id, email_address, tenant_schema, *rest = payload
+    except (signing.BadSignature, ValueError, TypeError):
+        return None
+    return {
+        "email_campaign_id": email_campaign_id,
+        "customer_id": customer_id,
+        "email_address": email_address,
+        "tenant_schema": tenant_schema,
+        "url": rest[0] if rest else None,
+    }
+
+
+def open_pixel_url(email_campaign_id, email_address, customer_id=None, tenant_schema=None):
+    token = make_token(email_campaign_id, email_address, customer_id, tenant_schema=tenant_schema)
+    return reverse("email_open_pixel", args=[token])
+
+
+def click_url(email_campaign_id, email_address, url, customer_id=None, tenant_schema=None):
+    token = make_token(email_campaign_id, email_address, customer_id, url, tenant_schema)
+    return reverse("email_click_redirect", args=[token])
+
+
+def tracked_links(email_campaign):
+    """``{url: tracked href}`` for the links of the campaign's template,
+    registering them; the hrefs contain a ``{{ tracking_token }}`` placeholder
+    (``recipient_token``). Empty unless ``EMAIL_TRACKING_BASE_URL`` is set."""
+    base = getattr(settings, "EMAIL_TRACKING_BASE_URL", None)
+    if not base:
+        return {}
+    urls = extract_links(email_campaign.email_template.html_content)
+    if not urls:
+        return {}
+    codes = register_links(email_campaign, urls)
+    prefix = base.rstrip("/") + reverse("email_link_redirect", args=["-", "-"])[:-4]
+    return {url: f"{prefix}{{{{ tracking_token }}}}/{code}/" for url, code in codes.items()}
+
+
+def recipient_token(email_campaign, email_address, customer_id=None):
+    return make_token(email_campaign.pk, email_address, customer_id, tenant_schema=email_campaign.tenant_schema)
+
+
+async def resolve_link(token_data, code):
+    """``(link id, url)`` of ``code`` in the token's email campaign, or ``None``;
+    queries the database only when the campaign's links are not cached."""
+    using = tenant_alias(token_data["tenant_schema"]) if token_data["tenant_schema"] else None
+    link = link_cache.cached(using, token_data["email_campaign_id"], code)
+    if link is None:
+        link = await sync_to_async(link_cache.resolve)(using, token_data["email_campaign_id"], code)
+    return link
+
+
+class TrackingWriter:
+    """Buffers tracking events and stages them in batches from a daemon thread."""
+
+    def __init__(self, interval=0.5, batch_size=1000, max_buffer=MAX_BUFFER):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_buffer = max_buffer
+        self.dropped = 0
+        self._reported = 0
+        self._buffer = deque()
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def add(self, tenant_schema, event):
+        # deque.append is atomic, so the request path never takes a lock;
+        # the bound may be overshot by the threads racing past the check.
+        if len(self._buffer) >= self.max_buffer:
+            self.dropped += 1
+            return
+        self._buffer.append((tenant_schema, event))
+        if self._thread is None:
+            self._start()
+        if len(self._buffer) >= self.batch_size:
+            self._wake.set()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="email-tracking-writer", daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("staging tracking events failed")
+            finally:
+                connections.close_all()
+
+    def flush(self):
+        """Stage everything buffered so far; returns the number of events written."""
+        with self._lock:
+            if self.dropped > self._reported:
+                logger.error("tracking buffer full, dropped %d events", self.dropped - self._reported)
+                self._reported = self.dropped
+            batch = []
+            while self._buffer:
+                batch.append(self._buffer.popleft())
+            if not batch:
+                return 0
+            by_tenant = defaultdict(list)
+            for tenant_schema, event in batch:
+                by_tenant[tenant_schema].append(event)
+            written = 0
+            try:
+                for tenant_schema, events in list(by_tenant.items()):
+                    using = tenant_alias(tenant_schema) if tenant_schema else None
+                    written += stage_events(events, using=using)
+                    del by_tenant[tenant_schema]
+            except Exception:
+                # keep what was not written for the next attempt, within bounds
+                leftover = [(t, e) for t, events in by_tenant.items() for e in events]
+                keep = max(0, self.max_buffer - len(self._buffer))
+                if len(leftover) > keep:
+                    # the oldest events go first
+                    self.dropped += len(leftover) - keep
+                    leftover = leftover[len(leftover) - keep:]
+                self._buffer.extendleft(reversed(leftover))
+                raise
+            return written
+
+
+writer = TrackingWriter(
+    getattr(settings, "EMAIL_TRACKING_FLUSH_SECONDS", 0.5),
+    getattr(settings, "EMAIL_TRACKING_BATCH_SIZE", 1000),
+)
+
+
+def record(token_data, event_type, user_agent=None, ip_address=None, link_id=None):
+    writer.add(token_data["tenant_schema"], {
+        "email_campaign_id": token_data["email_campaign_id"],
+        "customer_id": token_data["customer_id"],
+        "event_type": event_type,
+        "email_address": token_data["email_address"],
+        "timestamp": timezone.now(),
+        "user_agent": user_agent,
+        "ip_address": ip_address or None,
+        "link_clicked": token_data["url"] if event_type == "clicked" else None,
+        "link_id": link_id,
+    })
+
+
+class TrackingASGIMiddleware:
+    """Answers tracking requests before Django's request machinery.
+
+    In ASGI mode every ``MiddlewareMixin`` middleware and the request
+    signals hop to the sync thread, which costs milliseconds per request
+    under load. Tracking requests need none of that, so this wrapper around
+    the Django application serves the pixel and the redirect directly from
+    the ASGI scope; the regular views remain for WSGI deployments.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.open_prefix = reverse("email_open_pixel", args=["-"])[:-2]
+        self.click_prefix = reverse("email_click_redirect", args=["-"])[:-2]
+        self.link_prefix = reverse("email_link_redirect", args=["-", "-"])[:-4]
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["method"] in ("GET", "HEAD"):
+            path = scope["path"]
+            if path.startswith(self.open_prefix):
+                return await self._open(scope, send, path[len(self.open_prefix):].rstrip("/"))
+            if path.startswith(self.click_prefix):
+                return await self._click(scope, send, path[len(self.click_prefix):].rstrip("/"))
+            if path.startswith(self.link_prefix):
+                token, _, code = path[len(self.link_prefix):].rstrip("/").partition("/")
+                return await self._link(scope, send, token, code)
+        return await self.app(scope, receive, send)
+
+    @staticmethod
+    def _client(scope):
+        user_agent = None
+        for name, value in scope.get("headers", ()):
+            if name == b"user-agent":
+                user_agent = value.decode("latin-1")
+                break
+        client = scope.get("client")
+        return user_agent, client[0] if client else None
+
+    async def _open(self, scope, send, token):
+        data = read_token(token)
+        if data is not None:
+            record(data, "opened", *self._client(scope))
+        await send({"type": "http.response.start", "status": 200, "headers": PIXEL_HEADERS})
+        await send({"type": "http.response.body", "body": PIXEL if scope["method"] == "GET" else b""})
+
+    async def _click(self, scope, send, token):
+        data = read_token(token)
+        url = data and data["url"]
+        if not url or not url.startswith(REDIRECT_SCHEMES):
+            return await self._not_found(send)
+        record(data, "clicked", *self._client(scope))
+        await self._redirect(send, url)
+
+    @staticmethod
+    async def _not_found(send):
+        await send({"type": "http.response.start", "status": 404, "headers": [(b"content-type", b"text/plain")]})
+        await send({"type": "http.response.body", "body": b"Unknown link"})
+
+    @staticmethod
+    async def _redirect(send, url):
+        headers = [(b"location", iri_to_uri(url).encode("latin-1")), (b"content-length", b"0")]
+        await send({"type": "http.response.start", "status": 302, "headers": headers})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def _link(self, scope, send, token, code):
+        data = read_token(token)
+        link = data and code and await resolve_link(data, code)
+        if not link:
+            return await self._not_found(send)
+        record(data, "clicked", *self._client(scope), link_id=link[0])
+        await self._redirect(send, link[1])
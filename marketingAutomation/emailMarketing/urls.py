@@ -3,4 +3,10 @@ from . import views
 
 urlpatterns = [
     path('', views.emailMarketing, name='emailMarketing'),
+    path('api/events/', views.event_list, name='email_event_list'),
+    path('api/campaigns/<int:email_campaign_id>/reach/', views.campaign_reach, name='email_campaign_reach'),
+    path('api/webhooks/events/', views.event_webhook, name='email_event_webhook'),
+    path('t/o/<str:token>/', views.open_pixel, name='email_open_pixel'),
+    path('t/c/<str:token>/', views.click_redirect, name='email_click_redirect'),
+    path('t/l/<str:token>/<str:code>/', views.link_redirect, name='email_link_redirect'),
 ]
@@ -1,4 +1,160 @@
-from django.http import HttpResponse
+import hashlib
+import hmac
+import json
+from itertools import islice
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from django.http import Http404, HttpResponse, HttpResponseRedirect, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+
+from campaign.pagination import InvalidCursor, decode_cursor, encode_cursor, page_response
+
+from . import tracking
+from .ingest import InvalidEvent, parse_event, stage_events
+from .models import EmailCampaign
+from .partitions import events_in_range
+from .reach import REACH_EVENTS, unique_reach
+
+EVENT_FIELDS = [
+    "id", "email_campaign_id", "customer_id", "event_type", "email_address",
+    "timestamp", "link_clicked", "link_id", "bounce_reason", "created_at",
+]
+
 
 def emailMarketing(request):
-    return HttpResponse("Welcome to the Marketing Automation email marketing Page")
\ No newline at end of file
+    return HttpResponse("Welcome to the Marketing Automation email marketing Page")
+
+
+def event_page(filters, start, end, cursor, limit):
+    """One page of events newest first on ``(timestamp, id)``, read through
+    ``events_in_range`` so months already in partitions or the archive are
+    listed too; the cursor is the last event of the previous page."""
+    before = None
+    if cursor:
+        before = decode_cursor(cursor)
+        if timezone.is_naive(before[0]):
+            raise InvalidCursor(f"Invalid cursor {cursor!r}")
+    events = events_in_range(start, end, reverse=True, before=before, **filters)
+    rows = [{name: event[name] for name in EVENT_FIELDS} for event in islice(events, limit + 1)]
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]["timestamp"], rows[-1]["id"])
+    return rows, next_cursor
+
+
+@require_GET
+def event_list(request):
+    """Email events newest first; ``start``/``end`` (ISO 8601) bound their timestamps."""
+    filters = {}
+    for name in ("email_campaign_id", "customer_id"):
+        if name in request.GET:
+            try:
+                filters[name] = int(request.GET[name])
+            except ValueError:
+                return JsonResponse({"error": f"{name} must be an integer"}, status=400)
+    if "event_type" in request.GET:
+        filters["event_type"] = request.GET["event_type"]
+    bounds = {"start": None, "end": None}
+    for name in bounds:
+        if name in request.GET:
+            try:
+                bounds[name] = parse_datetime(request.GET[name])
+            except ValueError:
+                bounds[name] = None
+            if bounds[name] is None:
+                return JsonResponse({"error": f"{name} must be an ISO 8601 date and time"}, status=400)
+            if timezone.is_naive(bounds[name]):
+                bounds[name] = timezone.make_aware(bounds[name])
+    return page_response(
+        request, lambda cursor, limit: event_page(filters, bounds["start"], bounds["end"], cursor, limit)
+    )
+
+
+@require_GET
+def campaign_reach(request, email_campaign_id):
+    """Distinct addresses that opened / clicked, optionally between the
+    ``start`` and ``end`` days (``YYYY-MM-DD``, inclusive)."""
+    if not EmailCampaign.objects.filter(pk=email_campaign_id).exists():
+        raise Http404("Unknown email campaign")
+    days = {}
+    for name in ("start", "end"):
+        if name in request.GET:
+            days[name] = parse_date(request.GET[name])
+            if days[name] is None:
+                return JsonResponse({"error": f"{name} must be a YYYY-MM-DD date"}, status=400)
+    reach = {}
+    for event_type in REACH_EVENTS:
+        sketch = unique_reach([email_campaign_id], event_type, **days)
+        reach[event_type] = {"unique": sketch.count(), "standard_error": round(sketch.standard_error, 4)}
+    return JsonResponse({"email_campaign_id": email_campaign_id, **reach})
+
+
+def _signature_ok(request):
+    secret = getattr(settings, "EMAIL_WEBHOOK_SECRET", None)
+    if not secret:
+        # unsigned webhooks are only accepted in development
+        return settings.DEBUG
+    expected = hmac.new(secret.encode(), request.body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, request.headers.get("X-Webhook-Signature", ""))
+
+
+@csrf_exempt
+@require_POST
+def event_webhook(request):
+    """Accept a JSON list of events (or ``{"events": [...]}``) and stage them."""
+    if not _signature_ok(request):
+        return JsonResponse({"error": "invalid signature"}, status=403)
+    try:
+        payload = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({"error": "invalid JSON"}, status=400)
+    if isinstance(payload, dict):
+        payload = payload.get("events", [payload])
+    if not isinstance(payload, list):
+        return JsonResponse({"error": "expected a list of events"}, status=400)
+
+    events, rejected = [], []
+    for index, data in enumerate(payload):
+        try:
+            events.append(parse_event(data))
+        except InvalidEvent as exc:
+            rejected.append({"index": index, "error": str(exc)})
+    staged = stage_events(events)
+    return JsonResponse(
+        {"accepted": len(events), "duplicates": len(events) - staged, "rejected": rejected}, status=202
+    )
+
+
+async def open_pixel(request, token):
+    """1x1 GIF; records an ``opened`` event when the token is valid."""
+    data = tracking.read_token(token)
+    if data is not None:
+        tracking.record(data, "opened", request.headers.get("User-Agent"), request.META.get("REMOTE_ADDR"))
+    response = HttpResponse(tracking.PIXEL, content_type="image/gif")
+    response["Cache-Control"] = tracking.NO_CACHE
+    return response
+
+
+async def click_redirect(request, token):
+    """Redirect to the signed target URL and record a ``clicked`` event."""
+    data = tracking.read_token(token)
+    if data is None or not data["url"]:
+        raise Http404("Unknown link")
+    tracking.record(data, "clicked", request.headers.get("User-Agent"), request.META.get("REMOTE_ADDR"))
+    return HttpResponseRedirect(data["url"])
+
+
+async def link_redirect(request, token, code):
+    """Redirect to the campaign link ``code`` and record a ``clicked`` event."""
+    data = tracking.read_token(token)
+    link = data and await tracking.resolve_link(data, code)
+    if not link:
+        raise Http404("Unknown link")
+    tracking.record(
+        data, "clicked", request.headers.get("User-Agent"), request.META.get("REMOTE_ADDR"), link_id=link[0]
+    )
+    return HttpResponseRedirect(link[1])
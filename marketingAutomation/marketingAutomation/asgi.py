@@ -13,4 +13,8 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'marketingAutomation.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from emailMarketing.tracking import TrackingASGIMiddleware  # noqa: E402 (needs django.setup())
+
+application = TrackingASGIMiddleware(django_application)
@@ -52,6 +52,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'marketingAutomation.tenancy.TenantMiddleware',
 ]
 
 ROOT_URLCONF = 'marketingAutomation.urls'
@@ -84,6 +85,39 @@ DATABASES = {
     }
 }
 
+# Caches: "default" is per process; "shared" is seen by every web and worker process
+# (entries invalidated by one are gone for all). `migrate` creates its table
+# (campaign migration 0009), or point it at Redis/Memcached.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'shared_cache',
+    },
+}
+
+# Tenant routing (marketingAutomation.tenancy)
+# MODE "sqlite": one database file per tenant schema in SQLITE_DIR.
+# MODE "schema": the default PostgreSQL database with search_path set to the tenant schema;
+# set POOL (e.g. {"min_size": 0, "max_size": 4}) to use a psycopg pool per tenant.
+# HOSTS maps request host names to their tenant schema; SCHEMAS lists further tenants
+# (reached by workers only). Other schemas are refused; create tenants with migrate_tenants.
+
+DATABASE_ROUTERS = ['marketingAutomation.tenancy.TenantRouter']
+
+TENANT_ROUTING = {
+    'MODE': 'sqlite',
+    'SQLITE_DIR': BASE_DIR / 'tenants',
+    'HOSTS': {},
+    'SCHEMAS': [],
+    'CONN_MAX_AGE': 600,
+    'POOL': None,
+    'MAX_OPEN_PER_THREAD': 64,
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -125,3 +159,154 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Campaign message dispatch (campaign.dispatch)
+# Maps CampaignMessage.channel to a dotted path of a campaign.dispatch.ChannelSender.
+
+CAMPAIGN_MESSAGE_SENDERS = {}
+
+CAMPAIGN_DISPATCH_MAX_ATTEMPTS = 3
+
+CAMPAIGN_DISPATCH_RETRY_SECONDS = 60
+
+
+# Compiled message templates kept in memory per process (campaign.templating)
+
+CAMPAIGN_TEMPLATE_CACHE_SIZE = 512
+
+
+# Per-tenant active campaign id cache (campaign.active): upper bound of an entry's
+# lifetime, and the cache alias; it must be shared by all processes, since saves in one
+# process invalidate the entry for the others
+
+CAMPAIGN_ACTIVE_CACHE_SECONDS = 300
+
+CAMPAIGN_ACTIVE_CACHE = 'shared'
+
+
+# Budget pacing for dispatched messages (campaign.pacing)
+# Maps CampaignMessage.channel to the cost of one message, e.g. {"whatsapp": "0.05"}.
+
+CAMPAIGN_MESSAGE_COSTS = {}
+
+CAMPAIGN_PACING_FLUSH_SECONDS = 5.0
+
+CAMPAIGN_PACING_DEFER_SECONDS = 300
+
+
+# First pages of the keyset-paginated JSON list endpoints are cached this long (campaign.pagination)
+
+CAMPAIGN_PAGE_CACHE_SECONDS = 5
+
+
+# Email campaign sending (emailMarketing.sending); SMTP server from EMAIL_HOST/EMAIL_PORT/...
+# EMAIL_RECIPIENT_RESOLVER is a dotted path to resolver(customer_ids, email_campaign)
+# returning dicts with "email" (and "customer_id" plus template fields).
+
+EMAIL_RECIPIENT_RESOLVER = None
+
+EMAIL_SEND_POOL_SIZE = 8
+
+EMAIL_SEND_BATCH_SIZE = 500
+
+# Shared secret for the email event webhook: requests must carry a hex HMAC-SHA256 of
+# the body in X-Webhook-Signature (emailMarketing.views.event_webhook). Required unless
+# DEBUG is on; without it the webhook refuses every request.
+
+EMAIL_WEBHOOK_SECRET = None
+
+# Open/click tracking events are buffered in memory and staged this often / at this size
+# (emailMarketing.tracking)
+
+EMAIL_TRACKING_FLUSH_SECONDS = 0.5
+
+EMAIL_TRACKING_BATCH_SIZE = 1000
+
+# Precompiled email template artifacts (emailMarketing.artifacts): kept in an in-memory LRU
+# and persisted under EMAIL_ARTIFACT_DIR for warm restarts; None keeps them in memory only
+
+EMAIL_ARTIFACT_DIR = BASE_DIR / "artifacts"
+
+EMAIL_ARTIFACT_CACHE_SIZE = 256
+
+# Sequential A/B testing of email campaign variants (emailMarketing.abtest): metric
+# ("opened" or "clicked"), significance level, mSPRT mixing spread over the rate
+# difference and the sends each variant needs before a winner is promoted
+
+EMAIL_AB_TEST_METRIC = "opened"
+
+EMAIL_AB_TEST_ALPHA = 0.05
+
+EMAIL_AB_TEST_TAU = 0.05
+
+EMAIL_AB_TEST_MIN_SENT = 1000
+
+# EmailEvent partitions and cold archive (emailMarketing.partitions): months that ended more
+# than EMAIL_EVENT_ARCHIVE_DAYS ago are moved to compressed columnar files in this directory
+
+EMAIL_EVENT_ARCHIVE_DIR = BASE_DIR / "archive"
+
+EMAIL_EVENT_ARCHIVE_DAYS = 180
+
+# Webhook retry dedup (campaign.dedup): in-memory sliding Bloom filter per process
+# (keys per generation, false-positive rate, window) backed by IdempotencyKey rows
+# kept for INGEST_DEDUP_RETENTION_HOURS
+
+INGEST_DEDUP_CAPACITY = 1_000_000
+
+INGEST_DEDUP_ERROR_RATE = 0.001
+
+INGEST_DEDUP_WINDOW_SECONDS = 86400
+
+INGEST_DEDUP_RETENTION_HOURS = 72
+
+# Suppression index of bounced and unsubscribed addresses (emailMarketing.suppression):
+# one memory-mapped file per database alias in this directory, compacted by
+# flush_email_events once its log holds EMAIL_SUPPRESSION_COMPACT_AFTER addresses
+
+EMAIL_SUPPRESSION_DIR = BASE_DIR / "suppression"
+
+EMAIL_SUPPRESSION_COMPACT_AFTER = 50_000
+
+# Click tracking of campaign links (emailMarketing.links): when EMAIL_TRACKING_BASE_URL
+# (e.g. "https://track.example.com") is set, template links are registered with short
+# codes and redirected through it; EMAIL_LINK_CACHE_SIZE campaigns' links stay in memory
+
+EMAIL_TRACKING_BASE_URL = None
+
+EMAIL_LINK_CACHE_SIZE = 1000
+
+# WhatsApp campaign sending (whatsappMarketing.sending): WHATSAPP_PROVIDER is a dotted path to a
+# whatsappMarketing.sending.WhatsAppProvider class, WHATSAPP_RECIPIENT_RESOLVER to
+# resolver(customer_ids, whatsapp_campaign) returning dicts with "phone_number" (and "customer_id",
+# "parameters"). Rates are messages per second per tenant (WHATSAPP_TENANT_RATES overrides per
+# schema) and per tenant and template category, e.g. {"marketing": 40}.
+
+WHATSAPP_PROVIDER = None
+
+WHATSAPP_RECIPIENT_RESOLVER = None
+
+WHATSAPP_SEND_CONCURRENCY = 32
+
+WHATSAPP_SEND_BATCH_SIZE = 500
+
+WHATSAPP_SEND_BURST_SECONDS = 0.1
+
+WHATSAPP_TENANT_RATE = 80
+
+WHATSAPP_TENANT_RATES = {}
+
+WHATSAPP_CATEGORY_RATES = {}
+
+# Phone numbers of WhatsApp recipients (whatsappMarketing.phones) are normalized to E.164; national
+# numbers are read under WHATSAPP_DEFAULT_COUNTRY's rules unless the resolver gives a "country".
+# WHATSAPP_PHONE_RULES adds or overrides rules: {"PT": ("351", "", "00", r"[29]\d{8}")}
+
+WHATSAPP_DEFAULT_COUNTRY = "US"
+
+WHATSAPP_PHONE_RULES = {}
+
+# Compiled request bodies of approved WhatsApp templates kept in memory (whatsappMarketing.payloads)
+
+WHATSAPP_PAYLOAD_CACHE_SIZE = 256
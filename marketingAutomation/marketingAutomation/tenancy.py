@@ -0,0 +1,197 @@
+"""
+Per-tenant database routing.
+
+Every model carries ``tenant_id``/``tenant_schema``; this module sends the
+queries of a request (or worker job) to that tenant's storage:
+
+* ``MODE = "sqlite"``: one SQLite file per schema in ``SQLITE_DIR``.
+* ``MODE = "schema"``: the ``default`` PostgreSQL database with the
+  connection's ``search_path`` pinned to the tenant schema.
+
+Only the apps listed in ``APPS`` (the marketing apps, whose models carry the
+tenant fields) are routed; auth, sessions and admin stay on ``default``.
+Each tenant gets its own connection alias (``tenant_<schema>``), registered
+lazily from the ``default`` settings. Aliases use persistent connections
+(``CONN_MAX_AGE``) - or a psycopg pool when ``POOL`` is configured - so a
+tenant's connection is reused across requests instead of reconnecting, and
+in schema mode no ``SET search_path`` round trip is needed per request.
+
+Only configured tenants are routed: the schemas of ``HOSTS`` (which maps a
+request's host name to its tenant) and ``SCHEMAS`` (tenants reached only by
+workers and tracking links). Requests pick their tenant by host, never by
+anything the client sends along, and nothing is created on request: tenant
+databases and schemas are provisioned by ``migrate_tenants``.
+"""
+import copy
+import re
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import SuspiciousOperation
+from django.db import connections
+from django.http.request import split_domain_port
+
+SCHEMA_RE = re.compile(r"^[a-z_][a-z0-9_]{0,62}$")
+
+_current_alias = ContextVar("tenant_alias", default=None)
+_register_lock = threading.Lock()
+_open_aliases = threading.local()
+
+
+def tenant_settings():
+    return {
+        "MODE": "sqlite",
+        "SQLITE_DIR": Path(settings.BASE_DIR) / "tenants",
+        "HOSTS": {},
+        "SCHEMAS": (),
+        "CONN_MAX_AGE": 600,
+        "POOL": None,
+        "MAX_OPEN_PER_THREAD": 64,
+        "APPS": ("campaign", "emailMarketing", "qrCodeMarketing", "socialMedia", "whatsappMarketing"),
+        **getattr(settings, "TENANT_ROUTING", {}),
+    }
+
+
+def tenant_schemas():
+    """The configured tenant schemas."""
+    config = tenant_settings()
+    return frozenset(config["SCHEMAS"]) | frozenset(config["HOSTS"].values())
+
+
+def tenant_sqlite_path(schema):
+    return Path(tenant_settings()["SQLITE_DIR"]) / f"{schema}.sqlite3"
+
+
+def tenant_alias(schema):
+    """Connection alias for ``schema``, registering it on first use."""
+    alias = f"tenant_{schema}"
+    if alias in connections.settings:
+        return alias
+    if not SCHEMA_RE.match(schema or "") or schema not in tenant_schemas():
+        raise SuspiciousOperation(f"Unknown tenant schema {schema!r}")
+
+    with _register_lock:
+        if alias in connections.settings:
+            return alias
+        config = tenant_settings()
+        db = copy.deepcopy(connections.settings["default"])
+        db["CONN_MAX_AGE"] = config["CONN_MAX_AGE"]
+        db["CONN_HEALTH_CHECKS"] = True
+        if config["MODE"] == "sqlite":
+            # mode=rw: a tenant without a database fails instead of getting an empty file
+            db["NAME"] = f"file:{tenant_sqlite_path(schema)}?mode=rw"
+        else:
+            options = db.setdefault("OPTIONS", {})
+            options["options"] = f"-c search_path={schema},public"
+            if config["POOL"]:
+                options["pool"] = config["POOL"]
+                db["CONN_MAX_AGE"] = 0
+        db["TEST"] = {**db.get("TEST", {}), "NAME": None}
+        connections.settings[alias] = db
+        settings.DATABASES[alias] = db
+    return alias
+
+
+def current_tenant_alias():
+    return _current_alias.get()
+
+
+def _touch(alias):
+    """Track aliases used by this thread; close the least recently used ones."""
+    lru = getattr(_open_aliases, "lru", None)
+    if lru is None:
+        lru = _open_aliases.lru = OrderedDict()
+    lru[alias] = None
+    lru.move_to_end(alias)
+    limit = tenant_settings()["MAX_OPEN_PER_THREAD"]
+    while len(lru) > limit:
+        stale, _ = lru.popitem(last=False)
+        connections[stale].close()
+
+
+@contextmanager
+def tenant_context(schema):
+    """Route ORM queries inside the block to ``schema`` (for worker jobs)."""
+    alias = tenant_alias(schema) if schema else None
+    token = _current_alias.set(alias)
+    try:
+        yield alias
+    finally:
+        _current_alias.reset(token)
+        if alias:
+            _touch(alias)
+
+
+class TenantRouter:
+    def __init__(self):
+        self.apps = frozenset(tenant_settings()["APPS"])
+
+    def _route(self, model):
+        if model._meta.app_label in self.apps:
+            return _current_alias.get()
+        return None
+
+    def db_for_read(self, model, **hints):
+        return self._route(model)
+
+    def db_for_write(self, model, **hints):
+        return self._route(model)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db.startswith("tenant_"):
+            return app_label in self.apps
+        return None
+
+
+class TenantMiddleware:
+    """Activate the tenant of the request's host (``HOSTS``) for the whole
+    request; other hosts stay on ``default``."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.hosts = {host.lower(): schema for host, schema in tenant_settings()["HOSTS"].items()}
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def tenant_schema(self, request):
+        domain, _ = split_domain_port(request.get_host())
+        return self.hosts.get(domain)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        schema = self.tenant_schema(request)
+        if not schema:
+            return self.get_response(request)
+        with tenant_context(schema) as alias:
+            request.tenant_schema = schema
+            request.tenant_db = alias
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        # Requests without a tenant (e.g. tracking pixels) stay on the event
+        # loop; connection housekeeping needs the sync thread that owns them.
+        schema = self.tenant_schema(request)
+        if not schema:
+            return await self.get_response(request)
+        alias = tenant_alias(schema)
+        token = _current_alias.set(alias)
+        request.tenant_schema = schema
+        request.tenant_db = alias
+        try:
+            return await self.get_response(request)
+        finally:
+            _current_alias.reset(token)
+            await sync_to_async(_touch)(alias)
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.8 on 2026-10-18 03:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('campaign', '0002_analytics_rollups'),
+        ('qrCodeMarketing', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='qrcode',
+            name='campaign',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='qr_codes', to='campaign.campaign'),
+        ),
+    ]
@@ -9,6 +9,15 @@ class QRCode(models.Model):
 	tenant_id = models.BigIntegerField(null=True, blank=True, db_index=True)
 	tenant_schema = models.CharField(max_length=255, blank=True, null=True)
 
+	# Optional linkage to a marketing campaign (scans roll up into its analytics)
+	campaign = models.ForeignKey(
+		'campaign.Campaign',
+		on_delete=models.SET_NULL,
+		related_name='qr_codes',
+		null=True,
+		blank=True,
+	)
+
 	code = models.CharField(max_length=100, unique=True, help_text="Unique QR code identifier")
 	name = models.CharField(max_length=255)
 
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.8 on 2026-10-18 03:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('socialMedia', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='socialmediapostmetrics',
+            index=models.Index(fields=['last_synced_at'], name='social_medi_last_sy_7db307_idx'),
+        ),
+    ]
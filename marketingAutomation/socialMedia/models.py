@@ -110,6 +110,7 @@ class SocialMediaPostMetrics(models.Model):
 		ordering = ['-last_synced_at']
 		indexes = [
 			models.Index(fields=['social_media_post', 'platform']),
+			models.Index(fields=['last_synced_at']),
 		]
 		verbose_name = 'Social Media Post Metrics'
 		verbose_name_plural = 'Social Media Post Metrics'
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from marketingAutomation.tenancy import tenant_context
+from whatsappMarketing.models import WhatsAppCampaign
+from whatsappMarketing.sending import send_whatsapp_campaigns
+
+
+class Command(BaseCommand):
+    help = "Send WhatsAppCampaigns side by side under the per-tenant and per-category rate limits."
+
+    def add_arguments(self, parser):
+        parser.add_argument("whatsapp_campaign_ids", type=int, nargs="+")
+        parser.add_argument("--concurrency", type=int, help="Provider requests in flight (WHATSAPP_SEND_CONCURRENCY).")
+        parser.add_argument("--batch-size", type=int, help="Recipients per batch (WHATSAPP_SEND_BATCH_SIZE).")
+        parser.add_argument("--tenant", help="Read and record in this tenant schema's database.")
+
+    def handle(self, *args, **options):
+        ids = options["whatsapp_campaign_ids"]
+        with tenant_context(options["tenant"]):
+            campaigns = list(
+                WhatsAppCampaign.objects.select_related("whatsapp_template", "customer_segment").filter(pk__in=ids)
+            )
+            missing = set(ids) - {campaign.pk for campaign in campaigns}
+            if missing:
+                raise CommandError(f"WhatsAppCampaign {', '.join(map(str, sorted(missing)))} does not exist")
+            sent = send_whatsapp_campaigns(
+                campaigns, concurrency=options["concurrency"], batch_size=options["batch_size"]
+            )
+        self.stdout.write(self.style.SUCCESS(f"Sent {sent} messages"))
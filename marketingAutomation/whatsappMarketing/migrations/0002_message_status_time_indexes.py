@@ -0,0 +1,21 @@
+# Generated by Django 5.2.8 on 2026-10-18 03:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('whatsappMarketing', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='whatsappmessage',
+            index=models.Index(fields=['delivered_at'], name='whatsapp_me_deliver_71720d_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='whatsappmessage',
+            index=models.Index(fields=['read_at'], name='whatsapp_me_read_at_68e827_idx'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.8 on 2026-10-18 04:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('whatsappMarketing', '0002_message_status_time_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='whatsappmessage',
+            name='phone_key',
+            field=models.BigIntegerField(blank=True, help_text='Digits of the E.164 phone number', null=True),
+        ),
+        migrations.AddIndex(
+            model_name='whatsappmessage',
+            index=models.Index(fields=['whatsapp_campaign', 'phone_key'], name='whatsapp_me_whatsap_e50455_idx'),
+        ),
+    ]
@@ -128,6 +128,7 @@ class WhatsAppMessage(models.Model):
 
 	customer_id = models.BigIntegerField(null=True, blank=True, db_index=True)
 	phone_number = models.CharField(max_length=32)
+	phone_key = models.BigIntegerField(blank=True, null=True, help_text="Digits of the E.164 phone number")
 
 	message_id = models.CharField(max_length=255, blank=True, null=True, help_text="WhatsApp message ID")
 
@@ -151,7 +152,10 @@ class WhatsAppMessage(models.Model):
 		ordering = ["-created_at"]
 		indexes = [
 			models.Index(fields=["whatsapp_campaign", "status"]),
+			models.Index(fields=["whatsapp_campaign", "phone_key"]),
 			models.Index(fields=["message_id"]),
+			models.Index(fields=["delivered_at"]),
+			models.Index(fields=["read_at"]),
 		]
 		verbose_name = "WhatsApp Message"
 		verbose_name_plural = "WhatsApp Messages"
@@ -159,13 +163,17 @@ class WhatsAppMessage(models.Model):
 	def __str__(self):
 		return f"Msg {self.message_id or self.id} [{self.status}] to {self.phone_number}"
 
-	def mark_delivered(self):
-		self.status = 'delivered'
-		self.delivered_at = timezone.now()
-		self.save(update_fields=['status', 'delivered_at'])
+	def mark_delivered(self, timestamp=None):
+		self._apply_status('delivered', timestamp)
 
-	def mark_read(self):
-		self.status = 'read'
-		self.read_at = timezone.now()
-		self.save(update_fields=['status', 'read_at'])
+	def mark_read(self, timestamp=None):
+		self._apply_status('read', timestamp)
+
+	def _apply_status(self, status, timestamp):
+		# through the status state machine, so a late call cannot move the
+		# message back and the campaign counters count each transition once
+		from .statuses import apply_statuses
+
+		apply_statuses([(self.pk, status, timestamp or timezone.now())], using=self._state.db, key='pk')
+		self.refresh_from_db(fields=['status', 'sent_at', 'delivered_at', 'read_at'])
 
@@ -0,0 +1,178 @@
+"""
+Compiled provider payloads for ``WhatsAppTemplate``.
+
+A template message names the approved template and carries the values of
+its ``{{1}}``-style placeholders per component: the text header (or the
+media link of an image/video/document header), the body, and the buttons
+taking a per-recipient value (URL buttons with a placeholder in their URL,
+copy-code buttons). Footers take no parameters.
+
+``CompiledPayload`` reads a template version once: it counts the
+placeholders of every component, builds the whole request body as JSON
+with a slot per value (``to`` included), and splits it at the slots into
+static JSON fragments. A recipient's body is then the fragments
+interleaved with the JSON-escaped values, joined and encoded - no
+placeholder parsing, dict building or ``json.dumps`` per message.
+
+Compiled payloads of approved templates are kept in an LRU keyed by
+database alias, primary key and version (``updated_at``); pending or
+rejected templates, which the provider would refuse to send anyway, are
+compiled per call and never cached.
+"""
+import json
+import re
+import threading
+from collections import OrderedDict
+from itertools import count
+
+from django.conf import settings
+
+PLACEHOLDER_RE = re.compile(r"{{\s*(\d+)\s*}}")
+MEDIA_HEADERS = ("image", "video", "document")
+
+# slot markers survive json.dumps(ensure_ascii=False) verbatim; a private
+# use character does not occur in template text
+_MARK = "\ue000"
+_SLOT_RE = re.compile(f'"{_MARK}\\d+{_MARK}"')
+_escape = json.encoder.encode_basestring
+
+
+class ParameterError(ValueError):
+    """A recipient lacks values for the template's placeholders."""
+
+
+def parameter_count(text):
+    """Number of positional parameters ``text`` takes (its highest ``{{n}}``)."""
+    return max(map(int, PLACEHOLDER_RE.findall(text or "")), default=0)
+
+
+class CompiledPayload:
+    """Request body builder of one ``WhatsAppTemplate`` version."""
+
+    def __init__(self, template):
+        self.name = template.template_id
+        self.version = template.updated_at
+        slots = count()
+
+        def slot():
+            return f"{_MARK}{next(slots)}{_MARK}"
+
+        to = slot()
+        components = []
+        header_type = (template.header_type or "").lower()
+        self.header_count = 0
+        if header_type == "text":
+            self.header_count = parameter_count(template.header_content)
+            if self.header_count:
+                parameters = [{"type": "text", "text": slot()} for _ in range(self.header_count)]
+                components.append({"type": "header", "parameters": parameters})
+        elif header_type in MEDIA_HEADERS and template.header_content:
+            media = template.header_content
+            if parameter_count(media):
+                # the whole link comes from the recipient
+                self.header_count = 1
+                media = {"link": slot()}
+            elif media.startswith(("http://", "https://")):
+                media = {"link": media}
+            else:
+                media = {"id": media}
+            components.append({"type": "header", "parameters": [{"type": header_type, header_type: media}]})
+
+        self.body_count = parameter_count(template.body_content)
+        if self.body_count:
+            parameters = [{"type": "text", "text": slot()} for _ in range(self.body_count)]
+            components.append({"type": "body", "parameters": parameters})
+
+        self.button_count = 0
+        for index, button in enumerate(template.buttons or []):
+            kind = (button.get("type") or "").lower()
+            if kind == "url" and parameter_count(button.get("url")):
+                parameter = {"type": "text", "text": slot()}
+            elif kind == "copy_code":
+                parameter = {"type": "coupon_code", "coupon_code": slot()}
+            elif kind == "quick_reply" and button.get("payload"):
+                components.append({
+                    "type": "button", "sub_type": kind, "index": str(index),
+                    "parameters": [{"type": "payload", "payload": button["payload"]}],
+                })
+                continue
+            else:
+                continue
+            self.button_count += 1
+            components.append({"type": "button", "sub_type": kind, "index": str(index), "parameters": [parameter]})
+
+        message = {"name": template.template_id, "language": {"code": template.language}}
+        if components:
+            message["components"] = components
+        body = json.dumps(
+            {"messaging_product": "whatsapp", "recipient_type": "individual", "to": to, "type": "template",
+             "template": message},
+            ensure_ascii=False,
+            separators=(",", ":"),
+        )
+        # fragments at the even positions, values go in between
+        fragments = _SLOT_RE.split(body)
+        self._parts = [None] * (2 * len(fragments) - 1)
+        self._parts[::2] = fragments
+
+    def build(self, recipient):
+        """JSON request body (bytes) for ``recipient``: ``phone_number`` and the
+        ``header_parameters``, ``parameters`` (body) and ``button_parameters``
+        values, in placeholder order."""
+        header = recipient.get("header_parameters") or ()
+        body = recipient.get("parameters") or ()
+        buttons = recipient.get("button_parameters") or ()
+        if len(header) < self.header_count or len(body) < self.body_count or len(buttons) < self.button_count:
+            raise ParameterError(
+                f"template {self.name} takes {self.header_count} header, {self.body_count} body and "
+                f"{self.button_count} button parameters"
+            )
+        values = (
+            recipient["phone_number"],
+            *header[:self.header_count],
+            *body[:self.body_count],
+            *buttons[:self.button_count],
+        )
+        parts = self._parts.copy()
+        parts[1::2] = map(_escape, map(str, values))
+        return "".join(parts).encode()
+
+
+class PayloadCache:
+    """Thread-safe LRU of ``CompiledPayload`` of approved templates, keyed by
+    database alias and template version."""
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, template):
+        if template.approval_status != "approved":
+            return CompiledPayload(template)
+        # primary keys repeat across tenant databases
+        key = (template._state.db, template.pk, template.updated_at)
+        with self._lock:
+            compiled = self._entries.get(key)
+            if compiled is not None:
+                self._entries.move_to_end(key)
+                return compiled
+        compiled = CompiledPayload(template)
+        with self._lock:
+            self._entries[key] = compiled
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return compiled
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+payload_cache = PayloadCache(getattr(settings, "WHATSAPP_PAYLOAD_CACHE_SIZE", 256))
+
+
+def compiled_payload(template):
+    """Compiled payload builder of ``template``'s current version."""
+    return payload_cache.get(template)
@@ -0,0 +1,168 @@
+"""
+Phone number normalization and deduplication of WhatsApp audiences.
+
+Resolvers hand over whatever the customer records hold: ``(212) 555-0123``,
+``+1 212 555 0123``, ``0044 7911 123456``, ``07911 123456``. Sent as they
+are, the same person gets a message per spelling and malformed numbers are
+paid for and fail at the provider. ``normalize_numbers`` turns a batch of
+numbers into E.164 (``+12125550123``) under a country's rules, and
+``Audience`` keeps the numbers a send has already seen, so every recipient
+gets one message.
+
+A batch is normalized as one string rather than number by number: the
+numbers are joined with newlines, stripped of formatting in one
+``str.translate``, and rewritten by three compiled regular expression
+substitutions per country (national forms to ``+<code>``, the
+international call prefix to ``+``, anything that is not then valid E.164
+to an empty line), so the per-number work runs inside the regex engine. The
+compiled rules are cached per country (``COUNTRY_RULES``, extended or
+overridden by ``WHATSAPP_PHONE_RULES``).
+
+Numbers are checked for shape (length, national number prefix), not for
+allocation; that is the provider's job.
+"""
+import re
+from collections import defaultdict
+from functools import lru_cache
+
+from django.conf import settings
+
+# country: (calling code, trunk prefix, international call prefix, national significant number)
+COUNTRY_RULES = {
+    "US": ("1", "1", "011", r"[2-9]\d{2}[2-9]\d{6}"),
+    "CA": ("1", "1", "011", r"[2-9]\d{2}[2-9]\d{6}"),
+    "MX": ("52", "", "00", r"[1-9]\d{9}"),
+    "BR": ("55", "0", "00", r"[1-9]{2}9?\d{8}"),
+    "GB": ("44", "0", "00", r"[1-9]\d{8,9}"),
+    "IE": ("353", "0", "00", r"[1-9]\d{6,9}"),
+    "FR": ("33", "0", "00", r"[1-9]\d{8}"),
+    "DE": ("49", "0", "00", r"[1-9]\d{5,13}"),
+    "NL": ("31", "0", "00", r"[1-9]\d{8}"),
+    "ES": ("34", "", "00", r"[5-9]\d{8}"),
+    "IT": ("39", "", "00", r"0\d{5,10}|3\d{8,9}"),
+    "ZA": ("27", "0", "00", r"[1-9]\d{8}"),
+    "NG": ("234", "0", "009", r"[1-9]\d{7,9}"),
+    "KE": ("254", "0", "000", r"[17]\d{8}"),
+    "AE": ("971", "0", "00", r"[2-9]\d{7,8}"),
+    "IN": ("91", "0", "00", r"[1-9]\d{9}"),
+    "ID": ("62", "0", "001", r"[1-9]\d{7,11}"),
+    "PH": ("63", "0", "00", r"[2-9]\d{7,9}"),
+    "SG": ("65", "", "000", r"[3689]\d{7}"),
+    "AU": ("61", "0", "0011", r"[2-478]\d{8}"),
+}
+
+# formatting characters removed before matching; "\0" joins the batch
+_CLEAN = {ord(char): None for char in " \t\r\n\xa0\u2010\u2011\u2012\u2013\u2014-./()[]"}
+_CLEAN[0] = "\n"
+
+
+def country_rule(country):
+    """The ``(code, trunk, international prefix, national number)`` rule of
+    ``country``, or ``None`` when it has none."""
+    if not country:
+        return None
+    country = country.upper()
+    rule = getattr(settings, "WHATSAPP_PHONE_RULES", {}).get(country) or COUNTRY_RULES.get(country)
+    return tuple(rule) if rule else None
+
+
+@lru_cache(maxsize=None)
+def _substitutions(rule):
+    """``(pattern, replacement)`` steps of a rule over a ``"\\n"``-delimited
+    batch. Every pattern starts with the newline, so the regex engine jumps
+    between lines instead of trying every position. ``re.ASCII`` keeps
+    ``\\d`` to ``0-9``: other Unicode digits make a number invalid."""
+    if rule is None:
+        return (
+            (re.compile(r"\n00(?=[1-9])", re.ASCII), "\n+"),
+            (re.compile(r"\n(?!\+[1-9]\d{6,14}\n)[^\n]*", re.ASCII), "\n"),
+        )
+    code, trunk, prefix, national = rule
+    national = f"(?:{national})"
+    national_prefix = f"{code}|{re.escape(trunk)}" if trunk and trunk != code else code
+    return (
+        # 2125550123, 12125550123, 07911123456, 447911123456 (+<code> ones are done)
+        (re.compile(rf"\n(?:{national_prefix})?(?={national}\n)", re.ASCII), f"\n+{code}"),
+        (re.compile(rf"\n{re.escape(prefix)}(?=[1-9])", re.ASCII), "\n+"),
+        # calling codes are prefix free: +<code> numbers have to be national ones
+        (re.compile(rf"\n(?!\+{code}{national}\n|\+(?!{code})[1-9]\d{{6,14}}\n)[^\n]*", re.ASCII), "\n"),
+    )
+
+
+def normalize_numbers(numbers, country=None):
+    """E.164 forms of a batch of phone number strings, in order, with ``""``
+    for numbers that are not valid. National numbers are read under
+    ``country``'s rules (``WHATSAPP_DEFAULT_COUNTRY`` by default); numbers
+    in international form are accepted for any country."""
+    if not numbers:
+        return []
+    if country is None:
+        country = getattr(settings, "WHATSAPP_DEFAULT_COUNTRY", None)
+    # "+44 (0)20 ...": the trunk prefix in brackets is not dialled from abroad
+    text = "\n" + "\0".join(numbers).replace("(0)", "").translate(_CLEAN) + "\n"
+    for pattern, replacement in _substitutions(country_rule(country)):
+        text = pattern.sub(replacement, text)
+    normalized = text[1:-1].split("\n")
+    if len(normalized) != len(numbers):
+        # a number contained "\0" and split into two lines
+        return [normalize_numbers([number.replace("\0", "")], country)[0] for number in numbers]
+    return normalized
+
+
+def phone_key(number):
+    """Integer key of an E.164 number (its digits), stored as
+    ``WhatsAppMessage.phone_key``."""
+    return int(number)
+
+
+class Audience:
+    """The numbers one send has reached so far. ``add`` passes each valid
+    number once, and counts the invalid and duplicate ones it drops."""
+
+    def __init__(self, country=None):
+        self.country = country or getattr(settings, "WHATSAPP_DEFAULT_COUNTRY", None)
+        self.seen = set()
+        self.invalid = 0
+        self.duplicates = 0
+
+    def __len__(self):
+        return len(self.seen)
+
+    def add_numbers(self, numbers, country=None):
+        """Normalize a batch of numbers and return the set of valid E.164
+        numbers not seen before."""
+        normalized = normalize_numbers(numbers, country or self.country)
+        new = set(normalized)
+        new.discard("")
+        new -= self.seen
+        self.seen |= new
+        invalid = normalized.count("")
+        self.invalid += invalid
+        self.duplicates += len(normalized) - invalid - len(new)
+        return new
+
+    def add(self, recipients):
+        """The recipients (resolver dicts) whose numbers are new, in order,
+        with ``phone_number`` normalized and ``phone_key`` set. A recipient's
+        ``country`` overrides the audience's for its number."""
+        recipients = list(recipients)
+        by_country = defaultdict(list)
+        for recipient in recipients:
+            by_country[recipient.get("country") or self.country].append(recipient)
+        normalized = {}
+        for country, group in by_country.items():
+            numbers = normalize_numbers([recipient.get("phone_number") or "" for recipient in group], country)
+            normalized.update(zip(map(id, group), numbers))
+        added = []
+        for recipient in recipients:
+            number = normalized[id(recipient)]
+            if not number:
+                self.invalid += 1
+            elif number in self.seen:
+                self.duplicates += 1
+            else:
+                self.seen.add(number)
+                recipient["phone_number"] = number
+                recipient["phone_key"] = phone_key(number)
+                added.append(recipient)
+        return added
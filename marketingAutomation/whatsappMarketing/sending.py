@@ -0,0 +1,472 @@
+"""
+Rate-limited asyncio sender for ``WhatsAppCampaign``.
+
+WhatsApp providers cap throughput per business account (tier) and answer
+anything above it with 429s, which cost a round trip and a retry each.
+``WhatsAppSendScheduler`` keeps the send rate under those limits instead:
+
+* every tenant has a token bucket (``WHATSAPP_TENANT_RATE`` messages per
+  second, per-schema overrides in ``WHATSAPP_TENANT_RATES``), and every
+  tenant and template category a second one (``WHATSAPP_CATEGORY_RATES``),
+  so a message only leaves when both have a token;
+* the dispatcher takes turns over tenants, one message per turn, and
+  within a tenant over its campaigns, so a tenant with many or large
+  campaigns cannot starve the others - each gets its own rate whatever the
+  others queue;
+* the scheduler's buckets allow a much smaller burst than the provider's
+  (``WHATSAPP_SEND_BURST_SECONDS``), so requests bunched up on the way by
+  latency jitter still fit the provider's window;
+* a bounded pool of workers (``WHATSAPP_SEND_CONCURRENCY``) keeps that many
+  provider requests in flight (it has to cover rate x latency); a 429 that
+  still happens pauses the buckets for ``retry_after`` and requeues the
+  message. Network errors requeue it too, up to ``SEND_ATTEMPTS`` tries;
+  any other error of the provider client only fails that message.
+
+Recipients are streamed from the campaign's ``customer_segment`` bitmap in
+batches through ``WHATSAPP_RECIPIENT_RESOLVER`` (like the email pipeline),
+their numbers normalized to E.164 and deduplicated per campaign
+(``whatsappMarketing.phones``) before anything is sent. Request bodies are
+filled in from the template's compiled payload
+(``whatsappMarketing.payloads``). Results are recorded per batch: one
+``bulk_create`` of ``WhatsAppMessage`` rows (``sent`` with the provider
+message id, or ``failed``) and one ``F()`` update of ``sent_count``.
+However a run ends, every campaign's outstanding results are recorded and
+it gets a final status: ``sent``, or ``failed`` when nothing went out or
+its send did not complete. Numbers already messaged are skipped when it is
+sent again.
+
+``StubProvider`` is a local stand-in for the provider API that enforces
+the same per-tenant limits and answers after a fixed latency; the real
+client is configured with ``WHATSAPP_PROVIDER``.
+"""
+import asyncio
+import itertools
+import logging
+import time
+import uuid
+from collections import Counter, deque
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import WhatsAppCampaign, WhatsAppMessage
+from .payloads import ParameterError, compiled_payload
+from .phones import Audience
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONCURRENCY = 32
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_TENANT_RATE = 80
+# burst the scheduler allows itself, in seconds of rate; well under the
+# provider's so that requests bunched up by latency jitter still fit
+DEFAULT_BURST_SECONDS = 0.1
+# tries per message on network errors
+SEND_ATTEMPTS = 3
+
+
+class RateLimited(Exception):
+    """The provider refused a request for exceeding the throughput tier (HTTP 429)."""
+
+    def __init__(self, retry_after=1.0):
+        super().__init__(f"rate limited, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class ProviderError(Exception):
+    """The provider rejected a message; it is recorded as failed."""
+
+
+class TokenBucket:
+    """``rate`` tokens per second, holding at most ``capacity`` (one second of
+    tokens by default)."""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate, capacity=None, now=None):
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic() if now is None else now
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait(self, now, count=1):
+        """Seconds until ``count`` tokens are available (0 when they are)."""
+        self._refill(now)
+        return 0.0 if self.tokens >= count else (count - self.tokens) / self.rate
+
+    def take(self, now, count=1):
+        self._refill(now)
+        self.tokens -= count
+
+    def pause(self, now, seconds):
+        """Hand out nothing for ``seconds``."""
+        self._refill(now)
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+
+class WhatsAppProvider:
+    """Sends one message, given as its JSON request body (bytes, see
+    ``whatsappMarketing.payloads``); returns the provider message id, raises
+    ``RateLimited`` on a 429 and ``ProviderError`` for rejected messages."""
+
+    async def send(self, tenant, payload):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class StubProvider(WhatsAppProvider):
+    """In-process provider enforcing ``rate`` messages per second per tenant
+    (``rates`` per schema) with one second of burst, answering after
+    ``latency`` seconds."""
+
+    def __init__(self, rate=DEFAULT_TENANT_RATE, rates=None, latency=0.05):
+        self.rate = rate
+        self.rates = rates or {}
+        self.latency = latency
+        self.accepted = Counter()
+        self.rejected = Counter()
+        self._buckets = {}
+        self._ids = itertools.count()
+        self._prefix = uuid.uuid4().hex[:16]
+
+    async def send(self, tenant, payload):
+        now = time.monotonic()
+        bucket = self._buckets.get(tenant)
+        if bucket is None:
+            bucket = self._buckets[tenant] = TokenBucket(self.rates.get(tenant, self.rate), now=now)
+        if bucket.wait(now):
+            self.rejected[tenant] += 1
+            raise RateLimited(1 / bucket.rate)
+        bucket.take(now)
+        self.accepted[tenant] += 1
+        await asyncio.sleep(self.latency)
+        if b'"to":"+' not in payload:
+            raise ProviderError("recipient is not an E.164 phone number")
+        return f"wamid.{self._prefix}{next(self._ids):016x}"
+
+
+def get_provider():
+    path = getattr(settings, "WHATSAPP_PROVIDER", None)
+    if not path:
+        raise ImproperlyConfigured("WHATSAPP_PROVIDER is not configured")
+    return import_string(path)()
+
+
+def get_recipient_resolver():
+    """``WHATSAPP_RECIPIENT_RESOLVER``: ``resolver(customer_ids, whatsapp_campaign)``
+    returning an iterable of dicts with at least ``phone_number`` (and usually
+    ``customer_id`` plus the template ``parameters``; ``country`` when the
+    number may be national and not in ``WHATSAPP_DEFAULT_COUNTRY``)."""
+    path = getattr(settings, "WHATSAPP_RECIPIENT_RESOLVER", None)
+    if not path:
+        raise ImproperlyConfigured("WHATSAPP_RECIPIENT_RESOLVER is not configured")
+    return import_string(path)
+
+
+class _CampaignSend:
+    """Send state of one campaign inside the scheduler."""
+
+    def __init__(self, campaign, scheduler):
+        self.campaign = campaign
+        self.using = campaign._state.db
+        self.tenant = campaign.tenant_schema or "default"
+        template = campaign.whatsapp_template
+        self.category = (template.category or "").lower()
+        self.payload = compiled_payload(template).build
+        self.buckets = scheduler.buckets_for(self.tenant, self.category)
+        self.resolver = scheduler.resolver
+        self.batch_size = scheduler.batch_size
+        self.audience = Audience()
+        self.pending = deque()
+        self.attempts = Counter()
+        self.results = []
+        self.recording = set()
+        self.in_flight = 0
+        self.loading = False
+        self.exhausted = False
+        self.sent = 0
+        self.failed = 0
+        self.closed = False
+        self._chunks = None
+
+    @property
+    def finished(self):
+        return self.exhausted and not self.pending and not self.in_flight and not self.loading
+
+    def wait(self, now):
+        return max(bucket.wait(now) for bucket in self.buckets)
+
+    def take(self, now):
+        for bucket in self.buckets:
+            bucket.take(now)
+
+    def pause(self, now, seconds):
+        for bucket in self.buckets:
+            bucket.pause(now, seconds)
+
+    def next_batch(self):
+        """The next batch of recipients, or ``None`` when the segment is exhausted."""
+        if self._chunks is None:
+            WhatsAppCampaign.objects.using(self.using).filter(pk=self.campaign.pk).update(
+                status="sending", updated_at=timezone.now()
+            )
+            # numbers this campaign already messaged (an interrupted send) are not sent again
+            self.audience.seen.update(
+                f"+{key}"
+                for key in WhatsAppMessage.objects.using(self.using)
+                .filter(whatsapp_campaign_id=self.campaign.pk, phone_key__isnull=False)
+                .values_list("phone_key", flat=True)
+                .iterator()
+            )
+            self._chunks = self.campaign.customer_segment.get_members().iter_chunks(self.batch_size)
+        for ids in self._chunks:
+            recipients = self.audience.add(self.resolver(ids, self.campaign))
+            if recipients:
+                return recipients
+        return None
+
+    def record(self, results):
+        """Store ``(recipient, message_id, error)`` results of this campaign."""
+        now = timezone.now()
+        messages = [
+            WhatsAppMessage(
+                whatsapp_campaign_id=self.campaign.pk,
+                customer_id=recipient.get("customer_id"),
+                phone_number=recipient["phone_number"],
+                phone_key=recipient["phone_key"],
+                message_id=message_id,
+                status="failed" if error else "sent",
+                sent_at=None if error else now,
+                failed_reason=error,
+            )
+            for recipient, message_id, error in results
+        ]
+        sent = sum(1 for _, _, error in results if not error)
+        with transaction.atomic(using=self.using):
+            WhatsAppMessage.objects.using(self.using).bulk_create(messages)
+            if sent:
+                WhatsAppCampaign.objects.using(self.using).filter(pk=self.campaign.pk).update(
+                    sent_count=F("sent_count") + sent, updated_at=now
+                )
+
+    def finish(self, status=None):
+        status = status or ("sent" if self.sent or not self.failed else "failed")
+        WhatsAppCampaign.objects.using(self.using).filter(pk=self.campaign.pk).update(
+            status=status, updated_at=timezone.now()
+        )
+        self.campaign.status = status
+        self.closed = True
+
+
+class WhatsAppSendScheduler:
+    def __init__(self, provider=None, concurrency=None, batch_size=None, resolver=None,
+                 tenant_rate=None, tenant_rates=None, category_rates=None, burst=None):
+        self.provider = provider or get_provider()
+        self.concurrency = concurrency or getattr(settings, "WHATSAPP_SEND_CONCURRENCY", DEFAULT_CONCURRENCY)
+        self.batch_size = batch_size or getattr(settings, "WHATSAPP_SEND_BATCH_SIZE", DEFAULT_BATCH_SIZE)
+        self.resolver = resolver or get_recipient_resolver()
+        self.tenant_rate = tenant_rate or getattr(settings, "WHATSAPP_TENANT_RATE", DEFAULT_TENANT_RATE)
+        self.tenant_rates = getattr(settings, "WHATSAPP_TENANT_RATES", {}) if tenant_rates is None else tenant_rates
+        self.category_rates = (
+            getattr(settings, "WHATSAPP_CATEGORY_RATES", {}) if category_rates is None else category_rates
+        )
+        self.burst = burst or getattr(settings, "WHATSAPP_SEND_BURST_SECONDS", DEFAULT_BURST_SECONDS)
+        self.sent = Counter()
+        self.failed = Counter()
+        self.throttled = Counter()
+        self._buckets = {}
+        self._tenants = {}
+        self._jobs = []
+        self._ring = deque()
+        self._completions = []
+        self._failure = None
+        self._wake = None
+
+    def buckets_for(self, tenant, category):
+        """The tenant's bucket and, when its category is limited, the
+        tenant-and-category bucket; shared by the tenant's campaigns."""
+        if tenant not in self._buckets:
+            self._buckets[tenant] = self._bucket(self.tenant_rates.get(tenant, self.tenant_rate))
+        buckets = [self._buckets[tenant]]
+        rate = self.category_rates.get(category)
+        if rate:
+            key = (tenant, category)
+            if key not in self._buckets:
+                self._buckets[key] = self._bucket(rate)
+            buckets.append(self._buckets[key])
+        return buckets
+
+    def _bucket(self, rate):
+        return TokenBucket(rate, max(1, rate * self.burst))
+
+    def add(self, whatsapp_campaign):
+        job = _CampaignSend(whatsapp_campaign, self)
+        self._jobs.append(job)
+        if job.tenant not in self._tenants:
+            self._tenants[job.tenant] = deque()
+            self._ring.append(job.tenant)
+        self._tenants[job.tenant].append(job)
+        return job
+
+    def _notify(self):
+        if self._wake is not None:
+            self._wake.set()
+
+    async def _refill(self, job):
+        try:
+            recipients = await sync_to_async(job.next_batch)()
+        except Exception as exc:
+            self._failure = exc
+            return
+        finally:
+            job.loading = False
+            self._notify()
+        if recipients is None:
+            job.exhausted = True
+        else:
+            job.pending.extend(recipients)
+
+    async def _flush(self, job):
+        results, job.results = job.results, []
+        if results:
+            # a worker cancelled while waiting must not lose the batch
+            task = asyncio.ensure_future(sync_to_async(job.record)(results))
+            job.recording.add(task)
+            task.add_done_callback(job.recording.discard)
+            await asyncio.shield(task)
+
+    def _next(self, now):
+        """One message to send as ``(job, recipient)``, taking turns over tenants
+        and their campaigns, or ``(None, seconds until a bucket has a token)``
+        (``None`` seconds: wait for a worker or a recipient batch)."""
+        earliest = None
+        for _ in range(len(self._ring)):
+            tenant = self._ring[0]
+            self._ring.rotate(-1)
+            jobs = self._tenants[tenant]
+            for _ in range(len(jobs)):
+                job = jobs[0]
+                jobs.rotate(-1)
+                if len(job.pending) < self.batch_size and not job.loading and not job.exhausted:
+                    job.loading = True
+                    asyncio.ensure_future(self._refill(job))
+                if job.finished:
+                    jobs.pop()
+                    self._completions.append(asyncio.ensure_future(self._close(job)))
+                    continue
+                if not job.pending:
+                    continue
+                wait = job.wait(now)
+                if wait:
+                    earliest = wait if earliest is None else min(earliest, wait)
+                    continue
+                job.take(now)
+                return job, job.pending.popleft()
+            if not jobs:
+                self._ring.pop()
+                del self._tenants[tenant]
+        return None, earliest
+
+    async def _dispatch(self, queue):
+        while self._ring:
+            if self._failure is not None:
+                raise self._failure
+            job, item = self._next(time.monotonic())
+            if job is not None:
+                job.in_flight += 1
+                await queue.put((job, item))
+                continue
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), item or 1.0)
+            except asyncio.TimeoutError:
+                pass
+        await asyncio.gather(*self._completions)
+
+    async def _work(self, queue):
+        while True:
+            job, recipient = await queue.get()
+            try:
+                message_id = await self.provider.send(job.tenant, job.payload(recipient))
+            except RateLimited as exc:
+                self.throttled[job.tenant] += 1
+                job.pause(time.monotonic(), exc.retry_after)
+                job.pending.appendleft(recipient)
+            except (ProviderError, ParameterError) as exc:
+                self._fail(job, recipient, str(exc))
+            except (OSError, asyncio.TimeoutError) as exc:
+                job.attempts[recipient["phone_key"]] += 1
+                if job.attempts[recipient["phone_key"]] < SEND_ATTEMPTS:
+                    job.pending.append(recipient)
+                else:
+                    logger.warning("sending to %s failed: %r", recipient["phone_number"], exc)
+                    self._fail(job, recipient, repr(exc))
+            except Exception as exc:
+                logger.exception("provider error sending to %s", recipient["phone_number"])
+                self._fail(job, recipient, repr(exc))
+            else:
+                self.sent[job.tenant] += 1
+                job.sent += 1
+                job.results.append((recipient, message_id, None))
+            job.in_flight -= 1
+            if len(job.results) >= self.batch_size:
+                await self._flush(job)
+            queue.task_done()
+            self._notify()
+
+    def _fail(self, job, recipient, reason):
+        self.failed[job.tenant] += 1
+        job.failed += 1
+        job.results.append((recipient, None, reason))
+
+    async def _close(self, job):
+        """Record what ``job`` has left and give it its final status; a send
+        that did not run to completion is ``failed``."""
+        try:
+            await asyncio.gather(*job.recording)
+            await self._flush(job)
+        finally:
+            await sync_to_async(job.finish)(None if job.finished else "failed")
+
+    async def run(self):
+        """Send every added campaign to completion; returns messages sent."""
+        self._wake = asyncio.Event()
+        queue = asyncio.Queue(self.concurrency)
+        workers = [asyncio.ensure_future(self._work(queue)) for _ in range(self.concurrency)]
+        dispatcher = asyncio.ensure_future(self._dispatch(queue))
+        try:
+            # workers only stop by raising, which has to stop the send too
+            done, _ = await asyncio.wait([dispatcher, *workers], return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                task.result()
+        finally:
+            for task in [dispatcher, *workers]:
+                task.cancel()
+            await asyncio.gather(dispatcher, *workers, *self._completions, return_exceptions=True)
+            for job in self._jobs:
+                if not job.closed:
+                    try:
+                        await self._close(job)
+                    except Exception:
+                        logger.exception("recording WhatsApp campaign %s failed", job.campaign.pk)
+            await self.provider.close()
+        return sum(self.sent.values())
+
+
+def send_whatsapp_campaigns(whatsapp_campaigns, **kwargs):
+    """Send ``whatsapp_campaigns`` side by side to completion; returns messages sent."""
+    scheduler = WhatsAppSendScheduler(**kwargs)
+    for campaign in whatsapp_campaigns:
+        scheduler.add(campaign)
+    return asyncio.run(scheduler.run())
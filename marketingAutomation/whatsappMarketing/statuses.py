@@ -0,0 +1,202 @@
+"""
+Bulk application of WhatsApp delivery status callbacks.
+
+Providers report ``sent``/``delivered``/``read``/``failed`` per message,
+hundreds of thousands per campaign, out of order (``read`` before
+``delivered``) and with retries. ``apply_statuses`` takes a batch of
+``(message_id, status, timestamp)`` callbacks and runs them through a
+monotonic state machine: statuses are ranked (``STATUS_RANK``), each
+message ends at the highest status it has seen and never moves back, a
+status's timestamp is the earliest reported and never overwritten, and
+``read`` implies delivery, filling ``delivered_at`` when that callback is
+missing. Callbacks with a status outside ``STATUS_RANK`` (a provider adding
+one, say ``deleted``) are logged and skipped, so they cannot sink the
+batch. A message moving up counts once towards every counter it passes
+(``sent`` to ``read`` adds one delivered and one read), so repeated and
+reordered callbacks cannot inflate ``WhatsAppCampaign.delivered_count`` or
+``read_count``.
+
+Per chunk of callbacks, the messages are resolved with one SELECT through
+the ``message_id`` index and the transitions written with one ``UPDATE ...
+FROM (VALUES ...)`` joined on the primary key; then every campaign gets one
+aggregated counter increment, all in one transaction.
+
+The same transitions feed the hourly campaign rollups
+(``campaign.rollups.apply_deltas``) in that transaction, bucketed by the
+provider's timestamp: a callback arriving hours late still lands in the
+hour the message was delivered or read, which a rollup walking
+``delivered_at``/``read_at`` behind a watermark would have passed already.
+"""
+import logging
+from collections import Counter, defaultdict
+from itertools import islice
+
+from django.db import connections, router, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from campaign.rollups import apply_deltas
+
+from .models import WhatsAppCampaign, WhatsAppMessage
+
+logger = logging.getLogger(__name__)
+
+STATUS_TIME_FIELDS = {
+    "sent": "sent_at",
+    "delivered": "delivered_at",
+    "read": "read_at",
+    "failed": None,
+}
+# failed ranks below delivered: proof of delivery wins over a failure report
+STATUS_RANK = {"sent": 0, "failed": 1, "delivered": 2, "read": 3}
+COUNTER_FIELDS = {
+    "delivered": "delivered_count",
+    "read": "read_count",
+}
+# campaign rollup metric and position of its timestamp in a resolved state
+ROLLUP_METRICS = {"delivered": ("delivered", 2), "read": ("opened", 3)}
+TIME_FIELDS = ("sent_at", "delivered_at", "read_at")
+CHUNK_SIZE = 5000
+
+
+def _collect(updates):
+    """``{key: {status: earliest timestamp}}`` of a batch of callbacks."""
+    seen = defaultdict(dict)
+    unknown = Counter()
+    for key, status, timestamp in updates:
+        if status not in STATUS_RANK:
+            unknown[status] += 1
+            continue
+        if not key:
+            continue
+        timestamp = timestamp or timezone.now()
+        statuses = seen[key]
+        if status not in statuses or timestamp < statuses[status]:
+            statuses[status] = timestamp
+    if unknown:
+        logger.warning(
+            "skipped %d WhatsApp status callbacks with unknown statuses: %s",
+            sum(unknown.values()),
+            ", ".join(f"{status!r} x {n}" for status, n in unknown.items()),
+        )
+    return seen
+
+
+def resolve(current, seen):
+    """Final state of a message in status ``current`` after the callbacks
+    ``seen`` (``{status: timestamp}``): ``(status, sent_at, delivered_at,
+    read_at)`` with ``None`` for timestamps to keep, or ``None`` when the
+    message does not advance."""
+    target = max(seen, key=STATUS_RANK.__getitem__)
+    if STATUS_RANK[target] <= STATUS_RANK[current]:
+        return None
+    delivered_at = seen.get("delivered")
+    if delivered_at is None and target == "read":
+        delivered_at = seen["read"]
+    return target, seen.get("sent"), delivered_at, seen.get("read")
+
+
+def counter_deltas(current, target):
+    """Counted statuses a message passes moving from ``current`` to ``target``."""
+    return [
+        status for status in COUNTER_FIELDS if STATUS_RANK[current] < STATUS_RANK[status] <= STATUS_RANK[target]
+    ]
+
+
+def _write(changes, using):
+    """Store ``(pk, status, sent_at, delivered_at, read_at)`` transitions;
+    timestamps already set are kept."""
+    if not changes:
+        return
+    connection = connections[using]
+    ops = connection.ops
+    quote = ops.quote_name
+    table = quote(WhatsAppMessage._meta.db_table)
+    adapt = ops.adapt_datetimefield_value
+    rows = [(pk, status, *map(adapt, times)) for pk, status, *times in changes]
+    with connection.cursor() as cursor:
+        if connection.vendor not in ("postgresql", "sqlite"):
+            sql = "UPDATE %s SET status = %%s, %s WHERE id = %%s" % (
+                table,
+                ", ".join(f"{quote(f)} = COALESCE({quote(f)}, %s)" for f in TIME_FIELDS),
+            )
+            cursor.executemany(sql, [(*values, pk) for pk, *values in rows])
+            return
+        # untyped NULLs in VALUES would be text to PostgreSQL
+        stamp = "%s::timestamptz" if connection.vendor == "postgresql" else "%s"
+        row = "(%s, %s, " + ", ".join([stamp] * len(TIME_FIELDS)) + ")"
+        sql = "WITH v (id, status, %s) AS (VALUES %s) UPDATE %s SET status = v.status, %s FROM v WHERE %s.id = v.id" % (
+            ", ".join(TIME_FIELDS),
+            ", ".join([row] * len(rows)),
+            table,
+            ", ".join(f"{quote(f)} = COALESCE({table}.{quote(f)}, v.{f})" for f in TIME_FIELDS),
+            table,
+        )
+        cursor.execute(sql, [value for row in rows for value in row])
+
+
+def apply_counters(counts, using=None):
+    """Add ``{whatsapp_campaign_id: Counter(status=n)}`` to the campaign counters,
+    one UPDATE per campaign (in id order, so concurrent callers cannot deadlock)."""
+    now = timezone.now()
+    campaigns = WhatsAppCampaign.objects.db_manager(using)
+    for campaign_id in sorted(counts):
+        increments = {
+            COUNTER_FIELDS[status]: F(COUNTER_FIELDS[status]) + n
+            for status, n in counts[campaign_id].items()
+            if n and status in COUNTER_FIELDS
+        }
+        if increments:
+            campaigns.filter(pk=campaign_id).update(updated_at=now, **increments)
+
+
+def apply_rollups(transitions, using=None):
+    """Add ``{(whatsapp_campaign_id, hour_start): Counter(metric=n)}`` to the
+    rollup buckets of the campaigns' parent ``Campaign``."""
+    parents = dict(
+        WhatsAppCampaign.objects.using(using)
+        .filter(pk__in={campaign_id for campaign_id, _ in transitions}, campaign__isnull=False)
+        .values_list("pk", "campaign_id")
+    )
+    deltas = defaultdict(Counter)
+    for (campaign_id, hour), values in transitions.items():
+        if campaign_id in parents:
+            deltas[(parents[campaign_id], hour)].update(values)
+    apply_deltas(deltas, using)
+
+
+def apply_statuses(updates, using=None, key="message_id"):
+    """Apply ``(message_id, status, timestamp)`` callbacks; returns the number of
+    messages that advanced. Unknown message ids are ignored. ``key="pk"``
+    takes message primary keys instead of provider ids."""
+    using = using or router.db_for_write(WhatsAppMessage)
+    seen = _collect(updates)
+    messages = WhatsAppMessage.objects.using(using)
+    if connections[using].features.has_select_for_update:
+        messages = messages.select_for_update()
+    counts = defaultdict(Counter)
+    transitions = defaultdict(Counter)
+    changed = 0
+    keys = iter(seen)
+    with transaction.atomic(using=using):
+        while chunk := list(islice(keys, CHUNK_SIZE)):
+            rows = messages.filter(**{f"{key}__in": chunk}).values_list(
+                "pk", key, "whatsapp_campaign_id", "status"
+            )
+            changes = []
+            for pk, message_key, campaign_id, current in rows:
+                final = resolve(current, seen[message_key])
+                if final is None:
+                    continue
+                changes.append((pk, *final))
+                passed = counter_deltas(current, final[0])
+                counts[campaign_id].update(passed)
+                for status in passed:
+                    metric, position = ROLLUP_METRICS[status]
+                    hour = timezone.localtime(final[position]).replace(minute=0, second=0, microsecond=0)
+                    transitions[(campaign_id, hour)][metric] += 1
+            _write(changes, using)
+            changed += len(changes)
+        apply_counters(counts, using)
+        apply_rollups(transitions, using)
+    return changed
@@ -1,3 +1,249 @@
-from django.test import TestCase
+import asyncio
+import json
+from datetime import timedelta
 
-# Create your tests here.
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from campaign.models import Campaign, CustomerSegment
+from campaign.rollups import campaign_series
+
+from .models import WhatsAppCampaign, WhatsAppMessage, WhatsAppTemplate
+from .payloads import CompiledPayload, ParameterError, PayloadCache
+from .phones import Audience, normalize_numbers
+from .sending import StubProvider, WhatsAppSendScheduler
+from .statuses import apply_statuses
+
+
+def resolve(customer_ids, whatsapp_campaign):
+    return [{"customer_id": i, "phone_number": f"+1212555{i:04d}", "parameters": [f"N{i}"]} for i in customer_ids]
+
+
+class FlakyProvider(StubProvider):
+    """Drops the connection on the first request to customer 1 and breaks on customer 2."""
+
+    def __init__(self):
+        super().__init__(rate=1e9, latency=0)
+        self.calls = []
+
+    async def send(self, tenant, payload):
+        self.calls.append((tenant, payload))
+        if b"+12125550001" in payload and len(self.calls) < 3:
+            raise ConnectionResetError("connection reset by peer")
+        if b"+12125550002" in payload:
+            raise RuntimeError("unexpected response")
+        return await super().send(tenant, payload)
+
+
+class WhatsAppCampaignTestMixin:
+    def whatsapp_campaign(self, members=(), **template_fields):
+        segment = CustomerSegment.objects.create(name="spring")
+        segment.set_members(members)
+        template_fields = {
+            "name": "t", "template_id": "spring_sale", "language": "en_US", "approval_status": "approved",
+            "body_content": "Hi {{1}}", **template_fields,
+        }
+        return WhatsAppCampaign.objects.create(
+            name="spring", whatsapp_template=WhatsAppTemplate.objects.create(**template_fields),
+            customer_segment=segment,
+        )
+
+
+class StatusCallbackTests(WhatsAppCampaignTestMixin, TestCase):
+    def setUp(self):
+        self.campaign = self.whatsapp_campaign()
+        self.now = timezone.now()
+        self.messages = [
+            WhatsAppMessage.objects.create(
+                whatsapp_campaign=self.campaign, phone_number=f"+1212555{i:04d}", message_id=f"wamid.{i}",
+                status="sent", sent_at=self.now,
+            )
+            for i in range(2)
+        ]
+
+    def state(self, message):
+        message.refresh_from_db()
+        return message.status, message.delivered_at, message.read_at
+
+    def test_statuses_never_move_back_or_count_twice(self):
+        delivered, read = self.now + timedelta(seconds=5), self.now + timedelta(seconds=9)
+        apply_statuses([("wamid.0", "read", read), ("wamid.0", "read", read + timedelta(seconds=1))])
+        self.assertEqual(self.state(self.messages[0]), ("read", read, read))
+        # a late delivery report neither moves the message back nor counts again
+        self.assertEqual(apply_statuses([("wamid.0", "delivered", delivered), ("wamid.0", "failed", None)]), 0)
+        self.assertEqual(self.state(self.messages[0]), ("read", read, read))
+        self.campaign.refresh_from_db()
+        self.assertEqual((self.campaign.delivered_count, self.campaign.read_count), (1, 1))
+
+    def test_unknown_statuses_are_skipped(self):
+        with self.assertLogs("whatsappMarketing.statuses", "WARNING") as logs:
+            changed = apply_statuses([("wamid.0", "deleted", None), ("wamid.1", "delivered", self.now)])
+        self.assertEqual(changed, 1)
+        self.assertIn("'deleted' x 1", logs.output[0])
+        self.assertEqual(self.state(self.messages[0])[0], "sent")
+        self.assertEqual(self.state(self.messages[1])[0], "delivered")
+
+    def test_late_callbacks_reach_their_hour_bucket(self):
+        campaign = Campaign.objects.create(name="spring")
+        WhatsAppCampaign.objects.filter(pk=self.campaign.pk).update(campaign=campaign)
+        hour = self.now.replace(minute=0, second=0, microsecond=0) - timedelta(hours=5)
+        apply_statuses([("wamid.0", "read", hour + timedelta(minutes=10))])
+        # arrives hours after later activity was rolled up, for an earlier hour
+        apply_statuses([("wamid.1", "delivered", hour + timedelta(minutes=20)), ("wamid.0", "delivered", self.now)])
+        self.assertEqual(
+            [(row["bucket_start"], row["delivered"], row["opened"]) for row in campaign_series(campaign.pk)],
+            [(hour, 2, 1)],
+        )
+
+
+class PhoneNumberTests(TestCase):
+    def test_numbers_are_normalized_to_e164(self):
+        numbers = ["(212) 555-0123", "+1 212 555 0123", "1-212-555-0123", "011 44 7911 123456",
+                   "+44 (0)20 7946 0958", "555-0123", "+1 112 555 0123", "call me", "", "+1212\x005550123"]
+        self.assertEqual(normalize_numbers(numbers, "US"), [
+            "+12125550123", "+12125550123", "+12125550123", "+447911123456", "+442079460958", "", "", "", "",
+            "+12125550123",
+        ])
+        self.assertEqual(normalize_numbers(["07911 123456", "0044 7911 123456", "7911123456"], "GB"),
+                         ["+447911123456"] * 3)
+        # int() and str regexes take other Unicode digits; numbers are ASCII only
+        self.assertEqual(normalize_numbers(["+1212555012\uff13", "212555012\u0663", "+\u0664\u0664 7911 123456"], "US"),
+                         ["", "", ""])
+        self.assertEqual(normalize_numbers(["+\u0664\u0664 7911 123456"], "XX"), [""])
+        # without rules only international forms are read
+        self.assertEqual(normalize_numbers(["0044 7911 123456", "07911 123456"], "XX"), ["+447911123456", ""])
+
+    def test_rules_come_from_settings(self):
+        self.assertEqual(normalize_numbers(["912 345 678"], "PT"), [""])
+        with override_settings(WHATSAPP_PHONE_RULES={"PT": ("351", "", "00", r"[29]\d{8}")}):
+            self.assertEqual(normalize_numbers(["912 345 678"], "pt"), ["+351912345678"])
+
+    def test_audience_passes_each_number_once(self):
+        audience = Audience("US")
+        first = audience.add([
+            {"customer_id": 1, "phone_number": "(212) 555-0123"},
+            {"customer_id": 2, "phone_number": "07911 123456", "country": "GB"},
+            {"customer_id": 3, "phone_number": "+1 212 555 0123"},
+            {"customer_id": 4, "phone_number": None},
+        ])
+        self.assertEqual([(r["customer_id"], r["phone_number"], r["phone_key"]) for r in first],
+                         [(1, "+12125550123", 12125550123), (2, "+447911123456", 447911123456)])
+        self.assertEqual(audience.add_numbers(["+44 7911 123456", "212-555-0199"]), {"+12125550199"})
+        self.assertEqual((len(audience), audience.invalid, audience.duplicates), (3, 1, 2))
+
+
+class SendSchedulerTests(WhatsAppCampaignTestMixin, TransactionTestCase):
+    def scheduler(self, provider, **kwargs):
+        kwargs.setdefault("resolver", resolve)
+        return WhatsAppSendScheduler(provider=provider, tenant_rate=1e9, category_rates={}, **kwargs)
+
+    def test_provider_errors_fail_or_retry_one_message(self):
+        campaign = self.whatsapp_campaign(range(1, 4))
+        scheduler = self.scheduler(FlakyProvider(), concurrency=1)
+        scheduler.add(campaign)
+        with self.assertLogs("whatsappMarketing.sending", "ERROR"):
+            self.assertEqual(asyncio.run(scheduler.run()), 2)
+        statuses = dict(WhatsAppMessage.objects.values_list("customer_id", "status"))
+        self.assertEqual(statuses, {1: "sent", 2: "failed", 3: "sent"})
+        campaign.refresh_from_db()
+        self.assertEqual((campaign.status, campaign.sent_count), ("sent", 2))
+
+    def test_each_number_gets_one_message_across_runs(self):
+        campaign = self.whatsapp_campaign(range(1, 5))
+
+        def spellings(customer_ids, whatsapp_campaign):
+            numbers = {1: "(212) 555-0001", 2: "+1 212 555 0002", 3: "1 212 555 0001", 4: "555-0004"}
+            return [{"customer_id": i, "phone_number": numbers[i], "parameters": [f"N{i}"]} for i in customer_ids]
+
+        scheduler = self.scheduler(StubProvider(rate=1e9, latency=0), resolver=spellings)
+        scheduler.add(campaign)
+        self.assertEqual(asyncio.run(scheduler.run()), 2)
+        self.assertEqual(set(WhatsAppMessage.objects.values_list("customer_id", "phone_key")),
+                         {(1, 12125550001), (2, 12125550002)})
+
+        # a rerun (say, after an interruption) does not message them again
+        scheduler = self.scheduler(StubProvider(rate=1e9, latency=0), resolver=spellings)
+        scheduler.add(campaign)
+        self.assertEqual(asyncio.run(scheduler.run()), 0)
+        self.assertEqual(WhatsAppMessage.objects.count(), 2)
+
+    def test_interrupted_run_records_results_and_fails_the_campaign(self):
+        campaign = self.whatsapp_campaign(range(1, 7))
+
+        def dies_after_the_first_batch(customer_ids, whatsapp_campaign):
+            if 3 in customer_ids:
+                raise RuntimeError("resolver went away")
+            return resolve(customer_ids, whatsapp_campaign)
+
+        scheduler = WhatsAppSendScheduler(provider=StubProvider(rate=1e9, latency=0), batch_size=2,
+                                          resolver=dies_after_the_first_batch, tenant_rate=1e9, category_rates={})
+        scheduler.add(campaign)
+        with self.assertRaises(RuntimeError):
+            asyncio.run(scheduler.run())
+        campaign.refresh_from_db()
+        self.assertEqual(campaign.status, "failed")
+        self.assertEqual(WhatsAppMessage.objects.count(), sum(scheduler.sent.values()))
+        self.assertEqual(campaign.sent_count, sum(scheduler.sent.values()))
+
+    def test_tenants_take_turns(self):
+        provider = StubProvider(rate=1e9, latency=0)
+        scheduler = self.scheduler(provider, concurrency=1)
+        sent = []
+        send = provider.send
+
+        async def recording_send(tenant, payload):
+            sent.append(tenant)
+            return await send(tenant, payload)
+
+        provider.send = recording_send
+        for tenant, members in (("big", range(1, 41)), ("big", range(41, 81)), ("small", range(81, 91))):
+            campaign = self.whatsapp_campaign(members)
+            campaign.tenant_schema = tenant
+            scheduler.add(campaign)
+        self.assertEqual(asyncio.run(scheduler.run()), 90)
+        # once its recipients are loaded, the small tenant gets every other
+        # message, however much the big one queues
+        first = sent.index("small")
+        self.assertGreaterEqual(sent[first:first + 20].count("small"), 9)
+        self.assertEqual(set(WhatsAppCampaign.objects.values_list("status", flat=True)), {"sent"})
+
+
+class CompiledPayloadTests(TestCase):
+    def template(self, **fields):
+        fields = {
+            "name": "t", "template_id": "spring_sale", "language": "en_US", "approval_status": "approved",
+            "header_type": "text", "header_content": "Sale for {{1}}", "body_content": "Hi {{1}}, {{2}} off",
+            "buttons": [{"type": "URL", "text": "Shop", "url": "https://shop.example.com/r/{{1}}"},
+                        {"type": "QUICK_REPLY", "text": "Stop", "payload": "unsubscribe"},
+                        {"type": "COPY_CODE", "example": "SPRING20"}],
+            "updated_at": timezone.now(), **fields,
+        }
+        return WhatsAppTemplate(pk=1, **fields)
+
+    def test_slots_are_filled_in_placeholder_order(self):
+        body = json.loads(CompiledPayload(self.template()).build({
+            "phone_number": "+12125550001", "header_parameters": ["Ann"], "parameters": ['"Ann"', 20],
+            "button_parameters": ["c1", "SPRING20"],
+        }))
+        self.assertEqual(body["to"], "+12125550001")
+        components = body["template"]["components"]
+        self.assertEqual(components[0]["parameters"], [{"type": "text", "text": "Ann"}])
+        self.assertEqual([p["text"] for p in components[1]["parameters"]], ['"Ann"', "20"])
+        self.assertEqual([(c["sub_type"], c["index"]) for c in components[2:]],
+                         [("url", "0"), ("quick_reply", "1"), ("copy_code", "2")])
+        self.assertEqual(components[2]["parameters"], [{"type": "text", "text": "c1"}])
+        self.assertEqual(components[4]["parameters"], [{"type": "coupon_code", "coupon_code": "SPRING20"}])
+
+    def test_missing_parameters_are_refused(self):
+        with self.assertRaises(ParameterError):
+            CompiledPayload(self.template()).build({"phone_number": "+12125550001", "parameters": ["Ann"]})
+
+    def test_cache_keeps_databases_apart(self):
+        cache = PayloadCache()
+        tenant = self.template(body_content="Hola {{1}}")
+        tenant._state.db = "tenant_acme"
+        default = self.template(updated_at=tenant.updated_at)
+        default._state.db = "default"
+        self.assertIsNot(cache.get(default), cache.get(tenant))
+        self.assertIs(cache.get(default), cache.get(default))
+        self.assertIsNot(cache.get(self.template(approval_status="pending")), cache.get(default))